@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+POS FACILE - Chiamate AI in background
+Le chiamate OpenAI del wizard girano su un pool di thread condiviso invece di
+bloccare lo script Streamlit. Ogni task vive nello stato di sessione con un
+nome ('analisi', 'descrizione', ...) e una chiave (i dati di input): un nuovo
+task con chiave diversa annulla il precedente, il cui risultato viene scartato.
+
+I thread del pool non toccano mai lo stato di sessione: calcolano e basta.
+Lo script legge il risultato con prendi_risultato al primo rerun utile.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+# ==============================================================================
+# CONFIG
+# ==============================================================================
+
+AI_WORKERS = 4          # Chiamate AI contemporanee (tutte le sessioni)
+AI_TIMEOUT = 120        # Secondi di attesa massima in attendi()
+
+_TASKS = '_ai_task'     # Chiave nello stato di sessione: nome -> {'chiave', 'future'}
+
+_executor = ThreadPoolExecutor(max_workers=AI_WORKERS, thread_name_prefix='pos-ai')
+
+
+# ==============================================================================
+# TASK
+# ==============================================================================
+
+def avvia(stato, nome: str, chiave, funzione, *args, **kwargs):
+    """
+    Avvia funzione(*args, **kwargs) in background come task `nome` della sessione.
+    Se il task esiste gia con la stessa chiave (in corso o pronto) lo riusa;
+    con chiave diversa annulla il precedente.
+    stato: st.session_state (o qualunque dict)
+    """
+    tasks = stato.setdefault(_TASKS, {})
+    task = tasks.get(nome)
+    if task and task['chiave'] == chiave:
+        future = task['future']
+        if not future.done() or future.exception() is None:
+            return future
+    annulla(stato, nome)
+    future = _executor.submit(funzione, *args, **kwargs)
+    tasks[nome] = {'chiave': chiave, 'future': future}
+    return future
+
+
+def chiave_task(stato, nome: str):
+    """Chiave del task `nome`, None se non esiste."""
+    task = stato.get(_TASKS, {}).get(nome)
+    return task['chiave'] if task else None
+
+
+def stato_task(stato, nome: str) -> str:
+    """'assente', 'in_corso', 'pronto' o 'errore'."""
+    task = stato.get(_TASKS, {}).get(nome)
+    if not task:
+        return 'assente'
+    future = task['future']
+    if not future.done():
+        return 'in_corso'
+    return 'errore' if future.cancelled() or future.exception() is not None else 'pronto'
+
+
+def prendi_risultato(stato, nome: str, default=None):
+    """
+    Risultato del task concluso, che viene rimosso dalla sessione.
+    Se il task e ancora in corso lo lascia dov'e e restituisce default;
+    se e fallito stampa l'errore e restituisce default.
+    """
+    tasks = stato.get(_TASKS, {})
+    task = tasks.get(nome)
+    if not task or not task['future'].done():
+        return default
+    del tasks[nome]
+    future = task['future']
+    if future.cancelled():
+        return default
+    if future.exception() is not None:
+        print(f"Errore task AI {nome}: {future.exception()}")
+        return default
+    return future.result()
+
+
+def attendi(stato, nome: str, timeout: float = AI_TIMEOUT) -> bool:
+    """Attende la fine del task (per le versioni di Streamlit senza st.fragment)."""
+    task = stato.get(_TASKS, {}).get(nome)
+    if not task:
+        return False
+    try:
+        task['future'].result(timeout)
+    except Exception:
+        pass
+    return task['future'].done()
+
+
+def annulla(stato, nome: str):
+    """
+    Annulla il task `nome`. Se la chiamata e gia partita non si puo interrompere:
+    il risultato viene semplicemente scartato.
+    """
+    task = stato.get(_TASKS, {}).pop(nome, None)
+    if task:
+        task['future'].cancel()
@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+"""
+POS FACILE - Cache risposte AI
+Cache persistente (SQLite locale) delle risposte OpenAI, senza dipendenze da
+Streamlit. La chiave combina funzione, testo normalizzato, versione del
+dizionario lavorazioni e modello: la stessa descrizione gia analizzata torna
+subito, senza chiamata API.
+
+Le richieste identiche in volo nello stesso momento (doppio click, due schede)
+vengono unite: la prima esegue la chiamata, le altre ne attendono il risultato.
+
+Descrizioni quasi identiche ("rifacimento bagno con sostituzione impianto
+idraulico e piastrelle" riscritta con articoli o punteggiatura diversi) trovano
+la risposta precedente tramite un indice locale di similarita (TF-IDF su
+n-grammi di caratteri, coseno), sopra una soglia configurabile. L'indice e
+separato per utente (ambito_cache): una descrizione scritta da un cliente non
+viene mai proposta a un altro. Le voci eliminate dalla cache (scadenza, limite
+di voci) escono anche dall'indice.
+"""
+
+import copy
+import hashlib
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+
+
+# ==============================================================================
+# CONFIG
+# ==============================================================================
+
+AI_CACHE_PATH = os.environ.get(
+    'POS_AI_CACHE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.ai_cache.sqlite')
+)
+AI_CACHE_TTL_GIORNI = 90        # Scadenza di una risposta in cache
+AI_CACHE_MAX_VOCI = 5000        # Oltre, si eliminano le voci usate meno di recente
+AI_ATTESA_MAX = 120             # Secondi di attesa massima su una richiesta in volo
+# Similarita minima (coseno 0-1) per riusare l'analisi di una descrizione simile;
+# alta di proposito: "bagno" e "cucina" nella stessa frase stanno intorno a 0.9
+AI_SIMILARITA_SOGLIA = float(os.environ.get('POS_AI_SIMILARITA', '0.95'))
+AI_INDICI_MAX = 256             # Indici di similarita (uno per ambito) tenuti in memoria
+
+_lock = threading.Lock()
+_in_volo = {}                   # chiave -> _RichiestaInVolo
+_stats = {'hits': 0, 'simili': 0, 'misses': 0, 'unite': 0, 'errori': 0}
+_indici = OrderedDict()         # ambito -> _IndiceSimilarita (LRU)
+
+# Parole vuote ignorate nel confronto (articoli, preposizioni, congiunzioni)
+PAROLE_VUOTE = frozenset(
+    "a ad al alla alle allo ai agli all c che con col da dal dalla dalle dai degli dei del della "
+    "delle dello dell di e ed il i in l la le lo gli nel nella nelle nei negli o per su sul "
+    "sulla tra fra un una uno".split()
+)
+
+
+# ==============================================================================
+# CHIAVI
+# ==============================================================================
+
+def normalizza_testo(testo: str) -> str:
+    """Forma canonica del testo: unicode NFKC, minuscolo, spazi compattati, senza punteggiatura finale."""
+    testo = unicodedata.normalize('NFKC', testo or '').lower()
+    testo = re.sub(r'\s+', ' ', testo).strip()
+    return testo.rstrip('.;:,!? ')
+
+
+def chiave_cache(funzione: str, testo: str, versione: str, modello: str) -> str:
+    """Chiave SHA-256 di (funzione, testo normalizzato, versione dizionario, modello)."""
+    materiale = json.dumps([funzione, normalizza_testo(testo), versione, modello], ensure_ascii=False)
+    return hashlib.sha256(materiale.encode('utf-8')).hexdigest()
+
+
+def ambito_cache(funzione: str, versione: str, modello: str, utente: str) -> str:
+    """
+    Ambito di confronto per similarita: solo risposte dello stesso utente, per
+    la stessa funzione, dizionario e modello.
+    """
+    materiale = json.dumps([funzione, versione, modello, utente])
+    return hashlib.sha256(materiale.encode('utf-8')).hexdigest()[:16]
+
+
+# ==============================================================================
+# ARCHIVIO SQLITE
+# ==============================================================================
+
+def _connessione():
+    """Una connessione per operazione: SQLite gestisce i lock tra thread e processi."""
+    con = sqlite3.connect(AI_CACHE_PATH, timeout=10)
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS risposte ("
+        " chiave TEXT PRIMARY KEY, valore TEXT NOT NULL,"
+        " creato REAL NOT NULL, ultimo_uso REAL NOT NULL)"
+    )
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS testi ("
+        " chiave TEXT PRIMARY KEY, ambito TEXT NOT NULL, testo TEXT NOT NULL)"
+    )
+    return con
+
+
+def leggi(chiave: str):
+    """Risposta in cache (gia decodificata da JSON) o None."""
+    try:
+        con = _connessione()
+        try:
+            riga = con.execute(
+                "SELECT valore, creato FROM risposte WHERE chiave = ?", (chiave,)
+            ).fetchone()
+            if riga is None:
+                return None
+            if riga[1] < time.time() - AI_CACHE_TTL_GIORNI * 86400:
+                with con:
+                    con.execute("DELETE FROM risposte WHERE chiave = ?", (chiave,))
+                    con.execute("DELETE FROM testi WHERE chiave = ?", (chiave,))
+                _dimentica([chiave])
+                return None
+            with con:
+                con.execute("UPDATE risposte SET ultimo_uso = ? WHERE chiave = ?", (time.time(), chiave))
+            return json.loads(riga[0])
+        finally:
+            con.close()
+    except (sqlite3.Error, ValueError) as e:
+        print(f"Errore lettura cache AI: {e}")
+        return None
+
+
+def scrivi(chiave: str, valore):
+    """Salva una risposta (serializzabile in JSON) e mantiene la cache entro AI_CACHE_MAX_VOCI."""
+    try:
+        con = _connessione()
+        try:
+            adesso = time.time()
+            with con:
+                con.execute(
+                    "INSERT OR REPLACE INTO risposte (chiave, valore, creato, ultimo_uso) VALUES (?, ?, ?, ?)",
+                    (chiave, json.dumps(valore, ensure_ascii=False), adesso, adesso)
+                )
+                eliminate = [riga[0] for riga in con.execute(
+                    "SELECT chiave FROM risposte ORDER BY ultimo_uso DESC LIMIT -1 OFFSET ?",
+                    (AI_CACHE_MAX_VOCI,)
+                )]
+                con.executemany("DELETE FROM risposte WHERE chiave = ?", [(c,) for c in eliminate])
+                con.executemany("DELETE FROM testi WHERE chiave = ?", [(c,) for c in eliminate])
+        finally:
+            con.close()
+        _dimentica(eliminate)
+    except (sqlite3.Error, TypeError, ValueError) as e:
+        print(f"Errore scrittura cache AI: {e}")
+
+
+def _registra_testo(chiave: str, ambito: str, testo: str):
+    """Collega il testo normalizzato alla risposta, per le ricerche per similarita."""
+    try:
+        con = _connessione()
+        try:
+            with con:
+                con.execute("INSERT OR REPLACE INTO testi (chiave, ambito, testo) VALUES (?, ?, ?)",
+                            (chiave, ambito, testo))
+        finally:
+            con.close()
+    except sqlite3.Error as e:
+        print(f"Errore scrittura cache AI: {e}")
+
+
+def svuota():
+    """Elimina tutte le risposte in cache."""
+    try:
+        con = _connessione()
+        try:
+            with con:
+                con.execute("DELETE FROM risposte")
+                con.execute("DELETE FROM testi")
+        finally:
+            con.close()
+    except sqlite3.Error as e:
+        print(f"Errore svuotamento cache AI: {e}")
+    with _lock:
+        _indici.clear()
+
+
+# ==============================================================================
+# SIMILARITA
+# ==============================================================================
+
+def _ngrammi(testo: str) -> dict:
+    """Trigrammi di caratteri per parola (parole vuote escluse), peso tf sublineare."""
+    conteggi = Counter()
+    for parola in re.findall(r'\w+', testo):
+        if parola in PAROLE_VUOTE:
+            continue
+        parola = f" {parola} "
+        for i in range(len(parola) - 2):
+            conteggi[parola[i:i + 3]] += 1
+    return {g: 1 + math.log(n) for g, n in conteggi.items()}
+
+
+class _IndiceSimilarita:
+    """
+    Indice invertito trigramma -> chiavi, per un ambito. I pesi IDF vengono dal
+    corpus stesso: parole comuni a tutte le descrizioni ("rifacimento",
+    "sostituzione") contano meno di quelle che le distinguono.
+    Ogni indice ha il suo lock: la ricerca in un ambito non blocca gli altri.
+    Si conservano solo i vettori, non i testi.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.caricato = False
+        self.vettori = {}       # chiave -> {trigramma: peso}
+        self.indice = {}        # trigramma -> {chiavi}
+
+    def aggiungi(self, chiave: str, testo: str):
+        if chiave in self.vettori:
+            return
+        vettore = _ngrammi(testo)
+        if not vettore:
+            return
+        self.vettori[chiave] = vettore
+        for g in vettore:
+            self.indice.setdefault(g, set()).add(chiave)
+
+    def rimuovi(self, chiave: str):
+        vettore = self.vettori.pop(chiave, None)
+        for g in vettore or ():
+            chiavi = self.indice[g]
+            chiavi.discard(chiave)
+            if not chiavi:
+                del self.indice[g]
+
+    def cerca(self, testo: str, soglia: float) -> list:
+        """[(similarita, chiave)] sopra soglia, dalla piu simile."""
+        query = _ngrammi(testo)
+        if not query:
+            return []
+        totale = len(self.vettori) + 1
+        idf = {g: math.log(totale / (len(self.indice.get(g, ())) + 1)) + 1 for g in query}
+        candidati = set()
+        for g in query:
+            candidati.update(self.indice.get(g, ()))
+        norma_q = math.sqrt(sum((w * idf[g]) ** 2 for g, w in query.items()))
+        risultati = []
+        for chiave in candidati:
+            vettore = self.vettori[chiave]
+            prodotto = sum(w * vettore.get(g, 0) * idf[g] ** 2 for g, w in query.items())
+            norma_d = math.sqrt(sum(
+                (w * (math.log(totale / (len(self.indice[g]) + 1)) + 1)) ** 2 for g, w in vettore.items()
+            ))
+            similarita = prodotto / (norma_q * norma_d)
+            if similarita >= soglia:
+                risultati.append((round(similarita, 3), chiave))
+        return sorted(risultati, reverse=True)
+
+
+def _indice(ambito: str) -> _IndiceSimilarita:
+    """
+    Indice dell'ambito (LRU di AI_INDICI_MAX indici). Va usato con il suo lock:
+    alla prima ricerca viene caricato dal database.
+    """
+    with _lock:
+        indice = _indici.get(ambito)
+        if indice is None:
+            indice = _indici[ambito] = _IndiceSimilarita()
+            while len(_indici) > AI_INDICI_MAX:
+                _indici.popitem(last=False)
+        else:
+            _indici.move_to_end(ambito)
+    return indice
+
+
+def _carica(indice: _IndiceSimilarita, ambito: str):
+    """Carica dal database i testi dell'ambito. Da chiamare con indice.lock."""
+    if indice.caricato:
+        return
+    try:
+        con = _connessione()
+        try:
+            for chiave, testo in con.execute("SELECT chiave, testo FROM testi WHERE ambito = ?", (ambito,)):
+                indice.aggiungi(chiave, testo)
+        finally:
+            con.close()
+        indice.caricato = True
+    except sqlite3.Error as e:
+        print(f"Errore lettura cache AI: {e}")
+
+
+def _dimentica(chiavi: list):
+    """Toglie dagli indici in memoria le risposte eliminate dalla cache."""
+    if not chiavi:
+        return
+    with _lock:
+        indici = list(_indici.values())
+    for indice in indici:
+        with indice.lock:
+            for chiave in chiavi:
+                indice.rimuovi(chiave)
+
+
+def cerca_simile(ambito: str, testo: str, soglia: float = None):
+    """
+    Risposta in cache per il testo piu simile sopra soglia (default AI_SIMILARITA_SOGLIA).
+    Restituisce: (valore, similarita) oppure None
+    """
+    soglia = AI_SIMILARITA_SOGLIA if soglia is None else soglia
+    indice = _indice(ambito)
+    with indice.lock:
+        _carica(indice, ambito)
+        candidati = indice.cerca(normalizza_testo(testo), soglia)
+    for similarita, chiave in candidati:
+        valore = leggi(chiave)
+        if valore is not None:
+            return valore, similarita
+        # Eliminata da un altro processo: esce anche da questo indice
+        with indice.lock:
+            indice.rimuovi(chiave)
+    return None
+
+
+# ==============================================================================
+# CHIAMATE CON CACHE
+# ==============================================================================
+
+class _RichiestaInVolo:
+    __slots__ = ('evento', 'risultato')
+
+    def __init__(self):
+        self.evento = threading.Event()
+        self.risultato = None
+
+
+def con_cache(chiave: str, calcola, simile: tuple = None, esito: dict = None):
+    """
+    Restituisce la risposta in cache per chiave, altrimenti esegue calcola().
+    Le chiamate concorrenti con la stessa chiave eseguono calcola() una sola volta.
+    Un risultato None (errore, risposta non valida) non viene salvato.
+
+    simile: (ambito, testo) per cercare anche una risposta a un testo quasi identico
+            (vedi cerca_simile) e indicizzare il testo delle nuove risposte
+    esito: dict in cui scrivere 'fonte' ('cache', 'simile', 'modello') e, per le
+           risposte simili, 'similarita' (il testo trovato non viene restituito)
+    """
+    esito = {} if esito is None else esito
+    valore = leggi(chiave)
+    if valore is not None:
+        with _lock:
+            _stats['hits'] += 1
+        esito['fonte'] = 'cache'
+        return valore
+
+    if simile:
+        trovato = cerca_simile(*simile)
+        if trovato:
+            with _lock:
+                _stats['simili'] += 1
+            valore, esito['similarita'] = trovato
+            esito['fonte'] = 'simile'
+            return valore
+
+    with _lock:
+        richiesta = _in_volo.get(chiave)
+        proprietario = richiesta is None
+        if proprietario:
+            richiesta = _in_volo[chiave] = _RichiestaInVolo()
+            _stats['misses'] += 1
+        else:
+            _stats['unite'] += 1
+
+    esito['fonte'] = 'modello'
+    if not proprietario:
+        richiesta.evento.wait(AI_ATTESA_MAX)
+        # Copia: il risultato finisce nel session_state di sessioni diverse
+        return copy.deepcopy(richiesta.risultato)
+
+    try:
+        richiesta.risultato = calcola()
+        if richiesta.risultato is not None:
+            scrivi(chiave, richiesta.risultato)
+            if simile:
+                ambito, testo = simile
+                testo = normalizza_testo(testo)
+                _registra_testo(chiave, ambito, testo)
+                indice = _indice(ambito)
+                with indice.lock:
+                    if indice.caricato:
+                        indice.aggiungi(chiave, testo)
+        else:
+            with _lock:
+                _stats['errori'] += 1
+        return richiesta.risultato
+    finally:
+        with _lock:
+            _in_volo.pop(chiave, None)
+        richiesta.evento.set()
+
+
+def get_ai_cache_stats() -> dict:
+    """Contatori della cache: hits, risposte simili, misses, richieste unite, errori, voci salvate."""
+    with _lock:
+        stats = dict(_stats)
+    totale = stats['hits'] + stats['simili'] + stats['misses']
+    stats['hit_rate'] = round((stats['hits'] + stats['simili']) / totale, 3) if totale else 0.0
+    try:
+        con = _connessione()
+        try:
+            stats['voci'] = con.execute("SELECT COUNT(*) FROM risposte").fetchone()[0]
+        finally:
+            con.close()
+    except sqlite3.Error:
+        stats['voci'] = None
+    return stats
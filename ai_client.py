@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+POS FACILE - Client OpenAI condiviso
+Un solo openai.OpenAI per processo, con un httpx.Client (keep-alive) e timeout
+espliciti, invece di un client nuovo a ogni chiamata.
+
+Ogni chiamata passa da chiama_ai / stream_ai:
+- un semaforo globale limita le richieste contemporanee verso OpenAI, cosi un
+  picco di utenti non fa scattare i rate limit;
+- sugli errori temporanei (429, 5xx, timeout, connessione) si ritenta con
+  backoff esponenziale e jitter, rispettando l'header Retry-After;
+- per ogni helper (analizza, descrizione, assistente, completezza) si contano
+  chiamate, tentativi ripetuti, errori e latenza.
+Gli errori definitivi vengono stampati con il tipo e la chiamata restituisce None.
+
+Con POS_AI_BACKEND=stub il client e lo stub locale di ai_stub (niente rete,
+latenza configurabile, risposte registrate rigiocate); con il backend openai e
+POS_AI_REGISTRAZIONI impostato le risposte vere vengono registrate.
+"""
+
+import os
+import random
+import threading
+import time
+
+import streamlit as st
+
+try:
+    import httpx
+    import openai
+    OPENAI_AVAILABLE = True
+except ImportError:
+    OPENAI_AVAILABLE = False
+
+
+# ==============================================================================
+# CONFIG
+# ==============================================================================
+
+AI_BACKEND = os.environ.get('POS_AI_BACKEND', 'openai')          # 'openai' o 'stub'
+AI_REGISTRAZIONI = os.environ.get('POS_AI_REGISTRAZIONI')         # File JSONL delle risposte registrate
+AI_CONCORRENZA = int(os.environ.get('POS_AI_CONCORRENZA', '8'))  # Richieste OpenAI contemporanee (processo)
+AI_ATTESA_SLOT = 60.0           # Secondi di attesa massima di uno slot libero
+AI_TIMEOUT = 60.0               # Timeout lettura risposta (secondi)
+AI_CONNECT_TIMEOUT = 10.0       # Timeout apertura connessione (secondi)
+AI_TENTATIVI = 4                # Tentativi totali sugli errori temporanei
+AI_BACKOFF_BASE = 1.0           # Attesa prima del secondo tentativo, poi raddoppia
+AI_BACKOFF_MAX = 20.0           # Attesa massima tra due tentativi
+HTTP_MAX_CONNECTIONS = AI_CONCORRENZA
+HTTP_KEEPALIVE_EXPIRY = 60.0    # Secondi prima di chiudere una connessione inattiva
+
+_client = None
+_client_chiave = None
+_client_lock = threading.Lock()
+_semaforo = threading.BoundedSemaphore(AI_CONCORRENZA)
+_stats_lock = threading.Lock()
+_stats = {}                     # funzione -> contatori
+
+
+# ==============================================================================
+# CLIENT
+# ==============================================================================
+
+def _get_stub():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from ai_stub import StubAI
+                _client = StubAI(registrazioni=AI_REGISTRAZIONI)
+    return _client
+
+
+def get_openai_client():
+    """
+    Client OpenAI di processo (creato al primo utilizzo) o None se non configurato.
+    Con AI_BACKEND='stub' restituisce lo stub locale, anche senza chiave.
+    """
+    global _client, _client_chiave
+    if AI_BACKEND == 'stub':
+        return _get_stub()
+    if not OPENAI_AVAILABLE:
+        return None
+    try:
+        api_key = st.secrets.get("OPENAI_API_KEY", None)
+    except Exception:
+        return None
+    if not api_key:
+        return None
+    if _client is not None and _client_chiave == api_key:
+        return _client
+    with _client_lock:
+        if _client is None or _client_chiave != api_key:
+            _client = openai.OpenAI(
+                api_key=api_key,
+                timeout=httpx.Timeout(AI_TIMEOUT, connect=AI_CONNECT_TIMEOUT),
+                # I tentativi li gestisce chiama_ai, fuori dal semaforo
+                max_retries=0,
+                http_client=httpx.Client(
+                    limits=httpx.Limits(
+                        max_connections=HTTP_MAX_CONNECTIONS,
+                        max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+                        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+                    ),
+                    timeout=httpx.Timeout(AI_TIMEOUT, connect=AI_CONNECT_TIMEOUT),
+                ),
+            )
+            if AI_REGISTRAZIONI:
+                from ai_stub import RegistratoreAI
+                _client = RegistratoreAI(_client, AI_REGISTRAZIONI)
+            _client_chiave = api_key
+    return _client
+
+
+def modello_cache(modello: str) -> str:
+    """
+    Nome del modello da usare nelle chiavi di cache (ai_cache): con un backend
+    diverso da openai ha il prefisso del backend, cosi le risposte dello stub
+    non finiscono mai tra quelle del modello vero.
+    """
+    return modello if AI_BACKEND == 'openai' else f"{AI_BACKEND}:{modello}"
+
+
+# ==============================================================================
+# CHIAMATE
+# ==============================================================================
+
+def _registra(funzione: str, **incrementi):
+    with _stats_lock:
+        voce = _stats.setdefault(funzione, {'chiamate': 0, 'retry': 0, 'errori': 0, 'secondi': 0.0})
+        for nome, valore in incrementi.items():
+            voce[nome] += valore
+
+
+def _temporaneo(errore) -> bool:
+    """Errori per cui ha senso ritentare: rate limit, errori server, timeout e connessione."""
+    if not OPENAI_AVAILABLE:
+        return False
+    if isinstance(errore, openai.APIConnectionError):
+        return True
+    stato = getattr(errore, 'status_code', None)
+    return stato is not None and (stato == 429 or stato >= 500)
+
+
+def _attesa(errore, tentativo: int) -> float:
+    """Secondi prima del prossimo tentativo: Retry-After se presente, altrimenti backoff con jitter."""
+    risposta = getattr(errore, 'response', None)
+    try:
+        retry_after = float(risposta.headers.get('retry-after'))
+        return min(max(retry_after, 0.0), AI_BACKOFF_MAX)
+    except (AttributeError, TypeError, ValueError):
+        pass
+    attesa = min(AI_BACKOFF_BASE * 2 ** tentativo, AI_BACKOFF_MAX)
+    return attesa * random.uniform(0.5, 1.0)
+
+
+def _crea(client, funzione: str, parametri: dict):
+    """
+    chat.completions.create con semaforo e tentativi.
+    Restituisce (risposta, rilascia): rilascia libera lo slot del semaforo e va
+    chiamata dopo aver consumato la risposta (per gli stream, a fine lettura).
+    Restituisce (None, None) se lo slot non si libera o la chiamata fallisce.
+    """
+    for tentativo in range(AI_TENTATIVI):
+        if not _semaforo.acquire(timeout=AI_ATTESA_SLOT):
+            print(f"Errore chiamata AI {funzione}: nessuno slot libero dopo {AI_ATTESA_SLOT:.0f}s")
+            _registra(funzione, errori=1)
+            return None, None
+        try:
+            return client.chat.completions.create(**parametri), _semaforo.release
+        except Exception as e:
+            _semaforo.release()
+            if not _temporaneo(e) or tentativo == AI_TENTATIVI - 1:
+                print(f"Errore chiamata AI {funzione} ({type(e).__name__}): {e}")
+                _registra(funzione, errori=1)
+                return None, None
+            attesa = _attesa(e, tentativo)
+            print(f"AI {funzione}: {type(e).__name__}, nuovo tentativo tra {attesa:.1f}s")
+            _registra(funzione, retry=1)
+            time.sleep(attesa)
+    return None, None
+
+
+def chiama_ai(client, funzione: str, **parametri):
+    """
+    Completamento chat (parametri di chat.completions.create) per l'helper `funzione`.
+    Restituisce la risposta o None se la chiamata fallisce anche dopo i tentativi.
+    """
+    inizio = time.time()
+    risposta, rilascia = _crea(client, funzione, parametri)
+    if rilascia:
+        rilascia()
+    _registra(funzione, chiamate=1, secondi=time.time() - inizio)
+    return risposta
+
+
+def stream_ai(client, funzione: str, **parametri):
+    """
+    Completamento in streaming: restituisce i chunk man mano che arrivano.
+    Lo slot del semaforo resta occupato finche lo stream e aperto; la connessione
+    viene chiusa alla fine, su errore o se il generatore viene chiuso prima.
+    I tentativi valgono solo per l'apertura dello stream.
+    """
+    inizio = time.time()
+    risposta, rilascia = _crea(client, funzione, dict(parametri, stream=True))
+    try:
+        if risposta is not None:
+            for chunk in risposta:
+                yield chunk
+    except Exception as e:
+        print(f"Errore streaming AI {funzione} ({type(e).__name__}): {e}")
+        _registra(funzione, errori=1)
+    finally:
+        if risposta is not None:
+            risposta.close()
+        if rilascia:
+            rilascia()
+        _registra(funzione, chiamate=1, secondi=time.time() - inizio)
+
+
+def get_ai_client_stats() -> dict:
+    """Contatori per helper: chiamate, retry, errori, latenza media (secondi)."""
+    with _stats_lock:
+        stats = {funzione: dict(voce) for funzione, voce in _stats.items()}
+    for voce in stats.values():
+        voce['latenza_media'] = round(voce['secondi'] / voce['chiamate'], 2) if voce['chiamate'] else 0.0
+        voce['secondi'] = round(voce['secondi'], 1)
+    return stats
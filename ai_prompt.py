@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""
+POS FACILE - Prompt AI compatti
+Il catalogo delle lavorazioni entra in ogni analisi della descrizione. Invece
+del JSON indentato (una riga per chiave) si usa un'unica riga con codici brevi,
+"L1=Impianti Elettrici|L2=Impianti Idrico-Sanitari|...", costruita insieme alle
+istruzioni e agli schemi una volta per versione del catalogo (base o con le
+lavorazioni personalizzate di un utente, vedi prompt_analisi), al primo uso e
+non all'import: il messaggio di sistema e identico in ogni chiamata con lo
+stesso catalogo (prefisso riusabile dalla cache dei prompt di OpenAI), nel
+messaggio utente va solo la descrizione. Il modello risponde con i codici e
+decodifica_lavorazioni li riporta alle chiavi del dizionario.
+
+Le risposte JSON hanno uno schema rigoroso (structured output di OpenAI) e
+vengono comunque validate in locale: leggi_risposta restituisce i dati o
+l'elenco degli errori da rimandare al modello per un solo tentativo di
+correzione.
+
+Stima dei token con tiktoken se installato (altrimenti ~4 caratteri per token)
+e registro dei token effettivi di ogni chiamata, letti da response.usage.
+"""
+
+import json
+import re
+import threading
+
+from catalogo import SOVRAPPOSIZIONI_MAX, sovrapponi_lavorazioni
+from pdf_layout import CacheLRU
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+
+# ==============================================================================
+# CONFIG
+# ==============================================================================
+
+CARATTERI_PER_TOKEN = 4         # Stima senza tiktoken (testo italiano, prudente)
+BUDGET_PROMPT_TOKEN = 2000      # Oltre questa stima il prompt viene segnalato nel log
+
+_lock = threading.Lock()
+_encoder = None
+_stats = {'chiamate': 0, 'prompt': 0, 'risposta': 0, 'stimati': 0, 'secondi': 0.0}
+_prompt = CacheLRU(SOVRAPPOSIZIONI_MAX + 1)  # versione del catalogo -> prompt_analisi
+
+
+# ==============================================================================
+# CATALOGO LAVORAZIONI
+# ==============================================================================
+
+def codifica_catalogo(dizionario: dict) -> tuple:
+    """
+    Catalogo compatto: (testo 'L1=Nome|L2=Nome|...', {codice: chiave}).
+    I codici seguono l'ordine del dizionario, cosi le voci nuove in coda non
+    cambiano i codici esistenti.
+    """
+    codici = {f"L{i}": chiave for i, chiave in enumerate(dizionario, start=1)}
+    testo = "|".join(f"{codice}={dizionario[chiave]['nome']}" for codice, chiave in codici.items())
+    return testo, codici
+
+
+_SISTEMA_ANALISI = """Sei un RSPP esperto in sicurezza cantieri (D.Lgs 81/08).
+Analizza la descrizione lavori dell'utente e identifica TUTTE le lavorazioni pertinenti.
+
+LAVORAZIONI DISPONIBILI (codice=nome, usa SOLO questi codici):
+{catalogo}
+
+ISTRUZIONI:
+1. Identifica TUTTE le lavorazioni che si applicano alla descrizione
+2. Aggiungi rischi specifici NON coperti dalle lavorazioni standard
+3. Suggerisci note pratiche per il RSPP
+4. Indica il livello di complessità (basso/medio/alto)
+
+Rispondi SOLO con il JSON dello schema: lavorazioni_identificate (codici), rischi_aggiuntivi
+(nome, gravita ALTA/MEDIA/BASSA, descrizione dettagliata, misura preventiva), note_rspp per
+questo cantiere, complessita, attrezzature_suggerite, dpi_specifici."""
+
+
+def prompt_analisi(personalizzate: dict = None) -> dict:
+    """
+    Prompt di analisi per il catalogo base o con le lavorazioni personalizzate
+    (catalogo.sovrapponi_lavorazioni), costruito una volta per versione.
+    Restituisce: {
+        'versione': versione del catalogo (chiave delle cache delle risposte),
+        'dizionario': lavorazioni, 'catalogo': testo compatto, 'codici': {codice: chiave},
+        'sistema': messaggio di sistema, 'schema': schema inviato al modello (codici),
+        'schema_chiavi': schema per la validazione locale (chiavi),
+    }
+    """
+    dizionario, versione = sovrapponi_lavorazioni(personalizzate)
+    prompt = _prompt.get(versione)
+    if prompt is None:
+        catalogo, codici = codifica_catalogo(dizionario)
+        prompt = {
+            'versione': versione,
+            'dizionario': dizionario,
+            'catalogo': catalogo,
+            'codici': codici,
+            'sistema': _SISTEMA_ANALISI.format(catalogo=catalogo),
+            'schema': _schema_analisi(list(codici)),
+            'schema_chiavi': _schema_analisi(list(dizionario)),
+        }
+        _prompt.put(versione, prompt)
+    return prompt
+
+
+def decodifica_lavorazioni(valori, prompt: dict = None) -> list:
+    """
+    Codici (o chiavi) restituiti dal modello -> chiavi del dizionario, senza duplicati e sconosciuti.
+    prompt: risultato di prompt_analisi usato per la richiesta (default catalogo base)
+    """
+    prompt = prompt or prompt_analisi()
+    chiavi = []
+    for valore in valori or []:
+        valore = str(valore).strip()
+        chiave = prompt['codici'].get(valore.upper(), valore)
+        if chiave in prompt['dizionario'] and chiave not in chiavi:
+            chiavi.append(chiave)
+    return chiavi
+
+
+# ==============================================================================
+# SCHEMI RISPOSTA
+# ==============================================================================
+
+def _lista(elemento: dict) -> dict:
+    return {'type': 'array', 'items': elemento}
+
+
+def _oggetto(proprieta: dict) -> dict:
+    """Oggetto in modalita strict: tutte le proprieta obbligatorie, nessuna in piu."""
+    return {
+        'type': 'object',
+        'properties': proprieta,
+        'required': list(proprieta),
+        'additionalProperties': False,
+    }
+
+
+def _schema_analisi(lavorazioni: list) -> dict:
+    testo = {'type': 'string'}
+    return _oggetto({
+        'lavorazioni_identificate': _lista({'type': 'string', 'enum': lavorazioni}),
+        'rischi_aggiuntivi': _lista(_oggetto({
+            'nome': testo,
+            'gravita': {'type': 'string', 'enum': ['ALTA', 'MEDIA', 'BASSA']},
+            'descrizione': testo,
+            'misura': testo,
+        })),
+        'note_rspp': testo,
+        'complessita': {'type': 'string', 'enum': ['basso', 'medio', 'alto']},
+        'attrezzature_suggerite': _lista(testo),
+        'dpi_specifici': _lista(testo),
+    })
+
+
+# Gli schemi dell'analisi dipendono dal catalogo (vedi prompt_analisi): quello
+# visto dal modello usa i codici, quello validato le chiavi del dizionario
+SCHEMA_COMPLETEZZA = _oggetto({
+    'score': {'type': 'integer'},
+    'elementi_presenti': _lista({'type': 'string'}),
+    'suggerimenti': _lista({'type': 'string'}),
+})
+
+_TIPI = {
+    'object': dict, 'array': list, 'string': str,
+    'integer': int, 'number': (int, float), 'boolean': bool,
+}
+
+
+def formato_risposta(nome: str, schema: dict) -> dict:
+    """Parametro response_format di chat.completions.create per lo schema."""
+    return {'type': 'json_schema', 'json_schema': {'name': nome, 'strict': True, 'schema': schema}}
+
+
+def valida_schema(dati, schema: dict, percorso: str = 'risposta') -> list:
+    """Errori di dati rispetto allo schema (sottoinsieme JSON Schema usato qui); [] se valido."""
+    tipo = schema.get('type')
+    if tipo and (not isinstance(dati, _TIPI[tipo]) or (isinstance(dati, bool) and tipo != 'boolean')):
+        return [f"{percorso}: atteso {tipo}"]
+    if 'enum' in schema and dati not in schema['enum']:
+        return [f"{percorso}: valore '{dati}' non ammesso"]
+    errori = []
+    if tipo == 'object':
+        for nome in schema.get('required', []):
+            if nome not in dati:
+                errori.append(f"{percorso}.{nome}: mancante")
+        for nome, valore in dati.items():
+            if nome in schema.get('properties', {}):
+                errori += valida_schema(valore, schema['properties'][nome], f"{percorso}.{nome}")
+            elif schema.get('additionalProperties') is False:
+                errori.append(f"{percorso}.{nome}: campo non previsto")
+    elif tipo == 'array':
+        for i, elemento in enumerate(dati):
+            errori += valida_schema(elemento, schema['items'], f"{percorso}[{i}]")
+    return errori
+
+
+def _controlla_analisi(dati, prompt: dict = None) -> list:
+    prompt = prompt or prompt_analisi()
+    # Codici sconosciuti o inventati si scartano qui, senza chiedere una correzione
+    if isinstance(dati, dict) and isinstance(dati.get('lavorazioni_identificate'), list):
+        scartati = [v for v in dati['lavorazioni_identificate']
+                    if not decodifica_lavorazioni([v], prompt)]
+        if scartati:
+            print(f"Lavorazioni sconosciute scartate dalla risposta AI: {scartati}")
+        dati['lavorazioni_identificate'] = decodifica_lavorazioni(dati['lavorazioni_identificate'], prompt)
+    return valida_schema(dati, prompt['schema_chiavi'])
+
+
+def _controlla_completezza(dati, prompt: dict = None) -> list:
+    errori = valida_schema(dati, SCHEMA_COMPLETEZZA)
+    if not errori and not 0 <= dati['score'] <= 100:
+        errori.append(f"risposta.score: {dati['score']} fuori da 0-100")
+    return errori
+
+
+CONTROLLI = {'analisi': _controlla_analisi, 'completezza': _controlla_completezza}
+
+
+def leggi_risposta(contenuto: str, tipo: str, prompt: dict = None) -> tuple:
+    """
+    Legge e valida la risposta JSON del modello ('analisi' o 'completezza').
+    Tollera i blocchi ``` attorno al JSON. Per l'analisi riporta i codici alle
+    chiavi del dizionario del prompt usato (prompt_analisi, default catalogo base).
+    Restituisce: (dati, errori); dati e None se il JSON non e leggibile.
+    """
+    contenuto = (contenuto or '').strip()
+    if contenuto.startswith("```"):
+        contenuto = re.sub(r'^```(json)?\s*', '', contenuto)
+        contenuto = re.sub(r'\s*```$', '', contenuto)
+    try:
+        dati = json.loads(contenuto)
+    except ValueError as e:
+        return None, [f"JSON non valido: {e}"]
+    return dati, CONTROLLI[tipo](dati, prompt)
+
+
+# ==============================================================================
+# TOKEN
+# ==============================================================================
+
+def _get_encoder():
+    """Encoder tiktoken del modello, caricato una volta; None se non disponibile."""
+    global _encoder
+    if _encoder is None and TIKTOKEN_AVAILABLE:
+        try:
+            _encoder = tiktoken.get_encoding('o200k_base')
+        except Exception as e:
+            print(f"tiktoken non utilizzabile, uso la stima per caratteri: {e}")
+            _encoder = False
+    return _encoder or None
+
+
+def stima_token(messaggi) -> int:
+    """Token stimati di un testo o di una lista di messaggi chat ({'role', 'content'})."""
+    if isinstance(messaggi, str):
+        messaggi = [{'content': messaggi}]
+    encoder = _get_encoder()
+    totale = 0
+    for messaggio in messaggi:
+        testo = messaggio.get('content') or ''
+        totale += 4 + (len(encoder.encode(testo)) if encoder else -(-len(testo) // CARATTERI_PER_TOKEN))
+    return totale
+
+
+def registra_uso(funzione: str, stimati: int, usage=None, secondi: float = 0.0):
+    """
+    Registra e stampa i token di una chiamata: stimati prima dell'invio,
+    effettivi da response.usage (se il modello li restituisce) e durata.
+    """
+    prompt = getattr(usage, 'prompt_tokens', None)
+    risposta = getattr(usage, 'completion_tokens', None)
+    with _lock:
+        _stats['chiamate'] += 1
+        _stats['stimati'] += stimati
+        _stats['prompt'] += prompt or 0
+        _stats['risposta'] += risposta or 0
+        _stats['secondi'] += secondi
+    avviso = f" (oltre il budget di {BUDGET_PROMPT_TOKEN})" if stimati > BUDGET_PROMPT_TOKEN else ""
+    print(f"AI {funzione}: prompt {prompt if prompt is not None else '?'} token "
+          f"(stimati {stimati}{avviso}), risposta {risposta if risposta is not None else '?'} token, "
+          f"{secondi:.1f}s")
+
+
+def get_token_stats() -> dict:
+    """Totali dei token registrati dall'avvio del processo."""
+    with _lock:
+        stats = dict(_stats)
+    stats['secondi'] = round(stats['secondi'], 1)
+    stats['catalogo'] = stima_token(prompt_analisi()['catalogo'])
+    stats['tiktoken'] = _get_encoder() is not None
+    return stats
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+POS FACILE - Backend AI locale
+Sostituti di openai.OpenAI con la stessa interfaccia usata dall'app
+(client.chat.completions.create, anche in streaming), per provare il wizard e
+misurare il percorso AI senza rete e senza costi:
+
+- StubAI: risposte deterministiche con latenza configurabile. L'analisi della
+  descrizione usa il classificatore offline e restituisce JSON valido per lo
+  schema di ai_prompt; le risposte registrate (vedi RegistratoreAI) vengono
+  rigiocate tali e quali se la richiesta coincide.
+- RegistratoreAI: avvolge il client OpenAI vero e salva ogni risposta in un
+  file JSONL, da rigiocare poi con lo stub.
+
+Il backend si sceglie con le variabili d'ambiente (vedi ai_client):
+    POS_AI_BACKEND=stub            openai (default) o stub
+    POS_AI_STUB_LATENZA=0.5        secondi per chiamata dello stub
+    POS_AI_REGISTRAZIONI=ai.jsonl  stub: risposte da rigiocare; openai: dove registrarle
+Per benchmark ripetibili conviene puntare POS_AI_CACHE a un file nuovo, cosi
+la cache delle risposte non nasconde le chiamate.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from types import SimpleNamespace
+
+from ai_prompt import prompt_analisi, stima_token
+from classificatore import classifica_descrizione
+
+
+# ==============================================================================
+# CONFIG
+# ==============================================================================
+
+STUB_LATENZA = float(os.environ.get('POS_AI_STUB_LATENZA', '0.5'))
+STUB_FRAMMENTI = 20             # Frammenti in cui lo stub divide una risposta in streaming
+
+
+# ==============================================================================
+# REGISTRAZIONI
+# ==============================================================================
+
+def chiave_richiesta(parametri: dict) -> str:
+    """Chiave di una richiesta: modello, messaggi e schema di risposta (non temperatura o limiti)."""
+    formato = (parametri.get('response_format') or {}).get('json_schema', {}).get('name')
+    materiale = json.dumps([parametri.get('model'), parametri.get('messages'), formato], ensure_ascii=False)
+    return hashlib.sha256(materiale.encode('utf-8')).hexdigest()
+
+
+def leggi_registrazioni(percorso: str) -> dict:
+    """chiave -> contenuto delle risposte registrate (l'ultima registrazione vince)."""
+    registrazioni = {}
+    try:
+        with open(percorso, encoding='utf-8') as f:
+            for riga in f:
+                if riga.strip():
+                    voce = json.loads(riga)
+                    registrazioni[voce['chiave']] = voce['contenuto']
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Errore lettura registrazioni AI {percorso}: {e}")
+    return registrazioni
+
+
+# ==============================================================================
+# RISPOSTE IN FORMATO OPENAI
+# ==============================================================================
+
+def _usage(parametri: dict, contenuto: str):
+    prompt = stima_token(parametri.get('messages') or [])
+    risposta = stima_token(contenuto)
+    return SimpleNamespace(prompt_tokens=prompt, completion_tokens=risposta, total_tokens=prompt + risposta)
+
+
+def _risposta(parametri: dict, contenuto: str):
+    messaggio = SimpleNamespace(role='assistant', content=contenuto, refusal=None)
+    return SimpleNamespace(
+        model=parametri.get('model'),
+        choices=[SimpleNamespace(index=0, message=messaggio, finish_reason='stop')],
+        usage=_usage(parametri, contenuto),
+    )
+
+
+def _chunk(testo=None, usage=None):
+    scelte = [SimpleNamespace(index=0, delta=SimpleNamespace(content=testo))] if testo is not None else []
+    return SimpleNamespace(choices=scelte, usage=usage)
+
+
+class _Stream:
+    """Stream di chunk come quello di openai: iterabile, con close()."""
+
+    def __init__(self, chunks, pausa: float = 0.0):
+        self._chunks = chunks
+        self._pausa = pausa
+        self.chiuso = False
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            if self.chiuso:
+                return
+            if self._pausa and chunk.choices:
+                time.sleep(self._pausa)
+            yield chunk
+
+    def close(self):
+        self.chiuso = True
+
+
+class _StreamRegistrato:
+    """Stream del client vero che passa i chunk al registratore; close() chiude entrambi."""
+
+    def __init__(self, chunks, stream):
+        self._chunks = chunks
+        self._stream = stream
+
+    def __iter__(self):
+        return self._chunks
+
+    def close(self):
+        self._chunks.close()
+        self._stream.close()
+
+
+class _Backend(ABC):
+    """
+    Classe base dei backend: espone create(**parametri) come
+    client.chat.completions.create. Una sottoclasse senza create non si istanzia.
+    """
+
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    @abstractmethod
+    def create(self, **parametri):
+        """Risposta nel formato di openai chat.completions.create (anche stream=True)."""
+
+
+# ==============================================================================
+# STUB DETERMINISTICO
+# ==============================================================================
+
+def _testo_utente(messaggi: list) -> str:
+    return next((m.get('content') or '' for m in messaggi if m.get('role') == 'user'), '')
+
+
+def _analisi(messaggi: list) -> dict:
+    """
+    Analisi della descrizione con il classificatore offline, nel formato dello
+    schema (codici). Usa il catalogo base: i suoi codici valgono anche nei
+    prompt con lavorazioni personalizzate, che si aggiungono in coda.
+    """
+    testo = _testo_utente(messaggi)
+    trovata = re.search(r'"(.*)"', testo, re.S)
+    descrizione = trovata.group(1) if trovata else testo
+    prompt = prompt_analisi()
+    dizionario = prompt['dizionario']
+    codice_da_chiave = {chiave: codice for codice, chiave in prompt['codici'].items()}
+    chiavi = classifica_descrizione(descrizione)['lavorazioni_identificate']
+    complessita = 'basso' if len(chiavi) <= 1 else 'medio' if len(chiavi) <= 3 else 'alto'
+    return {
+        'lavorazioni_identificate': [codice_da_chiave[k] for k in chiavi if k in codice_da_chiave],
+        'rischi_aggiuntivi': [],
+        'note_rspp': "Verificare in cantiere le lavorazioni individuate e le interferenze tra le fasi.",
+        'complessita': complessita,
+        'attrezzature_suggerite': [dizionario[k]['attrezzature'][0] for k in chiavi
+                                   if dizionario[k].get('attrezzature')],
+        'dpi_specifici': [dizionario[k]['dpi_obbligatori'][0]['nome'] for k in chiavi
+                          if dizionario[k].get('dpi_obbligatori')],
+    }
+
+
+def _completezza(messaggi: list) -> dict:
+    return {'score': 100, 'elementi_presenti': ["Dati principali compilati"], 'suggerimenti': []}
+
+
+_RISPOSTE_JSON = {'analisi': _analisi, 'completezza': _completezza}
+
+
+def _testo(messaggi: list) -> str:
+    """Risposta testuale deterministica (descrizione lavori, assistente)."""
+    domanda = ' '.join(_testo_utente(messaggi).split())
+    impronta = hashlib.sha256(domanda.encode('utf-8')).hexdigest()[:8]
+    return (f"Risposta di prova ({impronta}). Esecuzione delle lavorazioni in sicurezza secondo "
+            f"D.Lgs 81/08: delimitazione dell'area, uso dei DPI previsti, verifica delle attrezzature "
+            f"prima dell'uso e coordinamento con le altre imprese presenti in cantiere.")
+
+
+class StubAI(_Backend):
+    """
+    Backend locale deterministico. Ogni chiamata attende `latenza` secondi
+    (in streaming, distribuiti sui frammenti) e restituisce la risposta
+    registrata per la stessa richiesta, se c'e, altrimenti una generata.
+    """
+
+    def __init__(self, latenza: float = STUB_LATENZA, registrazioni: str = None):
+        super().__init__()
+        self.latenza = latenza
+        self.registrazioni = leggi_registrazioni(registrazioni) if registrazioni else {}
+        self._lock = threading.Lock()
+        self.stats = {'chiamate': 0, 'rigiocate': 0}
+
+    def _contenuto(self, parametri: dict) -> str:
+        registrata = self.registrazioni.get(chiave_richiesta(parametri))
+        with self._lock:
+            self.stats['chiamate'] += 1
+            self.stats['rigiocate'] += registrata is not None
+        if registrata is not None:
+            return registrata
+        messaggi = parametri.get('messages') or []
+        formato = (parametri.get('response_format') or {}).get('json_schema', {}).get('name')
+        if formato in _RISPOSTE_JSON:
+            return json.dumps(_RISPOSTE_JSON[formato](messaggi), ensure_ascii=False)
+        return _testo(messaggi)
+
+    def create(self, **parametri):
+        contenuto = self._contenuto(parametri)
+        if not parametri.get('stream'):
+            time.sleep(self.latenza)
+            return _risposta(parametri, contenuto)
+        parole = re.findall(r'\S+\s*', contenuto)
+        passo = max(1, -(-len(parole) // STUB_FRAMMENTI))
+        chunks = [_chunk(''.join(parole[i:i + passo])) for i in range(0, len(parole), passo)]
+        if (parametri.get('stream_options') or {}).get('include_usage'):
+            chunks.append(_chunk(usage=_usage(parametri, contenuto)))
+        return _Stream(chunks, self.latenza / max(1, len(chunks) - 1))
+
+
+# ==============================================================================
+# REGISTRATORE
+# ==============================================================================
+
+class RegistratoreAI(_Backend):
+    """Client OpenAI che salva in `percorso` (JSONL) ogni risposta completa, da rigiocare con StubAI."""
+
+    def __init__(self, client, percorso: str):
+        super().__init__()
+        self.client = client
+        self.percorso = percorso
+        self._lock = threading.Lock()
+
+    def _salva(self, parametri: dict, contenuto: str):
+        voce = {'chiave': chiave_richiesta(parametri), 'modello': parametri.get('model'), 'contenuto': contenuto}
+        try:
+            with self._lock, open(self.percorso, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(voce, ensure_ascii=False) + '\n')
+        except OSError as e:
+            print(f"Errore registrazione risposta AI: {e}")
+
+    def _registra_stream(self, parametri: dict, stream):
+        testo = []
+        completo = False
+        try:
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    testo.append(chunk.choices[0].delta.content)
+                yield chunk
+            completo = True
+        finally:
+            # Gli stream interrotti a meta non si registrano
+            if completo:
+                self._salva(parametri, ''.join(testo))
+
+    def create(self, **parametri):
+        risposta = self.client.chat.completions.create(**parametri)
+        if not parametri.get('stream'):
+            self._salva(parametri, risposta.choices[0].message.content or '')
+            return risposta
+        return _StreamRegistrato(self._registra_stream(parametri, risposta), risposta)
+
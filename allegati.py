@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+"""
+POS FACILE - Allegati PDF
+Unione del POS generato con gli allegati caricati dall'utente (visura, DURC,
+attestati...), senza dipendenze da Streamlit.
+
+Il PDF unito viene scritto direttamente in un file temporaneo su disco e
+restituito come file handle, senza copie BytesIO -> bytes durante l'unione.
+Un file passato cosi com'e a st.download_button verrebbe letto per intero in
+memoria (MediaFileManager) a ogni render: va passato download_differito(file),
+letto solo al clic sul pulsante. Chi riceve il file lo chiude.
+Ogni allegato viene letto dal suo stream senza duplicarlo in bytes.
+Limite: pypdf non scrive per pagine, PdfWriter tiene in memoria tutte le
+pagine (POS + allegati) fino a write(). Il file temporaneo evita solo le copie
+del risultato, quindi il picco di memoria cresce con la dimensione degli allegati.
+
+Gli allegati vengono verificati (cifratura, pagine, file corrotti) in parallelo
+appena caricati: l'unione riusa i reader gia aperti e scarta quelli non validi.
+Un allegato puo anche essere il percorso di un PDF su disco (archivio allegati):
+in quel caso la verifica conserva solo i dati e l'unione apre file e reader
+propri, chiusi a fine scrittura.
+
+Ottimizzazione opzionale per l'invio via PEC: immagini scansionate ricampionate
+a una risoluzione massima, content stream ricompressi, oggetti identici
+(font, loghi ripetuti negli allegati) salvati una sola volta.
+"""
+
+import io
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from io import BytesIO
+
+try:
+    from pypdf import PdfReader, PdfWriter
+    PYPDF_AVAILABLE = True
+except ImportError:
+    PYPDF_AVAILABLE = False
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+
+# ==============================================================================
+# CONFIG
+# ==============================================================================
+
+BUFFER_SCRITTURA = 256 * 1024  # Buffer di scrittura verso il file temporaneo
+VERIFICA_WORKERS = 4           # Allegati analizzati in parallelo
+OTTIMIZZA_DPI = 150            # Risoluzione massima immagini nel PDF ottimizzato
+OTTIMIZZA_QUALITA_JPEG = 75    # Qualita JPEG delle immagini ricampionate
+
+# Ordine degli allegati nel PDF finale
+ORDINE_ALLEGATI = [
+    ('visura', 'Visura Camerale'),
+    ('durc', 'DURC'),
+    ('attestati', 'Attestati Formazione'),
+    ('idoneita', 'Idoneità Sanitarie'),
+    ('libretti', 'Libretti Attrezzature'),
+    ('sds', 'Schede SDS'),
+    ('pimus', 'Pi.M.U.S. / Manuali'),
+    ('dpi', 'Verbali Consegna DPI'),
+    ('altro', 'Altri Allegati')
+]
+
+
+# ==============================================================================
+# VERIFICA
+# ==============================================================================
+
+def _apri_reader(file_obj):
+    """PdfReader di un allegato gia verificato (cifrato al piu con la sola password proprietario)."""
+    file_obj.seek(0)
+    reader = PdfReader(file_obj)
+    if reader.is_encrypted:
+        reader.decrypt('')
+    return reader
+
+
+def verifica_allegato(file_obj) -> dict:
+    """
+    Analizza un allegato PDF: cifratura, numero pagine, integrita dell'albero pagine.
+    Restituisce: {'ok': bool, 'pagine': int, 'cifrato': bool, 'errore': str, 'reader': PdfReader}
+    Il reader resta aperto sul file e viene riusato per l'unione. Se file_obj e
+    un percorso il file viene chiuso subito e l'esito non ha reader.
+    """
+    esito = {'ok': False, 'pagine': 0, 'cifrato': False, 'errore': None, 'reader': None}
+    if not PYPDF_AVAILABLE:
+        esito['errore'] = "pypdf non installato"
+        return esito
+    if isinstance(file_obj, str):
+        try:
+            with open(file_obj, 'rb') as f:
+                return dict(verifica_allegato(f), reader=None)
+        except OSError as e:
+            esito['errore'] = f"PDF non leggibile: {str(e)}"
+            return esito
+    try:
+        file_obj.seek(0)
+        reader = PdfReader(file_obj)
+        if reader.is_encrypted:
+            esito['cifrato'] = True
+            # Con la sola password proprietario il file si apre con password vuota
+            if not reader.decrypt(''):
+                esito['errore'] = "PDF protetto da password"
+                return esito
+        pagine = len(reader.pages)
+        if pagine == 0:
+            esito['errore'] = "PDF senza pagine"
+            return esito
+        # Risolve ogni pagina: un file troncato o corrotto fallisce qui, non durante l'unione
+        for page in reader.pages:
+            page.mediabox
+    except Exception as e:
+        esito['errore'] = f"PDF non leggibile: {str(e)}"
+        return esito
+    esito.update(ok=True, pagine=pagine, reader=reader)
+    return esito
+
+
+def verifica_allegati(allegati_dict: dict) -> dict:
+    """
+    Verifica in parallelo (thread pool) tutti gli allegati caricati.
+    Restituisce: dict chiave allegato -> esito di verifica_allegato
+    """
+    caricati = {k: f for k, f in allegati_dict.items() if f is not None}
+    if not caricati:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(VERIFICA_WORKERS, len(caricati))) as pool:
+        futures = {k: pool.submit(verifica_allegato, f) for k, f in caricati.items()}
+        return {k: future.result() for k, future in futures.items()}
+
+
+# ==============================================================================
+# OTTIMIZZAZIONE
+# ==============================================================================
+
+def _ricampiona_immagini(writer, dpi: int) -> int:
+    """
+    Riduce le immagini piu definite di dpi rispetto alla pagina che le contiene
+    (il lato lungo dell'immagine confrontato con il lato lungo della pagina:
+    esatto per le scansioni a pagina intera, per eccesso per le immagini piccole).
+    Immagini con maschere di trasparenza o modi colore particolari restano intatte.
+    Restituisce il numero di immagini ricampionate.
+    """
+    ricampionate = 0
+    for page in writer.pages:
+        lato_pagina = max(float(page.mediabox.width), float(page.mediabox.height)) / 72
+        max_pixel = int(lato_pagina * dpi)
+        try:
+            immagini = list(page.images)
+        except Exception as e:
+            print(f"Errore lettura immagini pagina: {e}")
+            continue
+        for immagine in immagini:
+            try:
+                xobj = immagine.indirect_reference.get_object() if immagine.indirect_reference else None
+                if xobj is None or '/SMask' in xobj or '/Mask' in xobj:
+                    continue
+                img = immagine.image
+                if img.mode not in ('RGB', 'L') or max(img.size) <= max_pixel:
+                    continue
+                scala = max_pixel / max(img.size)
+                ridotta = img.resize((max(1, round(img.width * scala)), max(1, round(img.height * scala))),
+                                     Image.LANCZOS)
+                immagine.replace(ridotta, quality=OTTIMIZZA_QUALITA_JPEG)
+                ricampionate += 1
+            except Exception as e:
+                # Un'immagine non decodificabile resta com'e
+                print(f"Errore ricampionamento immagine: {e}")
+    return ricampionate
+
+
+def ottimizza_writer(writer, dpi: int = OTTIMIZZA_DPI) -> dict:
+    """
+    Ottimizza il PDF prima della scrittura: immagini ricampionate a dpi
+    (serve Pillow), content stream ricompressi, oggetti identici deduplicati.
+    Restituisce: {'immagini': n. immagini ricampionate}
+    """
+    ricampionate = _ricampiona_immagini(writer, dpi) if PIL_AVAILABLE and dpi else 0
+    for page in writer.pages:
+        try:
+            page.compress_content_streams()
+        except Exception as e:
+            print(f"Errore compressione pagina: {e}")
+    if hasattr(writer, 'compress_identical_objects'):
+        # pypdf >= 4: oggetti identici (font, loghi) scritti una volta, orfani rimossi
+        writer.compress_identical_objects()
+    return {'immagini': ricampionate}
+
+
+def _dimensione(file_obj) -> int:
+    if isinstance(file_obj, str):
+        return os.path.getsize(file_obj)
+    dimensione = getattr(file_obj, 'size', None)
+    if dimensione is None:
+        posizione = file_obj.tell()
+        dimensione = file_obj.seek(0, io.SEEK_END)
+        file_obj.seek(posizione)
+    return dimensione
+
+
+# ==============================================================================
+# UNIONE
+# ==============================================================================
+
+def scrivi_file_temporaneo(scrivi):
+    """
+    Crea un file temporaneo su disco, ci fa scrivere scrivi(stream) e lo
+    restituisce riposizionato all'inizio. Il file e senza buffer (io.RawIOBase,
+    uno dei formati accettati da st.download_button): la scrittura passa da un
+    BufferedWriter staccato alla fine. Il file sparisce alla chiusura.
+    """
+    raw = tempfile.TemporaryFile(mode='w+b', buffering=0)
+    stream = io.BufferedWriter(raw, BUFFER_SCRITTURA)
+    scrivi(stream)
+    stream.flush()
+    stream.detach()
+    raw.seek(0)
+    return raw
+
+
+def download_differito(file_obj):
+    """
+    Dati per st.download_button (streamlit >= 1.52): una funzione che Streamlit
+    chiama solo al clic, quindi il file viene letto in memoria solo se scaricato
+    e non a ogni render. Il file deve restare aperto finche il pulsante e visibile.
+    """
+    def leggi():
+        file_obj.seek(0)
+        return file_obj
+    return leggi
+
+
+def pdf_come_file(pdf_bytes: bytes):
+    """POS senza allegati nello stesso formato restituito da unisci_allegati."""
+    return scrivi_file_temporaneo(lambda stream: stream.write(pdf_bytes))
+
+
+def unisci_allegati(pos_bytes: bytes, allegati_dict: dict, avvisi: list = None, verifiche: dict = None,
+                    ottimizza_dpi: int = None, report: dict = None):
+    """
+    Unisce il POS con gli allegati nell'ordine di ORDINE_ALLEGATI.
+
+    Args:
+        pos_bytes: bytes del PDF POS generato
+        allegati_dict: dict chiave allegato -> file-like (es. UploadedFile), percorso
+                       di un PDF su disco o None
+        avvisi: lista in cui aggiungere i messaggi per gli allegati scartati
+        verifiche: esiti gia calcolati da verifica_allegati (i reader vengono riusati,
+                   senza reader il file viene riaperto qui); gli allegati senza
+                   esito vengono verificati qui
+        ottimizza_dpi: se indicato, ottimizza il PDF unito (vedi ottimizza_writer)
+        report: dict in cui scrivere 'prima' (POS + allegati validi, byte), 'dopo'
+                (PDF finale, byte) e 'immagini' (immagini ricampionate)
+
+    Returns:
+        file temporaneo posizionato all'inizio con il PDF unificato
+
+    Le pagine di tutti i documenti restano in memoria nel PdfWriter fino alla
+    scrittura: il picco di memoria non e limitato (vedi intestazione del modulo).
+    """
+    if not PYPDF_AVAILABLE:
+        # Se pypdf non è disponibile, ritorna solo il POS
+        return pdf_come_file(pos_bytes)
+
+    writer = PdfWriter()
+
+    # Il POS come primo documento
+    for page in PdfReader(BytesIO(pos_bytes)).pages:
+        writer.add_page(page)
+
+    verifiche = dict(verifiche or {})
+    mancanti = {k: f for k, f in allegati_dict.items() if f is not None and k not in verifiche}
+    verifiche.update(verifica_allegati(mancanti))
+
+    prima = len(pos_bytes)
+    # I file riaperti qui (allegati su disco) restano aperti fino alla scrittura
+    with ExitStack() as aperti:
+        for chiave, nome in ORDINE_ALLEGATI:
+            allegato = allegati_dict.get(chiave)
+            if allegato is None:
+                continue
+            esito = verifiche[chiave]
+            if not esito['ok']:
+                # Se un allegato non è valido, lo saltiamo
+                if avvisi is not None:
+                    avvisi.append(f"Impossibile allegare {nome}: {esito['errore']}")
+                continue
+            try:
+                reader = esito['reader']
+                if reader is None:
+                    if isinstance(allegato, str):
+                        allegato = aperti.enter_context(open(allegato, 'rb'))
+                    reader = _apri_reader(allegato)
+                for page in reader.pages:
+                    writer.add_page(page)
+                prima += _dimensione(allegati_dict[chiave])
+            except Exception as e:
+                if avvisi is not None:
+                    avvisi.append(f"Impossibile allegare {nome}: {str(e)}")
+
+        ricampionate = 0
+        if ottimizza_dpi:
+            try:
+                ricampionate = ottimizza_writer(writer, ottimizza_dpi)['immagini']
+            except Exception as e:
+                print(f"Errore ottimizzazione PDF: {e}")
+
+        out = scrivi_file_temporaneo(writer.write)
+        writer.close()
+    if report is not None:
+        report.update(prima=prima, dopo=_dimensione(out), immagini=ricampionate)
+    return out
@@ -5,22 +5,22 @@ POS FACILE - Generatore POS D.Lgs 81/08
 
 import streamlit as st
 from fpdf import FPDF
-from datetime import datetime, date, timedelta
-from io import BytesIO
-import re
+from datetime import datetime, date
 import json
+import time
 
-try:
-    import openai
-    OPENAI_AVAILABLE = True
-except ImportError:
-    OPENAI_AVAILABLE = False
+from pos_engine import genera_pdf_pos
+from catalogo import sovrapponi_lavorazioni
+from ai_cache import ambito_cache, chiave_cache, con_cache
+from classificatore import CONFIDENZA_MINIMA, classifica_descrizione
+from completezza import valuta_completezza
+from ai_prompt import (SCHEMA_COMPLETEZZA, formato_risposta, leggi_risposta, prompt_analisi,
+                       registra_uso, stima_token)
+from ai_client import chiama_ai, get_openai_client, modello_cache, stream_ai
+import ai_background
 
-try:
-    from pypdf import PdfReader, PdfWriter
-    PYPDF_AVAILABLE = True
-except ImportError:
-    PYPDF_AVAILABLE = False
+from allegati import PYPDF_AVAILABLE, OTTIMIZZA_DPI, download_differito, unisci_allegati, verifica_allegati, pdf_come_file
+from archivio_allegati import NOMI_ALLEGATI, archivia_allegati, allegati_archiviati, apri_allegati_archiviati, tocca_allegati
 
 # ==============================================================================
 # CONFIGURAZIONE
@@ -255,390 +255,10 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# ==============================================================================
-# DATABASE LAVORAZIONI - ARRICCHITO CON VALORI TECNICI
-# ==============================================================================
-DIZIONARIO_LAVORAZIONI = {
-    "impianti_elettrici": {
-        "nome": "Impianti Elettrici",
-        "descrizione_tecnica": "Installazione, modifica e manutenzione di impianti elettrici civili e industriali secondo norma CEI 64-8.",
-        "rischi": [
-            {"nome": "Elettrocuzione", "gravita": "ALTA", "descrizione": "Contatto diretto/indiretto con parti in tensione", "normativa": "Art. 80-87 D.Lgs 81/08"},
-            {"nome": "Arco elettrico", "gravita": "ALTA", "descrizione": "Ustioni da cortocircuito o sovraccarico", "normativa": "CEI 11-27"},
-            {"nome": "Caduta dall'alto", "gravita": "MEDIA", "descrizione": "Lavori su scale portatili oltre 2m", "normativa": "Art. 113 D.Lgs 81/08"},
-            {"nome": "Incendio", "gravita": "ALTA", "descrizione": "Innesco da scintille o sovraccarico", "normativa": "DM 10/03/1998"}
-        ],
-        "dpi_obbligatori": [
-            {"nome": "Guanti isolanti classe 00", "norma": "CEI EN 60903", "uso": "Lavori fino a 500V"},
-            {"nome": "Scarpe isolanti", "norma": "EN ISO 20345 SB", "uso": "Protezione elettrica"},
-            {"nome": "Casco isolante", "norma": "EN 397 + EN 50365", "uso": "Protezione testa"},
-            {"nome": "Occhiali di protezione", "norma": "EN 166", "uso": "Protezione arco elettrico"}
-        ],
-        "misure_prevenzione": [
-            "Sezionamento e blocco dell'impianto elettrico prima di ogni intervento",
-            "Verifica assenza tensione con cercafase e tester",
-            "Messa a terra delle masse e utilizzo di attrezzi isolati",
-            "Delimitazione area di lavoro con segnaletica",
-            "Presenza di estintore CO2 in prossimita"
-        ],
-        "attrezzature": ["Cercafase", "Tester digitale", "Pinza amperometrica", "Attrezzi isolati 1000V"],
-        "formazione_richiesta": ["PES/PAV/PEI secondo CEI 11-27", "Lavori in quota (se oltre 2m)"]
-    },
-    "impianti_idraulici": {
-        "nome": "Impianti Idrico-Sanitari",
-        "descrizione_tecnica": "Installazione e modifica di impianti di adduzione acqua, scarichi e apparecchi sanitari.",
-        "rischi": [
-            {"nome": "Ustioni", "gravita": "MEDIA", "descrizione": "Contatto con tubazioni acqua calda (>50C)", "normativa": "Art. 64 D.Lgs 81/08"},
-            {"nome": "Tagli e abrasioni", "gravita": "MEDIA", "descrizione": "Manipolazione tubazioni metalliche e raccordi", "normativa": "Art. 75 D.Lgs 81/08"},
-            {"nome": "Inalazione fumi saldatura", "gravita": "MEDIA", "descrizione": "Fumi metallici da brasatura/saldatura", "normativa": "Art. 223 D.Lgs 81/08"},
-            {"nome": "Posture incongrue", "gravita": "MEDIA", "descrizione": "Lavori in spazi ristretti (sotto sanitari)", "normativa": "Allegato XXXIII D.Lgs 81/08"}
-        ],
-        "dpi_obbligatori": [
-            {"nome": "Scarpe antinfortunistiche S3", "norma": "EN ISO 20345", "uso": "Protezione piede"},
-            {"nome": "Guanti antitaglio", "norma": "EN 388 (4X42)", "uso": "Manipolazione tubi"},
-            {"nome": "Occhiali di protezione", "norma": "EN 166", "uso": "Schegge e schizzi"},
-            {"nome": "Maschera per fumi", "norma": "EN 149 FFP2", "uso": "Durante saldature"}
-        ],
-        "misure_prevenzione": [
-            "Chiusura valvole di intercettazione e svuotamento impianto",
-            "Ventilazione forzata durante operazioni di saldatura/brasatura",
-            "Verifica assenza pressione residua prima di smontaggio",
-            "Utilizzo di cannello con dispositivo antiritorno di fiamma",
-            "Protezione pavimenti da caduta utensili"
-        ],
-        "attrezzature": ["Tagliatubi", "Filiera", "Cannello per brasatura", "Pressatrice"],
-        "sostanze_pericolose": ["Pasta disossidante (irritante)", "Gas propano/butano (infiammabile)", "Lega saldante (stagno/argento)"]
-    },
-    "opere_murarie": {
-        "nome": "Opere Murarie e Demolizioni",
-        "descrizione_tecnica": "Demolizione controllata di tramezzi non portanti, rimozione massetti, costruzione nuove murature in laterizio.",
-        "rischi": [
-            {"nome": "Crollo strutture", "gravita": "ALTA", "descrizione": "Cedimento improvviso elementi demoliti", "normativa": "Art. 151 D.Lgs 81/08"},
-            {"nome": "Caduta dall'alto", "gravita": "ALTA", "descrizione": "Lavori su ponteggi e trabattelli", "normativa": "Art. 122 D.Lgs 81/08"},
-            {"nome": "Inalazione polveri", "gravita": "ALTA", "descrizione": "Silice cristallina (SiO2) - TLV 0.025 mg/m3", "normativa": "Art. 224 D.Lgs 81/08"},
-            {"nome": "Rumore", "gravita": "ALTA", "descrizione": "Martello demolitore: Lep,d 95-105 dB(A)", "normativa": "Art. 189 D.Lgs 81/08"},
-            {"nome": "Vibrazioni HAV", "gravita": "ALTA", "descrizione": "Martello demolitore: 8-20 m/s2 - Limite 2h/giorno", "normativa": "Art. 201 D.Lgs 81/08"},
-            {"nome": "Proiezione schegge", "gravita": "MEDIA", "descrizione": "Frammenti durante demolizione", "normativa": "Art. 75 D.Lgs 81/08"}
-        ],
-        "dpi_obbligatori": [
-            {"nome": "Casco di protezione", "norma": "EN 397", "uso": "Caduta materiali"},
-            {"nome": "Maschera antipolvere FFP3", "norma": "EN 149", "uso": "Polveri silice"},
-            {"nome": "Cuffie antirumore", "norma": "EN 352-1 (SNR>28dB)", "uso": "Esposizione >85dB"},
-            {"nome": "Guanti antivibrazioni", "norma": "EN ISO 10819", "uso": "Uso demolitori"},
-            {"nome": "Scarpe S3 con puntale", "norma": "EN ISO 20345", "uso": "Caduta materiali"},
-            {"nome": "Occhiali a mascherina", "norma": "EN 166", "uso": "Proiezione schegge"}
-        ],
-        "misure_prevenzione": [
-            "Verifica statica preventiva a cura di tecnico abilitato",
-            "Puntellamento strutture adiacenti prima della demolizione",
-            "Bagnatura continua per abbattimento polveri (min. 80%)",
-            "Delimitazione area con recinzione e segnaletica",
-            "Pause obbligatorie: 15min ogni 2h uso martello demolitore",
-            "Allontanamento macerie entro fine giornata"
-        ],
-        "attrezzature": ["Martello demolitore elettrico/pneumatico", "Mazza e scalpello", "Trabattello", "Carriola"],
-        "valori_esposizione": {
-            "rumore": "Lep,d 95-105 dB(A) - Valore superiore di azione",
-            "vibrazioni_hav": "8-20 m/s2 - Superamento valore limite",
-            "polveri_silice": "Esposizione potenziale >TLV - Monitoraggio richiesto"
-        }
-    },
-    "tinteggiatura": {
-        "nome": "Tinteggiatura e Verniciatura",
-        "descrizione_tecnica": "Preparazione supporti, stuccatura, applicazione primer e finitura con pitture murali e smalti.",
-        "rischi": [
-            {"nome": "Agenti chimici", "gravita": "MEDIA", "descrizione": "COV (Composti Organici Volatili) da vernici", "normativa": "Art. 223 D.Lgs 81/08"},
-            {"nome": "Caduta da scala", "gravita": "MEDIA", "descrizione": "Utilizzo scale portatili e trabattelli", "normativa": "Art. 113 D.Lgs 81/08"},
-            {"nome": "Dermatiti da contatto", "gravita": "MEDIA", "descrizione": "Contatto con vernici, solventi, resine", "normativa": "Art. 224 D.Lgs 81/08"},
-            {"nome": "Scivolamento", "gravita": "BASSA", "descrizione": "Pavimenti bagnati o con residui vernice", "normativa": "Art. 63 D.Lgs 81/08"}
-        ],
-        "dpi_obbligatori": [
-            {"nome": "Maschera per vapori organici", "norma": "EN 14387 tipo A2", "uso": "Vernici a solvente"},
-            {"nome": "Guanti in nitrile", "norma": "EN 374-1 tipo B", "uso": "Contatto chimico"},
-            {"nome": "Occhiali di protezione", "norma": "EN 166", "uso": "Schizzi"},
-            {"nome": "Tuta monouso", "norma": "EN 13034 tipo 6", "uso": "Protezione corpo"}
-        ],
-        "misure_prevenzione": [
-            "Aerazione naturale o forzata dei locali (min. 4 ricambi/ora)",
-            "Consultazione Schede Dati di Sicurezza (SDS) dei prodotti",
-            "Divieto assoluto di fumo e fiamme libere",
-            "Stoccaggio vernici in contenitori chiusi e area ventilata",
-            "Pulizia attrezzi con solventi in area esterna o aspirata"
-        ],
-        "attrezzature": ["Rulli e pennelli", "Pistola airless", "Scala doppia", "Trabattello"],
-        "sostanze_pericolose": ["Idropittura lavabile (basso COV)", "Smalto all'acqua", "Primer fissativo", "Stucco in pasta"],
-        "nota_prodotti": "SPECIFICARE I PRODOTTI UTILIZZATI E ALLEGARE SCHEDE SDS"
-    },
-    "lavori_quota": {
-        "nome": "Lavori in Quota (oltre 2 metri)",
-        "descrizione_tecnica": "Attivita lavorativa svolta ad altezza superiore a 2 metri rispetto a piano stabile.",
-        "rischi": [
-            {"nome": "Caduta dall'alto", "gravita": "ALTA", "descrizione": "Rischio mortale - Prima causa morte sul lavoro", "normativa": "Art. 107 D.Lgs 81/08"},
-            {"nome": "Caduta materiali", "gravita": "ALTA", "descrizione": "Oggetti che cadono su persone sottostanti", "normativa": "Art. 115 D.Lgs 81/08"}
-        ],
-        "dpi_obbligatori": [
-            {"nome": "Casco con sottogola", "norma": "EN 397", "uso": "Caduta oggetti"},
-            {"nome": "Imbracatura anticaduta", "norma": "EN 361", "uso": "Trattenuta/arresto caduta"},
-            {"nome": "Cordino con assorbitore", "norma": "EN 355", "uso": "Limitazione caduta"},
-            {"nome": "Connettori", "norma": "EN 362", "uso": "Collegamento sistemi"},
-            {"nome": "Scarpe S3 antiscivolo", "norma": "EN ISO 20345", "uso": "Stabilita"}
-        ],
-        "misure_prevenzione": [
-            "Priorita a protezioni collettive (parapetti, reti)",
-            "DPI anticaduta solo se protezioni collettive non attuabili",
-            "Verifica giornaliera integrita trabattelli/ponteggi",
-            "Blocco ruote e stabilizzatori su trabattelli",
-            "Divieto di lavoro in quota con vento >60 km/h",
-            "Delimitazione e segnalazione area sottostante"
-        ],
-        "attrezzature": ["Trabattello a norma EN 1004", "Scala doppia EN 131", "Linea vita provvisoria"],
-        "formazione_richiesta": ["Corso lavori in quota 8h (Art. 77 D.Lgs 81/08)", "Addestramento DPI III categoria"]
-    },
-    "scavi": {
-        "nome": "Scavi e Movimenti Terra",
-        "descrizione_tecnica": "Scavi a sezione obbligata per fondazioni, sottoservizi, allacci fognari.",
-        "rischi": [
-            {"nome": "Seppellimento", "gravita": "ALTA", "descrizione": "Crollo pareti scavo non armate", "normativa": "Art. 119 D.Lgs 81/08"},
-            {"nome": "Caduta nello scavo", "gravita": "ALTA", "descrizione": "Assenza protezioni perimetrali", "normativa": "Art. 118 D.Lgs 81/08"},
-            {"nome": "Investimento", "gravita": "ALTA", "descrizione": "Mezzi meccanici in manovra", "normativa": "Art. 175 D.Lgs 81/08"},
-            {"nome": "Contatto sottoservizi", "gravita": "ALTA", "descrizione": "Linee elettriche, gas, acqua interrate", "normativa": "Art. 83 D.Lgs 81/08"}
-        ],
-        "dpi_obbligatori": [
-            {"nome": "Casco di protezione", "norma": "EN 397", "uso": "Caduta materiali"},
-            {"nome": "Gilet alta visibilita classe 2", "norma": "EN ISO 20471", "uso": "Visibilita"},
-            {"nome": "Scarpe S3 con lamina", "norma": "EN ISO 20345", "uso": "Perforazione"},
-            {"nome": "Guanti da lavoro", "norma": "EN 388", "uso": "Protezione mani"}
-        ],
-        "misure_prevenzione": [
-            "Richiesta PREVENTIVA tracciati sottoservizi agli enti gestori",
-            "Armatura pareti scavo oltre 1.5m di profondita",
-            "Parapetti perimetrali a 1m dal ciglio scavo",
-            "Rampa o scala di accesso ogni 30m di sviluppo",
-            "Divieto di deposito materiali a meno di 1m dal ciglio",
-            "Segnaletica e delimitazione area con nastro bianco/rosso"
-        ],
-        "attrezzature": ["Miniescavatore", "Pala", "Piccone", "Armature metalliche"],
-        "formazione_richiesta": ["Operatore macchine movimento terra (se utilizzo mezzi)"]
-    },
-    "rimozione_pavimenti": {
-        "nome": "Rimozione Pavimenti e Rivestimenti",
-        "descrizione_tecnica": "Demolizione e rimozione di pavimentazioni esistenti, massetti, rivestimenti ceramici.",
-        "rischi": [
-            {"nome": "Inalazione polveri", "gravita": "ALTA", "descrizione": "Polveri di cemento, ceramica, colla", "normativa": "Art. 224 D.Lgs 81/08"},
-            {"nome": "Rumore", "gravita": "ALTA", "descrizione": "Martello scrostatore: Lep,d 90-100 dB(A)", "normativa": "Art. 189 D.Lgs 81/08"},
-            {"nome": "Vibrazioni HAV", "gravita": "MEDIA", "descrizione": "Scrostatore: 5-15 m/s2", "normativa": "Art. 201 D.Lgs 81/08"},
-            {"nome": "Proiezione schegge", "gravita": "MEDIA", "descrizione": "Frammenti ceramica durante rimozione", "normativa": "Art. 75 D.Lgs 81/08"},
-            {"nome": "Posture incongrue", "gravita": "MEDIA", "descrizione": "Lavoro a terra prolungato", "normativa": "Allegato XXXIII"}
-        ],
-        "dpi_obbligatori": [
-            {"nome": "Maschera FFP3", "norma": "EN 149", "uso": "Polveri fini"},
-            {"nome": "Cuffie antirumore", "norma": "EN 352-1 (SNR>25dB)", "uso": "Protezione udito"},
-            {"nome": "Occhiali a mascherina", "norma": "EN 166", "uso": "Proiezione schegge"},
-            {"nome": "Ginocchiere", "norma": "EN 14404 tipo 2", "uso": "Lavoro a terra"},
-            {"nome": "Guanti antivibrazioni", "norma": "EN ISO 10819", "uso": "Uso scrostatore"}
-        ],
-        "misure_prevenzione": [
-            "Bagnatura preventiva per abbattimento polveri",
-            "Aspirazione localizzata su utensili elettrici",
-            "Pause obbligatorie ogni 2h di lavoro continuativo",
-            "Rotazione mansioni per ridurre esposizione",
-            "Rimozione macerie frequente per liberare area"
-        ],
-        "attrezzature": ["Martello scrostatore", "Smerigliatrice", "Aspiratore industriale", "Carriola"],
-        "valori_esposizione": {
-            "rumore": "Lep,d 90-100 dB(A)",
-            "vibrazioni_hav": "5-15 m/s2 - Rispettare pause"
-        }
-    },
-    "posa_pavimenti": {
-        "nome": "Posa Pavimenti e Rivestimenti",
-        "descrizione_tecnica": "Posa in opera di pavimenti e rivestimenti ceramici, preparazione sottofondi, fugatura.",
-        "rischi": [
-            {"nome": "Agenti chimici", "gravita": "MEDIA", "descrizione": "Colle, fuganti, primer (irritanti)", "normativa": "Art. 223 D.Lgs 81/08"},
-            {"nome": "Posture incongrue", "gravita": "MEDIA", "descrizione": "Lavoro prolungato in ginocchio", "normativa": "Allegato XXXIII"},
-            {"nome": "Tagli", "gravita": "MEDIA", "descrizione": "Manipolazione piastrelle e taglio", "normativa": "Art. 75 D.Lgs 81/08"},
-            {"nome": "Rumore", "gravita": "MEDIA", "descrizione": "Tagliapiastrelle elettrico: 85-95 dB(A)", "normativa": "Art. 189 D.Lgs 81/08"},
-            {"nome": "Polveri", "gravita": "MEDIA", "descrizione": "Taglio a secco ceramiche", "normativa": "Art. 224 D.Lgs 81/08"}
-        ],
-        "dpi_obbligatori": [
-            {"nome": "Guanti in nitrile", "norma": "EN 374", "uso": "Contatto colle"},
-            {"nome": "Ginocchiere professionali", "norma": "EN 14404 tipo 2", "uso": "Lavoro a terra"},
-            {"nome": "Occhiali di protezione", "norma": "EN 166", "uso": "Taglio piastrelle"},
-            {"nome": "Maschera FFP2", "norma": "EN 149", "uso": "Polveri da taglio"},
-            {"nome": "Tappi auricolari", "norma": "EN 352-2", "uso": "Tagliapiastrelle"}
-        ],
-        "misure_prevenzione": [
-            "Utilizzo tagliapiastrelle ad acqua per abbattimento polveri",
-            "Aerazione locali durante incollaggio",
-            "Rotazione posture: alternare lavoro in piedi/ginocchio",
-            "Consultazione SDS di colle e fuganti",
-            "Pulizia giornaliera residui"
-        ],
-        "attrezzature": ["Tagliapiastrelle elettrico", "Spatola dentata", "Frattazzo", "Livella laser"],
-        "sostanze_pericolose": ["Colla cementizia (irritante)", "Fugante epossidico (sensibilizzante)", "Primer acrilico"]
-    },
-    "altro_generico": {
-        "nome": "Altra Lavorazione Generica",
-        "descrizione_tecnica": "Lavorazione specifica non presente nelle categorie standard. Richiede analisi puntuale dei rischi in base alla situazione di cantiere.",
-        "rischi": [
-            {"nome": "Rischi specifici dell'attivita", "gravita": "ALTA", "descrizione": "Rischi derivanti dalla natura specifica delle operazioni (Vedi Analisi AI)", "normativa": "Art. 28 D.Lgs 81/08"},
-            {"nome": "Interferenze", "gravita": "MEDIA", "descrizione": "Rischi da contatto con altre lavorazioni o personale", "normativa": "Art. 26 D.Lgs 81/08"},
-            {"nome": "Movimentazione carichi", "gravita": "MEDIA", "descrizione": "Possibile movimentazione manuale di materiali", "normativa": "Titolo VI D.Lgs 81/08"}
-        ],
-        "dpi_obbligatori": [
-            {"nome": "Scarpe antinfortunistiche", "norma": "EN ISO 20345", "uso": "Sempre"},
-            {"nome": "Guanti di protezione", "norma": "EN 388", "uso": "Durante manipolazioni"},
-            {"nome": "DPI specifici aggiuntivi", "norma": "Da definire", "uso": "In base all'analisi rischi"}
-        ],
-        "misure_prevenzione": [
-            "Analisi preventiva dei rischi specifici prima dell'inizio lavori",
-            "Delimitazione dell'area operativa",
-            "Utilizzo di attrezzature conformi e marchiate CE",
-            "Coordinamento con il preposto per le fasi critiche",
-            "Mantenere ordine e pulizia nell'area di lavoro"
-        ],
-        "attrezzature": ["Attrezzatura specifica da definire"],
-        "formazione_richiesta": ["Formazione specifica per la mansione", "Addestramento attrezzature"]
-    }
-}
-
-TESTI_LEGALI = {
-    "premessa": """Il presente Piano Operativo di Sicurezza (POS) e redatto ai sensi dell'Art. 17, comma 1, lettera a), dell'Art. 26, comma 3, dell'Art. 96, comma 1, lettera g) e dell'Allegato XV del D.Lgs 81/2008 e s.m.i. (Testo Unico sulla Sicurezza). 
-Il POS costituisce documento di valutazione dei rischi specifici dell'impresa esecutrice, con riferimento al cantiere interessato, e deve essere considerato come piano complementare e di dettaglio del Piano di Sicurezza e Coordinamento (PSC), ove previsto.""",
-    
-    "obblighi_impresa": """L'impresa esecutrice, nella persona del Datore di Lavoro, si impegna a:
-- Osservare le misure generali di tutela di cui all'Art. 15 D.Lgs 81/08;
-- Predisporre l'accesso e la recinzione del cantiere con modalita che impediscano l'accesso a non addetti;
-- Curare la protezione dei lavoratori contro le influenze atmosferiche;
-- Curare le condizioni di rimozione dei materiali pericolosi;
-- Curare il deposito e l'evacuazione dei detriti e delle macerie;
-- Designare i lavoratori addetti alla gestione dell'emergenza;
-- Garantire la formazione e l'addestramento dei lavoratori sui rischi specifici.""",
-    
-    "coordinamento": """In presenza di piu imprese esecutrici, anche non contemporanea, il Datore di Lavoro dell'impresa:
-- Coopera all'attuazione delle misure di prevenzione e protezione dai rischi sul lavoro incidenti sull'attivita lavorativa oggetto dell'appalto (Art. 26, comma 2, lett. a);
-- Coordina gli interventi di protezione e prevenzione dai rischi cui sono esposti i lavoratori, informandosi reciprocamente anche al fine di eliminare rischi dovuti alle interferenze (Art. 26, comma 2, lett. b);
-- Partecipa alle riunioni di coordinamento indette dal CSE;
-- Segnala tempestivamente al CSE eventuali situazioni di pericolo.""",
-    
-    "emergenza": """PROCEDURE DI EMERGENZA:
-In caso di INFORTUNIO GRAVE: Chiamare immediatamente il 112, non spostare l'infortunato (salvo pericolo imminente), l'addetto al Primo Soccorso presta le prime cure in attesa dei soccorsi.
-In caso di INCENDIO: Dare l'allarme, utilizzare gli estintori solo se addestrati, evacuare verso il punto di raccolta, chiamare il 115.
-In caso di EVACUAZIONE: Abbandonare ordinatamente il cantiere seguendo le vie di fuga, recarsi al punto di raccolta, attendere il censimento.
-Il Datore di Lavoro verifica periodicamente l'efficienza dei presidi antincendio e di primo soccorso.""",
-
-    "premessa_estesa": """Il presente Piano Operativo di Sicurezza (POS) e redatto ai sensi dell'Art. 17, comma 1, lett. a), dell'Art. 26, comma 3, dell'Art. 89, comma 1, lett. h), dell'Art. 96, comma 1, lett. g) e dell'Allegato XV, punto 3.2 del D.Lgs 81/2008 e s.m.i.
-Il POS costituisce il documento di valutazione dei rischi specifici dell'impresa esecutrice, con riferimento al singolo cantiere interessato, e rappresenta il piano complementare e di dettaglio del Piano di Sicurezza e Coordinamento (PSC), ove previsto ai sensi dell'Art. 100.
-Il presente documento e stato redatto tenendo conto delle specifiche attivita e delle singole lavorazioni previste in cantiere, nonche del loro contestuale ambiente di lavoro.
-Il POS contiene i seguenti elementi minimi come richiesto dall'Allegato XV, punto 3.2, lettere da a) a l), del D.Lgs 81/2008.""",
-
-    "contenuti_allegato_xv": """Il presente POS e strutturato secondo i contenuti minimi richiesti dall'Allegato XV, punto 3.2 del D.Lgs 81/2008:
-a) Dati identificativi dell'impresa esecutrice (nominativi, indirizzi, recapiti)
-a.1) Nominativo del Datore di Lavoro, indirizzi e riferimenti telefonici
-a.2) Specifica attivita e singole lavorazioni svolte in cantiere
-a.3) Nominativi addetti al Primo Soccorso, Antincendio ed Evacuazione, e del RLS/RLST
-a.4) Nominativo del Medico Competente
-a.5) Nominativo del RSPP
-a.6) Nominativo del Direttore Tecnico e del Capocantiere
-a.7) Numero e qualifiche dei lavoratori dipendenti con specifiche mansioni
-b) Specifiche mansioni inerenti la sicurezza svolte in cantiere da ogni figura
-c) Descrizione dell'attivita di cantiere, delle modalita organizzative e dei turni di lavoro
-d) Elenco dei ponteggi, ponti su ruote a torre e altre opere provvisionali, attrezzature, macchine e impianti
-e) Elenco delle sostanze e miscele pericolose utilizzate con le relative Schede di Sicurezza
-f) Esito del rapporto di valutazione del rumore e, ove applicabile, delle vibrazioni
-g) Individuazione delle misure preventive e protettive integrative rispetto a quelle contenute nel PSC
-h) Procedure complementari e di dettaglio richieste dal PSC
-i) Elenco dei DPI forniti ai lavoratori
-l) Documentazione in merito all'informazione e formazione fornite ai lavoratori""",
-
-    "mansioni_ddl": """Il Datore di Lavoro ha la responsabilita dell'organizzazione del cantiere, della valutazione dei rischi, della designazione degli addetti alla sicurezza, della fornitura dei DPI, della formazione dei lavoratori. Vigila sull'osservanza delle misure di sicurezza e sul rispetto del POS. Coordina i lavori con le altre imprese presenti in cantiere.""",
-
-    "mansioni_rspp": """Il Responsabile del Servizio di Prevenzione e Protezione collabora con il Datore di Lavoro nella valutazione dei rischi e nella redazione del POS. Propone i programmi di informazione e formazione dei lavoratori. Partecipa alle riunioni periodiche di prevenzione (Art. 35 D.Lgs 81/08). Effettua sopralluoghi periodici in cantiere.""",
-
-    "mansioni_preposto": """Il Preposto (Direttore Tecnico / Capocantiere) sovrintende all'attivita lavorativa e garantisce l'attuazione delle direttive ricevute, controllandone la corretta esecuzione da parte dei lavoratori. Verifica che solo i lavoratori autorizzati accedano alle zone di rischio. Segnala tempestivamente al DdL le deficienze dei mezzi, delle attrezzature e dei DPI (Art. 19 D.Lgs 81/08).""",
-
-    "mansioni_ps": """L'Addetto al Primo Soccorso, designato ai sensi dell'Art. 45 D.Lgs 81/08, interviene in caso di infortunio o malore. Verifica periodicamente il contenuto della cassetta di primo soccorso (DM 388/2003). E in possesso di attestato di formazione di 12 ore (Gruppo B/C) o 16 ore (Gruppo A) con aggiornamento triennale.""",
-
-    "mansioni_antincendio": """L'Addetto Antincendio, designato ai sensi dell'Art. 46 D.Lgs 81/08, interviene con i mezzi di estinzione disponibili, coordina l'evacuazione, verifica l'agibilita delle vie di fuga e l'efficienza degli estintori. E in possesso di attestato di formazione secondo il DM 02/09/2021.""",
-
-    "mansioni_rls": """Il Rappresentante dei Lavoratori per la Sicurezza (RLS/RLST) e consultato preventivamente in ordine alla valutazione dei rischi, alla designazione degli addetti alla sicurezza, all'organizzazione della formazione. Ha diritto di accesso ai luoghi di lavoro e riceve le informazioni provenienti dai servizi di vigilanza (Art. 50 D.Lgs 81/08).""",
-
-    "mansioni_lavoratore": """Il lavoratore si prende cura della propria salute e sicurezza e di quella delle altre persone presenti in cantiere. Osserva le disposizioni e le istruzioni impartite dal DdL e dai preposti. Utilizza correttamente le attrezzature di lavoro e i DPI. Segnala immediatamente le condizioni di pericolo. Non rimuove i dispositivi di sicurezza (Art. 20 D.Lgs 81/08).""",
-
-    "organizzazione_accessi": """L'accesso al cantiere e consentito esclusivamente al personale autorizzato, dotato di DPI e identificato con tesserino di riconoscimento (Art. 26 comma 8, D.Lgs 81/08). L'ingresso e segnalato con cartellonistica conforme al D.Lgs 81/08 Allegato XXV (segnale di divieto di accesso ai non addetti, obbligo DPI, pericoli specifici). La recinzione del cantiere e realizzata con pannelli metallici di altezza minima 2 m o rete arancione su paletti.""",
-
-    "organizzazione_viabilita": """La viabilita interna al cantiere e organizzata per separare, ove possibile, i percorsi pedonali da quelli veicolari. Le aree di transito sono mantenute sgombre da materiali e detriti. I percorsi sono segnalati e, se necessario, illuminati. In caso di utilizzo di mezzi meccanici, e prevista la presenza di un moviere per le manovre in spazi ristretti.""",
-
-    "organizzazione_depositi": """Le aree di deposito materiali sono individuate in zone stabili e accessibili ai mezzi di trasporto. I materiali sono stoccati in modo ordinato, evitando altezze eccessive e garantendo la stabilita dei depositi. I materiali pericolosi (vernici, solventi, bombole gas) sono depositati in aree dedicate, ventilate e protette da fonti di calore, conformemente alle indicazioni delle Schede di Sicurezza.""",
-
-    "organizzazione_servizi": """Servizi igienico-assistenziali (Allegato XIII D.Lgs 81/08):
-- Servizi igienici: gabinetti e lavabi in numero adeguato, mantenuti puliti e in buone condizioni
-- Spogliatoi: armadietti individuali per indumenti di lavoro, separati dagli effetti personali
-- Acqua potabile: disponibile in quantita sufficiente, in recipienti chiusi e con rubinetto
-- Locale refettorio/consumo pasti: area coperta e attrezzata (ove necessario per la durata dei lavori)
-In caso di cantieri di breve durata e modesta entita, previo accordo con i lavoratori, si potra utilizzare il servizio igienico presente nell'immobile oggetto dei lavori o nei locali limitrofi.""",
-
-    "macroclima_estate": """LAVORI IN PERIODO ESTIVO (Rischio colpo di calore):
-In caso di temperature elevate (WBGT > 25 C o temperatura percepita > 33 C), il Datore di Lavoro adotta le seguenti misure:
-- Previsione di pause supplementari in aree ombreggiate (min. 15 min ogni 2 ore);
-- Disponibilita di acqua fresca e sali minerali in cantiere;
-- Evitare lavorazioni pesanti nelle ore piu calde (12:00-15:00);
-- Monitoraggio condizioni meteo mediante bollettini INAIL/Worklimate;
-- Formazione specifica dei lavoratori sul riconoscimento dei sintomi del colpo di calore;
-- Organizzazione del lavoro in modo da favorire le lavorazioni all'ombra nelle ore centrali.""",
-
-    "macroclima_inverno": """LAVORI IN PERIODO INVERNALE (Rischio ipotermia e ghiaccio):
-In caso di basse temperature, il Datore di Lavoro adotta le seguenti misure:
-- Fornitura di DPI adeguati (indumenti termici, guanti imbottiti);
-- Pause riscaldamento in locale riscaldato;
-- Trattamento antighiaccio su percorsi e rampe;
-- Verifica stabilita strutture in caso di nevicate o gelate;
-- Sospensione lavori in caso di condizioni meteo avverse (ghiaccio, vento forte > 60 km/h).""",
-
-    "metodologia_rischi": """La valutazione dei rischi e condotta con metodo semi-quantitativo, secondo la matrice Probabilita x Gravita (P x G).
-La Probabilita (P) tiene conto della frequenza di esposizione, delle condizioni operative, della formazione e delle misure gia in atto, ed e espressa su scala 1-4:
-P=1 Improbabile: evento possibile solo in circostanze eccezionali;
-P=2 Poco probabile: evento che potrebbe verificarsi con bassa frequenza;
-P=3 Probabile: evento atteso in alcune circostanze;
-P=4 Molto probabile: evento atteso nella maggior parte delle circostanze.
-La Gravita (G) del danno atteso e espressa su scala 1-4:
-G=1 Lieve: lesioni rapidamente reversibili (abrasioni, contusioni lievi);
-G=2 Medio: lesioni reversibili (fratture semplici, ustioni 1 grado);
-G=3 Grave: lesioni con effetti irreversibili parziali (fratture complesse, amputazioni parziali);
-G=4 Molto grave: lesioni mortali o invalidita permanente totale.
-Il Rischio R = P x G produce un valore da 1 a 16, classificato come:
-R = 1-2: BASSO (accettabile, mantenere le misure in atto);
-R = 3-4: MEDIO (programmazione interventi migliorativi);
-R = 6-8: ALTO (interventi urgenti di riduzione del rischio);
-R = 9-16: MOLTO ALTO (interventi immediati, eventuale sospensione attivita).""",
-
-    "procedure_psc": """In presenza di Piano di Sicurezza e Coordinamento (PSC), l'impresa esecutrice si impegna a:
-- Recepire integralmente le prescrizioni del PSC e le eventuali prescrizioni complementari;
-- Attuare le procedure di coordinamento previste dal CSP/CSE;
-- Partecipare alle riunioni di coordinamento e verbalizzare le decisioni assunte;
-- Comunicare al CSE eventuali proposte di modifica al PSC per meglio garantire la sicurezza;
-- Sottoporre il presente POS all'approvazione del CSE prima dell'inizio dei lavori;
-- Segnalare tempestivamente al CSE situazioni di pericolo grave e immediato;
-- Informare il CSE sull'ingresso in cantiere di eventuali subappaltatori.
-Qualora il PSC non sia previsto (cantieri con unica impresa e senza rischi particolari di cui all'Allegato XI), l'impresa opera in conformita al presente POS."""
-}
-
 # ==============================================================================
 # FUNZIONI AI
 # ==============================================================================
-def get_openai_client():
-    if not OPENAI_AVAILABLE:
-        return None
-    try:
-        api_key = st.secrets.get("OPENAI_API_KEY", None)
-        if api_key:
-            return openai.OpenAI(api_key=api_key)
-    except:
-        pass
-    return None
-
-
-def ai_analizza_descrizione(descrizione):
+def ai_analizza_descrizione(descrizione, origine=None, simili=True, utente=None, personalizzate=None):
     """
     Analizza la descrizione dei lavori con AI e identifica:
     - Lavorazioni pertinenti
@@ -646,69 +266,139 @@ def ai_analizza_descrizione(descrizione):
     - Note per il RSPP
     - Attrezzature suggerite
     - DPI consigliati
+    
+    Le risposte sono in cache (ai_cache) per descrizione normalizzata, versione del
+    dizionario e modello: una descrizione gia analizzata non genera nuove chiamate.
+    Con simili=True si riusa anche l'analisi di una descrizione quasi identica,
+    ma solo tra le descrizioni dello stesso utente (senza utente nessun riuso).
+    origine: dict in cui ai_cache scrive la fonte ('cache', 'simile', 'modello')
+    personalizzate: lavorazioni personalizzate dell'utente; prompt, schema e
+    versione del dizionario (quindi le chiavi di cache) sono quelli del catalogo sovrapposto
     """
-    client = get_openai_client()
-    if not client or not descrizione.strip():
+    if not descrizione.strip():
         return None
-    
-    lavorazioni_disponibili = {k: v['nome'] for k, v in DIZIONARIO_LAVORAZIONI.items()}
-    
-    prompt = f"""Sei un RSPP esperto in sicurezza cantieri (D.Lgs 81/08).
-Analizza questa descrizione lavori e identifica TUTTE le lavorazioni pertinenti.
+    modello = "gpt-4o-mini"
+    prompt = prompt_analisi(personalizzate)
+    # Chiavi separate per backend: le risposte dello stub non raggiungono quelle del modello vero
+    modello_chiave = modello_cache(modello)
+    chiave = chiave_cache('analizza_descrizione', descrizione, prompt['versione'], modello_chiave)
+    simile = None
+    if simili and utente:
+        simile = (ambito_cache('analizza_descrizione', prompt['versione'], modello_chiave, utente), descrizione)
+    return con_cache(chiave, lambda: _ai_analizza_descrizione(descrizione, modello, prompt), simile, origine)
+
 
-DESCRIZIONE LAVORI:
-"{descrizione}"
+def ai_analisi_con_origine(descrizione, simili=True, utente=None, personalizzate=None):
+    """ai_analizza_descrizione per i task in background: restituisce (risultato, origine)."""
+    origine = {}
+    return ai_analizza_descrizione(descrizione, origine, simili, utente, personalizzate), origine
 
-LAVORAZIONI DISPONIBILI (usa SOLO queste chiavi):
-{json.dumps(lavorazioni_disponibili, ensure_ascii=False, indent=2)}
 
-ISTRUZIONI:
-1. Identifica TUTTE le lavorazioni che si applicano alla descrizione
-2. Aggiungi rischi specifici NON coperti dalle lavorazioni standard
-3. Suggerisci note pratiche per il RSPP
-4. Indica il livello di complessità (basso/medio/alto)
+def _ai_json(client, funzione, messaggi, tipo, schema, prompt=None, **parametri):
+    """
+    Completamento con risposta JSON a schema rigoroso (structured output).
+    La risposta viene validata in locale (ai_prompt.leggi_risposta); se non e
+    valida si fa un solo tentativo di correzione rimandando al modello gli errori.
+    tipo: 'analisi' o 'completezza'
+    prompt: per l'analisi, il prompt_analisi della richiesta (catalogo usato)
+    Restituisce i dati validati o None.
+    """
+    parametri['response_format'] = formato_risposta(tipo, schema)
+    for tentativo in range(2):
+        stimati = stima_token(messaggi)
+        inizio = time.time()
+        response = chiama_ai(client, funzione, messages=messaggi, **parametri)
+        if response is None:
+            return None
+        registra_uso(funzione, stimati, getattr(response, 'usage', None), time.time() - inizio)
+        messaggio = response.choices[0].message
+        if getattr(messaggio, 'refusal', None):
+            print(f"Risposta AI {funzione} rifiutata: {messaggio.refusal}")
+            return None
+        dati, errori = leggi_risposta(messaggio.content, tipo, prompt)
+        if not errori:
+            return dati
+        print(f"Risposta AI {funzione} non valida: {'; '.join(errori[:5])}")
+        messaggi = messaggi + [
+            {"role": "assistant", "content": messaggio.content or ""},
+            {"role": "user", "content": "La risposta non rispetta lo schema: " + "; ".join(errori[:10])
+                                        + ". Rispondi di nuovo SOLO con il JSON corretto."}
+        ]
+    return None
 
-Rispondi SOLO con questo JSON:
-{{
-    "lavorazioni_identificate": ["chiave1", "chiave2"],
-    "rischi_aggiuntivi": [
-        {{"nome": "Nome Rischio", "gravita": "ALTA/MEDIA/BASSA", "descrizione": "Descrizione dettagliata", "misura": "Misura preventiva"}}
-    ],
-    "note_rspp": "Note e raccomandazioni specifiche per questo cantiere",
-    "complessita": "medio",
-    "attrezzature_suggerite": ["Attrezzatura 1", "Attrezzatura 2"],
-    "dpi_specifici": ["DPI 1", "DPI 2"]
-}}"""
 
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini", 
-            messages=[{"role": "user", "content": prompt}], 
-            temperature=0.3, 
-            max_tokens=1500
-        )
-        content = response.choices[0].message.content.strip()
-        if content.startswith("```"):
-            content = re.sub(r'^```json?\n?', '', content)
-            content = re.sub(r'\n?```$', '', content)
-        return json.loads(content)
-    except Exception as e:
+def _ai_analizza_descrizione(descrizione, modello, prompt):
+    client = get_openai_client()
+    if not client:
         return None
+    
+    # Istruzioni e catalogo compatto stanno nel messaggio di sistema (ai_prompt),
+    # costruito una volta per catalogo e uguale in ogni chiamata: qui va solo la descrizione
+    messaggi = [
+        {"role": "system", "content": prompt['sistema']},
+        {"role": "user", "content": f'DESCRIZIONE LAVORI:\n"{descrizione}"'}
+    ]
+    return _ai_json(client, 'analizza', messaggi, 'analisi', prompt['schema'], prompt,
+                    model=modello, temperature=0.3, max_tokens=1500)
 
 
-def ai_genera_descrizione_avanzata(tipo_lavoro, indirizzo="", durata=""):
+def _ai_stream(funzione, messaggi, temperature, max_tokens, parziale=None):
     """
-    Genera una descrizione tecnica professionale per il POS
-    con più contesto e dettagli.
+    Completamento in streaming: restituisce i frammenti di testo man mano che arrivano.
+    funzione: nome dell'helper per log e metriche ('descrizione', 'assistente')
+    parziale: lista in cui accumulare i frammenti ricevuti; resta valida anche se
+    l'utente interrompe a meta (Streamlit chiude il generatore al rerun).
     """
     client = get_openai_client()
     if not client:
-        return ""
+        return
+    stimati = stima_token(messaggi)
+    inizio = time.time()
+    usage = None
+    chunks = stream_ai(
+        client, funzione,
+        model="gpt-4o-mini", 
+        messages=messaggi, 
+        temperature=temperature, 
+        max_tokens=max_tokens,
+        stream_options={"include_usage": True}
+    )
     try:
-        contesto = f"Cantiere: {indirizzo}" if indirizzo else ""
-        durata_info = f"Durata prevista: {durata}" if durata else ""
-        
-        prompt = f"""Sei un Coordinatore della Sicurezza esperto D.Lgs 81/08.
+        for chunk in chunks:
+            # L'ultimo frammento porta solo il conteggio dei token
+            usage = getattr(chunk, 'usage', None) or usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if parziale is not None:
+                    parziale.append(delta)
+                yield delta
+    finally:
+        # Fine, errore o interruzione: chiude subito la connessione dello stream
+        chunks.close()
+        registra_uso(funzione, stimati, usage, time.time() - inizio)
+
+
+def mostra_stream(frammenti, stile="markdown"):
+    """Mostra il testo in arrivo con un cursore; restituisce il testo completo."""
+    segnaposto = st.empty()
+    testo = ""
+    for frammento in frammenti:
+        testo += frammento
+        getattr(segnaposto, stile)(testo + "▌")
+    if testo:
+        getattr(segnaposto, stile)(testo)
+    else:
+        segnaposto.empty()
+    return testo
+
+
+def _prompt_descrizione(tipo_lavoro, indirizzo="", durata=""):
+    contesto = f"Cantiere: {indirizzo}" if indirizzo else ""
+    durata_info = f"Durata prevista: {durata}" if durata else ""
+    
+    return f"""Sei un Coordinatore della Sicurezza esperto D.Lgs 81/08.
 Genera una DESCRIZIONE TECNICA PROFESSIONALE per un Piano Operativo di Sicurezza (POS).
 
 TIPO LAVORO: {tipo_lavoro}
@@ -728,1644 +418,152 @@ REGOLE TASSATIVE:
 
 Rispondi SOLO con la descrizione tecnica, senza introduzioni."""
 
-        response = client.chat.completions.create(
-            model="gpt-4o-mini", 
-            messages=[{"role": "user", "content": prompt}], 
-            temperature=0.4, 
-            max_tokens=300
-        )
-        testo = response.choices[0].message.content.strip()
-        return testo.strip('"\'')
-    except:
-        return ""
+
+def ai_genera_descrizione_stream(tipo_lavoro, indirizzo="", durata="", parziale=None):
+    """
+    Genera una descrizione tecnica professionale per il POS
+    con più contesto e dettagli, in streaming (vedi _ai_stream).
+    """
+    messaggi = [{"role": "user", "content": _prompt_descrizione(tipo_lavoro, indirizzo, durata)}]
+    return _ai_stream('descrizione', messaggi, 0.4, 300, parziale)
+
+
+def ai_genera_descrizione_avanzata(tipo_lavoro, indirizzo="", durata=""):
+    """
+    Genera una descrizione tecnica professionale per il POS
+    con più contesto e dettagli.
+    """
+    testo = "".join(ai_genera_descrizione_stream(tipo_lavoro, indirizzo, durata))
+    return testo.strip().strip('"\'')
+
+
+def ai_assistente_stream(domanda, parziale=None):
+    messaggi = [{"role": "system", "content": "RSPP esperto D.Lgs 81/08. Max 150 parole."}, {"role": "user", "content": domanda}]
+    return _ai_stream('assistente', messaggi, 0.3, 400, parziale)
 
 
 def ai_assistente(domanda):
-    client = get_openai_client()
-    if not client:
+    if not get_openai_client():
         return "AI non disponibile."
-    try:
-        response = client.chat.completions.create(model="gpt-4o-mini", messages=[{"role": "system", "content": "RSPP esperto D.Lgs 81/08. Max 150 parole."}, {"role": "user", "content": domanda}], temperature=0.3, max_tokens=400)
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        return f"Errore: {str(e)}"
+    risposta = "".join(ai_assistente_stream(domanda)).strip()
+    return risposta or "Errore: nessuna risposta dall'AI."
 
 
 def ai_valuta_completezza(dati_pos):
+    """Secondo parere AI sulla completezza; senza client o in errore vale la valutazione locale."""
     client = get_openai_client()
     if not client:
-        return {"score": 100, "suggerimenti": [], "elementi_presenti": ["Completo"]}
+        return valuta_completezza(dati_pos)
     
-    try:
-        ditta = dati_pos.get('ditta', {})
-        cantiere = dati_pos.get('cantiere', {})
-        addetti = dati_pos.get('addetti', {})
-        lavorazioni = dati_pos.get('lavorazioni', [])
-        
-        prompt = f"""Valuta completezza POS. Se tutti i campi sono compilati dai 100/100.
+    ditta = dati_pos.get('ditta', {})
+    cantiere = dati_pos.get('cantiere', {})
+    addetti = dati_pos.get('addetti', {})
+    lavorazioni = dati_pos.get('lavorazioni', [])
+    
+    prompt = f"""Valuta completezza POS. Se tutti i campi sono compilati dai 100/100.
 Dati: Impresa={ditta.get('ragione_sociale','')}, PIVA={ditta.get('piva_cf','')}, Datore={ditta.get('datore_lavoro','')}, 
 Cantiere={cantiere.get('indirizzo','')}, Durata={cantiere.get('durata','')}, Descrizione={'SI' if cantiere.get('descrizione') else 'NO'},
 PS={addetti.get('primo_soccorso','')}, Antincendio={addetti.get('antincendio','')}, Lavorazioni={len(lavorazioni)}
-Se tutto compilato: score 100. Rispondi JSON: {{"score": 100, "elementi_presenti": ["elem"], "suggerimenti": ["Pronto"]}}"""
+Se tutto compilato: score 100. Rispondi in JSON con score (0-100), elementi_presenti e suggerimenti."""
 
-        response = client.chat.completions.create(model="gpt-4o-mini", messages=[{"role": "user", "content": prompt}], temperature=0.1, max_tokens=300)
-        content = response.choices[0].message.content.strip()
-        if content.startswith("```"):
-            content = re.sub(r'^```json?\n?', '', content)
-            content = re.sub(r'\n?```$', '', content)
-        return json.loads(content)
-    except:
-        return {"score": 100, "suggerimenti": ["Pronto"], "elementi_presenti": ["Completo"]}
+    messaggi = [{"role": "user", "content": prompt}]
+    valutazione = _ai_json(client, 'completezza', messaggi, 'completezza', SCHEMA_COMPLETEZZA,
+                           model="gpt-4o-mini", temperature=0.1, max_tokens=300)
+    return valutazione or valuta_completezza(dati_pos)
 
 
-# ==============================================================================
-# PDF - VERSIONE ULTRA-SEMPLICE
-# ==============================================================================
-def pulisci_testo(text, max_len=200):
-    """
-    Pulisce il testo per il PDF mantenendo gli accenti italiani.
-    Usa la codifica latin-1 compatibile con i font standard di FPDF.
-    """
-    if text is None:
-        return "N.D."
-    text = str(text).strip()
-    if not text:
-        return "N.D."
-    
-    # 1. Normalizzazione caratteri speciali che rompono i PDF standard
-    replacements = {
-        '€': 'EUR', 
-        '’': "'", '‘': "'", 
-        '“': '"', '”': '"', 
-        '–': '-', '…': '...'
-    }
-    for old, new in replacements.items():
-        text = text.replace(old, new)
-    
-    # Rimuovi a capo e tabulazioni eccessive
-    text = text.replace('\n', ' ').replace('\r', ' ').replace('\t', ' ')
-    
-    # 2. Gestione Encoding per FPDF (Helvetica standard usa Latin-1/Windows-1252)
-    try:
-        # Tenta di codificare in latin-1 (supporta accenti italiani). 
-        # 'replace' sostituisce caratteri non supportati (es. Emoji, Cinese) con '?'
-        text = text.encode('latin-1', 'replace').decode('latin-1')
-    except Exception:
-        # Fallback estremo
-        text = text.encode('ascii', 'ignore').decode('ascii')
-
-    # 3. Pulizia finale spazi
-    while "  " in text:
-        text = text.replace("  ", " ")
-        
-    # Limita lunghezza
-    if max_len and len(text) > max_len:
-        text = text[:max_len-3] + "..."
-        
-    return text
+def _attesa_task_ai(nome, messaggio):
+    """Mostra l'attesa di un task AI e riesegue la pagina appena il risultato e pronto."""
+    if ai_background.stato_task(st.session_state, nome) == 'in_corso':
+        st.info(f"⏳ {messaggio}")
+    else:
+        st.rerun()
 
 
-def genera_pdf_pos(ditta, cantiere, addetti, lavorazioni, rischi_ai=None, lavoratori=None, attrezzature=None, sostanze=None):
-    """Genera PDF POS professionale e completo - Conforme Allegato XV D.Lgs 81/08 - V2 GRAFICA MIGLIORATA"""
-    
-    pdf = FPDF()
-    pdf.set_auto_page_break(auto=False)
-    
-    # ===================== COSTANTI DESIGN =====================
-    W = 186          # Larghezza utile (margini 12mm)
-    ML = 12          # Margine sinistro
-    MR = 12          # Margine destro
-    
-    # Palette colori professionale
-    ARANCIONE = (230, 92, 0)
-    ARANCIONE_CHIARO = (255, 237, 220)
-    BLU_SCURO = (22, 33, 62)
-    BLU_MEDIO = (44, 62, 103)
-    GRIGIO_SCURO = (55, 55, 65)
-    GRIGIO_MEDIO = (120, 120, 130)
-    GRIGIO_CHIARO = (242, 243, 247)
-    GRIGIO_BORDO = (200, 205, 215)
-    BIANCO = (255, 255, 255)
-    ROSSO_BADGE = (220, 53, 53)
-    ROSSO_CHIARO = (255, 235, 235)
-    GIALLO_BADGE = (217, 152, 11)
-    GIALLO_CHIARO = (255, 250, 230)
-    VERDE_BADGE = (34, 139, 34)
-    VERDE_CHIARO = (232, 250, 232)
-    BLU_CHIARO = (232, 240, 255)
-    
-    lavoratori = lavoratori or []
-    attrezzature = attrezzature or []
-    sostanze = sostanze or []
-    
-    num_pagina = [0]
-    
-    # ===================== HELPER FUNCTIONS =====================
-    
-    def check_spazio(altezza_necessaria=40):
-        if pdf.get_y() > (272 - altezza_necessaria):
-            nuova_pagina()
-    
-    def nuova_pagina():
-        num_pagina[0] += 1
-        pdf.add_page()
-        pdf.set_left_margin(ML)
-        pdf.set_right_margin(MR)
-        if num_pagina[0] > 1:
-            # Header sottile e elegante
-            pdf.set_fill_color(*BLU_SCURO)
-            pdf.rect(0, 0, 210, 8, 'F')
-            pdf.set_fill_color(*ARANCIONE)
-            pdf.rect(0, 8, 210, 0.8, 'F')
-            pdf.set_font('Helvetica', 'B', 7)
-            pdf.set_text_color(255, 255, 255)
-            pdf.set_xy(ML, 1.5)
-            pdf.cell(W * 0.7, 5, f'PIANO OPERATIVO DI SICUREZZA', ln=0)
-            pdf.set_font('Helvetica', '', 7)
-            pdf.cell(W * 0.3, 5, pulisci_testo(ditta.get("ragione_sociale", ""), 30), ln=0, align='R')
-            pdf.set_text_color(0, 0, 0)
-            pdf.set_y(14)
-            # Footer con numero pagina
-            _add_footer()
-    
-    def _add_footer():
-        """Aggiunge footer a ogni pagina"""
-        y_save = pdf.get_y()
-        pdf.set_y(285)
-        pdf.set_draw_color(*GRIGIO_BORDO)
-        pdf.line(ML, 284, ML + W, 284)
-        pdf.set_font('Helvetica', '', 6)
-        pdf.set_text_color(*GRIGIO_MEDIO)
-        pdf.set_x(ML)
-        pdf.cell(W * 0.33, 4, f'POS - {pulisci_testo(ditta.get("ragione_sociale", ""), 30)}', align='L')
-        pdf.cell(W * 0.34, 4, f'Pag. {num_pagina[0]}', align='C')
-        pdf.cell(W * 0.33, 4, 'Generato con POS Facile', align='R')
-        pdf.set_text_color(0, 0, 0)
-        pdf.set_draw_color(0, 0, 0)
-        pdf.set_y(y_save)
-    
-    def titolo_sezione(num, titolo):
-        check_spazio(50)
-        pdf.ln(6)
-        # Barra laterale arancione + testo
-        y = pdf.get_y()
-        pdf.set_fill_color(*ARANCIONE)
-        pdf.rect(ML, y, 3, 8, 'F')
-        pdf.set_fill_color(*GRIGIO_CHIARO)
-        pdf.rect(ML + 3, y, W - 3, 8, 'F')
-        pdf.set_font('Helvetica', 'B', 11)
-        pdf.set_text_color(*BLU_SCURO)
-        pdf.set_xy(ML + 7, y + 1)
-        pdf.cell(W - 10, 6, f'{num}. {titolo.upper()}')
-        pdf.set_text_color(0, 0, 0)
-        pdf.set_y(y + 11)
-    
-    def campo(label, valore):
-        check_spazio(8)
-        pdf.set_font('Helvetica', 'B', 9)
-        pdf.set_text_color(*GRIGIO_SCURO)
-        pdf.set_x(ML + 2)
-        label_w = pdf.get_string_width(pulisci_testo(label, 30) + ':  ')
-        pdf.cell(label_w, 5, pulisci_testo(label, 30) + ':  ', ln=0)
-        pdf.set_font('Helvetica', '', 9)
-        pdf.set_text_color(0, 0, 0)
-        pdf.cell(W - label_w - 4, 5, pulisci_testo(valore, 90), ln=1)
-    
-    def paragrafo(testo, size=9):
-        check_spazio(15)
-        pdf.set_font('Helvetica', '', size)
-        pdf.set_text_color(*GRIGIO_SCURO)
-        pdf.set_x(ML + 2)
-        pdf.multi_cell(W - 4, 4.5, pulisci_testo(testo, 1200))
-        pdf.set_text_color(0, 0, 0)
-    
-    def sottotitolo(testo):
-        check_spazio(12)
-        pdf.ln(3)
-        pdf.set_font('Helvetica', 'B', 10)
-        pdf.set_text_color(*BLU_SCURO)
-        pdf.set_x(ML + 2)
-        pdf.cell(W, 5, pulisci_testo(testo, 70), ln=1)
-        pdf.set_text_color(0, 0, 0)
-        pdf.ln(1)
-    
-    def riga(testo, size=9):
-        check_spazio(6)
-        pdf.set_font('Helvetica', '', size)
-        pdf.set_text_color(*GRIGIO_SCURO)
-        pdf.set_x(ML + 4)
-        pdf.cell(W - 6, 4.5, pulisci_testo(testo, 120), ln=1)
-        pdf.set_text_color(0, 0, 0)
-    
-    def tabella_header(colonne):
-        """Disegna header tabella moderno"""
-        pdf.set_fill_color(*BLU_SCURO)
-        pdf.set_text_color(255, 255, 255)
-        pdf.set_font('Helvetica', 'B', 8)
-        pdf.set_x(ML)
-        for nome, larghezza in colonne:
-            pdf.cell(larghezza, 6, '  ' + nome, fill=True)
-        pdf.ln()
-        pdf.set_text_color(0, 0, 0)
-    
-    def tabella_riga(valori, colonne, indice=0):
-        """Disegna riga tabella con colori alternati"""
-        check_spazio(8)
-        if indice % 2 == 0:
-            pdf.set_fill_color(*BIANCO)
-        else:
-            pdf.set_fill_color(*GRIGIO_CHIARO)
-        pdf.set_font('Helvetica', '', 8)
-        pdf.set_x(ML)
-        for i, (nome, larghezza) in enumerate(colonne):
-            val = valori[i] if i < len(valori) else ''
-            pdf.cell(larghezza, 6, '  ' + pulisci_testo(val, int(larghezza * 0.6)), fill=True)
-        pdf.ln()
-        # Linea sottile di separazione
-        pdf.set_draw_color(*GRIGIO_BORDO)
-        pdf.line(ML, pdf.get_y(), ML + W, pdf.get_y())
-        pdf.set_draw_color(0, 0, 0)
-    
-    # ==================== COPERTINA ====================
-    num_pagina[0] = 1
-    pdf.add_page()
-    pdf.set_left_margin(ML)
-    pdf.set_right_margin(MR)
-    
-    # Banda superiore blu scuro
-    pdf.set_fill_color(*BLU_SCURO)
-    pdf.rect(0, 0, 210, 75, 'F')
-    
-    # Linea decorativa arancione
-    pdf.set_fill_color(*ARANCIONE)
-    pdf.rect(0, 75, 210, 3, 'F')
-    
-    # Titolo grande
-    pdf.set_font('Helvetica', 'B', 32)
-    pdf.set_text_color(255, 255, 255)
-    pdf.set_xy(ML + 5, 18)
-    pdf.cell(W - 10, 14, 'PIANO OPERATIVO', ln=1)
-    pdf.set_xy(ML + 5, 32)
-    pdf.cell(W - 10, 14, 'DI SICUREZZA', ln=1)
-    
-    # Sottotitolo normativo
-    pdf.set_font('Helvetica', '', 11)
-    pdf.set_text_color(*ARANCIONE)
-    pdf.set_xy(ML + 5, 52)
-    pdf.cell(W - 10, 6, 'ai sensi del D.Lgs 81/2008', ln=1)
-    pdf.set_font('Helvetica', '', 9)
-    pdf.set_text_color(180, 190, 210)
-    pdf.set_xy(ML + 5, 59)
-    pdf.cell(W - 10, 5, 'Titolo IV - Capo I - Allegato XV, punto 3.2', ln=1)
-    
-    pdf.set_text_color(0, 0, 0)
-    pdf.set_y(88)
-    
-    # Box informativi copertina - design card
-    def box_copertina(etichetta, righe_dati, y_start):
-        pdf.set_y(y_start)
-        # Etichetta
-        pdf.set_font('Helvetica', 'B', 7)
-        pdf.set_text_color(*ARANCIONE)
-        pdf.set_x(ML + 5)
-        pdf.cell(W, 4, etichetta.upper(), ln=1)
-        # Linea
-        pdf.set_draw_color(*GRIGIO_BORDO)
-        pdf.line(ML + 5, pdf.get_y(), ML + 80, pdf.get_y())
-        pdf.set_draw_color(0, 0, 0)
-        pdf.ln(2)
-        # Dati
-        pdf.set_text_color(*GRIGIO_SCURO)
-        first = True
-        for v in righe_dati:
-            if v:
-                if first:
-                    pdf.set_font('Helvetica', 'B', 11)
-                    first = False
-                else:
-                    pdf.set_font('Helvetica', '', 9)
-                pdf.set_x(ML + 5)
-                pdf.cell(W, 5, pulisci_testo(v, 80), ln=1)
-        pdf.set_text_color(0, 0, 0)
-        return pdf.get_y() + 4
-    
-    y = 88
-    y = box_copertina('IMPRESA ESECUTRICE', [
-        ditta.get('ragione_sociale', ''),
-        f"P.IVA/C.F.: {ditta.get('piva_cf', '')}",
-        ditta.get('indirizzo', '')
-    ], y)
-    
-    y = box_copertina('CANTIERE', [
-        cantiere.get('indirizzo', ''),
-        f"Committente: {cantiere.get('committente', '')}",
-        f"Durata prevista: {cantiere.get('durata', '')}"
-    ], y)
-    
-    y = box_copertina('RESPONSABILI SICUREZZA', [
-        f"Datore di Lavoro: {ditta.get('datore_lavoro', '')}",
-        f"RSPP: {ditta.get('rspp', '') or ditta.get('datore_lavoro', '')}",
-        f"Medico Competente: {ditta.get('medico', '') or 'Non previsto'}"
-    ], y)
-    
-    # Data e revisione in fondo copertina
-    pdf.set_y(255)
-    pdf.set_draw_color(*GRIGIO_BORDO)
-    pdf.line(ML, 254, ML + W, 254)
-    pdf.set_draw_color(0, 0, 0)
-    
-    pdf.set_font('Helvetica', '', 9)
-    pdf.set_text_color(*GRIGIO_MEDIO)
-    pdf.set_x(ML)
-    pdf.cell(W * 0.5, 5, f"Data emissione: {date.today().strftime('%d/%m/%Y')}", align='L')
-    pdf.cell(W * 0.5, 5, f"Rev. 00", align='R', ln=1)
-    pdf.set_text_color(0, 0, 0)
-    
-    # Footer copertina
-    pdf.set_y(275)
-    pdf.set_font('Helvetica', '', 6)
-    pdf.set_text_color(*GRIGIO_MEDIO)
-    pdf.set_x(ML)
-    pdf.cell(W, 4, 'Documento generato con POS Facile - www.posfacile.it', align='C')
-    pdf.set_text_color(0, 0, 0)
-    
-    # ==================== SOMMARIO ====================
-    nuova_pagina()
-    
-    pdf.ln(2)
-    pdf.set_font('Helvetica', 'B', 14)
-    pdf.set_text_color(*BLU_SCURO)
-    pdf.set_x(ML)
-    pdf.cell(W, 8, 'SOMMARIO', ln=1)
-    pdf.set_text_color(0, 0, 0)
-    
-    pdf.set_draw_color(*ARANCIONE)
-    pdf.line(ML, pdf.get_y(), ML + 40, pdf.get_y())
-    pdf.set_draw_color(0, 0, 0)
-    pdf.ln(6)
-    
-    # Build sommario entries - numbered sections
-    sommario_voci = [
-        ('1', 'Premessa Normativa'),
-        ('2', 'Identificazione Impresa Esecutrice'),
-        ('3', 'Identificazione Cantiere'),
-        ('4', 'Mansioni Inerenti la Sicurezza'),
-        ('5', 'Elenco Lavoratori Impiegati'),
-        ('6', 'Formazione e Addestramento'),
-        ('7', 'Attrezzature di Cantiere'),
-        ('8', 'Sostanze e Miscele Pericolose'),
-        ('9', 'Organizzazione del Cantiere'),
-        ('10', 'Condizioni Climatiche - Macroclima'),
-        ('11', 'Cronoprogramma Lavori'),
-        ('12', 'Metodologia di Valutazione dei Rischi'),
-        ('13', 'Valutazione dei Rischi per Fase Lavorativa'),
-        ('14', 'Esiti Valutazione Rumore e Vibrazioni'),
-        ('15', 'Matrice DPI per Mansione'),
-        ('16', 'Coordinamento e Procedure PSC'),
-        ('17', 'Gestione Emergenze'),
-        ('18', 'Checklist Allegati'),
-        ('19', 'Dichiarazione e Firme'),
-        ('20', 'Verbale di Presa Visione e Consegna DPI'),
-    ]
-    
-    for num, titolo_voce in sommario_voci:
-        pdf.set_font('Helvetica', 'B', 9)
-        pdf.set_text_color(*BLU_SCURO)
-        pdf.set_x(ML + 2)
-        num_txt = f"Sez. {num}"
-        pdf.cell(18, 5.5, num_txt, ln=0)
-        pdf.set_font('Helvetica', '', 9)
-        pdf.set_text_color(*GRIGIO_SCURO)
-        # Dots leader
-        titolo_corto = pulisci_testo(titolo_voce, 60)
-        pdf.cell(W - 20, 5.5, titolo_corto, ln=1)
-        pdf.set_text_color(0, 0, 0)
-    
-    pdf.ln(4)
-    pdf.set_draw_color(*GRIGIO_BORDO)
-    pdf.line(ML, pdf.get_y(), ML + W, pdf.get_y())
-    pdf.set_draw_color(0, 0, 0)
-    pdf.ln(3)
-    pdf.set_font('Helvetica', 'I', 7)
-    pdf.set_text_color(*GRIGIO_MEDIO)
-    pdf.set_x(ML)
-    pdf.cell(W, 4, 'Contenuti minimi conformi all\'Allegato XV, punto 3.2, lettere da a) a l), D.Lgs 81/2008 e s.m.i.', ln=1)
-    pdf.set_text_color(0, 0, 0)
-    
-    # ==================== SEZ. 1: PREMESSA NORMATIVA ====================
-    nuova_pagina()
-    num_sez = 1
-    titolo_sezione(str(num_sez), 'Premessa Normativa')
-    
-    sottotitolo('Riferimenti Legislativi')
-    paragrafo(TESTI_LEGALI['premessa_estesa'])
-    
-    pdf.ln(2)
-    sottotitolo('Contenuti del POS - Allegato XV, punto 3.2')
-    paragrafo(TESTI_LEGALI['contenuti_allegato_xv'], size=8)
-    
-    # ==================== SEZ. 2: DATI IMPRESA ====================
-    num_sez += 1
-    titolo_sezione(str(num_sez), 'Identificazione Impresa Esecutrice')
-    campo('Ragione Sociale', ditta.get('ragione_sociale', ''))
-    campo('P.IVA / C.F.', ditta.get('piva_cf', ''))
-    campo('Sede Legale', ditta.get('indirizzo', ''))
-    campo('Telefono', ditta.get('telefono', '') or 'N.D.')
-    if ditta.get('codice_ateco'):
-        campo('Codice ATECO', ditta.get('codice_ateco', ''))
-    if ditta.get('num_dipendenti'):
-        campo('N. Dipendenti', ditta.get('num_dipendenti', ''))
-    
-    pdf.ln(2)
-    sottotitolo('Figure della Sicurezza')
-    campo('Datore di Lavoro', ditta.get('datore_lavoro', ''))
-    rspp = f"{ditta.get('datore_lavoro', '')} (Art. 34 D.Lgs 81/08)" if ditta.get('rspp_autonomo', True) else ditta.get('rspp', '')
-    campo('RSPP', rspp)
-    campo('Medico Competente', ditta.get('medico', '') or 'Non previsto')
-    campo('Addetto Primo Soccorso', addetti.get('primo_soccorso', ''))
-    campo('Addetto Antincendio', addetti.get('antincendio', ''))
-    
-    dtc = ditta.get('direttore_tecnico', '') or ditta.get('datore_lavoro', '')
-    campo('Direttore Tecnico / Capocantiere', dtc)
-    
-    rls_tipo = ditta.get('rls_tipo', 'non_eletto')
-    if rls_tipo == 'interno_eletto':
-        campo('RLS', ditta.get('rls_nome', ''))
-    elif rls_tipo == 'territoriale':
-        campo('RLST', ditta.get('rls_territoriale', ''))
-    else:
-        campo('RLS', 'Non eletto (< 15 dip.) - Funzioni RLST')
-    
-    # ==================== SEZ. 3: CANTIERE ====================
-    num_sez += 1
-    titolo_sezione(str(num_sez), 'Identificazione Cantiere')
-    campo('Indirizzo', cantiere.get('indirizzo', ''))
-    campo('Committente', cantiere.get('committente', ''))
-    campo('Durata', cantiere.get('durata', ''))
-    campo('Data Inizio', cantiere.get('data_inizio', ''))
-    campo('Orario Lavoro', cantiere.get('orario_lavoro', '08:00-12:00 / 13:00-17:00'))
-    campo('Giorni', cantiere.get('giorni_lavoro', 'Lun-Ven'))
-    if cantiere.get('cse'):
-        campo('CSE', cantiere.get('cse', ''))
-    if cantiere.get('csp'):
-        campo('CSP', cantiere.get('csp', ''))
-    
-    sottotitolo('Descrizione Opere')
-    paragrafo(cantiere.get('descrizione', ''))
-    
-    # ==================== SEZ. 4: MANSIONI SICUREZZA ====================
-    num_sez += 1
-    titolo_sezione(str(num_sez), 'Mansioni Inerenti la Sicurezza')
-    
-    pdf.set_font('Helvetica', 'I', 8)
-    pdf.set_text_color(*GRIGIO_MEDIO)
-    pdf.set_x(ML)
-    pdf.cell(W, 4, 'Allegato XV, punto 3.2, lettera b): Specifiche mansioni inerenti la sicurezza svolte in cantiere da ogni figura.', ln=1)
-    pdf.set_text_color(0, 0, 0)
-    pdf.ln(2)
-    
-    # Tabella mansioni sicurezza
-    mansioni_data = [
-        ('Datore di Lavoro', ditta.get('datore_lavoro', ''), TESTI_LEGALI['mansioni_ddl']),
-        ('RSPP', rspp, TESTI_LEGALI['mansioni_rspp']),
-        ('Preposto / DTC', dtc, TESTI_LEGALI['mansioni_preposto']),
-        ('Addetto Primo Soccorso', addetti.get('primo_soccorso', ''), TESTI_LEGALI['mansioni_ps']),
-        ('Addetto Antincendio', addetti.get('antincendio', ''), TESTI_LEGALI['mansioni_antincendio']),
-    ]
-    
-    rls_tipo = ditta.get('rls_tipo', 'non_eletto')
-    if rls_tipo == 'interno_eletto':
-        mansioni_data.append(('RLS', ditta.get('rls_nome', ''), TESTI_LEGALI['mansioni_rls']))
-    elif rls_tipo == 'territoriale':
-        mansioni_data.append(('RLST', ditta.get('rls_territoriale', ''), TESTI_LEGALI['mansioni_rls']))
-    
-    mansioni_data.append(('Lavoratori', f"{len(lavoratori)} impiegati in cantiere", TESTI_LEGALI['mansioni_lavoratore']))
-    
-    for figura, nome_persona, compiti in mansioni_data:
-        check_spazio(35)
-        # Header figura
-        y = pdf.get_y()
-        pdf.set_fill_color(*BLU_CHIARO)
-        pdf.rect(ML, y, W, 6, 'F')
-        pdf.set_fill_color(*BLU_SCURO)
-        pdf.rect(ML, y, 3, 6, 'F')
-        pdf.set_font('Helvetica', 'B', 8)
-        pdf.set_text_color(*BLU_SCURO)
-        pdf.set_xy(ML + 6, y + 0.5)
-        pdf.cell(60, 5, pulisci_testo(figura, 30))
-        pdf.set_font('Helvetica', '', 8)
-        pdf.set_text_color(*GRIGIO_SCURO)
-        pdf.cell(W - 68, 5, pulisci_testo(nome_persona, 60))
-        pdf.set_text_color(0, 0, 0)
-        pdf.set_y(y + 7)
-        # Compiti
-        pdf.set_font('Helvetica', '', 7)
-        pdf.set_text_color(*GRIGIO_SCURO)
-        pdf.set_x(ML + 4)
-        pdf.multi_cell(W - 8, 3.2, pulisci_testo(compiti, 500))
-        pdf.set_text_color(0, 0, 0)
-        pdf.ln(2)
-    
-    # ==================== SEZ. 5: LAVORATORI ====================
-    num_sez += 1
-    titolo_sezione(str(num_sez), 'Elenco Lavoratori Impiegati')
-    
-    if lavoratori:
-        pdf.set_font('Helvetica', 'I', 8)
-        pdf.set_text_color(*GRIGIO_MEDIO)
-        pdf.set_x(ML)
-        pdf.cell(W, 4, 'Allegato XV, punto 3.2, lettera a.7): Numero e relative qualifiche dei lavoratori dipendenti.', ln=1)
-        pdf.set_text_color(0, 0, 0)
-        pdf.ln(2)
-        
-        cols = [('Nome e Cognome', 52), ('Mansione', 38), ('Formazione', 50), ('Idoneita Sanitaria', 46)]
-        tabella_header(cols)
-        
-        for idx, lav in enumerate(lavoratori):
-            tabella_riga([
-                lav.get('nome', ''),
-                lav.get('mansione', ''),
-                lav.get('formazione', ''),
-                lav.get('idoneita', 'In corso')
-            ], cols, idx)
-        
-        pdf.ln(4)
-    else:
-        paragrafo('Lavoratori da definire prima dell\'inizio dei lavori.')
-    
-    # ==================== SEZ. 6: FORMAZIONE ====================
-    num_sez += 1
-    titolo_sezione(str(num_sez), 'Formazione e Addestramento')
-    
-    pdf.set_font('Helvetica', 'I', 8)
-    pdf.set_text_color(*GRIGIO_MEDIO)
-    pdf.set_x(ML)
-    pdf.cell(W, 4, 'Allegato XV, punto 3.2, lettera l): Documentazione in merito all\'informazione e formazione fornite ai lavoratori.', ln=1)
-    pdf.set_text_color(0, 0, 0)
-    pdf.ln(2)
-    
-    paragrafo("Tutti i lavoratori impiegati in cantiere sono in possesso degli attestati di formazione previsti dall'Accordo Stato-Regioni del 21/12/2011 e s.m.i. La formazione comprende il modulo generale (4 ore) e il modulo specifico rischio alto (12 ore) per il settore edile (ATECO F). L'aggiornamento quinquennale e regolarmente effettuato.", size=8)
-    
-    if lavoratori:
-        pdf.ln(2)
-        sottotitolo('Matrice Formazione Lavoratori')
-        
-        # Colonne matrice formazione
-        form_cols = [('Lavoratore', 40), ('Base', 15), ('Spec.', 15), ('PS', 14), ('AI', 14), ('RLS', 14), ('Gru', 14), ('Quota', 15), ('Pont.', 15), ('Macc.', 15), ('DPI 3a', 15)]
-        
-        # Header
-        pdf.set_fill_color(*BLU_SCURO)
-        pdf.set_text_color(255, 255, 255)
-        pdf.set_font('Helvetica', 'B', 6)
-        pdf.set_x(ML)
-        for nome, larg in form_cols:
-            pdf.cell(larg, 6, nome, fill=True, align='C')
-        pdf.ln()
-        pdf.set_text_color(0, 0, 0)
-        
-        for idx, lav in enumerate(lavoratori):
-            check_spazio(8)
-            if idx % 2 == 0:
-                pdf.set_fill_color(*BIANCO)
-            else:
-                pdf.set_fill_color(*GRIGIO_CHIARO)
-            pdf.set_font('Helvetica', '', 6)
-            pdf.set_x(ML)
-            nome = pulisci_testo(lav.get('nome', ''), 18)
-            mansione = lav.get('mansione', '').lower()
-            
-            # Determine formation based on role
-            is_ps = addetti.get('primo_soccorso', '').lower() in lav.get('nome', '').lower() if addetti.get('primo_soccorso') else False
-            is_ai = addetti.get('antincendio', '').lower() in lav.get('nome', '').lower() if addetti.get('antincendio') else False
-            is_rls = (rls_tipo == 'interno_eletto' and ditta.get('rls_nome', '').lower() in lav.get('nome', '').lower())
-            
-            valori = [
-                nome,       # Nome
-                'Si',       # Base (always)
-                'Si',       # Specifico (always for construction)
-                'Si' if is_ps else '--',  # PS
-                'Si' if is_ai else '--',  # AI
-                'Si' if is_rls else '--', # RLS
-                'Si' if 'gru' in mansione else '--',  # Gru
-                'Si' if any(k in mansione for k in ['quota', 'pont', 'coperto', 'tetto']) else '--',  # Quota
-                'Si' if 'pont' in mansione else '--',  # Ponteggi
-                'Si' if any(k in mansione for k in ['escavat', 'macchina', 'operatore']) else '--',  # Macchine
-                '--',  # DPI 3a cat
-            ]
-            
-            for i, (_, larg) in enumerate(form_cols):
-                val = valori[i] if i < len(valori) else ''
-                align = 'L' if i == 0 else 'C'
-                pdf.cell(larg, 5.5, val, fill=True, align=align)
-            pdf.ln()
-            pdf.set_draw_color(*GRIGIO_BORDO)
-            pdf.line(ML, pdf.get_y(), ML + W, pdf.get_y())
-            pdf.set_draw_color(0, 0, 0)
-        
-        pdf.ln(2)
-        pdf.set_font('Helvetica', 'I', 6)
-        pdf.set_text_color(*GRIGIO_MEDIO)
-        pdf.set_x(ML)
-        pdf.cell(W, 3.5, 'Legenda: Base=Formazione generale 4h | Spec.=Rischio specifico 12h edilizia | PS=Primo Soccorso | AI=Antincendio | Quota=Lavori in quota h>2m', ln=1)
-        pdf.set_x(ML)
-        pdf.cell(W, 3.5, 'Pont.=Montaggio ponteggi | Macc.=Macchine movimento terra | DPI 3a=DPI terza categoria | Gli attestati sono allegati al presente POS.', ln=1)
-        pdf.set_text_color(0, 0, 0)
-    
-    # ==================== SEZ. 7: ATTREZZATURE ====================
-    num_sez += 1
-    titolo_sezione(str(num_sez), 'Attrezzature di Cantiere')
-    
-    pdf.set_font('Helvetica', 'I', 8)
-    pdf.set_text_color(*GRIGIO_MEDIO)
-    pdf.set_x(ML)
-    pdf.cell(W, 4, 'Allegato XV, punto 3.2, lettera d): Elenco ponteggi, ponti su ruote a torre, opere provvisionali, attrezzature, macchine e impianti.', ln=1)
-    pdf.set_text_color(0, 0, 0)
-    pdf.ln(2)
-    
-    if attrezzature:
-        cols = [('Attrezzatura', 50), ('Marca/Modello', 36), ('Matricola', 26), ('Libretti', 18), ('Verifica', 28), ('Uso Com.', 28)]
-        tabella_header(cols)
-        
-        for idx, attr in enumerate(attrezzature):
-            tabella_riga([
-                attr.get('nome', ''),
-                attr.get('marca', ''),
-                attr.get('matricola', 'N.D.'),
-                'Si',
-                attr.get('verifica', 'Conforme'),
-                attr.get('uso_comune', 'No')
-            ], cols, idx)
-        
-        pdf.ln(2)
-        pdf.set_font('Helvetica', 'I', 7)
-        pdf.set_text_color(*GRIGIO_MEDIO)
-        pdf.set_x(ML)
-        pdf.multi_cell(W, 3.5, "I libretti d'uso e manutenzione sono disponibili in cantiere. Le verifiche periodiche delle attrezzature soggette (Art. 71, comma 11, D.Lgs 81/08 e Allegato VII) sono regolarmente effettuate. I certificati di collaudo e le verifiche ASL/INAIL sono allegati al presente POS.")
-        pdf.set_text_color(0, 0, 0)
-        pdf.ln(2)
-    else:
-        paragrafo('Attrezzature da definire prima dell\'inizio dei lavori. I libretti saranno resi disponibili in cantiere.')
-    
-    # ==================== SEZ. 8: SOSTANZE PERICOLOSE ====================
-    num_sez += 1
-    titolo_sezione(str(num_sez), 'Sostanze e Miscele Pericolose')
-    
-    pdf.set_font('Helvetica', 'I', 8)
-    pdf.set_text_color(*GRIGIO_MEDIO)
-    pdf.set_x(ML)
-    pdf.cell(W, 4, 'Allegato XV, punto 3.2, lettera e): Elenco delle sostanze e miscele pericolose utilizzate con relative SDS.', ln=1)
-    pdf.set_text_color(0, 0, 0)
-    pdf.ln(2)
-    
-    if sostanze:
-        cols = [('Prodotto', 46), ('Produttore', 34), ('Frasi H', 44), ('Fase Utilizzo', 30), ('SDS', 32)]
-        tabella_header(cols)
-        
-        for idx, sost in enumerate(sostanze):
-            tabella_riga([
-                sost.get('nome', ''),
-                sost.get('produttore', ''),
-                sost.get('frasi_h', 'Vedere SDS'),
-                sost.get('fase_utilizzo', 'Varie'),
-                'Allegata'
-            ], cols, idx)
-        
-        pdf.ln(2)
-        pdf.set_font('Helvetica', 'I', 7)
-        pdf.set_text_color(*GRIGIO_MEDIO)
-        pdf.set_x(ML)
-        pdf.multi_cell(W, 3.5, "Le Schede Dati di Sicurezza (SDS) conformi al Reg. CE 1907/2006 (REACH) e al Reg. CE 1272/2008 (CLP) sono disponibili in cantiere e sono state consegnate ai lavoratori esposti. Le misure di prevenzione specifiche sono riportate nella sezione Valutazione Rischi.")
-        pdf.set_text_color(0, 0, 0)
-    else:
-        paragrafo("Non e previsto l'utilizzo di sostanze o miscele pericolose classificate ai sensi del Reg. CE 1272/2008 (CLP). Qualora nel corso dei lavori si rendesse necessario l'uso di tali prodotti, il presente POS sara aggiornato con le relative SDS.")
-    
-    # ==================== SEZ. 9: ORGANIZZAZIONE CANTIERE ====================
-    num_sez += 1
-    titolo_sezione(str(num_sez), 'Organizzazione del Cantiere')
-    
-    pdf.set_font('Helvetica', 'I', 8)
-    pdf.set_text_color(*GRIGIO_MEDIO)
-    pdf.set_x(ML)
-    pdf.cell(W, 4, 'Allegato XV, punto 3.2, lettera c): Descrizione dell\'attivita, delle modalita organizzative e dei turni di lavoro.', ln=1)
-    pdf.set_text_color(0, 0, 0)
-    pdf.ln(2)
-    
-    sottotitolo('Accessi e Recinzione')
-    paragrafo(TESTI_LEGALI['organizzazione_accessi'])
-    
-    sottotitolo('Viabilita Interna')
-    paragrafo(TESTI_LEGALI['organizzazione_viabilita'])
-    
-    sottotitolo('Aree di Deposito Materiali')
-    paragrafo(TESTI_LEGALI['organizzazione_depositi'])
-    
-    sottotitolo('Servizi Igienico-Assistenziali')
-    paragrafo(TESTI_LEGALI['organizzazione_servizi'])
-    
-    sottotitolo("Obblighi dell'Impresa")
-    paragrafo(TESTI_LEGALI['obblighi_impresa'])
-    
-    sottotitolo('Documentazione in Cantiere')
-    docs = ["POS vidimato", "PSC (se previsto)", "DUVRI (se previsto)", "Registro infortuni",
-            "Libretti attrezzature", "SDS prodotti", "Attestati formazione", "Idoneita sanitarie",
-            "Tesserini riconoscimento", "Verbali consegna DPI"]
-    for doc in docs:
-        riga('- ' + doc)
-    
-    # ==================== SEZ. 10: MACROCLIMA ====================
-    num_sez += 1
-    titolo_sezione(str(num_sez), 'Condizioni Climatiche - Macroclima')
-    
-    paragrafo("Il Datore di Lavoro valuta i rischi derivanti dalle condizioni climatiche stagionali (Art. 28, comma 1, D.Lgs 81/08) e adotta le misure di prevenzione e protezione conseguenti, in funzione del periodo di esecuzione dei lavori.", size=8)
-    
-    pdf.ln(1)
-    sottotitolo('Periodo Estivo - Rischio Colpo di Calore')
-    paragrafo(TESTI_LEGALI['macroclima_estate'], size=8)
-    
-    sottotitolo('Periodo Invernale - Rischio Ipotermia')
-    paragrafo(TESTI_LEGALI['macroclima_inverno'], size=8)
-    
-    # ==================== SEZ. 11: CRONOPROGRAMMA ====================
-    if lavorazioni:
-        num_sez += 1
-        titolo_sezione(str(num_sez), 'Cronoprogramma Lavori')
-        
-        pdf.set_font('Helvetica', 'I', 8)
-        pdf.set_text_color(*GRIGIO_MEDIO)
-        pdf.set_x(ML)
-        pdf.cell(W, 4, 'Sequenza indicativa delle fasi lavorative (da adattare in base all\'avanzamento effettivo):', ln=1)
-        pdf.set_text_color(0, 0, 0)
-        pdf.ln(3)
-        
-        cols = [('#', 10), ('Fase Lavorativa', 80), ('Periodo Indicativo', 48), ('Note', 48)]
-        tabella_header(cols)
-        
-        durata_totale = cantiere.get('durata', '30 giorni')
-        match = re.search(r'(\d+)', durata_totale)
-        giorni_totali = int(match.group(1)) if match else 30
-        giorni_per_fase = max(3, giorni_totali // len(lavorazioni)) if lavorazioni else 5
-        giorno_corrente = 1
-        
-        for idx, lav_key in enumerate(lavorazioni):
-            if lav_key not in DIZIONARIO_LAVORAZIONI:
-                continue
-            dati = DIZIONARIO_LAVORAZIONI[lav_key]
-            nome_fase = dati.get('nome', '')
-            giorno_fine = min(giorno_corrente + giorni_per_fase - 1, giorni_totali)
-            periodo = f"Giorno {giorno_corrente} - {giorno_fine}"
-            
-            tabella_riga([str(idx + 1), nome_fase, periodo, ' '], cols, idx)
-            giorno_corrente = giorno_fine + 1
-        
-        pdf.ln(3)
-        pdf.set_font('Helvetica', 'I', 7)
-        pdf.set_text_color(*GRIGIO_MEDIO)
-        pdf.set_x(ML)
-        pdf.cell(W, 4, 'Nota: Le fasi possono sovrapporsi. Il cronoprogramma effettivo sara concordato con il CSE (ove previsto).', ln=1)
-        pdf.set_text_color(0, 0, 0)
-    
-    # ==================== SEZ. 12: METODOLOGIA RISCHI ====================
-    num_sez += 1
-    titolo_sezione(str(num_sez), 'Metodologia di Valutazione dei Rischi')
-    
-    paragrafo(TESTI_LEGALI['metodologia_rischi'], size=8)
-    
-    # Matrice PxG grafica
-    pdf.ln(3)
-    check_spazio(55)
-    sottotitolo('Matrice di Rischio P x G')
-    
-    # Disegna matrice 4x4
-    cell_w = 22
-    cell_h = 10
-    label_w = 30
-    x_start = ML + label_w + 2
-    y_start = pdf.get_y() + 2
-    
-    # Header colonne (Gravita)
-    pdf.set_font('Helvetica', 'B', 7)
-    pdf.set_text_color(*BLU_SCURO)
-    pdf.set_xy(x_start + cell_w * 0.5, y_start - 8)
-    pdf.cell(cell_w * 4, 5, 'GRAVITA (G)', align='C')
-    pdf.set_text_color(0, 0, 0)
-    
-    g_labels = ['G=1 Lieve', 'G=2 Medio', 'G=3 Grave', 'G=4 M.Grave']
-    pdf.set_font('Helvetica', 'B', 6)
-    for i, gl in enumerate(g_labels):
-        pdf.set_text_color(*BLU_SCURO)
-        pdf.set_xy(x_start + i * cell_w, y_start - 3)
-        pdf.cell(cell_w, 4, gl, align='C')
-    
-    # Header righe (Probabilita) + celle
-    p_labels = ['P=4 M.Prob.', 'P=3 Prob.', 'P=2 P.Prob.', 'P=1 Impr.']
-    matrice = [
-        [4, 8, 12, 16],
-        [3, 6, 9, 12],
-        [2, 4, 6, 8],
-        [1, 2, 3, 4]
-    ]
-    
-    for r, (pl, row) in enumerate(zip(p_labels, matrice)):
-        y_row = y_start + r * cell_h
-        # Label riga
-        pdf.set_font('Helvetica', 'B', 6)
-        pdf.set_text_color(*BLU_SCURO)
-        pdf.set_xy(ML, y_row)
-        pdf.cell(label_w, cell_h, pl, align='R')
-        
-        for c, val in enumerate(row):
-            x_cell = x_start + c * cell_w
-            # Colore cella
-            if val <= 2:
-                pdf.set_fill_color(*VERDE_CHIARO)
-                txt_color = VERDE_BADGE
-            elif val <= 4:
-                pdf.set_fill_color(*GIALLO_CHIARO)
-                txt_color = GIALLO_BADGE
-            elif val <= 8:
-                pdf.set_fill_color(255, 220, 200)
-                txt_color = ARANCIONE
-            else:
-                pdf.set_fill_color(*ROSSO_CHIARO)
-                txt_color = ROSSO_BADGE
-            
-            pdf.rect(x_cell, y_row, cell_w, cell_h, 'F')
-            pdf.set_draw_color(*GRIGIO_BORDO)
-            pdf.rect(x_cell, y_row, cell_w, cell_h, 'D')
-            pdf.set_draw_color(0, 0, 0)
-            
-            pdf.set_font('Helvetica', 'B', 10)
-            pdf.set_text_color(*txt_color)
-            pdf.set_xy(x_cell, y_row + 1)
-            pdf.cell(cell_w, cell_h - 2, str(val), align='C')
-    
-    pdf.set_text_color(0, 0, 0)
-    pdf.set_y(y_start + 4 * cell_h + 4)
-    
-    # Legenda colori
-    legenda = [
-        (VERDE_CHIARO, VERDE_BADGE, 'R = 1-2: BASSO'),
-        (GIALLO_CHIARO, GIALLO_BADGE, 'R = 3-4: MEDIO'),
-        ((255, 220, 200), ARANCIONE, 'R = 6-8: ALTO'),
-        (ROSSO_CHIARO, ROSSO_BADGE, 'R = 9-16: MOLTO ALTO'),
-    ]
-    
-    for bg, fg, testo_leg in legenda:
-        check_spazio(6)
-        y_leg = pdf.get_y()
-        pdf.set_fill_color(*bg)
-        pdf.rect(ML + 4, y_leg + 0.5, 10, 4, 'F')
-        pdf.set_font('Helvetica', 'B', 7)
-        pdf.set_text_color(*fg)
-        pdf.set_xy(ML + 16, y_leg)
-        pdf.cell(W - 20, 5, testo_leg)
-        pdf.set_y(y_leg + 5.5)
-    
-    pdf.set_text_color(0, 0, 0)
-    
-    # ==================== SEZ. 13: VALUTAZIONE RISCHI ====================
-    num_sez += 1
-    titolo_sezione(str(num_sez), 'Valutazione dei Rischi per Fase Lavorativa')
-    
-    for lav_key in lavorazioni:
-        if lav_key not in DIZIONARIO_LAVORAZIONI:
-            continue
-        dati = DIZIONARIO_LAVORAZIONI[lav_key]
-        
-        check_spazio(80)
-        pdf.ln(4)
-        
-        # Nome lavorazione con barra laterale
-        y = pdf.get_y()
-        pdf.set_fill_color(*ARANCIONE)
-        pdf.rect(ML, y, 3, 7, 'F')
-        pdf.set_fill_color(*ARANCIONE_CHIARO)
-        pdf.rect(ML + 3, y, W - 3, 7, 'F')
-        pdf.set_font('Helvetica', 'B', 10)
-        pdf.set_text_color(*BLU_SCURO)
-        pdf.set_xy(ML + 7, y + 1)
-        pdf.cell(W - 10, 5, pulisci_testo(dati.get('nome', ''), 70))
-        pdf.set_text_color(0, 0, 0)
-        pdf.set_y(y + 9)
-        
-        # Descrizione tecnica
-        pdf.set_font('Helvetica', 'I', 8)
-        pdf.set_text_color(*GRIGIO_MEDIO)
-        pdf.set_x(ML + 2)
-        pdf.multi_cell(W - 4, 3.5, pulisci_testo(dati.get('descrizione_tecnica', ''), 300))
-        pdf.set_text_color(0, 0, 0)
-        pdf.ln(2)
-        
-        # Valori esposizione (se presenti)
-        if dati.get('valori_esposizione'):
-            check_spazio(20)
-            pdf.set_fill_color(*GIALLO_CHIARO)
-            pdf.set_font('Helvetica', 'B', 8)
-            pdf.set_text_color(*GIALLO_BADGE)
-            pdf.set_x(ML)
-            pdf.cell(W, 5, '  VALORI ESPOSIZIONE', ln=1, fill=True)
-            pdf.set_font('Helvetica', '', 8)
-            pdf.set_text_color(*GRIGIO_SCURO)
-            for t, v in dati['valori_esposizione'].items():
-                pdf.set_x(ML + 4)
-                pdf.cell(W - 6, 4, f'{t.upper()}: {v}', ln=1)
-            pdf.set_text_color(0, 0, 0)
-            pdf.ln(2)
-        
-        # --- RISCHI ---
-        check_spazio(35)
-        pdf.set_fill_color(*BLU_SCURO)
-        pdf.set_text_color(255, 255, 255)
-        pdf.set_font('Helvetica', 'B', 8)
-        pdf.set_x(ML)
-        pdf.cell(W, 5, '  RISCHI IDENTIFICATI', ln=1, fill=True)
-        pdf.set_text_color(0, 0, 0)
-        pdf.ln(1)
-        
-        for r in dati.get('rischi', []):
-            check_spazio(8)
-            grav = r.get('gravita', 'M')[0]
-            
-            # Badge gravita con colori
-            if grav == 'A':
-                badge_color = ROSSO_BADGE
-                row_color = ROSSO_CHIARO
-            elif grav == 'M':
-                badge_color = GIALLO_BADGE
-                row_color = GIALLO_CHIARO
-            else:
-                badge_color = VERDE_BADGE
-                row_color = VERDE_CHIARO
-            
-            y = pdf.get_y()
-            # Sfondo riga
-            pdf.set_fill_color(*row_color)
-            pdf.rect(ML, y, W, 6, 'F')
-            # Badge
-            pdf.set_fill_color(*badge_color)
-            pdf.rect(ML + 1, y + 0.8, 8, 4.4, 'F')
-            pdf.set_font('Helvetica', 'B', 7)
-            pdf.set_text_color(255, 255, 255)
-            pdf.set_xy(ML + 1, y + 0.8)
-            pdf.cell(8, 4.4, f' {grav}', align='C')
-            
-            # Testo rischio
-            pdf.set_text_color(*GRIGIO_SCURO)
-            pdf.set_font('Helvetica', 'B', 8)
-            pdf.set_xy(ML + 11, y)
-            nome_rischio = pulisci_testo(r.get('nome', ''), 30)
-            desc_rischio = pulisci_testo(r.get('descrizione', ''), 65)
-            norm = pulisci_testo(r.get('normativa', ''), 30)
-            testo = f"{nome_rischio}: "
-            pdf.cell(pdf.get_string_width(testo), 6, testo, ln=0)
-            pdf.set_font('Helvetica', '', 8)
-            testo_desc = desc_rischio
-            if norm:
-                testo_desc += f" ({norm})"
-            pdf.cell(W - 13 - pdf.get_string_width(testo), 6, testo_desc[:90], ln=1)
-            pdf.set_text_color(0, 0, 0)
-            pdf.ln(0.5)
-        
-        pdf.ln(2)
-        
-        # --- DPI OBBLIGATORI ---
-        check_spazio(30)
-        pdf.set_fill_color(*BLU_CHIARO)
-        pdf.set_font('Helvetica', 'B', 8)
-        pdf.set_text_color(44, 82, 160)
-        pdf.set_x(ML)
-        pdf.cell(W, 5, '  DPI OBBLIGATORI', ln=1, fill=True)
-        pdf.set_text_color(*GRIGIO_SCURO)
-        pdf.set_font('Helvetica', '', 8)
-        pdf.ln(1)
-        for dpi in dati.get('dpi_obbligatori', []):
-            check_spazio(5)
-            if isinstance(dpi, dict):
-                txt = f"  - {pulisci_testo(dpi.get('nome', ''), 35)} [{pulisci_testo(dpi.get('norma', ''), 25)}]"
-            else:
-                txt = f"  - {pulisci_testo(str(dpi), 70)}"
-            pdf.set_x(ML + 2)
-            pdf.cell(W - 4, 4.5, txt[:100], ln=1)
-        
-        pdf.ln(2)
-        
-        # --- MISURE PREVENZIONE ---
-        check_spazio(30)
-        pdf.set_fill_color(*VERDE_CHIARO)
-        pdf.set_font('Helvetica', 'B', 8)
-        pdf.set_text_color(*VERDE_BADGE)
-        pdf.set_x(ML)
-        pdf.cell(W, 5, '  MISURE DI PREVENZIONE E PROTEZIONE', ln=1, fill=True)
-        pdf.set_text_color(*GRIGIO_SCURO)
-        pdf.set_font('Helvetica', '', 8)
-        pdf.ln(1)
-        for m in dati.get('misure_prevenzione', []):
-            check_spazio(5)
-            pdf.set_x(ML + 2)
-            pdf.cell(W - 4, 4.5, f"  - {pulisci_testo(str(m), 100)}", ln=1)
-        
-        pdf.ln(3)
-    
-    # Rischi AI - CON FILTRO ANTI-DUPLICATI
-    if rischi_ai and rischi_ai.get('rischi_aggiuntivi'):
-        rischi_esistenti = set()
-        keywords_esistenti = set()
-        for lav_key in lavorazioni:
-            if lav_key in DIZIONARIO_LAVORAZIONI:
-                for r in DIZIONARIO_LAVORAZIONI[lav_key].get('rischi', []):
-                    nome_lower = (r.get('nome', '') or '').lower()
-                    rischi_esistenti.add(nome_lower)
-                    for kw in ['caduta', 'rumore', 'polveri', 'vibrazioni', 'chimico', 'elettrico',
-                               'schegge', 'ustioni', 'tagli', 'crollo', 'inalazione', 'dermatiti',
-                               'posture', 'scivolamento', 'urti', 'abrasioni']:
-                        if kw in nome_lower:
-                            keywords_esistenti.add(kw)
-        
-        rischi_filtrati = []
-        for r in rischi_ai['rischi_aggiuntivi']:
-            nome_ai = (r.get('nome', '') or '').lower()
-            desc_ai = (r.get('descrizione', '') or '').lower()
-            is_duplicato = False
-            for kw in keywords_esistenti:
-                if kw in nome_ai or kw in desc_ai[:50]:
-                    is_duplicato = True
-                    break
-            if not is_duplicato:
-                rischi_filtrati.append(r)
-        
-        if rischi_filtrati:
-            check_spazio(40)
-            pdf.ln(3)
-            pdf.set_fill_color(*BLU_MEDIO)
-            pdf.set_text_color(255, 255, 255)
-            pdf.set_font('Helvetica', 'B', 9)
-            pdf.set_x(ML)
-            pdf.cell(W, 6, '  RISCHI AGGIUNTIVI SPECIFICI DEL CANTIERE', ln=1, fill=True)
-            pdf.set_text_color(0, 0, 0)
-            
-            pdf.set_font('Helvetica', 'I', 7)
-            pdf.set_text_color(*GRIGIO_MEDIO)
-            pdf.set_x(ML)
-            pdf.cell(W, 4, 'Rischi specifici identificati dall\'analisi della descrizione lavori:', ln=1)
-            pdf.set_text_color(0, 0, 0)
-            pdf.ln(1)
-            
-            pdf.set_font('Helvetica', '', 8)
-            for r in rischi_filtrati:
-                check_spazio(8)
-                grav = (r.get('gravita', 'M') or 'M')[0]
-                colore = ROSSO_CHIARO if grav == 'A' else (GIALLO_CHIARO if grav == 'M' else VERDE_CHIARO)
-                pdf.set_fill_color(*colore)
-                pdf.set_x(ML)
-                pdf.multi_cell(W, 5, f" [{grav}] {pulisci_testo(r.get('nome', ''), 35)}: {pulisci_testo(r.get('descrizione', ''), 120)}", fill=True)
-                pdf.ln(0.5)
-        
-        if rischi_ai.get('note_rspp'):
-            pdf.ln(2)
-            pdf.set_font('Helvetica', 'I', 8)
-            pdf.set_text_color(*GRIGIO_MEDIO)
-            pdf.set_x(ML)
-            pdf.multi_cell(W, 4, 'Note RSPP: ' + pulisci_testo(rischi_ai.get('note_rspp', ''), 300))
-            pdf.set_text_color(0, 0, 0)
-    
-    # ==================== SEZ. 14: RUMORE E VIBRAZIONI ====================
-    num_sez += 1
-    titolo_sezione(str(num_sez), 'Esiti Valutazione Rumore e Vibrazioni')
-    
-    pdf.set_font('Helvetica', 'I', 8)
-    pdf.set_text_color(*GRIGIO_MEDIO)
-    pdf.set_x(ML)
-    pdf.cell(W, 4, 'Allegato XV, punto 3.2, lettera f): Esito del rapporto di valutazione del rumore e delle vibrazioni.', ln=1)
-    pdf.set_text_color(0, 0, 0)
-    pdf.ln(2)
-    
-    sottotitolo('Rumore - Art. 189-198 D.Lgs 81/08')
-    paragrafo("La valutazione dell'esposizione al rumore e condotta conformemente all'Art. 190 D.Lgs 81/08 e alle Linee Guida ISPESL. I valori di esposizione riportati derivano da banche dati validate (CPT, ISPESL) e/o da misurazioni fonometriche effettuate in condizioni operative analoghe.", size=8)
-    
-    # Tabella valori rumore per lavorazione
-    has_noise_data = False
-    noise_rows = []
-    seen_noise = set()
-    for lav_key in lavorazioni:
-        if lav_key in DIZIONARIO_LAVORAZIONI:
-            dati = DIZIONARIO_LAVORAZIONI[lav_key]
-            nome_fase = dati.get('nome', '')
-            val_esp = dati.get('valori_esposizione', {})
-            # Primary source: valori_esposizione
-            for k, v in val_esp.items():
-                if 'rumore' in k.lower() or 'db' in str(v).lower():
-                    dedup_key = f"{nome_fase}|{v}"
-                    if dedup_key not in seen_noise:
-                        noise_rows.append((nome_fase, v))
-                        seen_noise.add(dedup_key)
-                        has_noise_data = True
-            # Fallback: risks (only if no valori_esposizione for this phase)
-            if nome_fase not in [r[0] for r in noise_rows]:
-                for r in dati.get('rischi', []):
-                    if 'rumore' in r.get('nome', '').lower():
-                        desc = r.get('descrizione', '')
-                        if 'dB' in desc:
-                            dedup_key = f"{nome_fase}|{desc}"
-                            if dedup_key not in seen_noise:
-                                noise_rows.append((nome_fase, desc))
-                                seen_noise.add(dedup_key)
-                                has_noise_data = True
-    
-    if has_noise_data:
-        cols_r = [('Fase Lavorativa', 76), ('Livello Esposizione Lep,d / Lpicco', 110)]
-        tabella_header(cols_r)
-        for idx, (fase, val) in enumerate(noise_rows):
-            tabella_riga([fase, str(val)], cols_r, idx)
-        pdf.ln(2)
-    
-    # Limiti normativi
-    check_spazio(30)
-    pdf.set_fill_color(*GIALLO_CHIARO)
-    pdf.set_font('Helvetica', 'B', 7)
-    pdf.set_text_color(*GIALLO_BADGE)
-    pdf.set_x(ML)
-    pdf.cell(W, 5, '  VALORI LIMITE E DI AZIONE (Art. 189 D.Lgs 81/08)', ln=1, fill=True)
-    pdf.set_text_color(*GRIGIO_SCURO)
-    pdf.set_font('Helvetica', '', 7)
-    for txt in [
-        'Valore inferiore di azione: Lep,d = 80 dB(A) / Lpicco = 135 dB(C) -> Informazione, DPI a disposizione',
-        'Valore superiore di azione: Lep,d = 85 dB(A) / Lpicco = 137 dB(C) -> Formazione, obbligo DPI, sorveglianza sanitaria',
-        'Valore limite di esposizione: Lep,d = 87 dB(A) / Lpicco = 140 dB(C) -> Non deve essere superato (con DPI)'
-    ]:
-        pdf.set_x(ML + 4)
-        pdf.cell(W - 6, 4, txt, ln=1)
-    pdf.set_text_color(0, 0, 0)
-    
-    pdf.ln(3)
-    sottotitolo('Vibrazioni - Art. 199-205 D.Lgs 81/08')
-    paragrafo("La valutazione dell'esposizione a vibrazioni meccaniche (sistema mano-braccio HAV e corpo intero WBV) e condotta conformemente all'Art. 202 D.Lgs 81/08. I valori riportati derivano da banche dati validate e dalle dichiarazioni dei fabbricanti.", size=8)
-    
-    # Tabella valori vibrazioni
-    has_vibr_data = False
-    vibr_rows = []
-    seen_vibr = set()
-    for lav_key in lavorazioni:
-        if lav_key in DIZIONARIO_LAVORAZIONI:
-            dati = DIZIONARIO_LAVORAZIONI[lav_key]
-            nome_fase = dati.get('nome', '')
-            val_esp = dati.get('valori_esposizione', {})
-            # Primary source: valori_esposizione
-            for k, v in val_esp.items():
-                if 'vibrazion' in k.lower() or 'm/s' in str(v).lower():
-                    dedup_key = f"{nome_fase}|{v}"
-                    if dedup_key not in seen_vibr:
-                        vibr_rows.append((nome_fase, v))
-                        seen_vibr.add(dedup_key)
-                        has_vibr_data = True
-            # Fallback: risks (only if no valori_esposizione for this phase)
-            if nome_fase not in [r[0] for r in vibr_rows]:
-                for r in dati.get('rischi', []):
-                    if 'vibrazion' in r.get('nome', '').lower():
-                        desc = r.get('descrizione', '')
-                        if 'm/s' in desc:
-                            dedup_key = f"{nome_fase}|{desc}"
-                            if dedup_key not in seen_vibr:
-                                vibr_rows.append((nome_fase, desc))
-                                seen_vibr.add(dedup_key)
-                                has_vibr_data = True
-    
-    if has_vibr_data:
-        cols_v = [('Fase Lavorativa', 76), ('Livello Esposizione A(8) / Valore di Picco', 110)]
-        tabella_header(cols_v)
-        for idx, (fase, val) in enumerate(vibr_rows):
-            tabella_riga([fase, str(val)], cols_v, idx)
-        pdf.ln(2)
-    
-    check_spazio(25)
-    pdf.set_fill_color(*GIALLO_CHIARO)
-    pdf.set_font('Helvetica', 'B', 7)
-    pdf.set_text_color(*GIALLO_BADGE)
-    pdf.set_x(ML)
-    pdf.cell(W, 5, '  VALORI LIMITE E DI AZIONE VIBRAZIONI', ln=1, fill=True)
-    pdf.set_text_color(*GRIGIO_SCURO)
-    pdf.set_font('Helvetica', '', 7)
-    for txt in [
-        'HAV - Valore di azione: A(8) = 2.5 m/s2 | Valore limite: A(8) = 5 m/s2',
-        'WBV - Valore di azione: A(8) = 0.5 m/s2 | Valore limite: A(8) = 1.0 m/s2'
-    ]:
-        pdf.set_x(ML + 4)
-        pdf.cell(W - 6, 4, txt, ln=1)
-    pdf.set_text_color(0, 0, 0)
-    
-    if not has_noise_data and not has_vibr_data:
-        pdf.ln(2)
-        paragrafo("I valori di esposizione a rumore e vibrazioni sono riportati nelle schede di valutazione rischi per ciascuna fase lavorativa (Sezione precedente). Si rimanda alla documentazione specifica allegata al DVR aziendale per i dati completi delle misurazioni/valutazioni.", size=8)
-    
-    # ==================== SEZ. 15: MATRICE DPI ====================
-    num_sez += 1
-    titolo_sezione(str(num_sez), 'Matrice DPI per Mansione')
-    
-    pdf.set_font('Helvetica', 'I', 8)
-    pdf.set_text_color(*GRIGIO_MEDIO)
-    pdf.set_x(ML)
-    pdf.cell(W, 4, 'Allegato XV, punto 3.2, lettera i): Elenco dei Dispositivi di Protezione Individuale forniti ai lavoratori.', ln=1)
-    pdf.set_text_color(0, 0, 0)
-    pdf.ln(2)
-    
-    # Collect all unique DPI from all selected lavorazioni (with smart dedup)
-    all_dpi = {}
-    dpi_dedup_keys = set()
-    
-    def _dpi_dedup_key(nome):
-        """Normalizza nome DPI per deduplicazione."""
-        n = nome.lower().strip()
-        # Normalize similar items
-        n = n.replace('professionali', '').replace('professionale', '')
-        n = n.replace('antipolvere ', '').replace('per fumi', 'FFP2')
-        n = n.replace('per vapori organici', 'vapori org.')
-        # Remove extra spaces
-        while '  ' in n:
-            n = n.replace('  ', ' ')
-        return n.strip()
-    
-    for lav_key in lavorazioni:
-        if lav_key in DIZIONARIO_LAVORAZIONI:
-            for dpi in DIZIONARIO_LAVORAZIONI[lav_key].get('dpi_obbligatori', []):
-                if isinstance(dpi, dict):
-                    nome_dpi = dpi.get('nome', '')
-                    norma_dpi = dpi.get('norma', '')
-                else:
-                    nome_dpi = str(dpi)
-                    norma_dpi = ''
-                if nome_dpi:
-                    dk = _dpi_dedup_key(nome_dpi)
-                    if dk not in dpi_dedup_keys:
-                        dpi_dedup_keys.add(dk)
-                        all_dpi[nome_dpi] = norma_dpi
-    
-    if all_dpi:
-        # Full DPI table
-        dpi_cols = [('DPI', 68), ('Norma di Riferimento', 50), ('Consegnato', 22), ('Formazione', 22), ('Firma', 24)]
-        tabella_header(dpi_cols)
-        
-        for idx, (nome_dpi, norma) in enumerate(all_dpi.items()):
-            tabella_riga([
-                nome_dpi,
-                norma,
-                'Si',
-                'Si',
-                ' '
-            ], dpi_cols, idx)
-        
-        pdf.ln(2)
-        pdf.set_font('Helvetica', 'I', 7)
-        pdf.set_text_color(*GRIGIO_MEDIO)
-        pdf.set_x(ML)
-        pdf.multi_cell(W, 3.5, "I DPI sono forniti conformemente all'Art. 77 D.Lgs 81/08. Il Datore di Lavoro assicura che i DPI siano conformi ai requisiti del Reg. UE 2016/425, adeguati ai rischi, adattati alle condizioni del lavoratore, e mantiene in efficienza i DPI mediante manutenzione, riparazione e sostituzione.")
-        pdf.set_text_color(0, 0, 0)
-    else:
-        paragrafo("I DPI obbligatori per ciascuna fase lavorativa sono indicati nelle schede di valutazione rischi (Sez. 13). La consegna avviene mediante verbale firmato (Sez. 20).")
-    
-    # ==================== SEZ. 16: COORDINAMENTO ====================
-    num_sez += 1
-    titolo_sezione(str(num_sez), 'Coordinamento e Procedure PSC')
-    
-    sottotitolo('Coordinamento tra Imprese')
-    paragrafo(TESTI_LEGALI['coordinamento'])
-    
-    pdf.ln(2)
-    sottotitolo('Procedure complementari e di dettaglio del PSC')
-    
-    pdf.set_font('Helvetica', 'I', 8)
-    pdf.set_text_color(*GRIGIO_MEDIO)
-    pdf.set_x(ML)
-    pdf.cell(W, 4, 'Allegato XV, punto 3.2, lettere g) e h): Misure preventive integrative e procedure complementari al PSC.', ln=1)
-    pdf.set_text_color(0, 0, 0)
-    pdf.ln(1)
-    
-    paragrafo(TESTI_LEGALI['procedure_psc'])
-    
-    # ==================== SEZ. 17: EMERGENZE ====================
-    num_sez += 1
-    titolo_sezione(str(num_sez), 'Gestione Emergenze')
-    paragrafo(TESTI_LEGALI['emergenza'])
-    
-    pdf.ln(3)
-    check_spazio(50)
-    
-    # Box numeri emergenza
-    y = pdf.get_y()
-    pdf.set_fill_color(*ROSSO_CHIARO)
-    pdf.rect(ML, y, W, 28, 'F')
-    pdf.set_fill_color(*ROSSO_BADGE)
-    pdf.rect(ML, y, 3, 28, 'F')
-    
-    pdf.set_font('Helvetica', 'B', 10)
-    pdf.set_text_color(*ROSSO_BADGE)
-    pdf.set_xy(ML + 7, y + 2)
-    pdf.cell(W, 5, 'NUMERI EMERGENZA', ln=1)
-    
-    pdf.set_font('Helvetica', 'B', 11)
-    pdf.set_text_color(*GRIGIO_SCURO)
-    for num_em, desc in [('112', 'Numero Unico Emergenze'), ('115', 'Vigili del Fuoco'), ('118', 'Soccorso Sanitario')]:
-        pdf.set_x(ML + 7)
-        pdf.cell(15, 5, num_em, ln=0)
-        pdf.set_font('Helvetica', '', 9)
-        pdf.cell(W - 22, 5, f'  -  {desc}', ln=1)
-        pdf.set_font('Helvetica', 'B', 11)
-    
-    pdf.set_text_color(0, 0, 0)
-    pdf.set_y(y + 30)
-    
-    # Ospedale
-    ospedale = cantiere.get('ospedale_vicino', '')
-    if ospedale:
-        pdf.set_font('Helvetica', 'B', 9)
-        pdf.set_x(ML)
-        pdf.multi_cell(W, 4.5, f'PRONTO SOCCORSO PIU VICINO: {pulisci_testo(ospedale, 150)}')
-        pdf.ln(1)
-    
-    pdf.set_font('Helvetica', 'B', 9)
-    pdf.set_x(ML)
-    pdf.cell(W, 5, 'PUNTO DI RACCOLTA: Ingresso cantiere', ln=1)
-    
-    # Procedure dettagliate emergenza
-    pdf.ln(3)
-    check_spazio(40)
-    sottotitolo('Procedura in caso di Infortunio')
-    paragrafo("1) Mantenere la calma e valutare la scena (sicurezza soccorritore). 2) Chiamare il 112 fornendo: indirizzo cantiere, numero feriti, dinamica. 3) L'addetto PS presta le prime cure (NON spostare l'infortunato se trauma spinale sospetto). 4) Accompagnare i soccorsi all'ingresso. 5) Il DdL compila la denuncia INAIL entro 2 giorni (48h).", size=8)
-    
-    sottotitolo('Procedura in caso di Incendio')
-    paragrafo("1) Dare l'allarme (voce / sirena). 2) Se incendio domabile: utilizzare estintori (solo personale formato). 3) Se non domabile: evacuare immediatamente. 4) Chiamare 115. 5) Recarsi al punto di raccolta. 6) Il preposto effettua il censimento.", size=8)
-    
-    # ==================== SEZ. 18: CHECKLIST ALLEGATI ====================
-    num_sez += 1
-    titolo_sezione(str(num_sez), 'Checklist Allegati')
-    
-    ha_ponteggio_fisso = any('ponteggio' in (a.get('nome', '') or '').lower() and 'trabattello' not in (a.get('nome', '') or '').lower() for a in attrezzature)
-    ha_trabattello = any('trabattello' in (a.get('nome', '') or '').lower() for a in attrezzature)
-    
-    if ha_ponteggio_fisso:
-        pimus_doc = "Pi.M.U.S. (ponteggi fissi Art. 136)"
-        pimus_stato = "Da allegare"
-    elif ha_trabattello:
-        pimus_doc = "Manuale d'uso trabattello"
-        pimus_stato = "Da allegare"
-    else:
-        pimus_doc = "Pi.M.U.S. / Manuale trabattello"
-        pimus_stato = "N.A."
-    
-    allegati = [
-        ("Visura Camerale", "Da allegare"),
-        ("DURC in corso di validita", "Da allegare"),
-        ("Attestati formazione lavoratori", "Da allegare"),
-        ("Idoneita sanitarie", "Da allegare"),
-        ("Libretti attrezzature", "Da allegare"),
-        ("Schede SDS sostanze", "Da allegare" if sostanze else "N.A."),
-        (pimus_doc, pimus_stato),
-        ("Verbale consegna DPI", "Da allegare"),
-        ("DVR aziendale (estratto)", "Da allegare"),
-        ("Rapporto valutazione rumore", "Da allegare"),
-        ("Iscrizione CCIAA", "Da allegare"),
-        ("Polizza assicurativa RCT/RCO", "Da allegare"),
-    ]
-    
-    cols = [('Documento', 126), ('Stato', 60)]
-    tabella_header(cols)
-    
-    for idx, (doc, stato) in enumerate(allegati):
-        check_spazio(8)
-        if idx % 2 == 0:
-            pdf.set_fill_color(*BIANCO)
-        else:
-            pdf.set_fill_color(*GRIGIO_CHIARO)
-        pdf.set_font('Helvetica', '', 9)
-        pdf.set_x(ML)
-        # Checkbox grafico
-        simbolo = '[ ]' if stato == 'Da allegare' else '[--]'
-        pdf.cell(126, 6, f'  {simbolo}  {doc}', fill=True)
-        # Stato con colore
-        if stato == 'N.A.':
-            pdf.set_text_color(*GRIGIO_MEDIO)
-        else:
-            pdf.set_text_color(*ARANCIONE)
-        pdf.set_font('Helvetica', 'I', 8)
-        pdf.cell(60, 6, f'  {stato}', fill=True, ln=1)
-        pdf.set_text_color(0, 0, 0)
-        pdf.set_draw_color(*GRIGIO_BORDO)
-        pdf.line(ML, pdf.get_y(), ML + W, pdf.get_y())
-        pdf.set_draw_color(0, 0, 0)
-    
-    # ==================== SEZ. 19: FIRME ====================
-    num_sez += 1
-    titolo_sezione(str(num_sez), 'Dichiarazione e Firme')
-    
-    pdf.set_font('Helvetica', '', 9)
-    pdf.set_text_color(*GRIGIO_SCURO)
-    pdf.set_x(ML)
-    pdf.multi_cell(W, 4.5, "Il sottoscritto, in qualita di Datore di Lavoro dell'impresa esecutrice, DICHIARA che:\n- Il presente POS e redatto conformemente all'Allegato XV, punto 3.2, del D.Lgs 81/2008;\n- I lavoratori sono stati informati e formati sui rischi specifici delle lavorazioni di cantiere;\n- I DPI sono stati forniti e ne viene verificato il corretto utilizzo;\n- Le attrezzature di lavoro sono conformi e regolarmente verificate;\n- La sorveglianza sanitaria e regolarmente effettuata dal Medico Competente;\n- Il presente POS sara aggiornato in caso di modifiche significative al cantiere.")
-    pdf.set_text_color(0, 0, 0)
-    
-    pdf.ln(8)
-    check_spazio(55)
-    
-    # Due colonne firme
-    pdf.set_font('Helvetica', 'B', 9)
-    pdf.set_text_color(*BLU_SCURO)
-    pdf.set_x(ML)
-    pdf.cell(90, 5, 'IL DATORE DI LAVORO')
-    pdf.cell(6, 5, '')
-    
-    rls_tipo = ditta.get('rls_tipo', 'non_eletto')
-    if rls_tipo == 'interno_eletto':
-        pdf.cell(90, 5, 'PER PRESA VISIONE RLS', ln=1)
-        firma_rls_nome = ditta.get('rls_nome', '')
-    elif rls_tipo == 'territoriale':
-        pdf.cell(90, 5, 'PER PRESA VISIONE RLST', ln=1)
-        firma_rls_nome = ditta.get('rls_territoriale', '')
+if hasattr(st, 'fragment'):
+    # Solo il riquadro di attesa viene rieseguito ogni secondo, non l'intera pagina
+    _attesa_task_ai = st.fragment(run_every=1)(_attesa_task_ai)
+
+
+def mostra_attesa_ai(nome, messaggio):
+    """Attesa non bloccante di un task AI (st.fragment), bloccante con spinner se non disponibile."""
+    if hasattr(st, 'fragment'):
+        _attesa_task_ai(nome, messaggio)
     else:
-        pdf.cell(90, 5, 'PER PRESA VISIONE (RLS)', ln=1)
-        firma_rls_nome = 'Non eletto - Funzioni RLST'
-    
-    pdf.set_text_color(0, 0, 0)
-    pdf.ln(14)
-    
-    # Linee firma
-    pdf.set_draw_color(*GRIGIO_BORDO)
-    pdf.set_x(ML)
-    pdf.line(ML, pdf.get_y(), ML + 85, pdf.get_y())
-    pdf.line(ML + 96, pdf.get_y(), ML + W, pdf.get_y())
-    pdf.set_draw_color(0, 0, 0)
-    pdf.ln(2)
-    
-    pdf.set_font('Helvetica', 'I', 8)
-    pdf.set_text_color(*GRIGIO_MEDIO)
-    pdf.set_x(ML)
-    pdf.cell(90, 4, f"({pulisci_testo(ditta.get('datore_lavoro', ''), 35)})")
-    pdf.cell(6, 4, '')
-    pdf.cell(90, 4, f"({pulisci_testo(firma_rls_nome, 40)})", ln=1)
-    pdf.set_text_color(0, 0, 0)
-    
-    pdf.ln(10)
-    pdf.set_font('Helvetica', '', 9)
-    pdf.set_x(ML)
-    pdf.cell(W * 0.5, 5, f"Data: {date.today().strftime('%d/%m/%Y')}", align='L')
-    pdf.cell(W * 0.5, 5, f"Luogo: {pulisci_testo(cantiere.get('indirizzo', ''), 50)}", align='R', ln=1)
-    
-    pdf.ln(6)
-    pdf.set_draw_color(*GRIGIO_BORDO)
-    pdf.line(ML, pdf.get_y(), ML + W, pdf.get_y())
-    pdf.set_draw_color(0, 0, 0)
-    pdf.ln(3)
-    pdf.set_font('Helvetica', 'B', 8)
-    pdf.set_text_color(*ARANCIONE)
-    pdf.set_x(ML)
-    data_rev = (date.today() + timedelta(days=365)).strftime('%d/%m/%Y')
-    pdf.cell(W, 5, f"PROSSIMA REVISIONE POS: {data_rev} (o in caso di modifiche significative al cantiere)", ln=1)
-    pdf.set_text_color(0, 0, 0)
-    
-    # ==================== SEZ. 20: VERBALE PRESA VISIONE ====================
-    if lavoratori:
-        nuova_pagina()
-        num_sez += 1
-        titolo_sezione(str(num_sez), 'Verbale di Presa Visione e Consegna DPI')
-        
-        pdf.set_font('Helvetica', '', 9)
-        pdf.set_text_color(*GRIGIO_SCURO)
-        pdf.set_x(ML)
-        pdf.multi_cell(W, 4.5, "I sottoscritti lavoratori dichiarano di aver preso visione del presente Piano Operativo di Sicurezza, di essere stati informati sui rischi specifici delle lavorazioni e sulle misure di prevenzione e protezione adottate, e di aver ricevuto i Dispositivi di Protezione Individuale (DPI) necessari per lo svolgimento delle attivita lavorative.")
-        pdf.set_text_color(0, 0, 0)
-        
-        pdf.ln(2)
-        pdf.set_font('Helvetica', 'I', 7)
-        pdf.set_text_color(*GRIGIO_MEDIO)
-        pdf.set_x(ML)
-        pdf.cell(W, 4, 'Riferimento normativo: Art. 36, 37, 77 e 78 D.Lgs 81/08', ln=1)
-        pdf.set_text_color(0, 0, 0)
-        pdf.ln(4)
-        
-        # Tabella firme
-        cols = [('Nome e Cognome', 42), ('Mansione', 28), ('Firma Presa Visione', 40), ('Firma Ricevuta DPI', 40), ('Data', 36)]
-        tabella_header(cols)
-        
-        for idx, lav in enumerate(lavoratori):
-            check_spazio(14)
-            if idx % 2 == 0:
-                pdf.set_fill_color(*BIANCO)
-            else:
-                pdf.set_fill_color(*GRIGIO_CHIARO)
-            pdf.set_font('Helvetica', '', 8)
-            pdf.set_x(ML)
-            pdf.cell(42, 12, '  ' + pulisci_testo(lav.get('nome', ''), 20), fill=True)
-            pdf.cell(28, 12, '  ' + pulisci_testo(lav.get('mansione', ''), 14), fill=True)
-            pdf.cell(40, 12, '', fill=True)
-            pdf.cell(40, 12, '', fill=True)
-            pdf.cell(36, 12, '  ___/___/______', fill=True, ln=1)
-            pdf.set_draw_color(*GRIGIO_BORDO)
-            pdf.line(ML, pdf.get_y(), ML + W, pdf.get_y())
-            pdf.set_draw_color(0, 0, 0)
-        
-        # Righe vuote extra
-        righe_extra = max(0, 5 - len(lavoratori))
-        for i in range(righe_extra):
-            check_spazio(14)
-            idx_fill = len(lavoratori) + i
-            if idx_fill % 2 == 0:
-                pdf.set_fill_color(*BIANCO)
-            else:
-                pdf.set_fill_color(*GRIGIO_CHIARO)
-            pdf.set_x(ML)
-            pdf.cell(42, 12, '', fill=True)
-            pdf.cell(28, 12, '', fill=True)
-            pdf.cell(40, 12, '', fill=True)
-            pdf.cell(40, 12, '', fill=True)
-            pdf.cell(36, 12, '  ___/___/______', fill=True, ln=1)
-            pdf.set_draw_color(*GRIGIO_BORDO)
-            pdf.line(ML, pdf.get_y(), ML + W, pdf.get_y())
-            pdf.set_draw_color(0, 0, 0)
-        
-        pdf.ln(5)
-        pdf.set_font('Helvetica', 'I', 7)
-        pdf.set_text_color(*GRIGIO_MEDIO)
-        pdf.set_x(ML)
-        pdf.multi_cell(W, 3.5, "NOTA: La firma del presente verbale attesta l'avvenuta informazione e formazione sui contenuti del POS e la consegna dei DPI. Il lavoratore si impegna ad utilizzare correttamente i DPI forniti e a segnalare eventuali anomalie al preposto o al Datore di Lavoro.")
-        pdf.set_text_color(0, 0, 0)
-        
-        pdf.ln(5)
-        pdf.set_font('Helvetica', '', 9)
-        pdf.set_x(ML)
-        pdf.cell(W, 5, f"Luogo: {pulisci_testo(cantiere.get('indirizzo', ''), 60)}", ln=1)
-        
-        pdf.ln(10)
-        pdf.set_font('Helvetica', 'B', 9)
-        pdf.set_text_color(*BLU_SCURO)
-        pdf.set_x(ML)
-        pdf.cell(W * 0.5, 5, 'IL DATORE DI LAVORO (per consegna DPI)', ln=1)
-        pdf.set_text_color(0, 0, 0)
-        pdf.ln(12)
-        pdf.set_draw_color(*GRIGIO_BORDO)
-        pdf.line(ML, pdf.get_y(), ML + 90, pdf.get_y())
-        pdf.set_draw_color(0, 0, 0)
-        pdf.ln(2)
-        pdf.set_font('Helvetica', 'I', 8)
-        pdf.set_text_color(*GRIGIO_MEDIO)
-        pdf.set_x(ML)
-        pdf.cell(90, 4, f"({pulisci_testo(ditta.get('datore_lavoro', ''), 35)})", ln=1)
-        pdf.set_text_color(0, 0, 0)
-    
-    return bytes(pdf.output())
+        with st.spinner(messaggio):
+            ai_background.attendi(st.session_state, nome)
+        st.rerun()
 
 
-def merge_pdfs_with_allegati(pos_bytes, allegati_dict):
+def merge_pdfs_with_allegati(pos_bytes, allegati_dict, verifiche=None, ottimizza_dpi=None):
     """
     Unisce il POS generato con i PDF allegati caricati dall'utente.
     
     Args:
         pos_bytes: bytes del PDF POS generato
         allegati_dict: dict con chiavi 'visura', 'durc', 'attestati', etc. e valori file-like objects
+        verifiche: esiti di verifica_allegati_caricati (reader gia aperti e validati)
+        ottimizza_dpi: se indicato, riduce il PDF per la PEC (immagini a questa risoluzione)
     
     Returns:
-        bytes del PDF unificato
+        file temporaneo (posizionato all'inizio) con il PDF unificato, da mostrare con offri_download
     """
-    if not PYPDF_AVAILABLE:
-        # Se pypdf non è disponibile, ritorna solo il POS
-        return pos_bytes
-    
-    writer = PdfWriter()
-    
-    # Aggiungi il POS come primo documento
-    pos_reader = PdfReader(BytesIO(pos_bytes))
-    for page in pos_reader.pages:
-        writer.add_page(page)
-    
-    # Ordine degli allegati
-    ordine_allegati = [
-        ('visura', 'Visura Camerale'),
-        ('durc', 'DURC'),
-        ('attestati', 'Attestati Formazione'),
-        ('idoneita', 'Idoneità Sanitarie'),
-        ('libretti', 'Libretti Attrezzature'),
-        ('sds', 'Schede SDS'),
-        ('pimus', 'Pi.M.U.S. / Manuali'),
-        ('dpi', 'Verbali Consegna DPI'),
-        ('altro', 'Altri Allegati')
-    ]
-    
-    # Aggiungi ogni allegato
-    for chiave, nome in ordine_allegati:
-        if chiave in allegati_dict and allegati_dict[chiave] is not None:
-            file_obj = allegati_dict[chiave]
-            try:
-                # Leggi il file
-                file_obj.seek(0)
-                allegato_reader = PdfReader(file_obj)
-                for page in allegato_reader.pages:
-                    writer.add_page(page)
-            except Exception as e:
-                # Se un allegato non è valido, lo saltiamo
-                st.warning(f"⚠️ Impossibile allegare {nome}: {str(e)}")
-                continue
-    
-    # Scrivi il PDF unificato
-    output = BytesIO()
-    writer.write(output)
-    output.seek(0)
-    return output.read()
+    avvisi = []
+    report = {}
+    out = unisci_allegati(pos_bytes, allegati_dict, avvisi, verifiche, ottimizza_dpi, report)
+    for avviso in avvisi:
+        st.warning(f"⚠️ {avviso}")
+    if ottimizza_dpi:
+        prima_mb, dopo_mb = report['prima'] / (1024 * 1024), report['dopo'] / (1024 * 1024)
+        st.info(f"🗜️ Dimensione PDF: {prima_mb:.1f} MB → {dopo_mb:.1f} MB"
+                f" ({report['immagini']} immagini ricampionate a {ottimizza_dpi} DPI)")
+    return out
+
+
+def registra_download(file_obj):
+    """Il file temporaneo resta aperto per il pulsante di download e viene chiuso al rerun successivo."""
+    st.session_state.setdefault('_download_aperti', []).append(file_obj)
+    return file_obj
+
+
+def offri_download(etichetta: str, file_obj, nome_file: str, mime: str):
+    """
+    Pulsante di download di un file registrato con registra_download: il
+    contenuto viene letto solo al clic (download_differito), non a ogni render.
+    """
+    st.download_button(etichetta, download_differito(file_obj), nome_file, mime,
+                       on_click="ignore", use_container_width=True)
+
+
+def chiudi_download():
+    """Chiude i file offerti in download nel rerun precedente (il pulsante non c'e piu)."""
+    for file_obj in st.session_state.pop('_download_aperti', []):
+        file_obj.close()
+
+
+
+def verifica_allegati_caricati(allegati_dict, impresa_id=None, durc_scadenza=None):
+    """
+    Verifica gli allegati appena caricati (in parallelo) e conserva gli esiti in sessione:
+    ai rerun successivi vengono rianalizzati solo i file nuovi o sostituiti.
+    Gli allegati nuovi e validi vengono archiviati per l'impresa (se gia salvata).
+    """
+    cache = st.session_state.setdefault('_verifiche_allegati', {})
+    firme = {
+        chiave: (getattr(f, 'file_id', None) or f.name, f.size)
+        for chiave, f in allegati_dict.items() if f is not None
+    }
+    nuovi = {chiave: allegati_dict[chiave] for chiave, firma in firme.items()
+             if chiave not in cache or cache[chiave][0] != firma}
+    esiti_nuovi = verifica_allegati(nuovi)
+    for chiave, esito in esiti_nuovi.items():
+        cache[chiave] = (firme[chiave], esito)
+    if impresa_id and esiti_nuovi:
+        archivia_allegati(impresa_id, nuovi, esiti_nuovi, durc_scadenza)
+    for chiave in list(cache):
+        if chiave not in firme:
+            del cache[chiave]
+    return {chiave: cache[chiave][1] for chiave in firme}
 
 
 def crea_copertina_allegati():
@@ -2442,6 +640,7 @@ def init_session():
         'attrezzature': [],
         'sostanze': [],
         'lavorazioni_selezionate': {},
+        'lavorazioni_personalizzate': {},  # chiave -> voce come nel catalogo (vedi catalogo.py)
         'rischi_ai': None,
         'disclaimer_ok': False,
         'ai_analisi_fatta': False
@@ -2484,7 +683,39 @@ def init_session():
     if 'sostanze' not in st.session_state:
         st.session_state.sostanze = []
     if not st.session_state.lavorazioni_selezionate:
-        st.session_state.lavorazioni_selezionate = {k: False for k in DIZIONARIO_LAVORAZIONI.keys()}
+        st.session_state.lavorazioni_selezionate = {k: False for k in dizionario_lavorazioni().keys()}
+
+
+def dizionario_lavorazioni() -> dict:
+    """Catalogo lavorazioni con le lavorazioni personalizzate dell'utente sovrapposte."""
+    return sovrapponi_lavorazioni(st.session_state.get('lavorazioni_personalizzate'))[0]
+
+
+def render_lavorazioni_personalizzate():
+    """Caricamento delle lavorazioni personalizzate (JSON, stesse voci del catalogo)."""
+    personalizzate = st.session_state.lavorazioni_personalizzate
+    with st.expander(f"➕ Lavorazioni personalizzate ({len(personalizzate)})"):
+        st.caption("File JSON con chiave -> lavorazione, stessi campi del catalogo (nome obbligatorio): "
+                   "una chiave esistente sostituisce la voce del catalogo, una nuova la aggiunge.")
+        file_json = st.file_uploader("Lavorazioni personalizzate", type=['json'], key="lavorazioni_json")
+        if file_json:
+            try:
+                caricate = json.loads(file_json.getvalue().decode('utf-8'))
+            except (UnicodeDecodeError, json.JSONDecodeError) as e:
+                st.error(f"File non valido: {str(e)}")
+                caricate = None
+            if caricate is not None and not isinstance(caricate, dict):
+                st.error("File non valido: serve un oggetto JSON chiave -> lavorazione")
+            elif caricate is not None and caricate != personalizzate:
+                st.session_state.lavorazioni_personalizzate = caricate
+                st.rerun()
+        if personalizzate:
+            ignorate = [k for k in personalizzate if k not in dizionario_lavorazioni()]
+            if ignorate:
+                st.warning(f"Lavorazioni ignorate (nome o campi non validi): {', '.join(ignorate)}")
+            if st.button("Rimuovi lavorazioni personalizzate", key="lavorazioni_json_rimuovi"):
+                st.session_state.lavorazioni_personalizzate = {}
+                st.rerun()
 
 
 # ==============================================================================
@@ -2605,9 +836,19 @@ def render_sidebar():
         st.markdown("##### 🤖 Assistente AI")
         domanda = st.text_input("Chiedi:", placeholder="Es: Quando serve il POS?", key="ai_q", label_visibility="collapsed")
         if st.button("💬 Chiedi all'AI", key="ask", use_container_width=True) and domanda:
-            with st.spinner("Elaboro..."):
-                risposta = ai_assistente(domanda)
-                st.info(risposta)
+            if not get_openai_client():
+                st.info("AI non disponibile.")
+            else:
+                # La risposta compare parola per parola; se l'utente interrompe resta la parte ricevuta
+                parziale = []
+                st.session_state.ai_risposta_parziale = parziale
+                risposta = mostra_stream(ai_assistente_stream(domanda, parziale), stile="info")
+                del st.session_state['ai_risposta_parziale']
+                if not risposta:
+                    st.info("Errore: nessuna risposta dall'AI.")
+        elif st.session_state.get('ai_risposta_parziale'):
+            parziale = "".join(st.session_state.pop('ai_risposta_parziale'))
+            st.info(f"{parziale} … _(risposta interrotta)_")
         
         st.markdown("---")
         
@@ -3060,20 +1301,40 @@ def render_step3():
             testo_da_usare = tipo_lavoro if tipo_lavoro else (tipo_comune if tipo_comune != tipi_lavoro_comuni[0] else "")
             
             if testo_da_usare:
-                with st.spinner("✨ Generazione descrizione tecnica professionale..."):
-                    # Usa la funzione avanzata con contesto
-                    indirizzo = st.session_state.cantiere.get('indirizzo', '')
-                    durata = st.session_state.cantiere.get('durata', '')
-                    desc = ai_genera_descrizione_avanzata(testo_da_usare, indirizzo, durata)
-                    
-                    if desc:
-                        st.session_state.cantiere['descrizione'] = desc
-                        st.success("✅ Descrizione generata! Scorri sotto per visualizzarla e modificarla.")
-                        st.rerun()
-                    else:
-                        st.error("❌ Errore nella generazione. Verifica la chiave API.")
+                # Usa la funzione avanzata con contesto, in streaming: il testo compare
+                # mentre viene generato e, se l'utente interrompe, la parte ricevuta resta
+                indirizzo = st.session_state.cantiere.get('indirizzo', '')
+                durata = st.session_state.cantiere.get('durata', '')
+                parziale = []
+                st.session_state.descrizione_parziale = parziale
+                st.markdown("##### ✨ Generazione descrizione tecnica professionale...")
+                desc = mostra_stream(ai_genera_descrizione_stream(testo_da_usare, indirizzo, durata, parziale), stile="info")
+                del st.session_state['descrizione_parziale']
+                desc = desc.strip().strip('"\'')
+                
+                if desc:
+                    st.session_state.cantiere['descrizione'] = desc
+                    st.success("✅ Descrizione generata! Scorri sotto per visualizzarla e modificarla.")
+                    st.rerun()
+                else:
+                    st.error("❌ Errore nella generazione. Verifica la chiave API.")
             else:
                 st.warning("⚠️ Seleziona un tipo di lavoro o inserisci una descrizione")
+        elif st.session_state.get('descrizione_parziale'):
+            # Generazione interrotta: si puo tenere il testo ricevuto fin qui
+            parziale = "".join(st.session_state.descrizione_parziale).strip()
+            st.warning("⚠️ Generazione interrotta. Testo ricevuto finora:")
+            st.info(parziale)
+            col_usa, col_scarta = st.columns(2)
+            with col_usa:
+                if st.button("✅ Usa questo testo", key="btn_usa_parziale", use_container_width=True):
+                    st.session_state.cantiere['descrizione'] = parziale.strip('"\'')
+                    del st.session_state['descrizione_parziale']
+                    st.rerun()
+            with col_scarta:
+                if st.button("🗑️ Scarta", key="btn_scarta_parziale", use_container_width=True):
+                    del st.session_state['descrizione_parziale']
+                    st.rerun()
         
         # Mostra anteprima se già generata
         if st.session_state.cantiere.get('descrizione'):
@@ -3332,6 +1593,17 @@ def render_step3():
                     }
                     st.session_state.attrezzature = attrezzature_temp
                     st.session_state.sostanze = sostanze_temp
+                    # Se le regole offline non bastano, l'analisi AI parte subito:
+                    # arriva in Fase 4 gia pronta (o quasi)
+                    personalizzate = st.session_state.lavorazioni_personalizzate
+                    if client and classifica_descrizione(descrizione, personalizzate)['confidenza'] < CONFIDENZA_MINIMA:
+                        versione = prompt_analisi(personalizzate)['versione']
+                        ai_background.avvia(st.session_state, 'analisi', (descrizione, True, versione),
+                                            ai_analisi_con_origine, descrizione, True,
+                                            st.session_state.get('user_id'), personalizzate)
+                        st.session_state.ai_auto_descrizione = (descrizione, versione)
+                    elif (ai_background.chiave_task(st.session_state, 'analisi') or ('',))[0] != descrizione:
+                        ai_background.annulla(st.session_state, 'analisi')
                     st.session_state.step = 4
                     st.rerun()
                 else:
@@ -3349,8 +1621,31 @@ def render_step4():
     st.markdown("### Fase 4: Analisi Rischi")
     
     client = get_openai_client()
+    personalizzate = st.session_state.lavorazioni_personalizzate
+    dizionario, versione = sovrapponi_lavorazioni(personalizzate)
     descrizione = st.session_state.cantiere.get('descrizione', '')
     
+    # === PRE-SELEZIONE OFFLINE ===
+    # Il classificatore a regole risponde in millisecondi, anche senza chiave API:
+    # le caselle si compilano subito, l'AI parte da sola solo se la confidenza e bassa
+    classificazione = None
+    if descrizione:
+        memorizzata = st.session_state.get('classificazione_locale')
+        if memorizzata and memorizzata[0] == (descrizione, versione):
+            classificazione = memorizzata[1]
+        else:
+            classificazione = classifica_descrizione(descrizione, personalizzate)
+            st.session_state.classificazione_locale = ((descrizione, versione), classificazione)
+            if memorizzata:
+                # Descrizione o lavorazioni personalizzate cambiate: l'analisi AI precedente non vale piu
+                st.session_state.ai_analisi_fatta = False
+                st.session_state.rischi_ai = None
+            if not st.session_state.get('ai_analisi_fatta'):
+                for key in dizionario.keys():
+                    is_sel = key in classificazione['lavorazioni_identificate']
+                    st.session_state.lavorazioni_selezionate[key] = is_sel
+                    st.session_state[f"cb_{key}"] = is_sel
+    
     # === SEZIONE AI ANALYSIS ===
     if client:
         st.markdown("""
@@ -3373,33 +1668,54 @@ def render_step4():
             with st.expander("📝 Descrizione lavori da analizzare", expanded=False):
                 st.info(descrizione)
             
-            # Pulsante analisi
+            # Pulsante analisi (con una pre-selezione sicura l'AI serve solo ad affinarla)
+            confidenza_bassa = classificazione['confidenza'] < CONFIDENZA_MINIMA
             col1, col2, col3 = st.columns([1, 2, 1])
             with col2:
                 analizza_btn = st.button(
-                    "🔍 ANALIZZA CON INTELLIGENZA ARTIFICIALE", 
+                    "🔍 ANALIZZA CON INTELLIGENZA ARTIFICIALE" if confidenza_bassa else "✨ AFFINA CON INTELLIGENZA ARTIFICIALE", 
                     type="primary", 
                     use_container_width=True,
                     key="btn_analizza_ai"
                 )
             
-            if analizza_btn:
-                with st.spinner("🤖 Analisi in corso... L'AI sta identificando rischi e lavorazioni..."):
-                    risultato = ai_analizza_descrizione(descrizione)
-                    if risultato:
-                        st.session_state.rischi_ai = risultato
-                        lavorazioni_trovate = risultato.get('lavorazioni_identificate', [])
-                        
-                        # Seleziona automaticamente le lavorazioni trovate
-                        for key in DIZIONARIO_LAVORAZIONI.keys():
-                            is_sel = key in lavorazioni_trovate
-                            st.session_state.lavorazioni_selezionate[key] = is_sel
-                            st.session_state[f"cb_{key}"] = is_sel
-                        
-                        st.session_state.ai_analisi_fatta = True
-                        st.rerun()
-                    else:
-                        st.error("❌ Errore durante l'analisi. Verifica la chiave API OpenAI.")
+            # Rianalisi forzata di una descrizione che aveva riusato un'analisi simile
+            rianalizza = st.session_state.pop('ai_rianalizza', False)
+            # Analisi automatica, una volta per descrizione e catalogo, se le regole non bastano
+            analisi_auto = (confidenza_bassa and not st.session_state.get('ai_analisi_fatta')
+                            and st.session_state.get('ai_auto_descrizione') != (descrizione, versione))
+            if analisi_auto:
+                st.session_state.ai_auto_descrizione = (descrizione, versione)
+            # Un'analisi avviata per un'altra descrizione o un altro catalogo viene annullata
+            chiave_analisi = ai_background.chiave_task(st.session_state, 'analisi')
+            if chiave_analisi and (chiave_analisi[0], chiave_analisi[2]) != (descrizione, versione):
+                ai_background.annulla(st.session_state, 'analisi')
+            if analizza_btn or rianalizza or analisi_auto:
+                simili = not rianalizza
+                ai_background.avvia(st.session_state, 'analisi', (descrizione, simili, versione),
+                                    ai_analisi_con_origine, descrizione, simili,
+                                    st.session_state.get('user_id'), personalizzate)
+            
+            stato_analisi = ai_background.stato_task(st.session_state, 'analisi')
+            if stato_analisi == 'in_corso':
+                mostra_attesa_ai('analisi', "🤖 Analisi in corso... L'AI sta identificando rischi e lavorazioni...")
+            elif stato_analisi != 'assente':
+                risultato, origine = ai_background.prendi_risultato(st.session_state, 'analisi', (None, {}))
+                if risultato:
+                    st.session_state.rischi_ai = risultato
+                    st.session_state.ai_origine = origine
+                    lavorazioni_trovate = risultato.get('lavorazioni_identificate', [])
+                    
+                    # Seleziona automaticamente le lavorazioni trovate
+                    for key in dizionario.keys():
+                        is_sel = key in lavorazioni_trovate
+                        st.session_state.lavorazioni_selezionate[key] = is_sel
+                        st.session_state[f"cb_{key}"] = is_sel
+                    
+                    st.session_state.ai_analisi_fatta = True
+                    st.rerun()
+                else:
+                    st.error("❌ Errore durante l'analisi. Verifica la chiave API OpenAI.")
             
             # === RISULTATI ANALISI AI ===
             if st.session_state.get('ai_analisi_fatta') and st.session_state.get('rischi_ai'):
@@ -3442,6 +1758,21 @@ def render_step4():
                 </div>
                 """, unsafe_allow_html=True)
                 
+                # Provenienza del risultato: cache, descrizione simile o nuova chiamata al modello
+                origine = st.session_state.get('ai_origine') or {}
+                if origine.get('fonte') == 'cache':
+                    st.caption("⚡ Risultato dalla cache: questa descrizione era già stata analizzata.")
+                elif origine.get('fonte') == 'simile':
+                    col_orig, col_btn = st.columns([3, 1])
+                    with col_orig:
+                        st.caption(f"♻️ Risultato riusato da una tua descrizione simile al {origine['similarita']:.0%}.")
+                    with col_btn:
+                        if st.button("🔄 Analizza con l'AI", key="btn_rianalizza_ai"):
+                            st.session_state.ai_rianalizza = True
+                            st.rerun()
+                elif origine.get('fonte') == 'modello':
+                    st.caption("🤖 Risultato generato dal modello AI.")
+                
                 # Mostra rischi aggiuntivi se presenti
                 if rischi_aggiuntivi:
                     st.markdown("#### ⚠️ Rischi Aggiuntivi Identificati")
@@ -3537,15 +1868,22 @@ def render_step4():
     # === SELEZIONE MANUALE LAVORAZIONI ===
     st.markdown("#### ✅ Seleziona Lavorazioni")
     st.caption("Le lavorazioni vengono selezionate automaticamente dall'AI, ma puoi modificarle manualmente")
+    if classificazione and not st.session_state.get('ai_analisi_fatta'):
+        parole = sorted({p for trovate in classificazione['parole_chiave'].values() for p in trovate})
+        st.caption(
+            f"⚡ Pre-selezione automatica offline ({classificazione['confidenza']:.0%} di confidenza)"
+            + (f" - parole chiave: {', '.join(parole)}" if parole else "")
+        )
     
+    render_lavorazioni_personalizzate()
     cols = st.columns(2)
-    for i, (key, data) in enumerate(DIZIONARIO_LAVORAZIONI.items()):
+    for i, (key, data) in enumerate(dizionario.items()):
         with cols[i % 2]:
             default_val = st.session_state.get(f"cb_{key}", st.session_state.lavorazioni_selezionate.get(key, False))
             checked = st.checkbox(data['nome'], value=default_val, key=f"cb_{key}")
             st.session_state.lavorazioni_selezionate[key] = checked
     
-    selected = [k for k, v in st.session_state.lavorazioni_selezionate.items() if v]
+    selected = [k for k, v in st.session_state.lavorazioni_selezionate.items() if v and k in dizionario]
     
     # === ANTEPRIMA LAVORAZIONI SELEZIONATE ===
     if selected:
@@ -3553,7 +1891,7 @@ def render_step4():
         st.markdown(f"#### 📋 Dettaglio Lavorazioni Selezionate ({len(selected)})")
         
         for key in selected:
-            data = DIZIONARIO_LAVORAZIONI[key]
+            data = dizionario[key]
             with st.expander(f"📋 {data['nome']}", expanded=False):
                 st.markdown(f"**Descrizione:** {data['descrizione_tecnica']}")
                 
@@ -3592,7 +1930,7 @@ def render_step5():
     # VERIFICA LIMITE POS - FONDAMENTALE PER MONETIZZAZIONE
     # ==========================================================================
     try:
-        from database import can_generate_pos, increment_pos_counter, save_pos_generato, save_impresa, save_lavoratori_template, save_attrezzature_template, ditta_to_impresa_dict
+        from database import verifica_pos_quota, consume_pos_quota, save_pos_generato, save_impresa, save_lavoratori_template, save_attrezzature_template, ditta_to_impresa_dict
         db_available = True
     except ImportError:
         db_available = False
@@ -3605,7 +1943,7 @@ def render_step5():
     pos_rimanenti = 1
     
     if db_available and user_id:
-        can_generate, pos_message, pos_rimanenti = can_generate_pos(user_id)
+        can_generate, pos_message, pos_rimanenti = verifica_pos_quota(user_id)
     
     # Mostra stato abbonamento
     if can_generate:
@@ -3667,7 +2005,8 @@ def render_step5():
     # ==========================================================================
     # RIEPILOGO DATI
     # ==========================================================================
-    selected = [k for k, v in st.session_state.lavorazioni_selezionate.items() if v]
+    dizionario = dizionario_lavorazioni()
+    selected = [k for k, v in st.session_state.lavorazioni_selezionate.items() if v and k in dizionario]
     
     c1, c2 = st.columns(2)
     with c1:
@@ -3784,27 +2123,99 @@ def render_step5():
         'dpi': allegato_dpi,
         'altro': allegato_altro
     }
-    num_allegati = sum(1 for v in allegati.values() if v is not None)
+    # Verifica immediata (pagine, cifratura, file corrotti): i file non validi
+    # vengono segnalati subito e non entrano nel PDF finale
+    impresa_id = st.session_state.ditta.get('_impresa_id', None)
+    verifiche_allegati = verifica_allegati_caricati(
+        allegati, impresa_id, st.session_state.ditta.get('durc_scadenza')
+    ) if PYPDF_AVAILABLE else {}
+    for chiave, esito in verifiche_allegati.items():
+        if not esito['ok']:
+            st.error(f"❌ {allegati[chiave].name}: {esito['errore']} - non verrà allegato")
+    
+    # Allegati gia caricati per questa impresa in POS precedenti: riuso senza ricaricarli
+    archiviati = {
+        chiave: voce for chiave, voce in allegati_archiviati(impresa_id).items()
+        if allegati.get(chiave) is None
+    } if PYPDF_AVAILABLE and impresa_id else {}
+    sha_archiviati = []  # blob riusati: ultimo uso aggiornato solo a POS generato
+    if archiviati:
+        elenco = ", ".join(f"{NOMI_ALLEGATI.get(k, k)} ({v['nome']})" for k, v in archiviati.items())
+        scadenza = next(iter(archiviati.values()))['scadenza']
+        if st.checkbox(
+            f"📂 Riusa gli allegati salvati per questa impresa: {elenco}",
+            value=True,
+            help=f"Documenti caricati in POS precedenti, validi fino alla scadenza DURC ({scadenza}). Caricando un nuovo file lo sostituisci."
+        ):
+            file_archiviati, verifiche_archiviate = apri_allegati_archiviati(impresa_id, archiviati)
+            sha_archiviati = [archiviati[chiave]['sha'] for chiave in file_archiviati]
+            allegati.update(file_archiviati)
+            verifiche_allegati.update(verifiche_archiviate)
+    num_allegati = sum(1 for esito in verifiche_allegati.values() if esito['ok'])
     
     if num_allegati > 0:
-        st.success(f"✅ **{num_allegati} allegat{'o' if num_allegati == 1 else 'i'} caricat{'o' if num_allegati == 1 else 'i'}** - Verranno uniti al POS")
+        pagine_allegati = sum(esito['pagine'] for esito in verifiche_allegati.values() if esito['ok'])
+        st.success(f"✅ **{num_allegati} allegat{'o' if num_allegati == 1 else 'i'} caricat{'o' if num_allegati == 1 else 'i'}** ({pagine_allegati} pagine) - Verranno uniti al POS")
+    
+    # Ottimizzazione per PEC: le caselle accettano messaggi di pochi MB
+    ottimizza_dpi = None
+    if num_allegati > 0 and PYPDF_AVAILABLE:
+        if st.checkbox(
+            "🗜️ Riduci dimensione PDF per l'invio via PEC",
+            value=False,
+            help="Ricampiona le scansioni, ricomprime le pagine ed elimina gli oggetti duplicati (font, loghi)"
+        ):
+            ottimizza_dpi = st.select_slider(
+                "Risoluzione massima immagini (DPI)",
+                options=[100, 150, 200, 300],
+                value=OTTIMIZZA_DPI
+            )
     
-    # Valutazione AI
+    # Verifica completezza: controlli locali sempre, AI come secondo parere
     st.markdown("---")
+    st.markdown('<div class="card-ai"><strong>✅ Verifica Documento</strong></div>', unsafe_allow_html=True)
+    dati_pos = {
+        'ditta': st.session_state.ditta, 'cantiere': st.session_state.cantiere, 'addetti': st.session_state.addetti,
+        'lavorazioni': selected, 'lavoratori': st.session_state.lavoratori, 'attrezzature': st.session_state.attrezzature
+    }
+    completezza = valuta_completezza(dati_pos)
+    score = completezza['score']
+    st.progress(score / 100)
+    if score >= 95:
+        st.success(f"🎉 **PERFETTO! {score}/100** - Documento completo!")
+    elif score >= 85:
+        st.success(f"✅ **OTTIMO! {score}/100**")
+    else:
+        st.warning(f"⚠️ **{score}/100** - Verifica i dati")
+    if completezza['suggerimenti']:
+        with st.expander(f"📝 {len(completezza['suggerimenti'])} campi da sistemare", expanded=score < 85):
+            for suggerimento in completezza['suggerimenti']:
+                st.markdown(f"- {suggerimento}")
+    
     client = get_openai_client()
     if client:
-        st.markdown('<div class="card-ai"><strong>🤖 Verifica Documento</strong></div>', unsafe_allow_html=True)
-        if st.button("✅ Verifica Completezza", use_container_width=True):
-            with st.spinner("Verifico..."):
-                val = ai_valuta_completezza({'ditta': st.session_state.ditta, 'cantiere': st.session_state.cantiere, 'addetti': st.session_state.addetti, 'lavorazioni': selected})
-                score = val.get('score', 100)
-                st.progress(score / 100)
-                if score >= 95:
-                    st.success(f"🎉 **PERFETTO! {score}/100** - Documento completo!")
-                elif score >= 85:
-                    st.success(f"✅ **OTTIMO! {score}/100**")
-                else:
-                    st.warning(f"⚠️ **{score}/100** - Verifica i dati")
+        chiave_dati = json.dumps(dati_pos, sort_keys=True, default=str)
+        if st.button("🤖 Secondo parere AI", use_container_width=True):
+            ai_background.avvia(st.session_state, 'completezza', chiave_dati, ai_valuta_completezza, dati_pos)
+        
+        if ai_background.stato_task(st.session_state, 'completezza') == 'in_corso':
+            if ai_background.chiave_task(st.session_state, 'completezza') != chiave_dati:
+                ai_background.annulla(st.session_state, 'completezza')
+            else:
+                mostra_attesa_ai('completezza', "Chiedo il parere AI...")
+        elif ai_background.stato_task(st.session_state, 'completezza') != 'assente':
+            chiave_task = ai_background.chiave_task(st.session_state, 'completezza')
+            val = ai_background.prendi_risultato(st.session_state, 'completezza')
+            if val:
+                st.session_state.valutazione_completezza = (chiave_task, val)
+        
+        # Esito mostrato finche i dati valutati non cambiano
+        valutazione = st.session_state.get('valutazione_completezza')
+        if valutazione and valutazione[0] == chiave_dati:
+            parere = valutazione[1]
+            st.info(f"🤖 **Parere AI: {parere.get('score', score)}/100**")
+            for suggerimento in parere.get('suggerimenti', []):
+                st.caption(f"• {suggerimento}")
     
     st.markdown("---")
     st.markdown('<div class="card" style="background:#FFF3E0;border-left-color:#FF9800;"><strong>⚠️ DICHIARAZIONE</strong><br>Il documento deve essere verificato e firmato dal Datore di Lavoro.</div>', unsafe_allow_html=True)
@@ -3834,83 +2245,196 @@ def render_step5():
                         st.session_state.rischi_ai,
                         st.session_state.lavoratori,
                         st.session_state.attrezzature,
-                        st.session_state.sostanze
+                        st.session_state.sostanze,
+                        st.session_state.lavorazioni_personalizzate
                     )
                     
                     # Se ci sono allegati e pypdf è disponibile, unisci i PDF
-                    if num_allegati > 0 and PYPDF_AVAILABLE:
+                    # Il PDF finale resta in un file temporaneo passato direttamente al download
+                    con_allegati = num_allegati > 0 and PYPDF_AVAILABLE
+                    if con_allegati:
                         with st.spinner(f"Unione {num_allegati} allegati..."):
-                            pdf_bytes = merge_pdfs_with_allegati(pdf_bytes, allegati)
-                        st.success(f"✅ POS generato con {num_allegati} allegati!")
+                            pdf_file = registra_download(merge_pdfs_with_allegati(pdf_bytes, allegati, verifiche_allegati, ottimizza_dpi))
+                        tocca_allegati(impresa_id, sha_archiviati)
                         nome_file = f"POS_COMPLETO_{date.today().strftime('%Y%m%d')}.pdf"
                     else:
-                        st.success("✅ POS generato con successo!")
+                        pdf_file = registra_download(pdf_come_file(pdf_bytes))
                         nome_file = f"POS_{date.today().strftime('%Y%m%d')}.pdf"
+                    del pdf_bytes
                     
                     # ============================================================
-                    # INCREMENTA CONTATORE POS (FONDAMENTALE PER MONETIZZAZIONE!)
+                    # SCALA IL POS DALLA QUOTA (FONDAMENTALE PER MONETIZZAZIONE!)
+                    # Verifica limite + incremento in un'unica chiamata atomica:
+                    # due schede aperte non possono superare il limite del piano.
                     # ============================================================
+                    quota_ok = True
+                    pos_rimanenti_dopo = None
                     if db_available and user_id:
-                        try:
-                            # Incrementa contatore
-                            increment_pos_counter(user_id)
-                            
-                            # Salva nel log storico
-                            impresa_id = st.session_state.ditta.get('_impresa_id', None)
-                            save_pos_generato(
-                                user_id, 
-                                impresa_id,
-                                st.session_state.cantiere,
-                                selected,
-                                nome_file
-                            )
-                            
-                            # Salva anagrafica se richiesto
-                            if salva_anagrafica:
-                                # Converti ditta nel formato database
-                                impresa_data = ditta_to_impresa_dict(st.session_state.ditta, st.session_state.addetti)
-                                piva = impresa_data.get('piva_cf', '')
-                                
-                                # Anti-duplicato: save_impresa aggiorna se esiste gia
-                                try:
-                                    from database import find_impresa_by_piva
-                                    is_update = find_impresa_by_piva(user_id, piva) is not None
-                                except:
-                                    is_update = False
-                                
-                                saved_id = save_impresa(user_id, impresa_data)
-                                
-                                if saved_id:
-                                    # Salva lavoratori e attrezzature collegati
-                                    save_lavoratori_template(saved_id, st.session_state.lavoratori)
-                                    save_attrezzature_template(saved_id, st.session_state.attrezzature)
-                                    if is_update:
-                                        st.info("💾 Anagrafica aggiornata con i dati correnti.")
-                                    else:
-                                        st.info("💾 Anagrafica salvata! Potrai riutilizzarla per i prossimi POS.")
-                        except Exception as e:
-                            # Non bloccare il download se c'è errore nel contatore
-                            print(f"Errore contatore/salvataggio: {e}")
+                        quota_ok, quota_msg, pos_rimanenti_dopo = consume_pos_quota(user_id)
                     
-                    # Mostra download button
-                    st.download_button(
-                        "📥 SCARICA PDF" + (" CON ALLEGATI" if num_allegati > 0 else ""), 
-                        pdf_bytes, 
-                        nome_file, 
-                        "application/pdf", 
-                        use_container_width=True
-                    )
-                    
-                    # Messaggio post-generazione
-                    if db_available and user_id:
-                        new_can, new_msg, new_remaining = can_generate_pos(user_id)
-                        if new_remaining > 0:
-                            st.info(f"📊 Ti rimangono ancora **{new_remaining} POS** disponibili.")
-                        elif not new_can:
-                            st.warning("⚠️ Hai esaurito i POS disponibili. Passa a un piano superiore per continuare!")
+                    if not quota_ok:
+                        pdf_file.close()
+                        st.error(f"🚫 {quota_msg}")
+                    else:
+                        if con_allegati:
+                            st.success(f"✅ POS generato con {num_allegati} allegati!")
+                        else:
+                            st.success("✅ POS generato con successo!")
+                        
+                        if db_available and user_id:
+                            try:
+                                # Salva nel log storico
+                                impresa_id = st.session_state.ditta.get('_impresa_id', None)
+                                save_pos_generato(
+                                    user_id, 
+                                    impresa_id,
+                                    st.session_state.cantiere,
+                                    selected,
+                                    nome_file
+                                )
+                                
+                                # Salva anagrafica se richiesto
+                                if salva_anagrafica:
+                                    # Converti ditta nel formato database
+                                    impresa_data = ditta_to_impresa_dict(st.session_state.ditta, st.session_state.addetti)
+                                    piva = impresa_data.get('piva_cf', '')
+                                    
+                                    # Anti-duplicato: save_impresa aggiorna se esiste gia
+                                    try:
+                                        from database import find_impresa_by_piva
+                                        is_update = find_impresa_by_piva(user_id, piva) is not None
+                                    except:
+                                        is_update = False
+                                    
+                                    saved_id = save_impresa(user_id, impresa_data)
+                                    
+                                    if saved_id:
+                                        # Salva lavoratori e attrezzature collegati
+                                        save_lavoratori_template(saved_id, st.session_state.lavoratori)
+                                        save_attrezzature_template(saved_id, st.session_state.attrezzature)
+                                        if is_update:
+                                            st.info("💾 Anagrafica aggiornata con i dati correnti.")
+                                        else:
+                                            st.info("💾 Anagrafica salvata! Potrai riutilizzarla per i prossimi POS.")
+                            except Exception as e:
+                                # Non bloccare il download se c'è errore nel salvataggio
+                                print(f"Errore salvataggio storico/anagrafica: {e}")
+                        
+                        # Mostra download button
+                        offri_download(
+                            "📥 SCARICA PDF" + (" CON ALLEGATI" if num_allegati > 0 else ""),
+                            pdf_file,
+                            nome_file,
+                            "application/pdf"
+                        )
+                        
+                        # Messaggio post-generazione (quota restituita dalla stessa chiamata)
+                        if pos_rimanenti_dopo is not None:
+                            if pos_rimanenti_dopo > 0:
+                                st.info(f"📊 Ti rimangono ancora **{pos_rimanenti_dopo} POS** disponibili.")
+                            else:
+                                st.warning("⚠️ Hai esaurito i POS disponibili. Passa a un piano superiore per continuare!")
                     
                 except Exception as e:
                     st.error(f"Errore: {str(e)}")
+    
+    # Generazione in serie: stessa impresa, piu cantieri
+    if disclaimer:
+        render_generazione_serie(selected, db_available, user_id)
+
+
+def render_generazione_serie(selected, db_available, user_id):
+    """
+    Generazione in serie: l'impresa corrente (dati, lavoratori, attrezzature)
+    su un elenco di cantieri caricato da CSV/JSON. Produce un unico ZIP e scala
+    la quota con un solo decremento atomico.
+    """
+    with st.expander("📦 Generazione in serie (più cantieri, stessa impresa)"):
+        st.caption("Carica un file CSV o JSON con un cantiere per riga: indirizzo, committente, durata, "
+                   "data_inizio, descrizione, ospedale_vicino, lavorazioni (codici separati da |). "
+                   "Se le lavorazioni mancano vengono usate quelle selezionate al passo 3.")
+        file_cantieri = st.file_uploader("Elenco cantieri", type=['csv', 'json'], key="batch_cantieri")
+        if not file_cantieri:
+            return
+        
+        from batch_pos import leggi_cantieri, genera_zip_batch
+        voci, errori = leggi_cantieri(file_cantieri.getvalue(), file_cantieri.name)
+        dizionario = dizionario_lavorazioni()
+        for voce in voci:
+            sconosciute = [k for k in voce['lavorazioni'] if k not in dizionario]
+            if sconosciute:
+                errori.append(f"{voce['cantiere']['indirizzo']}: lavorazioni sconosciute ignorate ({', '.join(sconosciute)})")
+                voce['lavorazioni'] = [k for k in voce['lavorazioni'] if k in dizionario]
+        for errore in errori:
+            st.warning(errore)
+        if not voci:
+            st.error("Nessun cantiere valido nel file.")
+            return
+        if not selected and any(not voce['lavorazioni'] for voce in voci):
+            st.error("Alcuni cantieri non hanno lavorazioni e nessuna lavorazione è selezionata al passo 3.")
+            return
+        
+        st.write(f"**{len(voci)} cantieri** pronti per **{st.session_state.ditta.get('ragione_sociale', '')}**")
+        
+        if db_available and user_id:
+            from database import verifica_pos_quota
+            can_generate, pos_message, pos_rimanenti = verifica_pos_quota(user_id)
+            if not can_generate or pos_rimanenti < len(voci):
+                st.error(f"🚫 Servono {len(voci)} POS, ne restano {pos_rimanenti if can_generate else 0}.")
+                return
+        
+        if not st.button(f"📦 GENERA {len(voci)} POS (ZIP)", use_container_width=True, key="batch_genera"):
+            return
+        
+        barra = st.progress(0.0, text="Generazione in corso...")
+        try:
+            zip_file, esiti = genera_zip_batch(
+                st.session_state.ditta,
+                st.session_state.addetti,
+                voci,
+                st.session_state.lavoratori,
+                st.session_state.attrezzature,
+                st.session_state.sostanze,
+                lavorazioni_default=selected,
+                lavorazioni_personalizzate=st.session_state.lavorazioni_personalizzate,
+                on_progress=lambda fatti, totale: barra.progress(fatti / totale, text=f"POS {fatti}/{totale}"),
+            )
+            registra_download(zip_file)
+        except Exception as e:
+            st.error(f"Errore: {str(e)}")
+            return
+        
+        generati = [e for e in esiti if e['ok']]
+        for e in esiti:
+            if not e['ok']:
+                st.warning(f"{e['nome_file']}: {e['errore']}")
+        if not generati:
+            st.error("Nessun POS generato.")
+            return
+        
+        # Un solo decremento atomico per tutti i POS generati
+        pos_rimanenti_dopo = None
+        if db_available and user_id:
+            from database import consume_pos_quota, save_pos_generati_batch
+            quota_ok, quota_msg, pos_rimanenti_dopo = consume_pos_quota(user_id, len(generati))
+            if not quota_ok:
+                st.error(f"🚫 {quota_msg}")
+                return
+            save_pos_generati_batch(
+                user_id,
+                st.session_state.ditta.get('_impresa_id', None),
+                [(e['cantiere'], e['lavorazioni'], e['nome_file']) for e in generati]
+            )
+        
+        st.success(f"✅ Generati {len(generati)} POS su {len(esiti)}")
+        offri_download(
+            "📥 SCARICA ZIP",
+            zip_file,
+            f"POS_SERIE_{date.today().strftime('%Y%m%d')}.zip",
+            "application/zip"
+        )
+        if pos_rimanenti_dopo is not None:
+            st.info(f"📊 Ti rimangono ancora **{pos_rimanenti_dopo} POS** disponibili.")
 
 
 # ==============================================================================
@@ -3918,6 +2442,7 @@ def render_step5():
 # ==============================================================================
 def main():
     init_session()
+    chiudi_download()
     render_header()
     render_sidebar()
     
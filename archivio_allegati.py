@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""
+POS FACILE - Archivio allegati
+Archivio locale degli allegati PDF indirizzato per contenuto (SHA-256):
+DURC, visura e attestati caricati per un'impresa vengono conservati una sola
+volta su disco e collegati all'impresa, cosi i POS successivi li riusano
+senza ricaricarli.
+
+    <ARCHIVIO_DIR>/blob/ab/abcdef....pdf   contenuto, nome = sha256
+    <ARCHIVIO_DIR>/indice.json             blob (dimensione, pagine, ultimo uso)
+                                           + collegamenti impresa -> allegati
+
+- Dimensione totale limitata (ARCHIVIO_MAX_MB): oltre il limite si eliminano i
+  blob usati meno di recente, con i collegamenti che li puntano.
+- Scadenza per impresa legata a durc_scadenza: scaduto il DURC l'intero set
+  dell'impresa viene scollegato (visura e attestati vanno comunque aggiornati).
+  Senza data si usa la validita del DURC (120 giorni dal caricamento).
+- L'ultimo uso di un blob (per l'eliminazione LRU) viene aggiornato solo da
+  tocca_allegati, dopo un'unione riuscita: mostrare o aprire gli allegati
+  archiviati non scrive su disco.
+- Gli esiti di verifica (pagine, validita) restano in una cache LRU in memoria
+  per sha, condivisa tra le sessioni. Nessun file o reader pypdf e condiviso:
+  ogni unione apre il blob per conto suo e lo chiude a fine scrittura.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from allegati import ORDINE_ALLEGATI, verifica_allegato
+from pdf_layout import CacheLRU
+
+
+# ==============================================================================
+# CONFIG
+# ==============================================================================
+
+ARCHIVIO_DIR = os.environ.get(
+    'POS_ALLEGATI_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.allegati_archivio')
+)
+ARCHIVIO_MAX_MB = int(os.environ.get('POS_ALLEGATI_MAX_MB', '500'))  # Spazio massimo su disco
+DURC_VALIDITA_GIORNI = 120      # Validita DURC se la scadenza non e indicata
+ESITI_CACHE_MAX = 256           # Esiti di verifica (solo dati) tenuti in memoria
+BLOCCO_LETTURA = 1024 * 1024    # Lettura a blocchi per hash e copia
+
+NOMI_ALLEGATI = dict(ORDINE_ALLEGATI)
+
+_lock = threading.RLock()
+_esiti = CacheLRU(ESITI_CACHE_MAX)  # sha -> esito di verifica_allegato sul blob
+
+
+# ==============================================================================
+# INDICE
+# ==============================================================================
+
+def _percorso_indice() -> str:
+    return os.path.join(ARCHIVIO_DIR, 'indice.json')
+
+
+def _percorso_blob(sha: str) -> str:
+    return os.path.join(ARCHIVIO_DIR, 'blob', sha[:2], f"{sha}.pdf")
+
+
+def _leggi_indice() -> dict:
+    try:
+        with open(_percorso_indice(), encoding='utf-8') as f:
+            indice = json.load(f)
+    except FileNotFoundError:
+        indice = {}
+    except (OSError, ValueError) as e:
+        print(f"Errore lettura indice archivio allegati: {e}")
+        indice = {}
+    indice.setdefault('blob', {})
+    indice.setdefault('imprese', {})
+    return indice
+
+
+def _scrivi_indice(indice: dict):
+    """Scrittura atomica: file temporaneo + rename."""
+    os.makedirs(ARCHIVIO_DIR, exist_ok=True)
+    temporaneo = f"{_percorso_indice()}.{os.getpid()}.tmp"
+    with open(temporaneo, 'w', encoding='utf-8') as f:
+        json.dump(indice, f, ensure_ascii=False)
+    os.replace(temporaneo, _percorso_indice())
+
+
+def _data_scadenza(durc_scadenza, caricato_il: date) -> str:
+    """durc_scadenza (date, 'AAAA-MM-GG' o 'GG/MM/AAAA') in ISO; default 120 giorni."""
+    if isinstance(durc_scadenza, date):
+        return durc_scadenza.isoformat()
+    for formato in ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y'):
+        try:
+            return datetime.strptime(str(durc_scadenza or '').strip(), formato).date().isoformat()
+        except ValueError:
+            continue
+    return (caricato_il + timedelta(days=DURC_VALIDITA_GIORNI)).isoformat()
+
+
+def _elimina_blob(indice: dict, sha: str):
+    indice['blob'].pop(sha, None)
+    for impresa in indice['imprese'].values():
+        for chiave in [k for k, v in impresa['allegati'].items() if v['sha'] == sha]:
+            del impresa['allegati'][chiave]
+    try:
+        os.remove(_percorso_blob(sha))
+    except FileNotFoundError:
+        pass
+
+
+def _pulisci(indice: dict):
+    """Scollega le imprese scadute, elimina i blob orfani e rientra nel limite di spazio."""
+    oggi = date.today().isoformat()
+    for impresa_id in [i for i, v in indice['imprese'].items() if v['scadenza'] < oggi]:
+        del indice['imprese'][impresa_id]
+
+    collegati = {v['sha'] for impresa in indice['imprese'].values() for v in impresa['allegati'].values()}
+    for sha in [s for s in indice['blob'] if s not in collegati]:
+        _elimina_blob(indice, sha)
+
+    limite = ARCHIVIO_MAX_MB * 1024 * 1024
+    totale = sum(b['dimensione'] for b in indice['blob'].values())
+    for sha in sorted(indice['blob'], key=lambda s: indice['blob'][s]['ultimo_uso']):
+        if totale <= limite:
+            break
+        totale -= indice['blob'][sha]['dimensione']
+        _elimina_blob(indice, sha)
+
+    for impresa_id in [i for i, v in indice['imprese'].items() if not v['allegati']]:
+        del indice['imprese'][impresa_id]
+
+
+# ==============================================================================
+# API
+# ==============================================================================
+
+def _hash_file(file_obj) -> str:
+    h = hashlib.sha256()
+    file_obj.seek(0)
+    for blocco in iter(lambda: file_obj.read(BLOCCO_LETTURA), b''):
+        h.update(blocco)
+    file_obj.seek(0)
+    return h.hexdigest()
+
+
+def archivia_allegati(impresa_id: str, allegati_dict: dict, verifiche: dict, durc_scadenza=None) -> int:
+    """
+    Archivia gli allegati validi (esito ok in verifiche) e li collega all'impresa,
+    sostituendo l'eventuale allegato precedente dello stesso tipo.
+    Un file gia presente nell'archivio (stesso sha) non viene riscritto.
+    Restituisce il numero di allegati collegati.
+    """
+    if not impresa_id:
+        return 0
+    validi = {k: f for k, f in allegati_dict.items()
+              if f is not None and verifiche.get(k, {}).get('ok')}
+    if not validi:
+        return 0
+
+    try:
+        # Hash e copia fuori dal lock: solo l'aggiornamento dell'indice e serializzato
+        archiviati = {}
+        for chiave, file_obj in validi.items():
+            sha = _hash_file(file_obj)
+            percorso = _percorso_blob(sha)
+            if not os.path.exists(percorso):
+                os.makedirs(os.path.dirname(percorso), exist_ok=True)
+                temporaneo = f"{percorso}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(temporaneo, 'wb') as out:
+                    for blocco in iter(lambda: file_obj.read(BLOCCO_LETTURA), b''):
+                        out.write(blocco)
+                os.replace(temporaneo, percorso)
+                file_obj.seek(0)
+            archiviati[chiave] = (sha, os.path.getsize(percorso), getattr(file_obj, 'name', chiave))
+
+        with _lock:
+            indice = _leggi_indice()
+            oggi = date.today()
+            impresa = indice['imprese'].setdefault(str(impresa_id), {'allegati': {}})
+            impresa['scadenza'] = _data_scadenza(durc_scadenza, oggi)
+            for chiave, (sha, dimensione, nome) in archiviati.items():
+                indice['blob'][sha] = {
+                    'dimensione': dimensione,
+                    'pagine': verifiche[chiave]['pagine'],
+                    'ultimo_uso': time.time(),
+                }
+                impresa['allegati'][chiave] = {'sha': sha, 'nome': nome, 'caricato_il': oggi.isoformat()}
+            _pulisci(indice)
+            _scrivi_indice(indice)
+        return len(archiviati)
+    except OSError as e:
+        print(f"Errore archiviazione allegati: {e}")
+        return 0
+
+
+def allegati_archiviati(impresa_id: str) -> dict:
+    """
+    Allegati collegati all'impresa e ancora validi.
+    Restituisce: dict chiave -> {'sha', 'nome', 'pagine', 'dimensione', 'caricato_il', 'scadenza'}
+    """
+    if not impresa_id:
+        return {}
+    with _lock:
+        indice = _leggi_indice()
+        impresa = indice['imprese'].get(str(impresa_id))
+        if not impresa:
+            return {}
+        if impresa['scadenza'] < date.today().isoformat():
+            _pulisci(indice)
+            _scrivi_indice(indice)
+            return {}
+        risultato = {}
+        for chiave, voce in impresa['allegati'].items():
+            blob = indice['blob'].get(voce['sha'])
+            if blob and os.path.exists(_percorso_blob(voce['sha'])):
+                risultato[chiave] = dict(voce, pagine=blob['pagine'], dimensione=blob['dimensione'],
+                                         scadenza=impresa['scadenza'])
+        return risultato
+
+
+def apri_allegati_archiviati(impresa_id: str, chiavi=None) -> tuple:
+    """
+    Allegati archiviati dell'impresa nel formato di unisci_allegati: percorso del
+    blob ed esito di verifica senza reader (unisci_allegati apre il file per
+    ogni unione). Ogni blob viene verificato una volta, poi l'esito viene dalla cache.
+    Sola lettura: chiamata a ogni render, non aggiorna l'ultimo uso (vedi tocca_allegati).
+    Restituisce: (allegati_dict chiave -> percorso, verifiche chiave -> esito)
+    """
+    allegati_dict, verifiche = {}, {}
+    voci = allegati_archiviati(impresa_id)
+    for chiave, voce in voci.items():
+        if chiavi is not None and chiave not in chiavi:
+            continue
+        sha = voce['sha']
+        percorso = _percorso_blob(sha)
+        esito = _esiti.get(sha)
+        if esito is None:
+            esito = verifica_allegato(percorso)
+            if esito['errore']:
+                print(f"Allegato archiviato {sha} non utilizzabile: {esito['errore']}")
+            _esiti.put(sha, esito)
+        if not esito['ok']:
+            continue
+        allegati_dict[chiave] = percorso
+        verifiche[chiave] = dict(esito)
+    return allegati_dict, verifiche
+
+
+def tocca_allegati(impresa_id: str, sha_usati) -> bool:
+    """
+    Segna come appena usati i blob dell'impresa finiti in un POS (da chiamare
+    dopo un'unione riuscita): sono gli ultimi a essere eliminati oltre ARCHIVIO_MAX_MB.
+    """
+    sha_usati = set(sha_usati or ())
+    if not impresa_id or not sha_usati:
+        return False
+    try:
+        with _lock:
+            indice = _leggi_indice()
+            impresa = indice['imprese'].get(str(impresa_id))
+            if not impresa:
+                return False
+            collegati = {v['sha'] for v in impresa['allegati'].values()} & sha_usati
+            adesso = time.time()
+            for sha in collegati:
+                if sha in indice['blob']:
+                    indice['blob'][sha]['ultimo_uso'] = adesso
+            _scrivi_indice(indice)
+            return True
+    except OSError as e:
+        print(f"Errore aggiornamento indice archivio allegati: {e}")
+        return False
+
+
+def scollega_allegato(impresa_id: str, chiave: str) -> bool:
+    """Rimuove un allegato dall'impresa (il blob resta finche e usato altrove)."""
+    try:
+        with _lock:
+            indice = _leggi_indice()
+            impresa = indice['imprese'].get(str(impresa_id))
+            if not impresa or impresa['allegati'].pop(chiave, None) is None:
+                return False
+            _pulisci(indice)
+            _scrivi_indice(indice)
+            return True
+    except OSError as e:
+        print(f"Errore rimozione allegato archiviato: {e}")
+        return False
+
+
+def get_archivio_stats() -> dict:
+    """Statistiche archivio: blob, imprese, spazio occupato, cache esiti."""
+    with _lock:
+        indice = _leggi_indice()
+    return {
+        'blob': len(indice['blob']),
+        'imprese': len(indice['imprese']),
+        'mb': round(sum(b['dimensione'] for b in indice['blob'].values()) / (1024 * 1024), 2),
+        'max_mb': ARCHIVIO_MAX_MB,
+        'esiti': _esiti.stats(),
+    }
@@ -11,11 +11,7 @@ Python li legge, chiama verify_otp(), e ottiene la sessione.
 import streamlit as st
 import time
 
-try:
-    from supabase import create_client, Client
-    SUPABASE_AVAILABLE = True
-except ImportError:
-    SUPABASE_AVAILABLE = False
+from connection_pool import supabase_client, sessione_da_risposta, get_http_session
 
 
 # ==============================================================================
@@ -23,12 +19,8 @@ except ImportError:
 # ==============================================================================
 
 def get_supabase_client():
-    if not SUPABASE_AVAILABLE:
-        return None
-    try:
-        return create_client(st.secrets["SUPABASE_URL"], st.secrets["SUPABASE_ANON_KEY"])
-    except Exception:
-        return None
+    """Client Supabase in prestito dal pool condiviso: usare con `with ... as client`."""
+    return supabase_client()
 
 def get_app_url():
     try:
@@ -50,6 +42,7 @@ def init_auth_state():
         'auth_message': None,
         '_rcv_access': None,
         '_rcv_refresh': None,
+        '_sb_sessione': None,
     }
     for k, v in defaults.items():
         if k not in st.session_state:
@@ -88,59 +81,62 @@ def _tr(msg):
 # ==============================================================================
 
 def login_user(email, password):
-    client = get_supabase_client()
-    if not client: return False, "Servizio non disponibile."
-    try:
-        res = client.auth.sign_in_with_password({"email": email, "password": password})
-        if res.user and res.session:
-            st.session_state.authenticated = True
-            st.session_state.user = res.user
-            return True, "Login effettuato!"
-        return False, "Email o password non corretti."
-    except Exception as e:
-        return False, _tr(str(e))
+    with get_supabase_client() as client:
+        if not client: return False, "Servizio non disponibile."
+        try:
+            res = client.auth.sign_in_with_password({"email": email, "password": password})
+            if res.user and res.session:
+                st.session_state.authenticated = True
+                st.session_state.user = res.user
+                # Sessione per le query RLS fatte da database.py sui client del pool
+                # (con refresh token: il pool rinnova il JWT prima della scadenza)
+                st.session_state._sb_sessione = sessione_da_risposta(res.session)
+                return True, "Login effettuato!"
+            return False, "Email o password non corretti."
+        except Exception as e:
+            return False, _tr(str(e))
 
 def register_user(email, password):
-    client = get_supabase_client()
-    if not client: return False, "Servizio non disponibile."
-    try:
-        base_url = get_app_url()
-        res = client.auth.sign_up({
-            "email": email,
-            "password": password,
-            "options": {"email_redirect_to": f"{base_url}/?nav=login"}
-        })
-        if res.user:
-            return True, "Registrazione completata! Controlla la tua email."
-        return False, "Errore durante la registrazione."
-    except Exception as e:
-        return False, _tr(str(e))
+    with get_supabase_client() as client:
+        if not client: return False, "Servizio non disponibile."
+        try:
+            base_url = get_app_url()
+            res = client.auth.sign_up({
+                "email": email,
+                "password": password,
+                "options": {"email_redirect_to": f"{base_url}/?nav=login"}
+            })
+            if res.user:
+                return True, "Registrazione completata! Controlla la tua email."
+            return False, "Errore durante la registrazione."
+        except Exception as e:
+            return False, _tr(str(e))
 
 def reset_password(email):
-    client = get_supabase_client()
-    if not client: return False, "Servizio non disponibile."
-    try:
-        client.auth.reset_password_email(email)
-        return True, "Email inviata! Controlla la posta e clicca il link."
-    except Exception as e:
-        return False, _tr(str(e))
+    with get_supabase_client() as client:
+        if not client: return False, "Servizio non disponibile."
+        try:
+            client.auth.reset_password_email(email)
+            return True, "Email inviata! Controlla la posta e clicca il link."
+        except Exception as e:
+            return False, _tr(str(e))
 
 
 def verify_recovery_token(token_hash):
     """Verifica token_hash da URL, ritorna (True, session) o (False, errore)."""
-    client = get_supabase_client()
-    if not client:
-        return False, "Servizio non disponibile."
-    try:
-        res = client.auth.verify_otp({
-            "token_hash": token_hash,
-            "type": "recovery"
-        })
-        if res and res.session:
-            return True, res.session
-        return False, "Link non valido o scaduto."
-    except Exception as e:
-        return False, _tr(str(e))
+    with get_supabase_client() as client:
+        if not client:
+            return False, "Servizio non disponibile."
+        try:
+            res = client.auth.verify_otp({
+                "token_hash": token_hash,
+                "type": "recovery"
+            })
+            if res and res.session:
+                return True, res.session
+            return False, "Link non valido o scaduto."
+        except Exception as e:
+            return False, _tr(str(e))
 
 
 def update_user_password(new_password):
@@ -150,34 +146,33 @@ def update_user_password(new_password):
     if not access_token:
         return False, "Sessione di recupero scaduta. Richiedi un nuovo link."
 
-    client = get_supabase_client()
-    if not client:
-        return False, "Servizio non disponibile."
+    with get_supabase_client() as client:
+        if not client:
+            return False, "Servizio non disponibile."
 
-    # TENTATIVO 1: set_session + update_user
-    try:
-        if refresh_token:
-            client.auth.set_session(access_token, refresh_token)
-        client.auth.update_user({"password": new_password})
-        _clear_recovery()
-        return True, "Password aggiornata!"
-    except Exception:
-        pass
-
-    # TENTATIVO 2: Header forzato
-    try:
-        client.options.headers["Authorization"] = f"Bearer {access_token}"
-        client.postgrest.auth(access_token)
-        client.auth.update_user({"password": new_password})
-        _clear_recovery()
-        return True, "Password aggiornata!"
-    except Exception:
-        pass
+        # TENTATIVO 1: set_session + update_user
+        try:
+            if refresh_token:
+                client.auth.set_session(access_token, refresh_token)
+            client.auth.update_user({"password": new_password})
+            _clear_recovery()
+            return True, "Password aggiornata!"
+        except Exception:
+            pass
+
+        # TENTATIVO 2: Header forzato (il client non torna nel pool)
+        try:
+            client.options.headers["Authorization"] = f"Bearer {access_token}"
+            client.postgrest.auth(access_token)
+            client.auth.update_user({"password": new_password})
+            _clear_recovery()
+            return True, "Password aggiornata!"
+        except Exception:
+            pass
 
     # TENTATIVO 3: REST API diretta
     try:
-        import requests as req
-        resp = req.put(
+        resp = get_http_session().put(
             f"{st.secrets['SUPABASE_URL']}/auth/v1/user",
             headers={
                 "Authorization": f"Bearer {access_token}",
@@ -202,11 +197,11 @@ def _clear_recovery():
 
 
 def logout_user():
-    client = get_supabase_client()
-    if client:
-        try: client.auth.sign_out()
-        except: pass
-    for k in ['authenticated', 'user', '_rcv_access', '_rcv_refresh',
+    with get_supabase_client() as client:
+        if client:
+            try: client.auth.sign_out()
+            except: pass
+    for k in ['authenticated', 'user', '_rcv_access', '_rcv_refresh', '_sb_sessione',
               'ditta', 'cantiere', 'lavoratori', 'attrezzature', 'sostanze', 'step']:
         if k in st.session_state:
             del st.session_state[k]
@@ -258,19 +253,19 @@ def handle_auth_callback():
     # --- PKCE code (conferma email) ---
     code = params.get("code")
     if code:
-        client = get_supabase_client()
         st.session_state.show_auth = True
         st.session_state.auth_mode = 'login'
-        if client:
-            try:
-                res = client.auth.exchange_code_for_session({"auth_code": str(code)})
-                if res and res.user:
-                    st.session_state.auth_message = ("success", "Email confermata! Ora puoi accedere.")
-                else:
-                    st.session_state.auth_message = ("error", "Link non valido o scaduto.")
-            except Exception:
-                st.session_state.auth_message = ("warning",
-                    "Link gia utilizzato. Se hai confermato, prova ad accedere.")
+        with get_supabase_client() as client:
+            if client:
+                try:
+                    res = client.auth.exchange_code_for_session({"auth_code": str(code)})
+                    if res and res.user:
+                        st.session_state.auth_message = ("success", "Email confermata! Ora puoi accedere.")
+                    else:
+                        st.session_state.auth_message = ("error", "Link non valido o scaduto.")
+                except Exception:
+                    st.session_state.auth_message = ("warning",
+                        "Link gia utilizzato. Se hai confermato, prova ad accedere.")
         _safe_clear()
         return True
 
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+POS FACILE - Generazione POS in serie
+Una ditta, molti cantieri: l'elenco dei cantieri arriva da un file CSV o JSON,
+i PDF vengono generati con genera_pdf_pos in un pool di processi e scritti
+in un archivio ZIP man mano che sono pronti.
+
+La quota POS non viene toccata qui: chi chiama scala in un'unica operazione
+atomica (database.consume_pos_quota con quantita) i POS effettivamente generati.
+"""
+
+import csv
+import io
+import json
+import multiprocessing
+import os
+import re
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+
+
+# ==============================================================================
+# CONFIG
+# ==============================================================================
+
+BATCH_MAX_CANTIERI = 100       # Cantieri accettati in un singolo file
+BATCH_MAX_WORKERS = 4          # Processi di generazione in parallelo
+BATCH_MIN_POOL = 3             # Sotto questa soglia si genera nel processo corrente
+ZIP_BUFFER = 256 * 1024       # Buffer di scrittura dello ZIP su disco
+
+# Campi cantiere riconosciuti nei file (stessi nomi di st.session_state.cantiere)
+CAMPI_CANTIERE = [
+    'indirizzo', 'committente', 'durata', 'data_inizio', 'descrizione',
+    'orario_lavoro', 'giorni_lavoro', 'cse', 'csp', 'ospedale_vicino',
+]
+
+
+# ==============================================================================
+# LETTURA ELENCO CANTIERI
+# ==============================================================================
+
+def _lista_lavorazioni(valore) -> list:
+    """Lavorazioni da lista JSON o da stringa separata da | ; , o spazi."""
+    if isinstance(valore, (list, tuple)):
+        return [str(v).strip() for v in valore if str(v).strip()]
+    if not valore:
+        return []
+    return [v for v in re.split(r'[|;,\s]+', str(valore)) if v]
+
+
+def _voce_da_record(record: dict) -> dict:
+    """Normalizza un record (piatto o {'cantiere': {...}, 'lavorazioni': [...]})."""
+    dati = record.get('cantiere') if isinstance(record.get('cantiere'), dict) else record
+    cantiere = {campo: str(dati.get(campo, '') or '').strip() for campo in CAMPI_CANTIERE}
+    return {
+        'cantiere': cantiere,
+        'lavorazioni': _lista_lavorazioni(record.get('lavorazioni', dati.get('lavorazioni'))),
+    }
+
+
+def leggi_cantieri(contenuto: bytes, nome_file: str = '') -> tuple:
+    """
+    Legge l'elenco cantieri da CSV o JSON.
+    JSON: lista di record, oppure {"cantieri": [...]}.
+    CSV: intestazione con i campi di CAMPI_CANTIERE piu "lavorazioni".
+    Restituisce: (voci: list, errori: list)
+    """
+    errori = []
+    try:
+        testo = contenuto.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        testo = contenuto.decode('latin-1')
+
+    records = []
+    if nome_file.lower().endswith('.json') or testo.lstrip().startswith(('[', '{')):
+        try:
+            dati = json.loads(testo)
+        except json.JSONDecodeError as e:
+            return [], [f"JSON non valido: {e}"]
+        if isinstance(dati, dict):
+            dati = dati.get('cantieri', [])
+        records = [r for r in dati if isinstance(r, dict)] if isinstance(dati, list) else []
+    else:
+        try:
+            dialetto = csv.Sniffer().sniff(testo[:4096], delimiters=';,\t')
+        except csv.Error:
+            dialetto = csv.excel
+        lettore = csv.DictReader(io.StringIO(testo), dialect=dialetto)
+        records = [{(k or '').strip().lower(): v for k, v in riga.items()} for riga in lettore]
+
+    voci = []
+    for n, record in enumerate(records, start=1):
+        voce = _voce_da_record(record)
+        if not voce['cantiere']['indirizzo']:
+            errori.append(f"Riga {n}: indirizzo cantiere mancante, ignorata")
+            continue
+        voci.append(voce)
+
+    if len(voci) > BATCH_MAX_CANTIERI:
+        errori.append(f"Troppi cantieri: vengono considerati solo i primi {BATCH_MAX_CANTIERI}")
+        voci = voci[:BATCH_MAX_CANTIERI]
+    return voci, errori
+
+
+def nome_file_pos(indice: int, cantiere: dict) -> str:
+    """Nome del PDF nello ZIP: POS_<n>_<indirizzo>_<data>.pdf"""
+    slug = re.sub(r'[^A-Za-z0-9]+', '_', cantiere.get('indirizzo', '')).strip('_')[:40] or 'cantiere'
+    return f"POS_{indice + 1:03d}_{slug}_{date.today().strftime('%Y%m%d')}.pdf"
+
+
+# ==============================================================================
+# GENERAZIONE
+# ==============================================================================
+
+def _genera_voce(lavoro: dict) -> bytes:
+    """Eseguita nei processi del pool: genera un singolo POS (import leggero, senza Streamlit)."""
+    from pos_engine import genera_pdf_pos
+    return genera_pdf_pos(
+        lavoro['ditta'], lavoro['cantiere'], lavoro['addetti'], lavoro['lavorazioni'],
+        None, lavoro['lavoratori'], lavoro['attrezzature'], lavoro['sostanze'],
+        lavoro['lavorazioni_personalizzate'],
+    )
+
+
+def genera_pos_batch(ditta, addetti, voci, lavoratori=None, attrezzature=None, sostanze=None,
+                     lavorazioni_default=None, max_workers=None, lavorazioni_personalizzate=None):
+    """
+    Genera un POS per ogni voce (cantiere + lavorazioni) con la stessa ditta.
+    lavorazioni_personalizzate: lavorazioni dell'utente sovrapposte al catalogo
+    (vedi catalogo.sovrapponi_lavorazioni), uguali per tutte le voci.
+    Generatore: restituisce (indice, nome_file, pdf_bytes, errore) man mano che
+    i PDF sono pronti, non nell'ordine delle voci.
+    """
+    lavori = []
+    for voce in voci:
+        lavori.append({
+            'ditta': ditta,
+            'cantiere': voce['cantiere'],
+            'addetti': addetti,
+            'lavorazioni': voce.get('lavorazioni') or list(lavorazioni_default or []),
+            'lavoratori': lavoratori or [],
+            'attrezzature': attrezzature or [],
+            'sostanze': sostanze or [],
+            'lavorazioni_personalizzate': lavorazioni_personalizzate or None,
+        })
+
+    workers = max_workers or min(BATCH_MAX_WORKERS, os.cpu_count() or 1)
+    if len(lavori) < BATCH_MIN_POOL or workers < 2:
+        for i, lavoro in enumerate(lavori):
+            yield _esito(i, lavoro, _genera_voce, lavoro)
+        return
+
+    pendenti = set(range(len(lavori)))
+    try:
+        # spawn: il processo Streamlit ha thread attivi, fork non e sicuro
+        contesto = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=min(workers, len(lavori)), mp_context=contesto) as pool:
+            futures = {pool.submit(_genera_voce, lavoro): i for i, lavoro in enumerate(lavori)}
+            for future in as_completed(futures):
+                i = futures[future]
+                pendenti.discard(i)
+                yield _esito(i, lavori[i], future.result)
+    except Exception as e:
+        # Pool non disponibile (es. ambiente senza processi): si completa in sequenza
+        print(f"Errore pool generazione POS: {e}")
+        for i in sorted(pendenti):
+            yield _esito(i, lavori[i], _genera_voce, lavori[i])
+
+
+def _esito(indice, lavoro, funzione, *args) -> tuple:
+    nome_file = nome_file_pos(indice, lavoro['cantiere'])
+    try:
+        return indice, nome_file, funzione(*args), None
+    except Exception as e:
+        print(f"Errore generazione POS {nome_file}: {e}")
+        return indice, nome_file, None, str(e)
+
+
+def genera_zip_batch(ditta, addetti, voci, lavoratori=None, attrezzature=None, sostanze=None,
+                     lavorazioni_default=None, max_workers=None, on_progress=None,
+                     lavorazioni_personalizzate=None) -> tuple:
+    """
+    Genera tutti i POS e li scrive in uno ZIP man mano che sono pronti,
+    con un riepilogo.csv degli esiti.
+    on_progress(completati, totale) viene chiamata dopo ogni PDF.
+    Restituisce: (file_zip posizionato all'inizio, esiti ordinati per indice)
+    dove esiti e una lista di dict {indice, nome_file, cantiere, lavorazioni, ok, errore}.
+    """
+    # File senza buffer (io.RawIOBase): chi chiama lo passa a st.download_button
+    # con allegati.download_differito e lo chiude
+    destinazione = tempfile.TemporaryFile(mode='w+b', buffering=0)
+    stream = io.BufferedWriter(destinazione, ZIP_BUFFER)
+    esiti = []
+    with zipfile.ZipFile(stream, 'w') as archivio:
+        risultati = genera_pos_batch(ditta, addetti, voci, lavoratori, attrezzature, sostanze,
+                                     lavorazioni_default, max_workers, lavorazioni_personalizzate)
+        for completati, (indice, nome_file, pdf_bytes, errore) in enumerate(risultati, start=1):
+            if pdf_bytes:
+                # I PDF sono gia compressi: ZIP_STORED evita di ricomprimerli
+                archivio.writestr(nome_file, pdf_bytes, compress_type=zipfile.ZIP_STORED)
+            voce = voci[indice]
+            esiti.append({
+                'indice': indice,
+                'nome_file': nome_file,
+                'cantiere': voce['cantiere'],
+                'lavorazioni': voce.get('lavorazioni') or list(lavorazioni_default or []),
+                'ok': bool(pdf_bytes),
+                'errore': errore,
+            })
+            if on_progress:
+                on_progress(completati, len(voci))
+
+        esiti.sort(key=lambda e: e['indice'])
+        riepilogo = io.StringIO()
+        scrittore = csv.writer(riepilogo, delimiter=';')
+        scrittore.writerow(['file', 'indirizzo', 'committente', 'esito'])
+        for e in esiti:
+            scrittore.writerow([e['nome_file'], e['cantiere']['indirizzo'], e['cantiere']['committente'],
+                                'OK' if e['ok'] else f"ERRORE: {e['errore']}"])
+        archivio.writestr('riepilogo.csv', riepilogo.getvalue().encode('utf-8-sig'),
+                          compress_type=zipfile.ZIP_DEFLATED)
+
+    stream.flush()
+    stream.detach()
+    destinazione.seek(0)
+    return destinazione, esiti
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+POS FACILE - Catalogo lavorazioni
+Dizionario delle lavorazioni e testi legali stanno in un file dati versionato
+(catalogo_lavorazioni.json) invece che in letterali Python: si aggiornano senza
+toccare il codice e vengono letti una sola volta per processo, al primo accesso
+(get_catalogo).
+
+La versione del catalogo e l'impronta del contenuto (SHA-256 del JSON canonico
+delle lavorazioni): e la chiave usata dalla cache delle schede PDF e dalla
+cache delle risposte AI, che si invalidano da sole quando il catalogo cambia.
+
+Le lavorazioni personalizzate di un utente si sovrappongono al catalogo base
+con sovrapponi_lavorazioni: chiave esistente = voce sostituita, chiave nuova =
+voce aggiunta. Il catalogo base non viene mai modificato.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+from pdf_layout import CacheLRU
+
+
+# ==============================================================================
+# CONFIG
+# ==============================================================================
+
+CATALOGO_PATH = os.environ.get(
+    'POS_CATALOGO',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'catalogo_lavorazioni.json')
+)
+FORMATO_CATALOGO = 1            # Formato del file supportato da questo codice
+SOVRAPPOSIZIONI_MAX = 32        # Cataloghi personalizzati tenuti in memoria
+
+# Campi di una lavorazione con il loro valore di default (le voci personalizzate
+# possono indicare solo il nome)
+CAMPI_LAVORAZIONE = {
+    'nome': '',
+    'descrizione_tecnica': '',
+    'rischi': [],
+    'dpi_obbligatori': [],
+    'misure_prevenzione': [],
+    'attrezzature': [],
+    'parole_chiave': [],        # radici per il classificatore offline (solo voci personalizzate)
+}
+
+_catalogo = None
+_lock = threading.Lock()
+_sovrapposizioni = CacheLRU(SOVRAPPOSIZIONI_MAX)  # impronta personalizzate -> (dizionario, versione)
+
+
+# ==============================================================================
+# CATALOGO BASE
+# ==============================================================================
+
+def impronta_lavorazioni(lavorazioni: dict) -> str:
+    """Impronta (16 caratteri) del contenuto di un dizionario lavorazioni."""
+    return hashlib.sha256(
+        json.dumps(lavorazioni, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    ).hexdigest()[:16]
+
+
+def _leggi_catalogo(percorso: str) -> dict:
+    with open(percorso, encoding='utf-8') as f:
+        dati = json.load(f)
+    formato = dati.get('formato', 1)
+    if formato > FORMATO_CATALOGO:
+        raise ValueError(f"formato {formato} non supportato (massimo {FORMATO_CATALOGO})")
+    lavorazioni = dati['lavorazioni']
+    return {
+        'formato': formato,
+        'lavorazioni': lavorazioni,
+        'testi_legali': dati['testi_legali'],
+        'versione': impronta_lavorazioni(lavorazioni),
+    }
+
+
+def get_catalogo() -> dict:
+    """
+    Catalogo base, letto al primo accesso e poi condiviso dal processo.
+    Restituisce: {'formato', 'lavorazioni', 'testi_legali', 'versione'}
+    Senza catalogo il POS non si puo generare: gli errori di lettura vengono
+    stampati e rilanciati.
+    """
+    global _catalogo
+    if _catalogo is None:
+        with _lock:
+            if _catalogo is None:
+                try:
+                    _catalogo = _leggi_catalogo(CATALOGO_PATH)
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"Errore lettura catalogo lavorazioni {CATALOGO_PATH}: {e}")
+                    raise
+    return _catalogo
+
+
+# ==============================================================================
+# LAVORAZIONI PERSONALIZZATE
+# ==============================================================================
+
+def _voce_personalizzata(chiave: str, voce) -> dict:
+    """Voce personalizzata completata con i campi di default; None se non valida."""
+    if not isinstance(voce, dict) or not str(voce.get('nome') or '').strip():
+        print(f"Lavorazione personalizzata '{chiave}' ignorata: manca il nome")
+        return None
+    completa = {campo: type(default)() for campo, default in CAMPI_LAVORAZIONE.items()}
+    completa.update(voce)
+    for campo, default in CAMPI_LAVORAZIONE.items():
+        if not isinstance(completa[campo], type(default)):
+            print(f"Lavorazione personalizzata '{chiave}' ignorata: campo {campo} non valido")
+            return None
+    return completa
+
+
+def sovrapponi_lavorazioni(personalizzate: dict = None) -> tuple:
+    """
+    Catalogo base + lavorazioni personalizzate (chiave -> voce come nel catalogo).
+    Il risultato resta in cache per impronta, cosi lo stesso utente riusa lo
+    stesso dizionario (e le stesse schede PDF in cache) tra un POS e l'altro.
+    Restituisce: (dizionario lavorazioni, versione)
+    """
+    catalogo = get_catalogo()
+    if not personalizzate:
+        return catalogo['lavorazioni'], catalogo['versione']
+    impronta = impronta_lavorazioni(personalizzate)
+    risultato = _sovrapposizioni.get(impronta)
+    if risultato is None:
+        dizionario = dict(catalogo['lavorazioni'])
+        for chiave, voce in personalizzate.items():
+            completa = _voce_personalizzata(chiave, voce)
+            if completa is not None:
+                dizionario[chiave] = completa
+        risultato = (dizionario, impronta_lavorazioni(dizionario))
+        _sovrapposizioni.put(impronta, risultato)
+    return risultato
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+POS FACILE - Classificatore lavorazioni offline
+Mappa la descrizione del cantiere sulle chiavi del dizionario lavorazioni con
+regole a parole chiave: radici di parola pesate, nessuna chiamata di rete.
+Risponde in pochi millisecondi e funziona anche senza chiave OpenAI; l'AI
+serve solo per affinare il risultato o quando la confidenza e bassa.
+
+Le regole vengono compilate al primo uso, una volta per versione del catalogo:
+le lavorazioni personalizzate di un utente partecipano con le radici del loro
+campo parole_chiave.
+"""
+
+import re
+import unicodedata
+
+from catalogo import SOVRAPPOSIZIONI_MAX, sovrapponi_lavorazioni
+from pdf_layout import CacheLRU
+
+
+# ==============================================================================
+# CONFIG
+# ==============================================================================
+
+SOGLIA_LAVORAZIONE = 1.0   # Punteggio minimo per selezionare una lavorazione
+SOGLIA_SICURA = 2.0        # Punteggio da cui una lavorazione si considera certa
+CONFIDENZA_MINIMA = 0.6    # Sotto questa confidenza conviene chiedere all'AI
+
+# Regole: lavorazione -> [(radice, peso)]. Una radice riconosce ogni parola che
+# inizia cosi ("demol" -> demolizione, demolire, demolito); con lo spazio finale
+# deve coincidere con la parola intera. Le radici di due parole ("impianto
+# elettrico") valgono solo se compaiono vicine nella descrizione.
+REGOLE_LAVORAZIONI = {
+    'impianti_elettrici': [
+        ('elettric', 2.0), ('impianto elettric', 1.0), ('quadro elettric', 1.0), ('cablagg', 2.0),
+        ('cavi ', 1.0), ('cavo ', 1.0), ('prese ', 1.0), ('interruttor', 1.5), ('illuminazion', 1.5),
+        ('punti luce', 2.0), ('corrugat', 1.0), ('domotic', 1.5), ('fotovoltaic', 2.0), ('salvavit', 1.5),
+    ],
+    'impianti_idraulici': [
+        ('idraulic', 2.0), ('idrico', 2.0), ('idrosanitar', 2.0), ('sanitari', 1.5), ('scaric', 1.0),
+        ('tubazion', 1.0), ('adduzion', 1.5), ('caldaia', 1.5), ('termosifon', 1.5), ('radiator', 1.5),
+        ('riscaldament', 1.0), ('lavabo', 1.5), ('doccia', 1.0), ('vasca', 1.0), ('wc ', 1.0),
+        ('rubinett', 1.5), ('bagno', 1.0), ('bagni ', 1.0), ('fognar', 1.0),
+    ],
+    'opere_murarie': [
+        ('demol', 1.5), ('tramezz', 2.0), ('muratur', 2.0), ('muri ', 1.0), ('muro ', 1.0),
+        ('parete', 1.0), ('pareti ', 1.0), ('mattoni', 1.5), ('laterizi', 1.5), ('forati', 1.0),
+        ('intonac', 1.5), ('massett', 1.0), ('cartongess', 1.5), ('apertura vano', 2.0),
+        ('architrav', 2.0), ('ristrutturazion', 1.0), ('calcinacc', 1.0),
+    ],
+    'tinteggiatura': [
+        ('tinteggi', 2.5), ('pittur', 2.0), ('vernic', 2.0), ('imbianc', 2.5), ('smalt', 1.5),
+        ('stuccatur', 1.5), ('rasatur', 1.5), ('primer', 1.5), ('idropittur', 2.5), ('decoraz', 1.0),
+    ],
+    'lavori_quota': [
+        ('quota', 2.0), ('ponteggi', 2.5), ('copertur', 2.0), ('tetto', 2.0), ('tetti ', 2.0),
+        ('tegol', 1.5), ('grondai', 2.0), ('lucernar', 1.5), ('facciat', 1.5), ('trabattell', 1.5),
+        ('piattaforma aere', 2.5), ('cestello', 1.5), ('linea vita', 2.0), ('guaina', 1.0),
+        ('impermeabilizzaz', 1.0), ('cornicion', 1.5), ('altezza', 1.0),
+    ],
+    'scavi': [
+        ('scav', 2.5), ('sterr', 2.0), ('movimento terra', 2.5), ('movimenti terra', 2.5),
+        ('escavator', 2.0), ('fondazion', 1.5), ('trincea', 2.0), ('sottoserviz', 1.5),
+        ('allacci', 1.0), ('reinterr', 2.0), ('drenagg', 1.0), ('plinti', 1.5),
+    ],
+    'rimozione_pavimenti': [
+        ('rimozione paviment', 2.5), ('rimozione rivestiment', 2.5), ('rimozione piastrell', 2.5),
+        ('demolizione paviment', 2.5), ('vecchio paviment', 2.0), ('vecchie piastrell', 2.0),
+        ('paviment esistent', 2.0), ('rifacimento paviment', 2.0), ('sostituzione paviment', 2.0),
+        ('sostituzione piastrell', 2.0), ('rifacimento bagn', 1.0), ('rifacimento cucin', 1.0),
+    ],
+    'posa_pavimenti': [
+        ('paviment', 1.5), ('piastrell', 1.5), ('rivestiment', 1.5), ('ceramic', 1.5), ('gres', 2.0),
+        ('parquet', 2.0), ('fugatur', 2.0), ('posa ', 1.0), ('battiscop', 1.5), ('sottofond', 1.0),
+        ('massett', 0.5), ('marmo', 1.0),
+    ],
+}
+
+# Peso delle radici indicate in parole_chiave da una lavorazione personalizzata:
+# una sola radice riconosciuta basta a considerarla certa
+PESO_PERSONALIZZATE = SOGLIA_SICURA
+
+# Parole entro cui due radici di una regola composta si considerano vicine
+DISTANZA_COMPOSTE = 3
+
+_regole = CacheLRU(SOVRAPPOSIZIONI_MAX + 1)  # versione del catalogo -> regole compilate
+
+
+def _normalizza(testo: str) -> list:
+    """Parole minuscole senza accenti e senza parole vuote brevi ('di', 'e', ...)."""
+    testo = unicodedata.normalize('NFKD', testo or '')
+    testo = ''.join(c for c in testo if not unicodedata.combining(c)).lower()
+    return [p for p in re.findall(r'[a-z0-9]+', testo) if len(p) > 2 or p == 'wc']
+
+
+def _compila_regole(dizionario: dict) -> dict:
+    """
+    Regole pre-elaborate (radice, parti, parola intera, peso), solo per le
+    lavorazioni del dizionario: REGOLE_LAVORAZIONI piu le parole_chiave delle voci.
+    """
+    regole = {}
+    for chiave, voce in dizionario.items():
+        voci = list(REGOLE_LAVORAZIONI.get(chiave, []))
+        voci += [(radice, PESO_PERSONALIZZATE) for radice in voce.get('parole_chiave') or []
+                 if isinstance(radice, str) and radice.strip()]
+        compilate = []
+        for radice, peso in voci:
+            intera = radice.endswith(' ')
+            parti = _normalizza(radice)
+            if parti:
+                compilate.append((' '.join(parti), parti, intera, peso))
+        if compilate:
+            regole[chiave] = compilate
+    return regole
+
+
+def _regole_catalogo(personalizzate: dict = None) -> tuple:
+    """(dizionario, regole compilate) del catalogo, compilate una volta per versione."""
+    dizionario, versione = sovrapponi_lavorazioni(personalizzate)
+    regole = _regole.get(versione)
+    if regole is None:
+        regole = _compila_regole(dizionario)
+        _regole.put(versione, regole)
+    return dizionario, regole
+
+
+def _trova(parole: list, parti: list, intera: bool) -> bool:
+    """True se le radici compaiono in ordine a distanza massima DISTANZA_COMPOSTE."""
+    def combacia(parola, radice, ultima):
+        return parola == radice if (intera and ultima) else parola.startswith(radice)
+
+    for i, parola in enumerate(parole):
+        if not combacia(parola, parti[0], len(parti) == 1):
+            continue
+        posizione = i
+        for n, radice in enumerate(parti[1:], start=2):
+            finestra = parole[posizione + 1:posizione + 1 + DISTANZA_COMPOSTE]
+            trovata = next((j for j, p in enumerate(finestra) if combacia(p, radice, n == len(parti))), None)
+            if trovata is None:
+                break
+            posizione += trovata + 1
+        else:
+            return True
+    return False
+
+
+def classifica_descrizione(descrizione: str, personalizzate: dict = None) -> dict:
+    """
+    Classifica una descrizione lavori sulle lavorazioni del dizionario (catalogo
+    base o con le lavorazioni personalizzate, vedi catalogo.sovrapponi_lavorazioni).
+    Restituisce: {
+        'lavorazioni_identificate': [chiavi per punteggio decrescente],
+        'punteggi': {chiave: punteggio},
+        'parole_chiave': {chiave: [radici riconosciute]},
+        'confidenza': 0-1 (quota di lavorazioni certe; 0 se nessuna),
+    }
+    Se nulla viene riconosciuto e la descrizione non e vuota propone altro_generico.
+    """
+    dizionario, regole_catalogo = _regole_catalogo(personalizzate)
+    parole = _normalizza(descrizione)
+    punteggi, parole_chiave = {}, {}
+    for chiave, regole in regole_catalogo.items():
+        totale, trovate = 0.0, []
+        for radice, parti, intera, peso in regole:
+            if _trova(parole, parti, intera):
+                totale += peso
+                trovate.append(radice)
+        if totale:
+            punteggi[chiave] = totale
+            parole_chiave[chiave] = trovate
+
+    identificate = sorted(
+        (k for k, v in punteggi.items() if v >= SOGLIA_LAVORAZIONE),
+        key=lambda k: punteggi[k], reverse=True
+    )
+    confidenza = (sum(1 for k in identificate if punteggi[k] >= SOGLIA_SICURA) / len(identificate)
+                  if identificate else 0.0)
+    if not identificate and parole and 'altro_generico' in dizionario:
+        identificate = ['altro_generico']
+    return {
+        'lavorazioni_identificate': identificate,
+        'punteggi': punteggi,
+        'parole_chiave': parole_chiave,
+        'confidenza': round(confidenza, 2),
+    }
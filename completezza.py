@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+POS FACILE - Valutazione completezza POS
+Controlli a regole sui dati raccolti dal wizard (ditta, cantiere, addetti,
+lavoratori, attrezzature, lavorazioni): campi obbligatori, cifra di controllo
+di P.IVA e codice fiscale, formato e scadenza delle date. Gira in locale in
+pochi microsecondi e restituisce un suggerimento per ogni campo da sistemare;
+la valutazione AI resta un secondo parere facoltativo.
+"""
+
+import re
+from datetime import date, datetime
+
+
+# ==============================================================================
+# VALIDATORI
+# ==============================================================================
+
+_CF_DISPARI = dict(zip(
+    '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ',
+    [1, 0, 5, 7, 9, 13, 15, 17, 19, 21, 1, 0, 5, 7, 9, 13, 15, 17, 19, 21,
+     2, 4, 18, 20, 11, 3, 6, 8, 12, 14, 16, 10, 22, 25, 24, 23]
+))
+_CF_FORMATO = re.compile(
+    r'^[A-Z]{6}[0-9LMNPQRSTUV]{2}[A-EHLMPRST][0-9LMNPQRSTUV]{2}[A-Z][0-9LMNPQRSTUV]{3}[A-Z]$'
+)
+
+
+def partita_iva_valida(piva: str) -> bool:
+    """11 cifre con cifra di controllo corretta (algoritmo di Luhn delle P.IVA italiane)."""
+    piva = re.sub(r'[\s.]', '', piva or '').upper()
+    if piva.startswith('IT'):
+        piva = piva[2:]
+    if not re.fullmatch(r'\d{11}', piva) or piva == '0' * 11:
+        return False
+    somma = 0
+    for i, c in enumerate(piva[:10]):
+        n = int(c)
+        if i % 2:
+            n *= 2
+            if n > 9:
+                n -= 9
+        somma += n
+    return (10 - somma % 10) % 10 == int(piva[10])
+
+
+def codice_fiscale_valido(cf: str) -> bool:
+    """Codice fiscale persona fisica: formato (anche omocodico) e carattere di controllo."""
+    cf = re.sub(r'\s', '', cf or '').upper()
+    if not _CF_FORMATO.match(cf):
+        return False
+    somma = 0
+    for i, c in enumerate(cf[:15]):
+        if i % 2:
+            somma += int(c) if c.isdigit() else ord(c) - ord('A')
+        else:
+            somma += _CF_DISPARI[c]
+    return chr(ord('A') + somma % 26) == cf[15]
+
+
+def leggi_data(testo):
+    """Data da date o da stringa GG/MM/AAAA (anche GG-MM-AAAA, AAAA-MM-GG); None se non valida."""
+    if isinstance(testo, date):
+        return testo
+    testo = str(testo or '').strip()
+    for formato in ('%d/%m/%Y', '%d-%m-%Y', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(testo, formato).date()
+        except ValueError:
+            continue
+    return None
+
+
+def _compilato(valore) -> bool:
+    return bool(str(valore or '').strip()) and str(valore).strip() not in ('N.D.', '__/__/____')
+
+
+# ==============================================================================
+# VALUTAZIONE
+# ==============================================================================
+
+def valuta_completezza(dati_pos: dict, oggi: date = None) -> dict:
+    """
+    Valuta la completezza del POS.
+    dati_pos: {'ditta', 'cantiere', 'addetti', 'lavorazioni', 'lavoratori', 'attrezzature'}
+    Restituisce: {
+        'score': 0-100 (somma pesata dei controlli superati),
+        'elementi_presenti': [etichette dei controlli superati],
+        'suggerimenti': [un messaggio per ogni controllo non superato],
+        'dettaglio': [{'sezione', 'campo', 'peso', 'ok', 'messaggio'}],
+    }
+    """
+    oggi = oggi or date.today()
+    ditta = dati_pos.get('ditta') or {}
+    cantiere = dati_pos.get('cantiere') or {}
+    addetti = dati_pos.get('addetti') or {}
+    lavorazioni = dati_pos.get('lavorazioni') or []
+    lavoratori = dati_pos.get('lavoratori') or []
+    attrezzature = dati_pos.get('attrezzature') or []
+
+    dettaglio = []
+
+    def controlla(sezione, campo, peso, ok, messaggio):
+        dettaglio.append({'sezione': sezione, 'campo': campo, 'peso': peso, 'ok': bool(ok), 'messaggio': messaggio})
+
+    # --- Impresa ---
+    controlla('Impresa', 'Ragione sociale', 10, _compilato(ditta.get('ragione_sociale')),
+              "Inserisci la ragione sociale dell'impresa")
+    piva = str(ditta.get('piva_cf') or '').strip()
+    if not piva:
+        controlla('Impresa', 'P.IVA / C.F.', 10, False, "Inserisci la P.IVA o il codice fiscale dell'impresa")
+    else:
+        compatto = re.sub(r'[\s.]', '', piva).upper()
+        lunghezza_ok = len(compatto) == 16 or re.fullmatch(r'(IT)?\d{11}', compatto)
+        controlla('Impresa', 'P.IVA / C.F.', 10, partita_iva_valida(piva) or codice_fiscale_valido(piva),
+                  f"P.IVA / C.F. '{piva}' non valido: la cifra di controllo non torna" if lunghezza_ok
+                  else f"P.IVA / C.F. '{piva}' non valido: servono 11 cifre (P.IVA) o 16 caratteri (C.F.)")
+    controlla('Impresa', 'Sede', 4, _compilato(ditta.get('indirizzo')), "Inserisci l'indirizzo della sede legale")
+    controlla('Impresa', 'Datore di lavoro', 8, _compilato(ditta.get('datore_lavoro')),
+              "Indica il datore di lavoro")
+    controlla('Impresa', 'RSPP', 6, ditta.get('rspp_autonomo', True) or _compilato(ditta.get('rspp')),
+              "Indica l'RSPP (o che il ruolo e svolto dal datore di lavoro)")
+    controlla('Impresa', 'Medico competente', 5, _compilato(ditta.get('medico')),
+              "Indica il medico competente (obbligatorio con lavoratori soggetti a sorveglianza sanitaria)")
+    rls_tipo = ditta.get('rls_tipo', 'non_eletto')
+    rls_ok = {
+        'interno_eletto': _compilato(ditta.get('rls_nome')),
+        'territoriale': _compilato(ditta.get('rls_territoriale')),
+    }.get(rls_tipo, True)
+    controlla('Impresa', 'RLS', 5, rls_ok, "Indica il nominativo dell'RLS / RLST")
+    ateco = str(ditta.get('codice_ateco') or '').strip()
+    controlla('Impresa', 'Codice ATECO', 2, re.fullmatch(r'\d{2}(\.\d{1,2}){0,3}', ateco),
+              "Inserisci il codice ATECO nel formato 41.20.00" if not ateco
+              else f"Codice ATECO '{ateco}' non nel formato 41.20.00")
+    if _compilato(ditta.get('durc_scadenza')):
+        scadenza_durc = leggi_data(ditta.get('durc_scadenza'))
+        controlla('Impresa', 'DURC', 4, scadenza_durc and scadenza_durc >= oggi,
+                  "Data di scadenza del DURC non valida (usa GG/MM/AAAA)" if not scadenza_durc
+                  else f"DURC scaduto il {scadenza_durc.strftime('%d/%m/%Y')}")
+
+    # --- Cantiere ---
+    controlla('Cantiere', 'Indirizzo', 10, _compilato(cantiere.get('indirizzo')), "Inserisci l'indirizzo del cantiere")
+    controlla('Cantiere', 'Committente', 3, _compilato(cantiere.get('committente')), "Indica il committente")
+    data_inizio = cantiere.get('data_inizio')
+    controlla('Cantiere', 'Data inizio', 5, leggi_data(data_inizio),
+              "Inserisci la data di inizio lavori" if not _compilato(data_inizio)
+              else f"Data di inizio '{data_inizio}' non valida (usa GG/MM/AAAA)")
+    controlla('Cantiere', 'Durata', 6, _compilato(cantiere.get('durata')), "Indica la durata prevista dei lavori")
+    descrizione = str(cantiere.get('descrizione') or '').strip()
+    controlla('Cantiere', 'Descrizione lavori', 8, len(descrizione) >= 20,
+              "Inserisci la descrizione dei lavori" if not descrizione
+              else "Descrizione dei lavori troppo breve: indica fasi e materiali")
+    controlla('Cantiere', 'Pronto soccorso', 2, _compilato(cantiere.get('ospedale_vicino')),
+              "Indica il pronto soccorso piu vicino")
+
+    # --- Emergenze ---
+    controlla('Emergenze', 'Addetto primo soccorso', 6, _compilato(addetti.get('primo_soccorso')),
+              "Nomina l'addetto al primo soccorso")
+    controlla('Emergenze', 'Addetto antincendio', 6, _compilato(addetti.get('antincendio')),
+              "Nomina l'addetto antincendio")
+
+    # --- Lavorazioni ---
+    controlla('Lavorazioni', 'Lavorazioni', 10, len(lavorazioni) > 0, "Seleziona almeno una lavorazione")
+
+    # --- Lavoratori ---
+    nominati = [lav for lav in lavoratori if _compilato(lav.get('nome'))]
+    controlla('Lavoratori', 'Elenco lavoratori', 5, nominati, "Inserisci i lavoratori presenti in cantiere")
+    for lav in nominati:
+        nome = lav['nome'].strip()
+        controlla('Lavoratori', f"{nome}: mansione", 1, _compilato(lav.get('mansione')), f"Indica la mansione di {nome}")
+        controlla('Lavoratori', f"{nome}: formazione", 1, _compilato(lav.get('formazione')),
+                  f"Indica la formazione di {nome} (art. 37)")
+        idoneita = lav.get('idoneita')
+        if _compilato(idoneita):
+            scadenza = leggi_data(idoneita)
+            controlla('Lavoratori', f"{nome}: idoneita", 1, scadenza and scadenza >= oggi,
+                      f"Data idoneita di {nome} non valida (usa GG/MM/AAAA)" if not scadenza
+                      else f"Idoneita sanitaria di {nome} scaduta il {scadenza.strftime('%d/%m/%Y')}")
+        else:
+            controlla('Lavoratori', f"{nome}: idoneita", 1, False, f"Indica la scadenza dell'idoneita sanitaria di {nome}")
+
+    # --- Attrezzature ---
+    for att in attrezzature:
+        if not _compilato(att.get('nome')) or not _compilato(att.get('verifica')):
+            continue
+        verifica = leggi_data(att['verifica'])
+        controlla('Attrezzature', f"{att['nome']}: verifica", 1, verifica and verifica <= oggi,
+                  f"Data ultima verifica di {att['nome']} non valida (usa GG/MM/AAAA)" if not verifica
+                  else f"Data ultima verifica di {att['nome']} nel futuro")
+
+    totale = sum(c['peso'] for c in dettaglio)
+    ottenuto = sum(c['peso'] for c in dettaglio if c['ok'])
+    return {
+        'score': round(100 * ottenuto / totale) if totale else 0,
+        'elementi_presenti': [f"{c['sezione']}: {c['campo']}" for c in dettaglio if c['ok']],
+        'suggerimenti': [c['messaggio'] for c in dettaglio if not c['ok']],
+        'dettaglio': dettaglio,
+    }
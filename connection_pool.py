@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+POS FACILE - Connection Pool
+Client Supabase condivisi tra database.py, auth_manager.py e license_manager.py.
+
+Un unico httpx.Client (keep-alive) viene condiviso da tutti i client Supabase
+del processo, quindi le connessioni TLS vengono riutilizzate tra un rerun
+Streamlit e l'altro. I client Supabase sono tenuti in un pool thread-safe:
+ogni operazione ne prende uno in prestito, eventualmente lo lega al token
+dell'utente, e lo restituisce al termine.
+
+La sessione dell'utente (access token, refresh token, scadenza) resta in
+st.session_state: i client condivisi non rinnovano nulla da soli, quindi il
+pool rinnova il token poco prima della scadenza, prima di legarlo al client.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+import streamlit as st
+
+try:
+    import httpx
+    from supabase import create_client, Client, ClientOptions
+    SUPABASE_AVAILABLE = True
+except ImportError:
+    SUPABASE_AVAILABLE = False
+
+try:
+    import requests
+    REQUESTS_AVAILABLE = True
+except ImportError:
+    REQUESTS_AVAILABLE = False
+
+
+# ==============================================================================
+# CONFIG
+# ==============================================================================
+
+POOL_MAX_IDLE = 8              # Client Supabase inattivi tenuti pronti
+HTTP_MAX_CONNECTIONS = 20      # Connessioni totali verso Supabase
+HTTP_MAX_KEEPALIVE = 10        # Connessioni tenute aperte (keep-alive)
+HTTP_KEEPALIVE_EXPIRY = 60.0   # Secondi prima di chiudere una connessione inattiva
+HTTP_TIMEOUT = 15.0            # Timeout richieste (secondi)
+HTTP_CONNECT_TIMEOUT = 5.0     # Timeout apertura connessione (secondi)
+TOKEN_MARGINE = 60             # Secondi prima della scadenza in cui il JWT viene rinnovato
+
+
+# ==============================================================================
+# POOL SUPABASE
+# ==============================================================================
+
+class SupabasePool:
+    """
+    Pool thread-safe di client Supabase che condividono un solo httpx.Client.
+
+    Uso:
+        with pool.client(access_token) as client:
+            client.table('profiles').select('*').execute()
+
+    Se viene passato un access_token, le query PostgREST partono con il JWT
+    dell'utente (RLS); al rilascio il client torna alla chiave anon.
+    Con sessione (dict access_token/refresh_token/expires_at) il token viene
+    prima rinnovato se sta per scadere, aggiornando il dict.
+    I client la cui sessione Auth e stata modificata (login, verify_otp, ...)
+    non tornano nel pool ma vengono scartati.
+    """
+
+    def __init__(self, url: str, key: str, max_idle: int = POOL_MAX_IDLE):
+        self.url = url
+        self.key = key
+        self.max_idle = max_idle
+        self._anon_header = f"Bearer {key}"
+        self._lock = threading.Lock()
+        self._lock_rinnovo = threading.Lock()
+        self._idle = []
+        self._http = httpx.Client(
+            timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+            follow_redirects=True,
+        )
+        self._stats = {'hits': 0, 'misses': 0, 'discarded': 0, 'in_use': 0, 'refresh': 0}
+
+    def _new_client(self) -> "Client":
+        options = ClientOptions(
+            httpx_client=self._http,
+            # Niente timer di refresh per client condivisi tra utenti diversi
+            auto_refresh_token=False,
+            persist_session=False,
+        )
+        return create_client(self.url, self.key, options)
+
+    def _acquire(self) -> "Client":
+        with self._lock:
+            self._stats['in_use'] += 1
+            if self._idle:
+                self._stats['hits'] += 1
+                return self._idle.pop()
+            self._stats['misses'] += 1
+        try:
+            return self._new_client()
+        except Exception:
+            with self._lock:
+                self._stats['in_use'] -= 1
+            raise
+
+    def _release(self, client: "Client", token_bound: bool):
+        reusable = client.options.headers.get("Authorization") == self._anon_header
+        if reusable and token_bound:
+            try:
+                client.postgrest.auth(self.key)
+            except Exception:
+                reusable = False
+        with self._lock:
+            self._stats['in_use'] -= 1
+            if reusable and len(self._idle) < self.max_idle:
+                self._idle.append(client)
+            else:
+                self._stats['discarded'] += 1
+
+    def _rinnova_token(self, sessione: dict) -> str:
+        """
+        Access token valido della sessione: se scade entro TOKEN_MARGINE secondi
+        lo rinnova con il refresh token (endpoint GoTrue) e aggiorna il dict.
+        Se il rinnovo fallisce restituisce il token attuale.
+        """
+        if sessione.get('expires_at', 0) - time.time() > TOKEN_MARGINE or not sessione.get('refresh_token'):
+            return sessione.get('access_token')
+        with self._lock_rinnovo:
+            # Un'altra richiesta della stessa sessione puo averlo gia rinnovato
+            if sessione.get('expires_at', 0) - time.time() > TOKEN_MARGINE:
+                return sessione['access_token']
+            try:
+                resp = self._http.post(
+                    f"{self.url}/auth/v1/token",
+                    params={'grant_type': 'refresh_token'},
+                    headers={'apikey': self.key, 'Authorization': self._anon_header},
+                    json={'refresh_token': sessione['refresh_token']},
+                )
+                resp.raise_for_status()
+                dati = resp.json()
+            except Exception as e:
+                print(f"Errore rinnovo sessione Supabase: {e}")
+                return sessione.get('access_token')
+            sessione.update(sessione_da_risposta(dati))
+            with self._lock:
+                self._stats['refresh'] += 1
+        return sessione['access_token']
+
+    @contextmanager
+    def client(self, access_token: str = None, sessione: dict = None):
+        """Presta un client Supabase, opzionalmente legato al JWT dell'utente."""
+        if sessione:
+            access_token = self._rinnova_token(sessione)
+        try:
+            client = self._acquire()
+        except Exception as e:
+            print(f"Errore connessione Supabase: {e}")
+            yield None
+            return
+        try:
+            if access_token:
+                client.postgrest.auth(access_token)
+            yield client
+        finally:
+            self._release(client, bool(access_token))
+
+    def stats(self) -> dict:
+        """Restituisce i contatori del pool (hits, misses, discarded, in_use, refresh, idle)."""
+        with self._lock:
+            data = dict(self._stats)
+            data['idle'] = len(self._idle)
+        return data
+
+
+def sessione_da_risposta(session) -> dict:
+    """
+    Dati da tenere in session_state per una sessione Supabase Auth (oggetto
+    Session di supabase-py o JSON dell'endpoint /token).
+    """
+    leggi = session.get if isinstance(session, dict) else lambda nome: getattr(session, nome, None)
+    expires_at = leggi('expires_at') or time.time() + (leggi('expires_in') or 3600)
+    return {
+        'access_token': leggi('access_token'),
+        'refresh_token': leggi('refresh_token'),
+        'expires_at': int(expires_at),
+    }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_supabase_pool() -> SupabasePool:
+    """Restituisce il pool di processo (creato al primo utilizzo) o None se non configurato."""
+    global _pool
+    if not SUPABASE_AVAILABLE:
+        return None
+    if _pool is not None:
+        return _pool
+    try:
+        url = st.secrets.get("SUPABASE_URL", "")
+        key = st.secrets.get("SUPABASE_ANON_KEY", "")
+    except Exception:
+        return None
+    if not url or not key:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = SupabasePool(url, key)
+    return _pool
+
+
+@contextmanager
+def supabase_client(access_token: str = None, sessione: dict = None):
+    """
+    Context manager per ottenere un client Supabase dal pool.
+    sessione: dict della sessione utente (vedi sessione_da_risposta), rinnovato
+    se il token sta per scadere.
+    Restituisce None se Supabase non e disponibile o configurato.
+    """
+    pool = get_supabase_pool()
+    if pool is None:
+        yield None
+        return
+    with pool.client(access_token, sessione) as client:
+        yield client
+
+
+def get_pool_stats() -> dict:
+    """Metriche del pool Supabase (vuote se il pool non e ancora stato creato)."""
+    if _pool is None:
+        return {'hits': 0, 'misses': 0, 'discarded': 0, 'in_use': 0, 'refresh': 0, 'idle': 0}
+    return _pool.stats()
+
+
+# ==============================================================================
+# SESSIONE HTTP (API esterne, es. Lemon Squeezy)
+# ==============================================================================
+
+_http_session = None
+_http_lock = threading.Lock()
+
+
+def get_http_session():
+    """Sessione requests condivisa con keep-alive, per le chiamate alle API esterne."""
+    global _http_session
+    if not REQUESTS_AVAILABLE:
+        return None
+    if _http_session is None:
+        with _http_lock:
+            if _http_session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=4, pool_maxsize=HTTP_MAX_KEEPALIVE
+                )
+                session.mount("https://", adapter)
+                _http_session = session
+    return _http_session
@@ -5,62 +5,115 @@ Gestisce tutte le operazioni con il database
 """
 
 import streamlit as st
+import json
+import threading
+import time
 from datetime import datetime
 
-try:
-    from supabase import create_client, Client
-    SUPABASE_AVAILABLE = True
-except ImportError:
-    SUPABASE_AVAILABLE = False
+from connection_pool import supabase_client
 
 
-def get_supabase_client() -> Client:
-    """Restituisce il client Supabase"""
-    if not SUPABASE_AVAILABLE:
-        return None
-    
+def _sessione_utente() -> dict:
+    """Sessione dell'utente loggato (salvata da auth_manager), usata per le policy RLS"""
     try:
-        url = st.secrets.get("SUPABASE_URL", "")
-        key = st.secrets.get("SUPABASE_ANON_KEY", "")
-        
-        if url and key:
-            return create_client(url, key)
-    except Exception as e:
-        st.error(f"Errore connessione Supabase: {e}")
-    
-    return None
+        return st.session_state.get('_sb_sessione')
+    except Exception:
+        return None
+
+
+def _db_client():
+    """Presta un client Supabase dal pool condiviso, legato al token dell'utente corrente"""
+    return supabase_client(sessione=_sessione_utente())
+
+
+def _funzione_mancante(errore) -> bool:
+    """True se l'RPC e fallita perche la funzione SQL non esiste (PGRST202 / HTTP 404)"""
+    codice = str(getattr(errore, 'code', '') or '')
+    return codice in ('PGRST202', '404') or 'PGRST202' in str(errore)
+
+
+# ============================================================================
+# CACHE PROFILI
+# ============================================================================
+
+PROFILE_CACHE_TTL = 60  # secondi
+
+_profile_cache = {}  # user_id -> (scadenza, profilo)
+_quota_cache = {}    # user_id -> (scadenza, esito di verifica_pos_quota)
+_profile_cache_lock = threading.Lock()
+
+
+def _profile_cache_get(user_id: str) -> dict:
+    with _profile_cache_lock:
+        entry = _profile_cache.get(user_id)
+        if not entry:
+            return None
+        scadenza, profile = entry
+        if time.monotonic() >= scadenza:
+            del _profile_cache[user_id]
+            return None
+        return dict(profile)
+
+
+def _profile_cache_put(user_id: str, profile: dict):
+    with _profile_cache_lock:
+        _profile_cache[user_id] = (time.monotonic() + PROFILE_CACHE_TTL, dict(profile))
+
+
+def invalidate_profile_cache(user_id: str = None):
+    """Invalida il profilo in cache (di un utente, o di tutti se user_id e None)"""
+    with _profile_cache_lock:
+        if user_id is None:
+            _profile_cache.clear()
+            _quota_cache.clear()
+        else:
+            _profile_cache.pop(user_id, None)
+            _quota_cache.pop(user_id, None)
 
 
 # ============================================================================
 # GESTIONE PROFILO UTENTE
 # ============================================================================
 
-def get_user_profile(user_id: str) -> dict:
-    """Recupera il profilo utente"""
-    client = get_supabase_client()
-    if not client:
-        return None
+def get_user_profile(user_id: str, use_cache: bool = True) -> dict:
+    """
+    Recupera il profilo utente.
+    Con use_cache=True un profilo letto da meno di PROFILE_CACHE_TTL secondi
+    viene restituito senza interrogare il database.
+    """
+    if use_cache:
+        cached = _profile_cache_get(user_id)
+        if cached is not None:
+            return cached
     
-    try:
-        response = client.table('profiles').select('*').eq('id', user_id).single().execute()
-        return response.data
-    except Exception as e:
-        print(f"Errore get_user_profile: {e}")
-        return None
+    with _db_client() as client:
+        if not client:
+            return None
+        
+        try:
+            response = client.table('profiles').select('*').eq('id', user_id).single().execute()
+            if response.data:
+                _profile_cache_put(user_id, response.data)
+            return response.data
+        except Exception as e:
+            print(f"Errore get_user_profile: {e}")
+            return None
 
 
 def update_user_profile(user_id: str, data: dict) -> bool:
     """Aggiorna il profilo utente"""
-    client = get_supabase_client()
-    if not client:
-        return False
-    
-    try:
-        client.table('profiles').update(data).eq('id', user_id).execute()
-        return True
-    except Exception as e:
-        print(f"Errore update_user_profile: {e}")
-        return False
+    with _db_client() as client:
+        if not client:
+            return False
+        
+        try:
+            client.table('profiles').update(data).eq('id', user_id).execute()
+            return True
+        except Exception as e:
+            print(f"Errore update_user_profile: {e}")
+            return False
+        finally:
+            invalidate_profile_cache(user_id)
 
 
 def get_pos_limits(piano: str) -> int:
@@ -74,33 +127,29 @@ def get_pos_limits(piano: str) -> int:
     return limits.get(piano, 1)
 
 
-def can_generate_pos(user_id: str) -> tuple:
+def _pos_mese_usati(profile: dict) -> int:
+    """POS del mese corrente: in un nuovo mese il contatore vale 0 (regola di reset_monthly_counter)"""
+    oggi = datetime.now()
+    if profile.get('mese_contatore') != oggi.month or profile.get('anno_contatore') != oggi.year:
+        return 0
+    return profile.get('pos_generati_mese', 0) or 0
+
+
+def can_generate_pos(user_id: str, use_cache: bool = True) -> tuple:
     """
-    Verifica se l'utente può generare un POS.
+    Verifica se l'utente può generare un POS calcolando la quota dal profilo,
+    senza scrivere nulla (il reset mensile resta a consume_pos_quota).
+    Usata solo se la funzione SQL consume_pos_quota non e installata:
+    altrimenti vedi verifica_pos_quota.
     Restituisce: (can_generate: bool, message: str, remaining: int)
     """
-    profile = get_user_profile(user_id)
+    profile = get_user_profile(user_id, use_cache=use_cache)
     if not profile:
         return False, "Profilo non trovato", 0
     
     piano = profile.get('piano', 'free')
     pos_totale = profile.get('pos_generati_totale', 0)
-    pos_mese = profile.get('pos_generati_mese', 0)
-    
-    # Controlla se siamo in un nuovo mese (reset contatore)
-    mese_db = profile.get('mese_contatore', 1)
-    anno_db = profile.get('anno_contatore', 2024)
-    mese_attuale = datetime.now().month
-    anno_attuale = datetime.now().year
-    
-    if mese_db != mese_attuale or anno_db != anno_attuale:
-        # Reset contatore mensile
-        update_user_profile(user_id, {
-            'pos_generati_mese': 0,
-            'mese_contatore': mese_attuale,
-            'anno_contatore': anno_attuale
-        })
-        pos_mese = 0
+    pos_mese = _pos_mese_usati(profile)
     
     limite = get_pos_limits(piano)
     
@@ -117,38 +166,143 @@ def can_generate_pos(user_id: str) -> tuple:
         return True, f"Puoi generare ancora {remaining} POS questo mese", remaining
 
 
-def increment_pos_counter(user_id: str) -> bool:
-    """Incrementa il contatore POS dopo una generazione"""
-    profile = get_user_profile(user_id)
+def increment_pos_counter(user_id: str, quantita: int = 1) -> bool:
+    """Incrementa il contatore POS dopo una generazione (quantita POS), con il reset mensile"""
+    # Lettura fresca: il valore in cache potrebbe essere superato da un'altra scheda
+    profile = get_user_profile(user_id, use_cache=False)
     if not profile:
         return False
     
+    oggi = datetime.now()
     try:
-        client = get_supabase_client()
-        client.table('profiles').update({
-            'pos_generati_totale': profile.get('pos_generati_totale', 0) + 1,
-            'pos_generati_mese': profile.get('pos_generati_mese', 0) + 1
-        }).eq('id', user_id).execute()
+        with _db_client() as client:
+            client.table('profiles').update({
+                'pos_generati_totale': profile.get('pos_generati_totale', 0) + quantita,
+                'pos_generati_mese': _pos_mese_usati(profile) + quantita,
+                'mese_contatore': oggi.month,
+                'anno_contatore': oggi.year
+            }).eq('id', user_id).execute()
         return True
     except Exception as e:
         print(f"Errore increment_pos_counter: {e}")
         return False
+    finally:
+        invalidate_profile_cache(user_id)
+
+
+def consume_pos_quota(user_id: str, quantita: int = 1) -> tuple:
+    """
+    Verifica il limite del piano e scala quantita POS in un'unica chiamata atomica
+    (funzione SQL consume_pos_quota, con reset mensile lato server).
+    Con quantita > 1 (generazione in serie) vengono scalati tutti o nessuno.
+    Solo se la funzione SQL non e installata si usa il vecchio percorso
+    lettura + update; qualsiasi altro errore (anche un timeout, dopo il quale
+    la quota potrebbe essere gia stata scalata) restituisce consumed=False.
+    Restituisce: (consumed: bool, message: str, remaining: int)
+    """
+    if quantita < 1:
+        return False, "Quantita POS non valida", 0
+
+    with _db_client() as client:
+        if not client:
+            return False, "Database non disponibile", 0
+
+        try:
+            params = {'p_user_id': user_id}
+            if quantita != 1:
+                params['p_quantita'] = quantita
+            response = client.rpc('consume_pos_quota', params).execute()
+            esito = response.data or {}
+        except Exception as e:
+            print(f"Errore consume_pos_quota: {e}")
+            if not _funzione_mancante(e):
+                return False, "Verifica quota POS non riuscita, riprova tra qualche istante", 0
+            # Funzione SQL non ancora installata: vecchio percorso lettura + update
+            esito = None
+        finally:
+            invalidate_profile_cache(user_id)
+
+    if esito is None:
+        can_generate, message, remaining = can_generate_pos(user_id, use_cache=False)
+        if not can_generate:
+            return False, message, 0
+        if remaining < quantita:
+            return False, f"Servono {quantita} POS, ne restano {remaining}", remaining
+        if not increment_pos_counter(user_id, quantita):
+            return False, "Errore aggiornamento contatore POS", remaining
+        return True, message, max(0, remaining - quantita)
+
+    return _esito_quota(esito, quantita)
+
+
+def _esito_quota(esito: dict, quantita: int) -> tuple:
+    """Risposta della funzione SQL consume_pos_quota -> (allowed, message, remaining)"""
+    if not esito.get('found', False):
+        return False, "Profilo non trovato", 0
+
+    remaining = esito.get('remaining', 0)
+    if not esito.get('allowed', False):
+        if quantita > 1 and remaining > 0:
+            return False, f"Servono {quantita} POS, ne restano {remaining}", remaining
+        if esito.get('piano') == 'free':
+            return False, "Hai già utilizzato il tuo POS gratuito. Passa a un piano PRO!", 0
+        return False, f"Hai raggiunto il limite di {esito.get('limite', 0)} POS per questo mese", 0
+
+    if esito.get('piano') == 'free':
+        if quantita == 0:
+            return True, "Puoi generare il tuo POS gratuito", remaining
+        return True, "POS gratuito utilizzato", remaining
+    return True, f"Puoi generare ancora {remaining} POS questo mese", remaining
+
+
+def verifica_pos_quota(user_id: str) -> tuple:
+    """
+    Quota POS disponibile, senza scalare nulla: consume_pos_quota con
+    p_quantita = 0 (sola lettura, stesso reset mensile lato server).
+    Per il banner e i controlli prima della generazione. L'esito resta in
+    cache PROFILE_CACHE_TTL secondi, invalidato da ogni scrittura sul profilo.
+    Restituisce: (can_generate: bool, message: str, remaining: int)
+    """
+    with _profile_cache_lock:
+        entry = _quota_cache.get(user_id)
+        if entry and time.monotonic() < entry[0]:
+            return entry[1]
+
+    with _db_client() as client:
+        if not client:
+            return False, "Database non disponibile", 0
+
+        try:
+            response = client.rpc('consume_pos_quota', {'p_user_id': user_id, 'p_quantita': 0}).execute()
+            risultato = _esito_quota(response.data or {}, 0)
+        except Exception as e:
+            print(f"Errore verifica_pos_quota: {e}")
+            if not _funzione_mancante(e):
+                return False, "Verifica quota POS non riuscita, riprova tra qualche istante", 0
+            # Funzione SQL non ancora installata: quota calcolata dal profilo
+            return can_generate_pos(user_id)
+
+    with _profile_cache_lock:
+        _quota_cache[user_id] = (time.monotonic() + PROFILE_CACHE_TTL, risultato)
+    return risultato
 
 
 def activate_license(user_id: str, license_key: str, piano: str) -> bool:
     """Attiva una licenza per l'utente"""
     try:
-        client = get_supabase_client()
-        client.table('profiles').update({
-            'piano': piano,
-            'license_key': license_key,
-            'license_activated_at': datetime.now().isoformat(),
-            'pos_generati_mese': 0  # Reset contatore mese
-        }).eq('id', user_id).execute()
+        with _db_client() as client:
+            client.table('profiles').update({
+                'piano': piano,
+                'license_key': license_key,
+                'license_activated_at': datetime.now().isoformat(),
+                'pos_generati_mese': 0  # Reset contatore mese
+            }).eq('id', user_id).execute()
         return True
     except Exception as e:
         print(f"Errore activate_license: {e}")
         return False
+    finally:
+        invalidate_profile_cache(user_id)
 
 
 # ============================================================================
@@ -157,46 +311,46 @@ def activate_license(user_id: str, license_key: str, piano: str) -> bool:
 
 def get_user_imprese(user_id: str) -> list:
     """Recupera tutte le imprese dell'utente"""
-    client = get_supabase_client()
-    if not client:
-        return []
-    
-    try:
-        response = client.table('imprese').select('*').eq('user_id', user_id).order('created_at', desc=True).execute()
-        return response.data or []
-    except Exception as e:
-        print(f"Errore get_user_imprese: {e}")
-        return []
+    with _db_client() as client:
+        if not client:
+            return []
+        
+        try:
+            response = client.table('imprese').select('*').eq('user_id', user_id).order('created_at', desc=True).execute()
+            return response.data or []
+        except Exception as e:
+            print(f"Errore get_user_imprese: {e}")
+            return []
 
 
 def get_impresa_by_id(impresa_id: str) -> dict:
     """Recupera un'impresa specifica"""
-    client = get_supabase_client()
-    if not client:
-        return None
-    
-    try:
-        response = client.table('imprese').select('*').eq('id', impresa_id).single().execute()
-        return response.data
-    except Exception as e:
-        print(f"Errore get_impresa_by_id: {e}")
-        return None
+    with _db_client() as client:
+        if not client:
+            return None
+        
+        try:
+            response = client.table('imprese').select('*').eq('id', impresa_id).single().execute()
+            return response.data
+        except Exception as e:
+            print(f"Errore get_impresa_by_id: {e}")
+            return None
 
 
 def find_impresa_by_piva(user_id: str, piva_cf: str) -> dict:
     """Cerca un'impresa esistente per P.IVA/CF dello stesso utente. Restituisce il record o None."""
-    client = get_supabase_client()
-    if not client or not piva_cf:
-        return None
-    
-    try:
-        response = client.table('imprese').select('*').eq('user_id', user_id).eq('piva_cf', piva_cf).execute()
-        if response.data and len(response.data) > 0:
-            return response.data[0]
-        return None
-    except Exception as e:
-        print(f"Errore find_impresa_by_piva: {e}")
-        return None
+    with _db_client() as client:
+        if not client or not piva_cf:
+            return None
+        
+        try:
+            response = client.table('imprese').select('*').eq('user_id', user_id).eq('piva_cf', piva_cf).execute()
+            if response.data and len(response.data) > 0:
+                return response.data[0]
+            return None
+        except Exception as e:
+            print(f"Errore find_impresa_by_piva: {e}")
+            return None
 
 
 def save_impresa(user_id: str, impresa_data: dict) -> str:
@@ -204,80 +358,80 @@ def save_impresa(user_id: str, impresa_data: dict) -> str:
     Salva o aggiorna un'impresa. Restituisce l'ID.
     Se esiste gia un'impresa con la stessa P.IVA per lo stesso utente, aggiorna quella esistente.
     """
-    client = get_supabase_client()
-    if not client:
-        return None
-    
-    try:
-        impresa_id = impresa_data.pop('id', None)
-        impresa_data['user_id'] = user_id
-        
-        # Anti-duplicato: cerca per P.IVA se non abbiamo un ID esplicito
-        if not impresa_id:
-            piva = impresa_data.get('piva_cf', '')
-            existing = find_impresa_by_piva(user_id, piva)
-            if existing:
-                impresa_id = existing.get('id')
-        
-        if impresa_id:
-            # Update esistente
-            response = client.table('imprese').update(impresa_data).eq('id', impresa_id).execute()
-        else:
-            # Insert nuova
-            response = client.table('imprese').insert(impresa_data).execute()
+    with _db_client() as client:
+        if not client:
+            return None
         
-        if response.data:
-            return response.data[0].get('id')
-        return None
-    except Exception as e:
-        print(f"Errore save_impresa: {e}")
-        return None
+        try:
+            impresa_id = impresa_data.pop('id', None)
+            impresa_data['user_id'] = user_id
+            
+            # Anti-duplicato: cerca per P.IVA se non abbiamo un ID esplicito
+            if not impresa_id:
+                piva = impresa_data.get('piva_cf', '')
+                existing = find_impresa_by_piva(user_id, piva)
+                if existing:
+                    impresa_id = existing.get('id')
+            
+            if impresa_id:
+                # Update esistente
+                response = client.table('imprese').update(impresa_data).eq('id', impresa_id).execute()
+            else:
+                # Insert nuova
+                response = client.table('imprese').insert(impresa_data).execute()
+            
+            if response.data:
+                return response.data[0].get('id')
+            return None
+        except Exception as e:
+            print(f"Errore save_impresa: {e}")
+            return None
 
 
 def delete_impresa(impresa_id: str) -> bool:
     """Elimina un'impresa"""
-    client = get_supabase_client()
-    if not client:
-        return False
-    
-    try:
-        client.table('imprese').delete().eq('id', impresa_id).execute()
-        return True
-    except Exception as e:
-        print(f"Errore delete_impresa: {e}")
-        return False
+    with _db_client() as client:
+        if not client:
+            return False
+        
+        try:
+            client.table('imprese').delete().eq('id', impresa_id).execute()
+            return True
+        except Exception as e:
+            print(f"Errore delete_impresa: {e}")
+            return False
 
 
 def set_default_impresa(user_id: str, impresa_id: str) -> bool:
     """Imposta un'impresa come predefinita"""
-    client = get_supabase_client()
-    if not client:
-        return False
-    
-    try:
-        # Prima rimuovi il flag da tutte
-        client.table('imprese').update({'is_default': False}).eq('user_id', user_id).execute()
-        # Poi imposta quella selezionata
-        client.table('imprese').update({'is_default': True}).eq('id', impresa_id).execute()
-        return True
-    except Exception as e:
-        print(f"Errore set_default_impresa: {e}")
-        return False
+    with _db_client() as client:
+        if not client:
+            return False
+        
+        try:
+            # Prima rimuovi il flag da tutte
+            client.table('imprese').update({'is_default': False}).eq('user_id', user_id).execute()
+            # Poi imposta quella selezionata
+            client.table('imprese').update({'is_default': True}).eq('id', impresa_id).execute()
+            return True
+        except Exception as e:
+            print(f"Errore set_default_impresa: {e}")
+            return False
 
 
 def get_default_impresa(user_id: str) -> dict:
     """Recupera l'impresa predefinita dell'utente"""
-    client = get_supabase_client()
-    if not client:
-        return None
-    
-    try:
-        response = client.table('imprese').select('*').eq('user_id', user_id).eq('is_default', True).single().execute()
-        return response.data
-    except:
-        # Se non c'è default, prendi la prima
-        imprese = get_user_imprese(user_id)
-        return imprese[0] if imprese else None
+    with _db_client() as client:
+        if not client:
+            return None
+        
+        try:
+            response = client.table('imprese').select('*').eq('user_id', user_id).eq('is_default', True).single().execute()
+            return response.data
+        except:
+            # Se non c'è default, prendi la prima
+            imprese = get_user_imprese(user_id)
+            return imprese[0] if imprese else None
 
 
 # ============================================================================
@@ -286,38 +440,110 @@ def get_default_impresa(user_id: str) -> dict:
 
 def save_pos_generato(user_id: str, impresa_id: str, cantiere_data: dict, lavorazioni: list, nome_file: str) -> bool:
     """Salva un POS generato nello storico"""
-    client = get_supabase_client()
-    if not client:
-        return False
-    
-    try:
-        client.table('pos_generati').insert({
-            'user_id': user_id,
-            'impresa_id': impresa_id,
-            'cantiere_indirizzo': cantiere_data.get('indirizzo', ''),
-            'cantiere_committente': cantiere_data.get('committente', ''),
-            'cantiere_durata': cantiere_data.get('durata', ''),
-            'lavorazioni': lavorazioni,
-            'nome_file': nome_file
-        }).execute()
+    with _db_client() as client:
+        if not client:
+            return False
+        
+        try:
+            client.table('pos_generati').insert({
+                'user_id': user_id,
+                'impresa_id': impresa_id,
+                'cantiere_indirizzo': cantiere_data.get('indirizzo', ''),
+                'cantiere_committente': cantiere_data.get('committente', ''),
+                'cantiere_durata': cantiere_data.get('durata', ''),
+                'lavorazioni': lavorazioni,
+                'nome_file': nome_file
+            }).execute()
+            return True
+        except Exception as e:
+            print(f"Errore save_pos_generato: {e}")
+            return False
+
+
+def save_pos_generati_batch(user_id: str, impresa_id: str, voci: list) -> bool:
+    """
+    Salva nello storico i POS di una generazione in serie con un solo insert.
+    voci: lista di (cantiere_data, lavorazioni, nome_file)
+    """
+    if not voci:
         return True
-    except Exception as e:
-        print(f"Errore save_pos_generato: {e}")
-        return False
+    with _db_client() as client:
+        if not client:
+            return False
+
+        try:
+            client.table('pos_generati').insert([{
+                'user_id': user_id,
+                'impresa_id': impresa_id,
+                'cantiere_indirizzo': cantiere_data.get('indirizzo', ''),
+                'cantiere_committente': cantiere_data.get('committente', ''),
+                'cantiere_durata': cantiere_data.get('durata', ''),
+                'lavorazioni': lavorazioni,
+                'nome_file': nome_file
+            } for cantiere_data, lavorazioni, nome_file in voci]).execute()
+            return True
+        except Exception as e:
+            print(f"Errore save_pos_generati_batch: {e}")
+            return False
 
 
 def get_pos_history(user_id: str, limit: int = 20) -> list:
     """Recupera lo storico POS dell'utente"""
-    client = get_supabase_client()
-    if not client:
-        return []
-    
-    try:
-        response = client.table('pos_generati').select('*').eq('user_id', user_id).order('data_generazione', desc=True).limit(limit).execute()
-        return response.data or []
-    except Exception as e:
-        print(f"Errore get_pos_history: {e}")
-        return []
+    with _db_client() as client:
+        if not client:
+            return []
+        
+        try:
+            response = client.table('pos_generati').select('*').eq('user_id', user_id).order('data_generazione', desc=True).limit(limit).execute()
+            return response.data or []
+        except Exception as e:
+            print(f"Errore get_pos_history: {e}")
+            return []
+
+
+# ============================================================================
+# SALVATAGGIO TEMPLATE (BULK)
+# ============================================================================
+
+def _righe_confrontabili(rows: list) -> list:
+    """Righe template in forma confrontabile: senza ordine, campi vuoti e None equivalenti"""
+    return sorted(json.dumps({k: v or '' for k, v in r.items()}, sort_keys=True, ensure_ascii=False)
+                  for r in rows)
+
+
+def _replace_template(tabella: str, impresa_id: str, rows: list) -> bool:
+    """
+    Sostituisce le righe template di un'impresa con una sola chiamata RPC
+    (delete + insert multiplo nella stessa transazione). La funzione SQL
+    confronta le righe nuove con quelle in tabella e non scrive nulla se
+    sono uguali. Solo se la funzione non e installata ripiega su lettura,
+    confronto e delete + insert multi-riga (non transazionale).
+    """
+    with _db_client() as client:
+        if not client:
+            return False
+        
+        try:
+            client.rpc(f'replace_{tabella}', {'p_impresa_id': impresa_id, 'p_rows': rows}).execute()
+            return True
+        except Exception as e:
+            if not _funzione_mancante(e):
+                print(f"Errore save_{tabella}: {e}")
+                return False
+            print(f"RPC replace_{tabella} non installata, uso delete + insert: {e}")
+        
+        try:
+            campi = ','.join(rows[0]) if rows else 'nome'
+            attuali = client.table(tabella).select(campi).eq('impresa_id', impresa_id).execute().data or []
+            if _righe_confrontabili(attuali) == _righe_confrontabili(rows):
+                return True
+            client.table(tabella).delete().eq('impresa_id', impresa_id).execute()
+            if rows:
+                client.table(tabella).insert([dict(r, impresa_id=impresa_id) for r in rows]).execute()
+            return True
+        except Exception as e:
+            print(f"Errore save_{tabella}: {e}")
+            return False
 
 
 # ============================================================================
@@ -326,42 +552,27 @@ def get_pos_history(user_id: str, limit: int = 20) -> list:
 
 def get_lavoratori_template(impresa_id: str) -> list:
     """Recupera i lavoratori salvati per un'impresa"""
-    client = get_supabase_client()
-    if not client:
-        return []
-    
-    try:
-        response = client.table('lavoratori_template').select('*').eq('impresa_id', impresa_id).execute()
-        return response.data or []
-    except Exception as e:
-        print(f"Errore get_lavoratori_template: {e}")
-        return []
+    with _db_client() as client:
+        if not client:
+            return []
+        
+        try:
+            response = client.table('lavoratori_template').select('*').eq('impresa_id', impresa_id).execute()
+            return response.data or []
+        except Exception as e:
+            print(f"Errore get_lavoratori_template: {e}")
+            return []
 
 
 def save_lavoratori_template(impresa_id: str, lavoratori: list) -> bool:
-    """Salva i lavoratori come template per un'impresa"""
-    client = get_supabase_client()
-    if not client:
-        return False
-    
-    try:
-        # Prima elimina i vecchi
-        client.table('lavoratori_template').delete().eq('impresa_id', impresa_id).execute()
-        
-        # Poi inserisci i nuovi
-        for lav in lavoratori:
-            if lav.get('nome'):
-                client.table('lavoratori_template').insert({
-                    'impresa_id': impresa_id,
-                    'nome': lav.get('nome', ''),
-                    'mansione': lav.get('mansione', ''),
-                    'formazione': lav.get('formazione', ''),
-                    'idoneita_sanitaria': lav.get('idoneita', '')
-                }).execute()
-        return True
-    except Exception as e:
-        print(f"Errore save_lavoratori_template: {e}")
-        return False
+    """Salva i lavoratori come template per un'impresa (solo se cambiati)"""
+    rows = [{
+        'nome': lav.get('nome', ''),
+        'mansione': lav.get('mansione', ''),
+        'formazione': lav.get('formazione', ''),
+        'idoneita_sanitaria': lav.get('idoneita', '')
+    } for lav in lavoratori if lav.get('nome')]
+    return _replace_template('lavoratori_template', impresa_id, rows)
 
 
 # ============================================================================
@@ -370,42 +581,27 @@ def save_lavoratori_template(impresa_id: str, lavoratori: list) -> bool:
 
 def get_attrezzature_template(impresa_id: str) -> list:
     """Recupera le attrezzature salvate per un'impresa"""
-    client = get_supabase_client()
-    if not client:
-        return []
-    
-    try:
-        response = client.table('attrezzature_template').select('*').eq('impresa_id', impresa_id).execute()
-        return response.data or []
-    except Exception as e:
-        print(f"Errore get_attrezzature_template: {e}")
-        return []
+    with _db_client() as client:
+        if not client:
+            return []
+        
+        try:
+            response = client.table('attrezzature_template').select('*').eq('impresa_id', impresa_id).execute()
+            return response.data or []
+        except Exception as e:
+            print(f"Errore get_attrezzature_template: {e}")
+            return []
 
 
 def save_attrezzature_template(impresa_id: str, attrezzature: list) -> bool:
-    """Salva le attrezzature come template per un'impresa"""
-    client = get_supabase_client()
-    if not client:
-        return False
-    
-    try:
-        # Prima elimina i vecchi
-        client.table('attrezzature_template').delete().eq('impresa_id', impresa_id).execute()
-        
-        # Poi inserisci i nuovi
-        for attr in attrezzature:
-            if attr.get('nome'):
-                client.table('attrezzature_template').insert({
-                    'impresa_id': impresa_id,
-                    'nome': attr.get('nome', ''),
-                    'marca': attr.get('marca', ''),
-                    'matricola': attr.get('matricola', ''),
-                    'ultima_verifica': attr.get('verifica', '')
-                }).execute()
-        return True
-    except Exception as e:
-        print(f"Errore save_attrezzature_template: {e}")
-        return False
+    """Salva le attrezzature come template per un'impresa (solo se cambiate)"""
+    rows = [{
+        'nome': attr.get('nome', ''),
+        'marca': attr.get('marca', ''),
+        'matricola': attr.get('matricola', ''),
+        'ultima_verifica': attr.get('verifica', '')
+    } for attr in attrezzature if attr.get('nome')]
+    return _replace_template('attrezzature_template', impresa_id, rows)
 
 
 # ============================================================================
@@ -8,6 +8,8 @@ V2 - Gestione errori migliorata
 import streamlit as st
 import requests
 
+from connection_pool import get_http_session
+
 # Mapping tra variant ID di Lemon Squeezy e piano
 # IMPORTANTE: Questi valori dipendono da come hai chiamato i "Variant" su Lemon Squeezy.
 # Se il nome del prodotto contiene "starter", "professional" o "unlimited",
@@ -80,7 +82,7 @@ def validate_license(license_key: str) -> tuple:
             "instance_name": f"POSFacile_Web_{st.session_state.get('user_id', 'unknown')[:8]}"
         }
         
-        response = requests.post(url, json=data, headers=headers, timeout=10)
+        response = get_http_session().post(url, json=data, headers=headers, timeout=10)
         
         if response.status_code == 200:
             res_json = response.json()
@@ -147,7 +149,7 @@ def validate_existing_license(license_key: str) -> tuple:
         
         data = {"license_key": license_key}
         
-        response = requests.post(url, json=data, headers=headers, timeout=10)
+        response = get_http_session().post(url, json=data, headers=headers, timeout=10)
         
         if response.status_code == 200:
             res_json = response.json()
@@ -198,7 +200,7 @@ def deactivate_license(license_key: str) -> bool:
             "instance_id": f"POSFacile_Web_{st.session_state.get('user_id', 'unknown')[:8]}"
         }
         
-        response = requests.post(url, json=data, headers=headers, timeout=10)
+        response = get_http_session().post(url, json=data, headers=headers, timeout=10)
         return response.status_code == 200
         
     except:
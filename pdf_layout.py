@@ -0,0 +1,858 @@
+# -*- coding: utf-8 -*-
+"""
+POS FACILE - Motore di impaginazione PDF
+Il POS viene prodotto in due fasi:
+
+1. genera_pdf_pos descrive il documento come una sequenza di blocchi
+   (titoli, campi, paragrafi, righe di tabella, disegni) dentro un Documento;
+2. Documento.genera() misura i blocchi, decide le interruzioni di pagina
+   (stesse regole del vecchio check_spazio) e solo alla fine li disegna su FPDF.
+
+La spezzatura in righe dei testi (la parte piu costosa di multi_cell) viene
+calcolata una sola volta per processo e tenuta in cache: i testi fissi
+(TESTI_LEGALI, premessa, metodologia...) non vengono piu rimisurati a ogni POS.
+
+Le parti che non cambiano tra un POS e l'altro (sommario, testi legali, matrice
+P x G, macroclima) sono blocchi statici: vengono disegnati una volta su un PDF
+di appoggio, il content stream risultante resta in cache e nei documenti
+successivi viene solo "timbrato" alla quota giusta.
+"""
+
+import re
+import threading
+from collections import OrderedDict
+
+from fpdf import FPDF
+
+try:
+    from fpdf.enums import Align, WrapMode, XPos, YPos
+    from fpdf.line_break import MultiLineBreak
+    from fpdf.util import Padding
+    RIGHE_DIRETTE = True
+except ImportError:
+    # Versioni di fpdf2 senza queste API: si ricade su multi_cell
+    RIGHE_DIRETTE = False
+
+try:
+    from fpdf.enums import PDFResourceType
+    from fpdf.fonts import CoreFont
+    FRAMMENTI_STATICI = True
+except ImportError:
+    # Senza queste API i blocchi statici vengono semplicemente ridisegnati
+    FRAMMENTI_STATICI = False
+
+
+# ==============================================================================
+# COSTANTI DESIGN
+# ==============================================================================
+
+W = 186          # Larghezza utile (margini 12mm)
+ML = 12          # Margine sinistro
+MR = 12          # Margine destro
+Y_LIMITE = 272   # Quota oltre la quale (meno lo spazio richiesto) si cambia pagina
+Y_INIZIO = 14    # Prima quota utile delle pagine interne
+
+# Palette colori professionale
+ARANCIONE = (230, 92, 0)
+ARANCIONE_CHIARO = (255, 237, 220)
+BLU_SCURO = (22, 33, 62)
+BLU_MEDIO = (44, 62, 103)
+GRIGIO_SCURO = (55, 55, 65)
+GRIGIO_MEDIO = (120, 120, 130)
+GRIGIO_CHIARO = (242, 243, 247)
+GRIGIO_BORDO = (200, 205, 215)
+BIANCO = (255, 255, 255)
+ROSSO_BADGE = (220, 53, 53)
+ROSSO_CHIARO = (255, 235, 235)
+GIALLO_BADGE = (217, 152, 11)
+GIALLO_CHIARO = (255, 250, 230)
+VERDE_BADGE = (34, 139, 34)
+VERDE_CHIARO = (232, 250, 232)
+BLU_CHIARO = (232, 240, 255)
+
+MISURE_CACHE_MAX = 2048  # Testi spezzati in righe tenuti in memoria
+FRAMMENTI_CACHE_MAX = 1024  # Blocchi statici pre-renderizzati tenuti in memoria
+SCHEDE_CACHE_MAX = 128      # Gruppi di blocchi statici (schede rischi per lavorazione)
+
+
+# ==============================================================================
+# TESTO
+# ==============================================================================
+
+def pulisci_testo(text, max_len=200):
+    """
+    Pulisce il testo per il PDF mantenendo gli accenti italiani.
+    Usa la codifica latin-1 compatibile con i font standard di FPDF.
+    """
+    if text is None:
+        return "N.D."
+    text = str(text).strip()
+    if not text:
+        return "N.D."
+
+    # 1. Normalizzazione caratteri speciali che rompono i PDF standard
+    replacements = {
+        '€': 'EUR',
+        '’': "'", '‘': "'",
+        '“': '"', '”': '"',
+        '–': '-', '…': '...'
+    }
+    for old, new in replacements.items():
+        text = text.replace(old, new)
+
+    # Rimuovi a capo e tabulazioni eccessive
+    text = text.replace('\n', ' ').replace('\r', ' ').replace('\t', ' ')
+
+    # 2. Gestione Encoding per FPDF (Helvetica standard usa Latin-1/Windows-1252)
+    try:
+        # Tenta di codificare in latin-1 (supporta accenti italiani).
+        # 'replace' sostituisce caratteri non supportati (es. Emoji, Cinese) con '?'
+        text = text.encode('latin-1', 'replace').decode('latin-1')
+    except Exception:
+        # Fallback estremo
+        text = text.encode('ascii', 'ignore').decode('ascii')
+
+    # 3. Pulizia finale spazi
+    while "  " in text:
+        text = text.replace("  ", " ")
+
+    # Limita lunghezza
+    if max_len and len(text) > max_len:
+        text = text[:max_len-3] + "..."
+
+    return text
+
+
+# ==============================================================================
+# CACHE
+# ==============================================================================
+
+class CacheLRU:
+    """Piccola cache LRU thread-safe con contatori di hit/miss."""
+
+    def __init__(self, max_voci: int):
+        self.max_voci = max_voci
+        self._voci = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, chiave):
+        with self._lock:
+            if chiave in self._voci:
+                self._voci.move_to_end(chiave)
+                self.hits += 1
+                return self._voci[chiave]
+            self.misses += 1
+            return None
+
+    def put(self, chiave, valore):
+        with self._lock:
+            self._voci[chiave] = valore
+            self._voci.move_to_end(chiave)
+            while len(self._voci) > self.max_voci:
+                self._voci.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._voci.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            totale = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / totale, 3) if totale else 0.0,
+                'voci': len(self._voci),
+            }
+
+
+# ==============================================================================
+# MISURA DEI TESTI
+# ==============================================================================
+
+class TestoMisurato:
+    """Testo gia spezzato in righe per un dato font e larghezza."""
+
+    __slots__ = ('testo', 'righe', 'n_righe', 'a_capo_finale')
+
+    def __init__(self, testo, righe=None, n_righe=1, a_capo_finale=False):
+        self.testo = testo
+        self.righe = righe                # tuple di (testo_riga, TextLine), None = usa multi_cell
+        self.n_righe = len(righe) if righe else n_righe
+        self.a_capo_finale = a_capo_finale
+
+    def altezza(self, h: float) -> float:
+        return self.n_righe * h + (h if self.a_capo_finale else 0)
+
+
+_misure = CacheLRU(MISURE_CACHE_MAX)
+_pdf_misure = None
+_pdf_misure_lock = threading.Lock()
+
+
+def _nuovo_pdf() -> FPDF:
+    pdf = FPDF()
+    pdf.set_auto_page_break(auto=False)
+    pdf.add_page()
+    pdf.set_left_margin(ML)
+    pdf.set_right_margin(MR)
+    return pdf
+
+
+def misura_testo(testo: str, w: float, size: float, stile: str = '', align: str = 'J') -> TestoMisurato:
+    """
+    Spezza il testo in righe come farebbe multi_cell(w, ...) in Helvetica.
+    Il risultato resta in cache per processo (chiave: font, larghezza, testo).
+    """
+    chiave = (stile, size, w, align, testo)
+    misura = _misure.get(chiave)
+    if misura is not None:
+        return misura
+
+    global _pdf_misure
+    with _pdf_misure_lock:
+        if _pdf_misure is None:
+            _pdf_misure = _nuovo_pdf()
+        pdf = _pdf_misure
+        pdf.set_font('Helvetica', stile, size)
+        misura = None
+        if RIGHE_DIRETTE:
+            try:
+                misura = _spezza_righe(pdf, testo, w, align)
+            except Exception:
+                misura = None
+        if misura is None:
+            righe = pdf.multi_cell(w, 1, testo, align=align, dry_run=True, output='LINES')
+            misura = TestoMisurato(testo, None, max(len(righe), 1))
+
+    _misure.put(chiave, misura)
+    return misura
+
+
+def _spezza_righe(pdf: FPDF, testo: str, w: float, align: str) -> TestoMisurato:
+    # Stessa procedura di FPDF.multi_cell, senza disegnare
+    testo = pdf.normalize_text(testo).replace('\r', '')
+    frammenti = pdf._preload_font_styles(testo, False)
+    spezzatura = MultiLineBreak(
+        frammenti, w, [pdf.c_margin, pdf.c_margin],
+        align=Align.coerce(align), print_sh=False, wrapmode=WrapMode.WORD,
+    )
+    righe = []
+    linea = spezzatura.get_line()
+    while linea is not None:
+        testo_riga = ''.join(f.string for f in linea.fragments)
+        # La riga viene salvata senza i frammenti (legati al font del PDF di misura)
+        righe.append((testo_riga, linea._replace(fragments=())))
+        linea = spezzatura.get_line()
+    if not righe:
+        return TestoMisurato(testo)
+    return TestoMisurato(testo, tuple(righe), a_capo_finale=righe[-1][1].trailing_nl)
+
+
+def disegna_testo(pdf: FPDF, misura: TestoMisurato, w: float, h: float):
+    """Equivalente di multi_cell(w, h, testo) a partire da righe gia misurate."""
+    if misura.righe is None:
+        pdf.multi_cell(w, h, misura.testo)
+        return
+    ultima = len(misura.righe) - 1
+    for i, (testo_riga, linea) in enumerate(misura.righe):
+        frammenti = pdf._preload_font_styles(testo_riga, False) if testo_riga else []
+        pdf._render_styled_text_line(
+            linea._replace(fragments=frammenti),
+            h=h,
+            new_x=XPos.RIGHT if i == ultima else XPos.LEFT,
+            new_y=YPos.NEXT,
+            padding=Padding(),
+        )
+    if misura.a_capo_finale:
+        pdf.ln()
+
+
+# ==============================================================================
+# FRAMMENTI STATICI
+# ==============================================================================
+
+class Frammento:
+    """Content stream di un blocco gia disegnato, con i font che usa."""
+
+    __slots__ = ('contenuto', 'font', 'altezza', 'stato_iniziale')
+
+    def __init__(self, contenuto, font, altezza, stato_iniziale):
+        self.contenuto = contenuto              # bytes degli operatori PDF
+        self.font = font                        # {indice nel PDF di appoggio: (famiglia, stile)}
+        self.altezza = altezza
+        self.stato_iniziale = stato_iniziale    # stato grafico della pagina al momento della cattura
+
+
+_frammenti = CacheLRU(FRAMMENTI_CACHE_MAX)
+_Y_CATTURA = 50  # Quota di cattura: lascia spazio ai disegni che salgono sopra y (es. matrice P x G)
+_RISORSA_PDF = re.compile(rb'/([A-Za-z]+)\d+ ')
+# Font come operando di Tf; le stringhe letterali (...) vengono saltate intere,
+# cosi un testo che contiene "/F1 10.00 Tf" non viene toccato
+_FONT_PDF = re.compile(rb'\((?:\\.|[^\\)])*\)|/F(\d+) ([\d.]+ Tf)', re.S)
+
+
+def cattura_frammento(blocco) -> Frammento:
+    """
+    Disegna il blocco su un PDF di appoggio (a quota _Y_CATTURA) e ne conserva gli operatori.
+    Restituisce None se il blocco usa risorse diverse dai font standard
+    (immagini, trasparenze...), che non si possono ricopiare cosi come sono.
+    """
+    altezza = blocco.misura()
+    pdf = _nuovo_pdf()
+    pagina = pdf.pages[pdf.page]
+    inizio = len(pagina.contents)
+    pdf.set_y(_Y_CATTURA)
+    blocco.disegna(pdf, _Y_CATTURA)
+    contenuto = bytes(pagina.contents[inizio:])
+
+    if any(nome != b'F' for nome in _RISORSA_PDF.findall(contenuto)):
+        return None
+    font = {}
+    for fontkey, f in pdf.fonts.items():
+        if not isinstance(f, CoreFont):
+            return None
+        stile = f.emphasis.style
+        font[f.i] = (fontkey[:len(fontkey) - len(stile)], stile)
+    stato = f'0 g 0 G {pdf.line_width * pdf.k:.2f} w 0 Tw 0 Tc 100 Tz'
+    return Frammento(contenuto, font, altezza, stato)
+
+
+def _indice_font(pdf: FPDF, famiglia: str, stile: str) -> int:
+    """Indice del font nel PDF di destinazione, registrandolo se serve."""
+    fontkey = famiglia + stile
+    if fontkey not in pdf.fonts:
+        # set_font registra il font; poi si ripristina il font corrente
+        stato = (pdf.font_family, pdf.font_style, pdf.font_size_pt,
+                 pdf.current_font, pdf.current_font_is_set_on_page)
+        pdf.set_font(famiglia, stile)
+        (pdf.font_family, pdf.font_style, pdf.font_size_pt,
+         pdf.current_font, pdf.current_font_is_set_on_page) = stato
+    indice = pdf.fonts[fontkey].i
+    pdf._resource_catalog.add(PDFResourceType.FONT, indice, pdf.page)
+    return indice
+
+
+def timbra_frammento(pdf: FPDF, frammento: Frammento, y: float):
+    """
+    Ricopia il frammento nella pagina corrente spostato alla quota y.
+    Il blocco q ... Q isola colori, font e spessori: lo stato di FPDF resta valido.
+    """
+    indici = {i: _indice_font(pdf, famiglia, stile) for i, (famiglia, stile) in frammento.font.items()}
+
+    def rinumera(m):
+        if m.group(1) is None or int(m.group(1)) not in indici:
+            return m.group(0)
+        return b'/F%d %s' % (indici[int(m.group(1))], m.group(2))
+
+    contenuto = _FONT_PDF.sub(rinumera, frammento.contenuto)
+    pdf._out(f'q {frammento.stato_iniziale} 1 0 0 1 0 {(_Y_CATTURA - y) * pdf.k:.2f} cm')
+    pdf._out(contenuto.rstrip(b'\n'))
+    pdf._out('Q')
+
+
+def get_layout_stats() -> dict:
+    """Metriche delle cache del motore PDF (misura testi, frammenti statici, schede)."""
+    return {'misure': _misure.stats(), 'frammenti': _frammenti.stats(), 'schede': _schede.stats()}
+
+
+# ==============================================================================
+# BLOCCHI DEL DOCUMENTO
+# ==============================================================================
+
+class Blocco:
+    """
+    Elemento del modello di documento.
+    spazio: come il vecchio check_spazio(), se la quota corrente supera
+    Y_LIMITE - spazio il blocco va a pagina nuova.
+    misura() restituisce l'altezza occupata, disegna() lo disegna alla quota y.
+    """
+
+    spazio = 0
+
+    def misura(self) -> float:
+        return 0
+
+    def disegna(self, pdf: FPDF, y: float):
+        pass
+
+
+class Spazio(Blocco):
+    """Spaziatura verticale (pdf.ln)."""
+
+    def __init__(self, mm: float):
+        self.mm = mm
+
+    def misura(self):
+        return self.mm
+
+
+class Controllo(Blocco):
+    """Solo controllo di spazio residuo (check_spazio), senza contenuto."""
+
+    def __init__(self, spazio: float):
+        self.spazio = spazio
+
+
+class NuovaPagina(Blocco):
+    """Interruzione di pagina forzata."""
+
+
+class Titolo(Blocco):
+    """Titolo di sezione con barra laterale arancione."""
+
+    spazio = 50
+
+    def __init__(self, num, titolo):
+        self.num = num
+        self.titolo = titolo
+
+    def misura(self):
+        return 17
+
+    def disegna(self, pdf, y):
+        y += 6
+        pdf.set_fill_color(*ARANCIONE)
+        pdf.rect(ML, y, 3, 8, 'F')
+        pdf.set_fill_color(*GRIGIO_CHIARO)
+        pdf.rect(ML + 3, y, W - 3, 8, 'F')
+        pdf.set_font('Helvetica', 'B', 11)
+        pdf.set_text_color(*BLU_SCURO)
+        pdf.set_xy(ML + 7, y + 1)
+        pdf.cell(W - 10, 6, f'{self.num}. {self.titolo.upper()}')
+        pdf.set_text_color(0, 0, 0)
+
+
+class Sottotitolo(Blocco):
+    spazio = 12
+
+    def __init__(self, testo):
+        self.testo = testo
+
+    def misura(self):
+        return 9
+
+    def disegna(self, pdf, y):
+        pdf.set_font('Helvetica', 'B', 10)
+        pdf.set_text_color(*BLU_SCURO)
+        pdf.set_xy(ML + 2, y + 3)
+        pdf.cell(W, 5, pulisci_testo(self.testo, 70), ln=1)
+        pdf.set_text_color(0, 0, 0)
+
+
+class Campo(Blocco):
+    """Riga 'Etichetta: valore'."""
+
+    spazio = 8
+
+    def __init__(self, label, valore):
+        self.label = label
+        self.valore = valore
+
+    def misura(self):
+        return 5
+
+    def disegna(self, pdf, y):
+        pdf.set_font('Helvetica', 'B', 9)
+        pdf.set_text_color(*GRIGIO_SCURO)
+        pdf.set_xy(ML + 2, y)
+        etichetta = pulisci_testo(self.label, 30) + ':  '
+        label_w = pdf.get_string_width(etichetta)
+        pdf.cell(label_w, 5, etichetta, ln=0)
+        pdf.set_font('Helvetica', '', 9)
+        pdf.set_text_color(0, 0, 0)
+        pdf.cell(W - label_w - 4, 5, pulisci_testo(self.valore, 90), ln=1)
+
+
+class Riga(Blocco):
+    """Riga di testo semplice (elenchi, voci di scheda)."""
+
+    def __init__(self, testo, size=9, h=4.5, x=ML + 4, w=W - 6, spazio=6, pulisci=True):
+        self.testo = pulisci_testo(testo, 120) if pulisci else testo
+        self.size = size
+        self.h = h
+        self.x = x
+        self.w = w
+        self.spazio = spazio
+
+    def misura(self):
+        return self.h
+
+    def disegna(self, pdf, y):
+        pdf.set_font('Helvetica', '', self.size)
+        pdf.set_text_color(*GRIGIO_SCURO)
+        pdf.set_xy(self.x, y)
+        pdf.cell(self.w, self.h, self.testo, ln=1)
+        pdf.set_text_color(0, 0, 0)
+
+
+class Banda(Blocco):
+    """Fascia a tutta larghezza con titoletto (RISCHI, DPI, MISURE...)."""
+
+    def __init__(self, testo, riempimento, colore, size=8, h=5):
+        self.testo = testo
+        self.riempimento = riempimento
+        self.colore = colore
+        self.size = size
+        self.h = h
+
+    def misura(self):
+        return self.h
+
+    def disegna(self, pdf, y):
+        pdf.set_fill_color(*self.riempimento)
+        pdf.set_font('Helvetica', 'B', self.size)
+        pdf.set_text_color(*self.colore)
+        pdf.set_xy(ML, y)
+        pdf.cell(W, self.h, self.testo, ln=1, fill=True)
+        pdf.set_text_color(0, 0, 0)
+
+
+class Nota(Blocco):
+    """Riga singola in corsivo grigio (riferimenti normativi, legende)."""
+
+    def __init__(self, testo, size=8, h=4, stile='I', colore=GRIGIO_MEDIO):
+        self.testo = testo
+        self.size = size
+        self.h = h
+        self.stile = stile
+        self.colore = colore
+
+    def misura(self):
+        return self.h
+
+    def disegna(self, pdf, y):
+        pdf.set_font('Helvetica', self.stile, self.size)
+        pdf.set_text_color(*self.colore)
+        pdf.set_xy(ML, y)
+        pdf.cell(W, self.h, self.testo, ln=1)
+        pdf.set_text_color(0, 0, 0)
+
+
+class Testo(Blocco):
+    """Testo su piu righe (multi_cell) misurato in anticipo."""
+
+    def __init__(self, testo, x=ML, w=W, h=4.5, size=9, stile='', colore=GRIGIO_SCURO,
+                 riempimento=None, spazio=0):
+        self.testo = testo
+        self.x = x
+        self.w = w
+        self.h = h
+        self.size = size
+        self.stile = stile
+        self.colore = colore
+        self.riempimento = riempimento
+        self.spazio = spazio
+        self._misura = None
+
+    def misura(self):
+        if self._misura is None:
+            self._misura = misura_testo(self.testo, self.w, self.size, self.stile)
+        return self._misura.altezza(self.h)
+
+    def disegna(self, pdf, y):
+        pdf.set_font('Helvetica', self.stile, self.size)
+        pdf.set_text_color(*self.colore)
+        if self.riempimento:
+            pdf.set_fill_color(*self.riempimento)
+            pdf.rect(self.x, y, self.w, self.misura(), 'F')
+        pdf.set_xy(self.x, y)
+        disegna_testo(pdf, self._misura or misura_testo(self.testo, self.w, self.size, self.stile),
+                      self.w, self.h)
+        pdf.set_text_color(0, 0, 0)
+
+
+class Paragrafo(Testo):
+    spazio = 15
+
+    def __init__(self, testo, size=9):
+        super().__init__(pulisci_testo(testo, 1200), x=ML + 2, w=W - 4, h=4.5, size=size, spazio=15)
+
+
+class TabellaHeader(Blocco):
+    """Intestazione tabella (sfondo blu, testo bianco)."""
+
+    def __init__(self, colonne, size=8, h=6, prefisso='  ', align=''):
+        self.colonne = colonne
+        self.size = size
+        self.h = h
+        self.prefisso = prefisso
+        self.align = align
+
+    def misura(self):
+        return self.h
+
+    def disegna(self, pdf, y):
+        pdf.set_fill_color(*BLU_SCURO)
+        pdf.set_text_color(255, 255, 255)
+        pdf.set_font('Helvetica', 'B', self.size)
+        pdf.set_xy(ML, y)
+        for nome, larghezza in self.colonne:
+            pdf.cell(larghezza, self.h, self.prefisso + nome, fill=True, align=self.align)
+        pdf.set_text_color(0, 0, 0)
+
+
+class TabellaRiga(Blocco):
+    """Riga di tabella con colori alternati e linea di separazione."""
+
+    def __init__(self, valori, colonne, indice=0, h=6, size=8, spazio=8,
+                 prefisso='  ', allinea=None, pulisci=True):
+        self.valori = valori
+        self.colonne = colonne
+        self.indice = indice
+        self.h = h
+        self.size = size
+        self.spazio = spazio
+        self.prefisso = prefisso
+        self.allinea = allinea
+        self.pulisci = pulisci
+
+    def misura(self):
+        return self.h
+
+    def disegna(self, pdf, y):
+        pdf.set_fill_color(*(BIANCO if self.indice % 2 == 0 else GRIGIO_CHIARO))
+        pdf.set_font('Helvetica', '', self.size)
+        pdf.set_xy(ML, y)
+        for i, (nome, larghezza) in enumerate(self.colonne):
+            val = self.valori[i] if i < len(self.valori) else ''
+            if self.pulisci:
+                val = pulisci_testo(val, int(larghezza * 0.6))
+            align = self.allinea[i] if self.allinea else ''
+            pdf.cell(larghezza, self.h, self.prefisso + val, fill=True, align=align)
+        # Linea sottile di separazione
+        pdf.set_draw_color(*GRIGIO_BORDO)
+        pdf.line(ML, y + self.h, ML + W, y + self.h)
+        pdf.set_draw_color(0, 0, 0)
+
+
+class Disegno(Blocco):
+    """
+    Parte grafica libera: funzione(pdf, y) disegna a partire dalla quota y e
+    lascia pdf.get_y() sotto l'ultimo elemento. Se l'altezza non e indicata
+    viene misurata eseguendo il disegno su una pagina di prova.
+    """
+
+    def __init__(self, funzione, altezza=None, spazio=0):
+        self.funzione = funzione
+        self.altezza = altezza
+        self.spazio = spazio
+
+    def misura(self):
+        if self.altezza is None:
+            pdf = _nuovo_pdf()
+            pdf.set_y(0)
+            self.funzione(pdf, 0)
+            self.altezza = pdf.get_y()
+        return self.altezza
+
+    def disegna(self, pdf, y):
+        self.funzione(pdf, y)
+
+
+class Statico(Blocco):
+    """
+    Blocco il cui contenuto non dipende dai dati del POS.
+    Viene disegnato una volta per processo (chiave = contenuto) e poi timbrato;
+    se la cattura non e possibile si ricade sul disegno normale.
+    """
+
+    def __init__(self, blocco: Blocco, chiave):
+        self.blocco = blocco
+        self.chiave = chiave
+        self.spazio = blocco.spazio
+        self._frammento = None
+
+    def _cattura(self):
+        if self._frammento is None:
+            frammento = _frammenti.get(self.chiave)
+            if frammento is None:
+                try:
+                    frammento = cattura_frammento(self.blocco)
+                except Exception as e:
+                    print(f"Errore cattura frammento PDF: {e}")
+                    frammento = None
+                # False = non catturabile, si evita di riprovare a ogni POS
+                _frammenti.put(self.chiave, frammento or False)
+            self._frammento = frammento
+        return self._frammento
+
+    def misura(self):
+        frammento = self._cattura() if FRAMMENTI_STATICI else None
+        return frammento.altezza if frammento else self.blocco.misura()
+
+    def disegna(self, pdf, y):
+        frammento = self._cattura() if FRAMMENTI_STATICI else None
+        if frammento:
+            timbra_frammento(pdf, frammento, y)
+        else:
+            self.blocco.disegna(pdf, y)
+
+
+_schede = CacheLRU(SCHEDE_CACHE_MAX)
+
+
+def blocchi_statici(chiave, costruisci) -> tuple:
+    """
+    Gruppo di blocchi che dipende solo da chiave (es. scheda rischi di una lavorazione).
+    Al primo uso costruisci(bozza) riempie un Documento vuoto; i blocchi con contenuto
+    diventano Statico, cosi in cache restano sia l'impaginazione sia i frammenti.
+    Le istanze vengono condivise tra documenti: i blocchi non hanno stato per-POS.
+    """
+    blocchi = _schede.get(chiave)
+    if blocchi is None:
+        bozza = Documento()
+        costruisci(bozza)
+        blocchi = tuple(
+            b if isinstance(b, (Spazio, Controllo, NuovaPagina, Statico)) else Statico(b, chiave + (i,))
+            for i, b in enumerate(bozza.blocchi)
+        )
+        _schede.put(chiave, blocchi)
+    return blocchi
+
+
+# ==============================================================================
+# DOCUMENTO
+# ==============================================================================
+
+class Documento:
+    """
+    Modello del POS: lista di blocchi con impaginazione e rendering separati.
+    La prima pagina e la copertina (senza intestazione), le successive hanno
+    intestazione e pie di pagina con ragione sociale e numero di pagina.
+    """
+
+    def __init__(self, ragione_sociale: str = ''):
+        self.ragione_sociale = ragione_sociale
+        self.blocchi = []
+
+    # --- Costruzione ---------------------------------------------------------
+
+    def aggiungi(self, blocco: Blocco) -> Blocco:
+        self.blocchi.append(blocco)
+        return blocco
+
+    def estendi(self, blocchi):
+        self.blocchi.extend(blocchi)
+
+    def nuova_pagina(self):
+        self.aggiungi(NuovaPagina())
+
+    def check_spazio(self, altezza_necessaria=40):
+        self.aggiungi(Controllo(altezza_necessaria))
+
+    def ln(self, mm):
+        self.aggiungi(Spazio(mm))
+
+    def titolo_sezione(self, num, titolo):
+        self.aggiungi(Titolo(num, titolo))
+
+    def sottotitolo(self, testo):
+        self.aggiungi(Sottotitolo(testo))
+
+    def campo(self, label, valore):
+        self.aggiungi(Campo(label, valore))
+
+    def paragrafo(self, testo, size=9, statico=False):
+        blocco = Paragrafo(testo, size)
+        if statico:
+            blocco = Statico(blocco, ('paragrafo', size, blocco.testo))
+        self.aggiungi(blocco)
+
+    def riga(self, testo, **kwargs):
+        self.aggiungi(Riga(testo, **kwargs))
+
+    def nota(self, testo, **kwargs):
+        self.aggiungi(Nota(testo, **kwargs))
+
+    def banda(self, testo, riempimento, colore, **kwargs):
+        self.aggiungi(Banda(testo, riempimento, colore, **kwargs))
+
+    def testo(self, testo, **kwargs):
+        self.aggiungi(Testo(testo, **kwargs))
+
+    def tabella_header(self, colonne, **kwargs):
+        self.aggiungi(TabellaHeader(colonne, **kwargs))
+
+    def tabella_riga(self, valori, colonne, indice=0, **kwargs):
+        self.aggiungi(TabellaRiga(valori, colonne, indice, **kwargs))
+
+    def disegno(self, funzione, altezza=None, spazio=0, statico=None):
+        """statico: chiave del frammento se il disegno non dipende dai dati del POS."""
+        blocco = Disegno(funzione, altezza, spazio)
+        if statico is not None:
+            blocco = Statico(blocco, ('disegno', statico))
+        self.aggiungi(blocco)
+
+    # --- Impaginazione -------------------------------------------------------
+
+    def impagina(self) -> list:
+        """
+        Fase di layout: misura ogni blocco e lo assegna a una pagina.
+        Restituisce una lista di pagine, ognuna lista di (y, blocco).
+        """
+        pagine = [[]]
+        y = 0
+        for blocco in self.blocchi:
+            if isinstance(blocco, NuovaPagina):
+                pagine.append([])
+                y = Y_INIZIO
+                continue
+            if blocco.spazio and y > Y_LIMITE - blocco.spazio:
+                pagine.append([])
+                y = Y_INIZIO
+            altezza = blocco.misura()
+            if altezza or not isinstance(blocco, (Spazio, Controllo)):
+                pagine[-1].append((y, blocco))
+            y += altezza
+        return pagine
+
+    # --- Rendering -----------------------------------------------------------
+
+    def _intestazione(self, pdf, num_pagina):
+        # Header sottile e elegante
+        pdf.set_fill_color(*BLU_SCURO)
+        pdf.rect(0, 0, 210, 8, 'F')
+        pdf.set_fill_color(*ARANCIONE)
+        pdf.rect(0, 8, 210, 0.8, 'F')
+        pdf.set_font('Helvetica', 'B', 7)
+        pdf.set_text_color(255, 255, 255)
+        pdf.set_xy(ML, 1.5)
+        pdf.cell(W * 0.7, 5, 'PIANO OPERATIVO DI SICUREZZA', ln=0)
+        pdf.set_font('Helvetica', '', 7)
+        pdf.cell(W * 0.3, 5, pulisci_testo(self.ragione_sociale, 30), ln=0, align='R')
+        pdf.set_text_color(0, 0, 0)
+        # Footer con numero pagina
+        pdf.set_draw_color(*GRIGIO_BORDO)
+        pdf.line(ML, 284, ML + W, 284)
+        pdf.set_font('Helvetica', '', 6)
+        pdf.set_text_color(*GRIGIO_MEDIO)
+        pdf.set_xy(ML, 285)
+        pdf.cell(W * 0.33, 4, f'POS - {pulisci_testo(self.ragione_sociale, 30)}', align='L')
+        pdf.cell(W * 0.34, 4, f'Pag. {num_pagina}', align='C')
+        pdf.cell(W * 0.33, 4, 'Generato con POS Facile', align='R')
+        pdf.set_text_color(0, 0, 0)
+        pdf.set_draw_color(0, 0, 0)
+
+    def disegna(self, pagine: list) -> FPDF:
+        """Fase di rendering: disegna le pagine gia impaginate."""
+        pdf = FPDF()
+        pdf.set_auto_page_break(auto=False)
+        for num, pagina in enumerate(pagine, start=1):
+            pdf.add_page()
+            pdf.set_left_margin(ML)
+            pdf.set_right_margin(MR)
+            if num > 1:
+                self._intestazione(pdf, num)
+            for y, blocco in pagina:
+                pdf.set_y(y)
+                blocco.disegna(pdf, y)
+        return pdf
+
+    def genera(self) -> bytes:
+        """Impagina e disegna il documento, restituendo i bytes del PDF."""
+        return bytes(self.disegna(self.impagina()).output())
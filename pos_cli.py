@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+POS FACILE - Riga di comando
+Genera POS senza avviare l'interfaccia Streamlit.
+
+    python pos_cli.py generate input.json -o out.pdf
+    python pos_cli.py lavorazioni
+
+input.json contiene gli stessi dati raccolti dalle fasi dell'app:
+    {"ditta": {...}, "cantiere": {...}, "addetti": {...}, "lavorazioni": ["..."],
+     "lavoratori": [...], "attrezzature": [...], "sostanze": [...], "rischi_ai": {...},
+     "lavorazioni_personalizzate": {"chiave": {"nome": "...", "rischi": [...], ...}}}
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from catalogo import sovrapponi_lavorazioni
+from pos_engine import genera_pdf_pos
+
+
+def _leggi_input(percorso: str) -> dict:
+    if percorso == '-':
+        return json.load(sys.stdin)
+    with open(percorso, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def cmd_generate(args) -> int:
+    try:
+        dati = _leggi_input(args.input)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Errore lettura {args.input}: {e}", file=sys.stderr)
+        return 2
+
+    personalizzate = dati.get('lavorazioni_personalizzate') or None
+    dizionario, _ = sovrapponi_lavorazioni(personalizzate)
+    lavorazioni = dati.get('lavorazioni') or []
+    sconosciute = [k for k in lavorazioni if k not in dizionario]
+    if sconosciute:
+        print(f"Lavorazioni sconosciute ignorate: {', '.join(sconosciute)}", file=sys.stderr)
+    lavorazioni = [k for k in lavorazioni if k in dizionario]
+    if not lavorazioni:
+        print("Nessuna lavorazione valida (vedi: python pos_cli.py lavorazioni)", file=sys.stderr)
+        return 2
+
+    inizio = time.perf_counter()
+    pdf_bytes = genera_pdf_pos(
+        dati.get('ditta') or {},
+        dati.get('cantiere') or {},
+        dati.get('addetti') or {},
+        lavorazioni,
+        dati.get('rischi_ai'),
+        dati.get('lavoratori') or [],
+        dati.get('attrezzature') or [],
+        dati.get('sostanze') or [],
+        personalizzate,
+    )
+    if args.output == '-':
+        sys.stdout.buffer.write(pdf_bytes)
+    else:
+        with open(args.output, 'wb') as f:
+            f.write(pdf_bytes)
+        print(f"{args.output}: {len(pdf_bytes)} byte in {time.perf_counter() - inizio:.2f}s", file=sys.stderr)
+    return 0
+
+
+def cmd_lavorazioni(args) -> int:
+    dizionario, _ = sovrapponi_lavorazioni(None)
+    for chiave, dati in dizionario.items():
+        print(f"{chiave}\t{dati.get('nome', '')}")
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python pos_cli.py', description='Generatore POS D.Lgs 81/08')
+    comandi = parser.add_subparsers(dest='comando', required=True)
+
+    p_generate = comandi.add_parser('generate', help='genera un POS da un file JSON')
+    p_generate.add_argument('input', help="file JSON con i dati del POS ('-' = stdin)")
+    p_generate.add_argument('-o', '--output', default='POS.pdf', help="PDF di destinazione ('-' = stdout)")
+    p_generate.set_defaults(funzione=cmd_generate)
+
+    p_lavorazioni = comandi.add_parser('lavorazioni', help='elenca le lavorazioni disponibili')
+    p_lavorazioni.set_defaults(funzione=cmd_lavorazioni)
+
+    args = parser.parse_args(argv)
+    return args.funzione(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,1258 @@
+# -*- coding: utf-8 -*-
+"""
+POS FACILE - Motore di generazione POS
+Dizionario lavorazioni, testi legali e genera_pdf_pos, senza dipendenze da
+Streamlit: importabile da app.py, dalla generazione in serie (batch_pos.py)
+e dalla riga di comando (pos_cli.py). Il dizionario e i testi legali vengono
+dal catalogo versionato (catalogo.py), letto al primo utilizzo e non
+all'import del modulo.
+"""
+
+import re
+from datetime import date, timedelta
+
+from catalogo import SOVRAPPOSIZIONI_MAX, get_catalogo, sovrapponi_lavorazioni
+from pdf_layout import (
+    CacheLRU, Documento, blocchi_statici, pulisci_testo, W, ML,
+    ARANCIONE, ARANCIONE_CHIARO, BLU_SCURO, BLU_MEDIO, BLU_CHIARO, BIANCO,
+    GRIGIO_SCURO, GRIGIO_MEDIO, GRIGIO_CHIARO, GRIGIO_BORDO,
+    ROSSO_BADGE, ROSSO_CHIARO, GIALLO_BADGE, GIALLO_CHIARO, VERDE_BADGE, VERDE_CHIARO,
+)
+
+
+# ==============================================================================
+# CATALOGO LAVORAZIONI E TESTI LEGALI (catalogo_lavorazioni.json, vedi catalogo.py)
+# ==============================================================================
+
+# DIZIONARIO_LAVORAZIONI, TESTI_LEGALI, DIZIONARIO_VERSIONE (impronta del
+# dizionario, chiave delle cache) e INDICE_DIZIONARIO restano attributi del
+# modulo, ma risolti al primo accesso (__getattr__): importare pos_engine non
+# legge il catalogo. Dentro il modulo si usa get_catalogo().
+_ATTRIBUTI_CATALOGO = {
+    'DIZIONARIO_LAVORAZIONI': 'lavorazioni',
+    'TESTI_LEGALI': 'testi_legali',
+    'DIZIONARIO_VERSIONE': 'versione',
+}
+
+
+def __getattr__(nome):
+    if nome in _ATTRIBUTI_CATALOGO:
+        return get_catalogo()[_ATTRIBUTI_CATALOGO[nome]]
+    if nome == 'INDICE_DIZIONARIO':
+        catalogo = get_catalogo()
+        return indice_dizionario(catalogo['lavorazioni'], catalogo['versione'])
+    raise AttributeError(f"module {__name__!r} has no attribute {nome!r}")
+
+
+# ==============================================================================
+# INDICI DEL DIZIONARIO (costruiti una volta per versione)
+# ==============================================================================
+
+# Parole chiave dei rischi usate per scartare i rischi AI gia coperti dalle schede
+PAROLE_CHIAVE_RISCHI = (
+    'caduta', 'rumore', 'polveri', 'vibrazioni', 'chimico', 'elettrico',
+    'schegge', 'ustioni', 'tagli', 'crollo', 'inalazione', 'dermatiti',
+    'posture', 'scivolamento', 'urti', 'abrasioni',
+)
+
+
+def chiave_dpi(nome: str) -> str:
+    """Normalizza il nome di un DPI per la deduplicazione nella matrice DPI."""
+    n = nome.lower().strip()
+    n = n.replace('professionali', '').replace('professionale', '')
+    n = n.replace('antipolvere ', '').replace('per fumi', 'FFP2')
+    n = n.replace('per vapori organici', 'vapori org.')
+    while '  ' in n:
+        n = n.replace('  ', ' ')
+    return n.strip()
+
+
+def _valori_esposizione(dati: dict, chiave_val: str, unita: str, unita_rischi: str) -> tuple:
+    """
+    Valori di esposizione (rumore o vibrazioni) di una lavorazione:
+    (da valori_esposizione, dalle descrizioni dei rischi). I secondi si usano
+    solo se la lavorazione non ha i primi.
+    """
+    primari = tuple(dict.fromkeys(
+        v for k, v in dati.get('valori_esposizione', {}).items()
+        if chiave_val in k.lower() or unita in str(v).lower()
+    ))
+    da_rischi = tuple(dict.fromkeys(
+        r.get('descrizione', '') for r in dati.get('rischi', [])
+        if chiave_val in r.get('nome', '').lower() and unita_rischi in r.get('descrizione', '')
+    ))
+    return primari, da_rischi
+
+
+def indicizza_dizionario(dizionario: dict) -> dict:
+    """
+    Indici per le sezioni del PDF, cosi i builder fanno lookup invece di
+    ripercorrere il dizionario:
+    - 'rischi': parola chiave -> lavorazioni con un rischio che la contiene
+    - 'dpi': lavorazione -> ((chiave_dpi, nome, norma), ...)
+    - 'rumore' / 'vibrazioni': lavorazione -> (valori primari, valori dai rischi)
+    """
+    indice = {'rischi': {}, 'dpi': {}, 'rumore': {}, 'vibrazioni': {}}
+    for lav_key, dati in dizionario.items():
+        for r in dati.get('rischi', []):
+            nome_lower = (r.get('nome', '') or '').lower()
+            for kw in PAROLE_CHIAVE_RISCHI:
+                if kw in nome_lower:
+                    indice['rischi'].setdefault(kw, set()).add(lav_key)
+        dpi_lav = []
+        for dpi in dati.get('dpi_obbligatori', []):
+            if isinstance(dpi, dict):
+                nome_dpi, norma_dpi = dpi.get('nome', ''), dpi.get('norma', '')
+            else:
+                nome_dpi, norma_dpi = str(dpi), ''
+            if nome_dpi:
+                dpi_lav.append((chiave_dpi(nome_dpi), nome_dpi, norma_dpi))
+        indice['dpi'][lav_key] = tuple(dpi_lav)
+        indice['rumore'][lav_key] = _valori_esposizione(dati, 'rumore', 'db', 'dB')
+        indice['vibrazioni'][lav_key] = _valori_esposizione(dati, 'vibrazion', 'm/s', 'm/s')
+    indice['rischi'] = {kw: frozenset(lavs) for kw, lavs in indice['rischi'].items()}
+    return indice
+
+
+_indici = CacheLRU(SOVRAPPOSIZIONI_MAX + 1)  # versione -> indice (catalogo base e personalizzati)
+
+
+def indice_dizionario(dizionario: dict, versione: str) -> dict:
+    """Indice di un dizionario (base o con lavorazioni personalizzate), costruito una volta per versione."""
+    indice = _indici.get(versione)
+    if indice is None:
+        indice = indicizza_dizionario(dizionario)
+        _indici.put(versione, indice)
+    return indice
+
+
+# ==============================================================================
+# PDF
+# ==============================================================================
+def scheda_rischi(doc, dati):
+    """
+    Scheda di valutazione rischi di una lavorazione (Sez. 13): rischi, DPI e misure.
+    Dipende solo dalla voce del dizionario lavorazioni, per questo genera_pdf_pos
+    la prende dalla cache delle schede invece di ricostruirla a ogni POS.
+    """
+    doc.check_spazio(80)
+    doc.ln(4)
+
+    # Nome lavorazione con barra laterale
+    def disegna_nome_fase(pdf, y, nome=dati.get('nome', '')):
+        pdf.set_fill_color(*ARANCIONE)
+        pdf.rect(ML, y, 3, 7, 'F')
+        pdf.set_fill_color(*ARANCIONE_CHIARO)
+        pdf.rect(ML + 3, y, W - 3, 7, 'F')
+        pdf.set_font('Helvetica', 'B', 10)
+        pdf.set_text_color(*BLU_SCURO)
+        pdf.set_xy(ML + 7, y + 1)
+        pdf.cell(W - 10, 5, pulisci_testo(nome, 70))
+        pdf.set_text_color(0, 0, 0)
+
+    doc.disegno(disegna_nome_fase, altezza=9)
+
+    # Descrizione tecnica
+    doc.testo(pulisci_testo(dati.get('descrizione_tecnica', ''), 300), x=ML + 2, w=W - 4, h=3.5,
+              size=8, stile='I', colore=GRIGIO_MEDIO)
+    doc.ln(2)
+
+    # Valori esposizione (se presenti)
+    if dati.get('valori_esposizione'):
+        doc.check_spazio(20)
+        doc.banda('  VALORI ESPOSIZIONE', GIALLO_CHIARO, GIALLO_BADGE)
+        for t, v in dati['valori_esposizione'].items():
+            doc.riga(f'{t.upper()}: {v}', size=8, h=4, spazio=0, pulisci=False)
+        doc.ln(2)
+
+    # --- RISCHI ---
+    doc.check_spazio(35)
+    doc.banda('  RISCHI IDENTIFICATI', BLU_SCURO, BIANCO)
+    doc.ln(1)
+
+    for r in dati.get('rischi', []):
+        grav = r.get('gravita', 'M')[0]
+
+        # Badge gravita con colori
+        if grav == 'A':
+            badge_color = ROSSO_BADGE
+            row_color = ROSSO_CHIARO
+        elif grav == 'M':
+            badge_color = GIALLO_BADGE
+            row_color = GIALLO_CHIARO
+        else:
+            badge_color = VERDE_BADGE
+            row_color = VERDE_CHIARO
+
+        def disegna_rischio(pdf, y, r=r, grav=grav, badge_color=badge_color, row_color=row_color):
+            # Sfondo riga
+            pdf.set_fill_color(*row_color)
+            pdf.rect(ML, y, W, 6, 'F')
+            # Badge
+            pdf.set_fill_color(*badge_color)
+            pdf.rect(ML + 1, y + 0.8, 8, 4.4, 'F')
+            pdf.set_font('Helvetica', 'B', 7)
+            pdf.set_text_color(255, 255, 255)
+            pdf.set_xy(ML + 1, y + 0.8)
+            pdf.cell(8, 4.4, f' {grav}', align='C')
+
+            # Testo rischio
+            pdf.set_text_color(*GRIGIO_SCURO)
+            pdf.set_font('Helvetica', 'B', 8)
+            pdf.set_xy(ML + 11, y)
+            nome_rischio = pulisci_testo(r.get('nome', ''), 30)
+            desc_rischio = pulisci_testo(r.get('descrizione', ''), 65)
+            norm = pulisci_testo(r.get('normativa', ''), 30)
+            testo = f"{nome_rischio}: "
+            pdf.cell(pdf.get_string_width(testo), 6, testo, ln=0)
+            pdf.set_font('Helvetica', '', 8)
+            testo_desc = desc_rischio
+            if norm:
+                testo_desc += f" ({norm})"
+            pdf.cell(W - 13 - pdf.get_string_width(testo), 6, testo_desc[:90], ln=1)
+            pdf.set_text_color(0, 0, 0)
+
+        doc.disegno(disegna_rischio, altezza=6.5, spazio=8)
+
+    doc.ln(2)
+
+    # --- DPI OBBLIGATORI ---
+    doc.check_spazio(30)
+    doc.banda('  DPI OBBLIGATORI', BLU_CHIARO, (44, 82, 160))
+    doc.ln(1)
+    for dpi in dati.get('dpi_obbligatori', []):
+        if isinstance(dpi, dict):
+            txt = f"  - {pulisci_testo(dpi.get('nome', ''), 35)} [{pulisci_testo(dpi.get('norma', ''), 25)}]"
+        else:
+            txt = f"  - {pulisci_testo(str(dpi), 70)}"
+        doc.riga(txt[:100], size=8, x=ML + 2, w=W - 4, spazio=5, pulisci=False)
+
+    doc.ln(2)
+
+    # --- MISURE PREVENZIONE ---
+    doc.check_spazio(30)
+    doc.banda('  MISURE DI PREVENZIONE E PROTEZIONE', VERDE_CHIARO, VERDE_BADGE)
+    doc.ln(1)
+    for m in dati.get('misure_prevenzione', []):
+        doc.riga(f"  - {pulisci_testo(str(m), 100)}", size=8, x=ML + 2, w=W - 4, spazio=5, pulisci=False)
+
+    doc.ln(3)
+
+
+def genera_pdf_pos(ditta, cantiere, addetti, lavorazioni, rischi_ai=None, lavoratori=None, attrezzature=None, sostanze=None,
+                   lavorazioni_personalizzate=None):
+    """
+    Genera PDF POS professionale e completo - Conforme Allegato XV D.Lgs 81/08 - V2 GRAFICA MIGLIORATA
+    Il documento viene prima descritto come sequenza di blocchi (pdf_layout.Documento),
+    poi impaginato e disegnato in un unico passaggio.
+    lavorazioni_personalizzate: voci dell'utente sovrapposte al catalogo (vedi catalogo.py)
+    """
+
+    doc = Documento(ditta.get('ragione_sociale', ''))
+
+    dizionario, versione = sovrapponi_lavorazioni(lavorazioni_personalizzate)
+    indice = indice_dizionario(dizionario, versione)
+    testi_legali = get_catalogo()['testi_legali']
+
+    lavoratori = lavoratori or []
+    attrezzature = attrezzature or []
+    sostanze = sostanze or []
+
+    # ===================== HELPER =====================
+    # Gli helper aggiungono blocchi al modello: niente viene disegnato qui
+    check_spazio = doc.check_spazio
+    nuova_pagina = doc.nuova_pagina
+    titolo_sezione = doc.titolo_sezione
+    campo = doc.campo
+    paragrafo = doc.paragrafo
+    sottotitolo = doc.sottotitolo
+    riga = doc.riga
+    nota = doc.nota
+    banda = doc.banda
+    tabella_header = doc.tabella_header
+    tabella_riga = doc.tabella_riga
+    disegno = doc.disegno
+
+    # ==================== COPERTINA ====================
+    def disegna_copertina(pdf, y):
+        # Banda superiore blu scuro
+        pdf.set_fill_color(*BLU_SCURO)
+        pdf.rect(0, 0, 210, 75, 'F')
+
+        # Linea decorativa arancione
+        pdf.set_fill_color(*ARANCIONE)
+        pdf.rect(0, 75, 210, 3, 'F')
+
+        # Titolo grande
+        pdf.set_font('Helvetica', 'B', 32)
+        pdf.set_text_color(255, 255, 255)
+        pdf.set_xy(ML + 5, 18)
+        pdf.cell(W - 10, 14, 'PIANO OPERATIVO', ln=1)
+        pdf.set_xy(ML + 5, 32)
+        pdf.cell(W - 10, 14, 'DI SICUREZZA', ln=1)
+
+        # Sottotitolo normativo
+        pdf.set_font('Helvetica', '', 11)
+        pdf.set_text_color(*ARANCIONE)
+        pdf.set_xy(ML + 5, 52)
+        pdf.cell(W - 10, 6, 'ai sensi del D.Lgs 81/2008', ln=1)
+        pdf.set_font('Helvetica', '', 9)
+        pdf.set_text_color(180, 190, 210)
+        pdf.set_xy(ML + 5, 59)
+        pdf.cell(W - 10, 5, 'Titolo IV - Capo I - Allegato XV, punto 3.2', ln=1)
+
+        pdf.set_text_color(0, 0, 0)
+        pdf.set_y(88)
+
+        # Box informativi copertina - design card
+        def box_copertina(etichetta, righe_dati, y_start):
+            pdf.set_y(y_start)
+            # Etichetta
+            pdf.set_font('Helvetica', 'B', 7)
+            pdf.set_text_color(*ARANCIONE)
+            pdf.set_x(ML + 5)
+            pdf.cell(W, 4, etichetta.upper(), ln=1)
+            # Linea
+            pdf.set_draw_color(*GRIGIO_BORDO)
+            pdf.line(ML + 5, pdf.get_y(), ML + 80, pdf.get_y())
+            pdf.set_draw_color(0, 0, 0)
+            pdf.ln(2)
+            # Dati
+            pdf.set_text_color(*GRIGIO_SCURO)
+            first = True
+            for v in righe_dati:
+                if v:
+                    if first:
+                        pdf.set_font('Helvetica', 'B', 11)
+                        first = False
+                    else:
+                        pdf.set_font('Helvetica', '', 9)
+                    pdf.set_x(ML + 5)
+                    pdf.cell(W, 5, pulisci_testo(v, 80), ln=1)
+            pdf.set_text_color(0, 0, 0)
+            return pdf.get_y() + 4
+
+        y = 88
+        y = box_copertina('IMPRESA ESECUTRICE', [
+            ditta.get('ragione_sociale', ''),
+            f"P.IVA/C.F.: {ditta.get('piva_cf', '')}",
+            ditta.get('indirizzo', '')
+        ], y)
+
+        y = box_copertina('CANTIERE', [
+            cantiere.get('indirizzo', ''),
+            f"Committente: {cantiere.get('committente', '')}",
+            f"Durata prevista: {cantiere.get('durata', '')}"
+        ], y)
+
+        y = box_copertina('RESPONSABILI SICUREZZA', [
+            f"Datore di Lavoro: {ditta.get('datore_lavoro', '')}",
+            f"RSPP: {ditta.get('rspp', '') or ditta.get('datore_lavoro', '')}",
+            f"Medico Competente: {ditta.get('medico', '') or 'Non previsto'}"
+        ], y)
+
+        # Data e revisione in fondo copertina
+        pdf.set_y(255)
+        pdf.set_draw_color(*GRIGIO_BORDO)
+        pdf.line(ML, 254, ML + W, 254)
+        pdf.set_draw_color(0, 0, 0)
+
+        pdf.set_font('Helvetica', '', 9)
+        pdf.set_text_color(*GRIGIO_MEDIO)
+        pdf.set_x(ML)
+        pdf.cell(W * 0.5, 5, f"Data emissione: {date.today().strftime('%d/%m/%Y')}", align='L')
+        pdf.cell(W * 0.5, 5, f"Rev. 00", align='R', ln=1)
+        pdf.set_text_color(0, 0, 0)
+
+        # Footer copertina
+        pdf.set_y(275)
+        pdf.set_font('Helvetica', '', 6)
+        pdf.set_text_color(*GRIGIO_MEDIO)
+        pdf.set_x(ML)
+        pdf.cell(W, 4, 'Documento generato con POS Facile - www.posfacile.it', align='C')
+        pdf.set_text_color(0, 0, 0)
+
+    disegno(disegna_copertina, altezza=0)
+
+    # ==================== SOMMARIO ====================
+    nuova_pagina()
+
+    # Build sommario entries - numbered sections
+    sommario_voci = [
+        ('1', 'Premessa Normativa'),
+        ('2', 'Identificazione Impresa Esecutrice'),
+        ('3', 'Identificazione Cantiere'),
+        ('4', 'Mansioni Inerenti la Sicurezza'),
+        ('5', 'Elenco Lavoratori Impiegati'),
+        ('6', 'Formazione e Addestramento'),
+        ('7', 'Attrezzature di Cantiere'),
+        ('8', 'Sostanze e Miscele Pericolose'),
+        ('9', 'Organizzazione del Cantiere'),
+        ('10', 'Condizioni Climatiche - Macroclima'),
+        ('11', 'Cronoprogramma Lavori'),
+        ('12', 'Metodologia di Valutazione dei Rischi'),
+        ('13', 'Valutazione dei Rischi per Fase Lavorativa'),
+        ('14', 'Esiti Valutazione Rumore e Vibrazioni'),
+        ('15', 'Matrice DPI per Mansione'),
+        ('16', 'Coordinamento e Procedure PSC'),
+        ('17', 'Gestione Emergenze'),
+        ('18', 'Checklist Allegati'),
+        ('19', 'Dichiarazione e Firme'),
+        ('20', 'Verbale di Presa Visione e Consegna DPI'),
+    ]
+
+    def disegna_sommario(pdf, y):
+        pdf.set_y(y + 2)
+        pdf.set_font('Helvetica', 'B', 14)
+        pdf.set_text_color(*BLU_SCURO)
+        pdf.set_x(ML)
+        pdf.cell(W, 8, 'SOMMARIO', ln=1)
+        pdf.set_text_color(0, 0, 0)
+
+        pdf.set_draw_color(*ARANCIONE)
+        pdf.line(ML, pdf.get_y(), ML + 40, pdf.get_y())
+        pdf.set_draw_color(0, 0, 0)
+        pdf.ln(6)
+
+        for num, titolo_voce in sommario_voci:
+            pdf.set_font('Helvetica', 'B', 9)
+            pdf.set_text_color(*BLU_SCURO)
+            pdf.set_x(ML + 2)
+            num_txt = f"Sez. {num}"
+            pdf.cell(18, 5.5, num_txt, ln=0)
+            pdf.set_font('Helvetica', '', 9)
+            pdf.set_text_color(*GRIGIO_SCURO)
+            # Dots leader
+            titolo_corto = pulisci_testo(titolo_voce, 60)
+            pdf.cell(W - 20, 5.5, titolo_corto, ln=1)
+            pdf.set_text_color(0, 0, 0)
+
+        pdf.ln(4)
+        pdf.set_draw_color(*GRIGIO_BORDO)
+        pdf.line(ML, pdf.get_y(), ML + W, pdf.get_y())
+        pdf.set_draw_color(0, 0, 0)
+        pdf.ln(3)
+        pdf.set_font('Helvetica', 'I', 7)
+        pdf.set_text_color(*GRIGIO_MEDIO)
+        pdf.set_x(ML)
+        pdf.cell(W, 4, 'Contenuti minimi conformi all\'Allegato XV, punto 3.2, lettere da a) a l), D.Lgs 81/2008 e s.m.i.', ln=1)
+        pdf.set_text_color(0, 0, 0)
+
+    disegno(disegna_sommario, statico='sommario')
+
+    # ==================== SEZ. 1: PREMESSA NORMATIVA ====================
+    nuova_pagina()
+    num_sez = 1
+    titolo_sezione(str(num_sez), 'Premessa Normativa')
+
+    sottotitolo('Riferimenti Legislativi')
+    paragrafo(testi_legali['premessa_estesa'], statico=True)
+
+    doc.ln(2)
+    sottotitolo('Contenuti del POS - Allegato XV, punto 3.2')
+    paragrafo(testi_legali['contenuti_allegato_xv'], size=8, statico=True)
+
+    # ==================== SEZ. 2: DATI IMPRESA ====================
+    num_sez += 1
+    titolo_sezione(str(num_sez), 'Identificazione Impresa Esecutrice')
+    campo('Ragione Sociale', ditta.get('ragione_sociale', ''))
+    campo('P.IVA / C.F.', ditta.get('piva_cf', ''))
+    campo('Sede Legale', ditta.get('indirizzo', ''))
+    campo('Telefono', ditta.get('telefono', '') or 'N.D.')
+    if ditta.get('codice_ateco'):
+        campo('Codice ATECO', ditta.get('codice_ateco', ''))
+    if ditta.get('num_dipendenti'):
+        campo('N. Dipendenti', ditta.get('num_dipendenti', ''))
+
+    doc.ln(2)
+    sottotitolo('Figure della Sicurezza')
+    campo('Datore di Lavoro', ditta.get('datore_lavoro', ''))
+    rspp = f"{ditta.get('datore_lavoro', '')} (Art. 34 D.Lgs 81/08)" if ditta.get('rspp_autonomo', True) else ditta.get('rspp', '')
+    campo('RSPP', rspp)
+    campo('Medico Competente', ditta.get('medico', '') or 'Non previsto')
+    campo('Addetto Primo Soccorso', addetti.get('primo_soccorso', ''))
+    campo('Addetto Antincendio', addetti.get('antincendio', ''))
+
+    dtc = ditta.get('direttore_tecnico', '') or ditta.get('datore_lavoro', '')
+    campo('Direttore Tecnico / Capocantiere', dtc)
+
+    rls_tipo = ditta.get('rls_tipo', 'non_eletto')
+    if rls_tipo == 'interno_eletto':
+        campo('RLS', ditta.get('rls_nome', ''))
+    elif rls_tipo == 'territoriale':
+        campo('RLST', ditta.get('rls_territoriale', ''))
+    else:
+        campo('RLS', 'Non eletto (< 15 dip.) - Funzioni RLST')
+
+    # ==================== SEZ. 3: CANTIERE ====================
+    num_sez += 1
+    titolo_sezione(str(num_sez), 'Identificazione Cantiere')
+    campo('Indirizzo', cantiere.get('indirizzo', ''))
+    campo('Committente', cantiere.get('committente', ''))
+    campo('Durata', cantiere.get('durata', ''))
+    campo('Data Inizio', cantiere.get('data_inizio', ''))
+    campo('Orario Lavoro', cantiere.get('orario_lavoro', '08:00-12:00 / 13:00-17:00'))
+    campo('Giorni', cantiere.get('giorni_lavoro', 'Lun-Ven'))
+    if cantiere.get('cse'):
+        campo('CSE', cantiere.get('cse', ''))
+    if cantiere.get('csp'):
+        campo('CSP', cantiere.get('csp', ''))
+
+    sottotitolo('Descrizione Opere')
+    paragrafo(cantiere.get('descrizione', ''))
+
+    # ==================== SEZ. 4: MANSIONI SICUREZZA ====================
+    num_sez += 1
+    titolo_sezione(str(num_sez), 'Mansioni Inerenti la Sicurezza')
+
+    nota('Allegato XV, punto 3.2, lettera b): Specifiche mansioni inerenti la sicurezza svolte in cantiere da ogni figura.')
+    doc.ln(2)
+
+    # Tabella mansioni sicurezza
+    mansioni_data = [
+        ('Datore di Lavoro', ditta.get('datore_lavoro', ''), testi_legali['mansioni_ddl']),
+        ('RSPP', rspp, testi_legali['mansioni_rspp']),
+        ('Preposto / DTC', dtc, testi_legali['mansioni_preposto']),
+        ('Addetto Primo Soccorso', addetti.get('primo_soccorso', ''), testi_legali['mansioni_ps']),
+        ('Addetto Antincendio', addetti.get('antincendio', ''), testi_legali['mansioni_antincendio']),
+    ]
+
+    rls_tipo = ditta.get('rls_tipo', 'non_eletto')
+    if rls_tipo == 'interno_eletto':
+        mansioni_data.append(('RLS', ditta.get('rls_nome', ''), testi_legali['mansioni_rls']))
+    elif rls_tipo == 'territoriale':
+        mansioni_data.append(('RLST', ditta.get('rls_territoriale', ''), testi_legali['mansioni_rls']))
+
+    mansioni_data.append(('Lavoratori', f"{len(lavoratori)} impiegati in cantiere", testi_legali['mansioni_lavoratore']))
+
+    for figura, nome_persona, compiti in mansioni_data:
+        check_spazio(35)
+
+        # Header figura
+        def disegna_figura(pdf, y, figura=figura, nome_persona=nome_persona):
+            pdf.set_fill_color(*BLU_CHIARO)
+            pdf.rect(ML, y, W, 6, 'F')
+            pdf.set_fill_color(*BLU_SCURO)
+            pdf.rect(ML, y, 3, 6, 'F')
+            pdf.set_font('Helvetica', 'B', 8)
+            pdf.set_text_color(*BLU_SCURO)
+            pdf.set_xy(ML + 6, y + 0.5)
+            pdf.cell(60, 5, pulisci_testo(figura, 30))
+            pdf.set_font('Helvetica', '', 8)
+            pdf.set_text_color(*GRIGIO_SCURO)
+            pdf.cell(W - 68, 5, pulisci_testo(nome_persona, 60))
+            pdf.set_text_color(0, 0, 0)
+
+        disegno(disegna_figura, altezza=7)
+        # Compiti
+        doc.testo(pulisci_testo(compiti, 500), x=ML + 4, w=W - 8, h=3.2, size=7)
+        doc.ln(2)
+
+    # ==================== SEZ. 5: LAVORATORI ====================
+    num_sez += 1
+    titolo_sezione(str(num_sez), 'Elenco Lavoratori Impiegati')
+
+    if lavoratori:
+        nota('Allegato XV, punto 3.2, lettera a.7): Numero e relative qualifiche dei lavoratori dipendenti.')
+        doc.ln(2)
+
+        cols = [('Nome e Cognome', 52), ('Mansione', 38), ('Formazione', 50), ('Idoneita Sanitaria', 46)]
+        tabella_header(cols)
+
+        for idx, lav in enumerate(lavoratori):
+            tabella_riga([
+                lav.get('nome', ''),
+                lav.get('mansione', ''),
+                lav.get('formazione', ''),
+                lav.get('idoneita', 'In corso')
+            ], cols, idx)
+
+        doc.ln(4)
+    else:
+        paragrafo('Lavoratori da definire prima dell\'inizio dei lavori.', statico=True)
+
+    # ==================== SEZ. 6: FORMAZIONE ====================
+    num_sez += 1
+    titolo_sezione(str(num_sez), 'Formazione e Addestramento')
+
+    nota('Allegato XV, punto 3.2, lettera l): Documentazione in merito all\'informazione e formazione fornite ai lavoratori.')
+    doc.ln(2)
+
+    paragrafo("Tutti i lavoratori impiegati in cantiere sono in possesso degli attestati di formazione previsti dall'Accordo Stato-Regioni del 21/12/2011 e s.m.i. La formazione comprende il modulo generale (4 ore) e il modulo specifico rischio alto (12 ore) per il settore edile (ATECO F). L'aggiornamento quinquennale e regolarmente effettuato.", size=8, statico=True)
+
+    if lavoratori:
+        doc.ln(2)
+        sottotitolo('Matrice Formazione Lavoratori')
+
+        # Colonne matrice formazione
+        form_cols = [('Lavoratore', 40), ('Base', 15), ('Spec.', 15), ('PS', 14), ('AI', 14), ('RLS', 14), ('Gru', 14), ('Quota', 15), ('Pont.', 15), ('Macc.', 15), ('DPI 3a', 15)]
+        form_align = ['L'] + ['C'] * (len(form_cols) - 1)
+
+        # Header
+        tabella_header(form_cols, size=6, prefisso='', align='C')
+
+        for idx, lav in enumerate(lavoratori):
+            nome = pulisci_testo(lav.get('nome', ''), 18)
+            mansione = lav.get('mansione', '').lower()
+
+            # Determine formation based on role
+            is_ps = addetti.get('primo_soccorso', '').lower() in lav.get('nome', '').lower() if addetti.get('primo_soccorso') else False
+            is_ai = addetti.get('antincendio', '').lower() in lav.get('nome', '').lower() if addetti.get('antincendio') else False
+            is_rls = (rls_tipo == 'interno_eletto' and ditta.get('rls_nome', '').lower() in lav.get('nome', '').lower())
+
+            valori = [
+                nome,       # Nome
+                'Si',       # Base (always)
+                'Si',       # Specifico (always for construction)
+                'Si' if is_ps else '--',  # PS
+                'Si' if is_ai else '--',  # AI
+                'Si' if is_rls else '--', # RLS
+                'Si' if 'gru' in mansione else '--',  # Gru
+                'Si' if any(k in mansione for k in ['quota', 'pont', 'coperto', 'tetto']) else '--',  # Quota
+                'Si' if 'pont' in mansione else '--',  # Ponteggi
+                'Si' if any(k in mansione for k in ['escavat', 'macchina', 'operatore']) else '--',  # Macchine
+                '--',  # DPI 3a cat
+            ]
+
+            tabella_riga(valori, form_cols, idx, h=5.5, size=6, prefisso='', allinea=form_align, pulisci=False)
+
+        doc.ln(2)
+        nota('Legenda: Base=Formazione generale 4h | Spec.=Rischio specifico 12h edilizia | PS=Primo Soccorso | AI=Antincendio | Quota=Lavori in quota h>2m', size=6, h=3.5)
+        nota('Pont.=Montaggio ponteggi | Macc.=Macchine movimento terra | DPI 3a=DPI terza categoria | Gli attestati sono allegati al presente POS.', size=6, h=3.5)
+
+    # ==================== SEZ. 7: ATTREZZATURE ====================
+    num_sez += 1
+    titolo_sezione(str(num_sez), 'Attrezzature di Cantiere')
+
+    nota('Allegato XV, punto 3.2, lettera d): Elenco ponteggi, ponti su ruote a torre, opere provvisionali, attrezzature, macchine e impianti.')
+    doc.ln(2)
+
+    if attrezzature:
+        cols = [('Attrezzatura', 50), ('Marca/Modello', 36), ('Matricola', 26), ('Libretti', 18), ('Verifica', 28), ('Uso Com.', 28)]
+        tabella_header(cols)
+
+        for idx, attr in enumerate(attrezzature):
+            tabella_riga([
+                attr.get('nome', ''),
+                attr.get('marca', ''),
+                attr.get('matricola', 'N.D.'),
+                'Si',
+                attr.get('verifica', 'Conforme'),
+                attr.get('uso_comune', 'No')
+            ], cols, idx)
+
+        doc.ln(2)
+        doc.testo("I libretti d'uso e manutenzione sono disponibili in cantiere. Le verifiche periodiche delle attrezzature soggette (Art. 71, comma 11, D.Lgs 81/08 e Allegato VII) sono regolarmente effettuate. I certificati di collaudo e le verifiche ASL/INAIL sono allegati al presente POS.",
+                  h=3.5, size=7, stile='I', colore=GRIGIO_MEDIO)
+        doc.ln(2)
+    else:
+        paragrafo('Attrezzature da definire prima dell\'inizio dei lavori. I libretti saranno resi disponibili in cantiere.', statico=True)
+
+    # ==================== SEZ. 8: SOSTANZE PERICOLOSE ====================
+    num_sez += 1
+    titolo_sezione(str(num_sez), 'Sostanze e Miscele Pericolose')
+
+    nota('Allegato XV, punto 3.2, lettera e): Elenco delle sostanze e miscele pericolose utilizzate con relative SDS.')
+    doc.ln(2)
+
+    if sostanze:
+        cols = [('Prodotto', 46), ('Produttore', 34), ('Frasi H', 44), ('Fase Utilizzo', 30), ('SDS', 32)]
+        tabella_header(cols)
+
+        for idx, sost in enumerate(sostanze):
+            tabella_riga([
+                sost.get('nome', ''),
+                sost.get('produttore', ''),
+                sost.get('frasi_h', 'Vedere SDS'),
+                sost.get('fase_utilizzo', 'Varie'),
+                'Allegata'
+            ], cols, idx)
+
+        doc.ln(2)
+        doc.testo("Le Schede Dati di Sicurezza (SDS) conformi al Reg. CE 1907/2006 (REACH) e al Reg. CE 1272/2008 (CLP) sono disponibili in cantiere e sono state consegnate ai lavoratori esposti. Le misure di prevenzione specifiche sono riportate nella sezione Valutazione Rischi.",
+                  h=3.5, size=7, stile='I', colore=GRIGIO_MEDIO)
+    else:
+        paragrafo("Non e previsto l'utilizzo di sostanze o miscele pericolose classificate ai sensi del Reg. CE 1272/2008 (CLP). Qualora nel corso dei lavori si rendesse necessario l'uso di tali prodotti, il presente POS sara aggiornato con le relative SDS.", statico=True)
+
+    # ==================== SEZ. 9: ORGANIZZAZIONE CANTIERE ====================
+    num_sez += 1
+    titolo_sezione(str(num_sez), 'Organizzazione del Cantiere')
+
+    nota('Allegato XV, punto 3.2, lettera c): Descrizione dell\'attivita, delle modalita organizzative e dei turni di lavoro.')
+    doc.ln(2)
+
+    sottotitolo('Accessi e Recinzione')
+    paragrafo(testi_legali['organizzazione_accessi'], statico=True)
+
+    sottotitolo('Viabilita Interna')
+    paragrafo(testi_legali['organizzazione_viabilita'], statico=True)
+
+    sottotitolo('Aree di Deposito Materiali')
+    paragrafo(testi_legali['organizzazione_depositi'], statico=True)
+
+    sottotitolo('Servizi Igienico-Assistenziali')
+    paragrafo(testi_legali['organizzazione_servizi'], statico=True)
+
+    sottotitolo("Obblighi dell'Impresa")
+    paragrafo(testi_legali['obblighi_impresa'], statico=True)
+
+    sottotitolo('Documentazione in Cantiere')
+    docs = ["POS vidimato", "PSC (se previsto)", "DUVRI (se previsto)", "Registro infortuni",
+            "Libretti attrezzature", "SDS prodotti", "Attestati formazione", "Idoneita sanitarie",
+            "Tesserini riconoscimento", "Verbali consegna DPI"]
+    for voce_doc in docs:
+        riga('- ' + voce_doc)
+
+    # ==================== SEZ. 10: MACROCLIMA ====================
+    num_sez += 1
+    titolo_sezione(str(num_sez), 'Condizioni Climatiche - Macroclima')
+
+    paragrafo("Il Datore di Lavoro valuta i rischi derivanti dalle condizioni climatiche stagionali (Art. 28, comma 1, D.Lgs 81/08) e adotta le misure di prevenzione e protezione conseguenti, in funzione del periodo di esecuzione dei lavori.", size=8, statico=True)
+
+    doc.ln(1)
+    sottotitolo('Periodo Estivo - Rischio Colpo di Calore')
+    paragrafo(testi_legali['macroclima_estate'], size=8, statico=True)
+
+    sottotitolo('Periodo Invernale - Rischio Ipotermia')
+    paragrafo(testi_legali['macroclima_inverno'], size=8, statico=True)
+
+    # ==================== SEZ. 11: CRONOPROGRAMMA ====================
+    if lavorazioni:
+        num_sez += 1
+        titolo_sezione(str(num_sez), 'Cronoprogramma Lavori')
+
+        nota('Sequenza indicativa delle fasi lavorative (da adattare in base all\'avanzamento effettivo):')
+        doc.ln(3)
+
+        cols = [('#', 10), ('Fase Lavorativa', 80), ('Periodo Indicativo', 48), ('Note', 48)]
+        tabella_header(cols)
+
+        durata_totale = cantiere.get('durata', '30 giorni')
+        match = re.search(r'(\d+)', durata_totale)
+        giorni_totali = int(match.group(1)) if match else 30
+        giorni_per_fase = max(3, giorni_totali // len(lavorazioni)) if lavorazioni else 5
+        giorno_corrente = 1
+
+        for idx, lav_key in enumerate(lavorazioni):
+            if lav_key not in dizionario:
+                continue
+            dati = dizionario[lav_key]
+            nome_fase = dati.get('nome', '')
+            giorno_fine = min(giorno_corrente + giorni_per_fase - 1, giorni_totali)
+            periodo = f"Giorno {giorno_corrente} - {giorno_fine}"
+
+            tabella_riga([str(idx + 1), nome_fase, periodo, ' '], cols, idx)
+            giorno_corrente = giorno_fine + 1
+
+        doc.ln(3)
+        nota('Nota: Le fasi possono sovrapporsi. Il cronoprogramma effettivo sara concordato con il CSE (ove previsto).', size=7)
+
+    # ==================== SEZ. 12: METODOLOGIA RISCHI ====================
+    num_sez += 1
+    titolo_sezione(str(num_sez), 'Metodologia di Valutazione dei Rischi')
+
+    paragrafo(testi_legali['metodologia_rischi'], size=8, statico=True)
+
+    # Matrice PxG grafica
+    doc.ln(3)
+    check_spazio(55)
+    sottotitolo('Matrice di Rischio P x G')
+
+    # Disegna matrice 4x4
+    cell_w = 22
+    cell_h = 10
+    label_w = 30
+
+    def disegna_matrice(pdf, y):
+        x_start = ML + label_w + 2
+        y_start = y + 2
+
+        # Header colonne (Gravita)
+        pdf.set_font('Helvetica', 'B', 7)
+        pdf.set_text_color(*BLU_SCURO)
+        pdf.set_xy(x_start + cell_w * 0.5, y_start - 8)
+        pdf.cell(cell_w * 4, 5, 'GRAVITA (G)', align='C')
+        pdf.set_text_color(0, 0, 0)
+
+        g_labels = ['G=1 Lieve', 'G=2 Medio', 'G=3 Grave', 'G=4 M.Grave']
+        pdf.set_font('Helvetica', 'B', 6)
+        for i, gl in enumerate(g_labels):
+            pdf.set_text_color(*BLU_SCURO)
+            pdf.set_xy(x_start + i * cell_w, y_start - 3)
+            pdf.cell(cell_w, 4, gl, align='C')
+
+        # Header righe (Probabilita) + celle
+        p_labels = ['P=4 M.Prob.', 'P=3 Prob.', 'P=2 P.Prob.', 'P=1 Impr.']
+        matrice = [
+            [4, 8, 12, 16],
+            [3, 6, 9, 12],
+            [2, 4, 6, 8],
+            [1, 2, 3, 4]
+        ]
+
+        for r, (pl, row) in enumerate(zip(p_labels, matrice)):
+            y_row = y_start + r * cell_h
+            # Label riga
+            pdf.set_font('Helvetica', 'B', 6)
+            pdf.set_text_color(*BLU_SCURO)
+            pdf.set_xy(ML, y_row)
+            pdf.cell(label_w, cell_h, pl, align='R')
+
+            for c, val in enumerate(row):
+                x_cell = x_start + c * cell_w
+                # Colore cella
+                if val <= 2:
+                    pdf.set_fill_color(*VERDE_CHIARO)
+                    txt_color = VERDE_BADGE
+                elif val <= 4:
+                    pdf.set_fill_color(*GIALLO_CHIARO)
+                    txt_color = GIALLO_BADGE
+                elif val <= 8:
+                    pdf.set_fill_color(255, 220, 200)
+                    txt_color = ARANCIONE
+                else:
+                    pdf.set_fill_color(*ROSSO_CHIARO)
+                    txt_color = ROSSO_BADGE
+
+                pdf.rect(x_cell, y_row, cell_w, cell_h, 'F')
+                pdf.set_draw_color(*GRIGIO_BORDO)
+                pdf.rect(x_cell, y_row, cell_w, cell_h, 'D')
+                pdf.set_draw_color(0, 0, 0)
+
+                pdf.set_font('Helvetica', 'B', 10)
+                pdf.set_text_color(*txt_color)
+                pdf.set_xy(x_cell, y_row + 1)
+                pdf.cell(cell_w, cell_h - 2, str(val), align='C')
+
+        pdf.set_text_color(0, 0, 0)
+        pdf.set_y(y_start + 4 * cell_h + 4)
+
+    disegno(disegna_matrice, altezza=2 + 4 * cell_h + 4, statico='matrice_pxg')
+
+    # Legenda colori
+    legenda = [
+        (VERDE_CHIARO, VERDE_BADGE, 'R = 1-2: BASSO'),
+        (GIALLO_CHIARO, GIALLO_BADGE, 'R = 3-4: MEDIO'),
+        ((255, 220, 200), ARANCIONE, 'R = 6-8: ALTO'),
+        (ROSSO_CHIARO, ROSSO_BADGE, 'R = 9-16: MOLTO ALTO'),
+    ]
+
+    for bg, fg, testo_leg in legenda:
+        def disegna_legenda(pdf, y_leg, bg=bg, fg=fg, testo_leg=testo_leg):
+            pdf.set_fill_color(*bg)
+            pdf.rect(ML + 4, y_leg + 0.5, 10, 4, 'F')
+            pdf.set_font('Helvetica', 'B', 7)
+            pdf.set_text_color(*fg)
+            pdf.set_xy(ML + 16, y_leg)
+            pdf.cell(W - 20, 5, testo_leg)
+            pdf.set_text_color(0, 0, 0)
+
+        disegno(disegna_legenda, altezza=5.5, spazio=6, statico=('legenda_pxg', testo_leg))
+
+    # ==================== SEZ. 13: VALUTAZIONE RISCHI ====================
+    num_sez += 1
+    titolo_sezione(str(num_sez), 'Valutazione dei Rischi per Fase Lavorativa')
+
+    for lav_key in lavorazioni:
+        if lav_key not in dizionario:
+            continue
+        doc.estendi(blocchi_statici(
+            ('scheda_rischi', lav_key, versione),
+            lambda bozza, dati=dizionario[lav_key]: scheda_rischi(bozza, dati),
+        ))
+
+    # Rischi AI - CON FILTRO ANTI-DUPLICATI
+    if rischi_ai and rischi_ai.get('rischi_aggiuntivi'):
+        selezionate = set(lavorazioni)
+        indice_rischi = indice['rischi']
+        keywords_esistenti = {kw for kw, lavs in indice_rischi.items() if not lavs.isdisjoint(selezionate)}
+
+        rischi_filtrati = []
+        for r in rischi_ai['rischi_aggiuntivi']:
+            nome_ai = (r.get('nome', '') or '').lower()
+            desc_ai = (r.get('descrizione', '') or '').lower()[:50]
+            is_duplicato = any(kw in nome_ai or kw in desc_ai for kw in keywords_esistenti)
+            if not is_duplicato:
+                rischi_filtrati.append(r)
+
+        if rischi_filtrati:
+            check_spazio(40)
+            doc.ln(3)
+            banda('  RISCHI AGGIUNTIVI SPECIFICI DEL CANTIERE', BLU_MEDIO, BIANCO, size=9, h=6)
+            nota('Rischi specifici identificati dall\'analisi della descrizione lavori:', size=7)
+            doc.ln(1)
+
+            for r in rischi_filtrati:
+                grav = (r.get('gravita', 'M') or 'M')[0]
+                colore = ROSSO_CHIARO if grav == 'A' else (GIALLO_CHIARO if grav == 'M' else VERDE_CHIARO)
+                doc.testo(f" [{grav}] {pulisci_testo(r.get('nome', ''), 35)}: {pulisci_testo(r.get('descrizione', ''), 120)}",
+                          h=5, size=8, colore=(0, 0, 0), riempimento=colore, spazio=8)
+                doc.ln(0.5)
+
+        if rischi_ai.get('note_rspp'):
+            doc.ln(2)
+            doc.testo('Note RSPP: ' + pulisci_testo(rischi_ai.get('note_rspp', ''), 300),
+                      h=4, size=8, stile='I', colore=GRIGIO_MEDIO)
+
+    # ==================== SEZ. 14: RUMORE E VIBRAZIONI ====================
+    num_sez += 1
+    titolo_sezione(str(num_sez), 'Esiti Valutazione Rumore e Vibrazioni')
+
+    nota('Allegato XV, punto 3.2, lettera f): Esito del rapporto di valutazione del rumore e delle vibrazioni.')
+    doc.ln(2)
+
+    sottotitolo('Rumore - Art. 189-198 D.Lgs 81/08')
+    paragrafo("La valutazione dell'esposizione al rumore e condotta conformemente all'Art. 190 D.Lgs 81/08 e alle Linee Guida ISPESL. I valori di esposizione riportati derivano da banche dati validate (CPT, ISPESL) e/o da misurazioni fonometriche effettuate in condizioni operative analoghe.", size=8, statico=True)
+
+    def righe_esposizione(tipo):
+        """(fase, valore) senza duplicati; i valori dai rischi solo per le fasi senza valori propri."""
+        righe, viste, fasi = [], set(), set()
+        for lav_key in lavorazioni:
+            if lav_key not in dizionario:
+                continue
+            nome_fase = dizionario[lav_key].get('nome', '')
+            primari, da_rischi = indice[tipo][lav_key]
+            for valore in primari or (() if nome_fase in fasi else da_rischi):
+                if (nome_fase, valore) not in viste:
+                    viste.add((nome_fase, valore))
+                    fasi.add(nome_fase)
+                    righe.append((nome_fase, valore))
+        return righe
+
+    # Tabella valori rumore per lavorazione
+    noise_rows = righe_esposizione('rumore')
+    has_noise_data = bool(noise_rows)
+
+    if has_noise_data:
+        cols_r = [('Fase Lavorativa', 76), ('Livello Esposizione Lep,d / Lpicco', 110)]
+        tabella_header(cols_r)
+        for idx, (fase, val) in enumerate(noise_rows):
+            tabella_riga([fase, str(val)], cols_r, idx)
+        doc.ln(2)
+
+    # Limiti normativi
+    check_spazio(30)
+    banda('  VALORI LIMITE E DI AZIONE (Art. 189 D.Lgs 81/08)', GIALLO_CHIARO, GIALLO_BADGE, size=7)
+    for txt in [
+        'Valore inferiore di azione: Lep,d = 80 dB(A) / Lpicco = 135 dB(C) -> Informazione, DPI a disposizione',
+        'Valore superiore di azione: Lep,d = 85 dB(A) / Lpicco = 137 dB(C) -> Formazione, obbligo DPI, sorveglianza sanitaria',
+        'Valore limite di esposizione: Lep,d = 87 dB(A) / Lpicco = 140 dB(C) -> Non deve essere superato (con DPI)'
+    ]:
+        riga(txt, size=7, h=4, spazio=0, pulisci=False)
+
+    doc.ln(3)
+    sottotitolo('Vibrazioni - Art. 199-205 D.Lgs 81/08')
+    paragrafo("La valutazione dell'esposizione a vibrazioni meccaniche (sistema mano-braccio HAV e corpo intero WBV) e condotta conformemente all'Art. 202 D.Lgs 81/08. I valori riportati derivano da banche dati validate e dalle dichiarazioni dei fabbricanti.", size=8, statico=True)
+
+    # Tabella valori vibrazioni
+    vibr_rows = righe_esposizione('vibrazioni')
+    has_vibr_data = bool(vibr_rows)
+
+    if has_vibr_data:
+        cols_v = [('Fase Lavorativa', 76), ('Livello Esposizione A(8) / Valore di Picco', 110)]
+        tabella_header(cols_v)
+        for idx, (fase, val) in enumerate(vibr_rows):
+            tabella_riga([fase, str(val)], cols_v, idx)
+        doc.ln(2)
+
+    check_spazio(25)
+    banda('  VALORI LIMITE E DI AZIONE VIBRAZIONI', GIALLO_CHIARO, GIALLO_BADGE, size=7)
+    for txt in [
+        'HAV - Valore di azione: A(8) = 2.5 m/s2 | Valore limite: A(8) = 5 m/s2',
+        'WBV - Valore di azione: A(8) = 0.5 m/s2 | Valore limite: A(8) = 1.0 m/s2'
+    ]:
+        riga(txt, size=7, h=4, spazio=0, pulisci=False)
+
+    if not has_noise_data and not has_vibr_data:
+        doc.ln(2)
+        paragrafo("I valori di esposizione a rumore e vibrazioni sono riportati nelle schede di valutazione rischi per ciascuna fase lavorativa (Sezione precedente). Si rimanda alla documentazione specifica allegata al DVR aziendale per i dati completi delle misurazioni/valutazioni.", size=8, statico=True)
+
+    # ==================== SEZ. 15: MATRICE DPI ====================
+    num_sez += 1
+    titolo_sezione(str(num_sez), 'Matrice DPI per Mansione')
+
+    nota('Allegato XV, punto 3.2, lettera i): Elenco dei Dispositivi di Protezione Individuale forniti ai lavoratori.')
+    doc.ln(2)
+
+    # Collect all unique DPI from all selected lavorazioni (with smart dedup)
+    all_dpi = {}
+    dpi_dedup_keys = set()
+    for lav_key in lavorazioni:
+        for dk, nome_dpi, norma_dpi in indice['dpi'].get(lav_key, ()):
+            if dk not in dpi_dedup_keys:
+                dpi_dedup_keys.add(dk)
+                all_dpi[nome_dpi] = norma_dpi
+
+    if all_dpi:
+        # Full DPI table
+        dpi_cols = [('DPI', 68), ('Norma di Riferimento', 50), ('Consegnato', 22), ('Formazione', 22), ('Firma', 24)]
+        tabella_header(dpi_cols)
+
+        for idx, (nome_dpi, norma) in enumerate(all_dpi.items()):
+            tabella_riga([
+                nome_dpi,
+                norma,
+                'Si',
+                'Si',
+                ' '
+            ], dpi_cols, idx)
+
+        doc.ln(2)
+        doc.testo("I DPI sono forniti conformemente all'Art. 77 D.Lgs 81/08. Il Datore di Lavoro assicura che i DPI siano conformi ai requisiti del Reg. UE 2016/425, adeguati ai rischi, adattati alle condizioni del lavoratore, e mantiene in efficienza i DPI mediante manutenzione, riparazione e sostituzione.",
+                  h=3.5, size=7, stile='I', colore=GRIGIO_MEDIO)
+    else:
+        paragrafo("I DPI obbligatori per ciascuna fase lavorativa sono indicati nelle schede di valutazione rischi (Sez. 13). La consegna avviene mediante verbale firmato (Sez. 20).", statico=True)
+
+    # ==================== SEZ. 16: COORDINAMENTO ====================
+    num_sez += 1
+    titolo_sezione(str(num_sez), 'Coordinamento e Procedure PSC')
+
+    sottotitolo('Coordinamento tra Imprese')
+    paragrafo(testi_legali['coordinamento'], statico=True)
+
+    doc.ln(2)
+    sottotitolo('Procedure complementari e di dettaglio del PSC')
+
+    nota('Allegato XV, punto 3.2, lettere g) e h): Misure preventive integrative e procedure complementari al PSC.')
+    doc.ln(1)
+
+    paragrafo(testi_legali['procedure_psc'], statico=True)
+
+    # ==================== SEZ. 17: EMERGENZE ====================
+    num_sez += 1
+    titolo_sezione(str(num_sez), 'Gestione Emergenze')
+    paragrafo(testi_legali['emergenza'], statico=True)
+
+    doc.ln(3)
+    check_spazio(50)
+
+    # Box numeri emergenza
+    def disegna_numeri_emergenza(pdf, y):
+        pdf.set_fill_color(*ROSSO_CHIARO)
+        pdf.rect(ML, y, W, 28, 'F')
+        pdf.set_fill_color(*ROSSO_BADGE)
+        pdf.rect(ML, y, 3, 28, 'F')
+
+        pdf.set_font('Helvetica', 'B', 10)
+        pdf.set_text_color(*ROSSO_BADGE)
+        pdf.set_xy(ML + 7, y + 2)
+        pdf.cell(W, 5, 'NUMERI EMERGENZA', ln=1)
+
+        pdf.set_font('Helvetica', 'B', 11)
+        pdf.set_text_color(*GRIGIO_SCURO)
+        for num_em, desc in [('112', 'Numero Unico Emergenze'), ('115', 'Vigili del Fuoco'), ('118', 'Soccorso Sanitario')]:
+            pdf.set_x(ML + 7)
+            pdf.cell(15, 5, num_em, ln=0)
+            pdf.set_font('Helvetica', '', 9)
+            pdf.cell(W - 22, 5, f'  -  {desc}', ln=1)
+            pdf.set_font('Helvetica', 'B', 11)
+
+        pdf.set_text_color(0, 0, 0)
+
+    disegno(disegna_numeri_emergenza, altezza=30)
+
+    # Ospedale
+    ospedale = cantiere.get('ospedale_vicino', '')
+    if ospedale:
+        doc.testo(f'PRONTO SOCCORSO PIU VICINO: {pulisci_testo(ospedale, 150)}', stile='B', colore=(0, 0, 0))
+        doc.ln(1)
+
+    nota('PUNTO DI RACCOLTA: Ingresso cantiere', size=9, h=5, stile='B', colore=(0, 0, 0))
+
+    # Procedure dettagliate emergenza
+    doc.ln(3)
+    check_spazio(40)
+    sottotitolo('Procedura in caso di Infortunio')
+    paragrafo("1) Mantenere la calma e valutare la scena (sicurezza soccorritore). 2) Chiamare il 112 fornendo: indirizzo cantiere, numero feriti, dinamica. 3) L'addetto PS presta le prime cure (NON spostare l'infortunato se trauma spinale sospetto). 4) Accompagnare i soccorsi all'ingresso. 5) Il DdL compila la denuncia INAIL entro 2 giorni (48h).", size=8, statico=True)
+
+    sottotitolo('Procedura in caso di Incendio')
+    paragrafo("1) Dare l'allarme (voce / sirena). 2) Se incendio domabile: utilizzare estintori (solo personale formato). 3) Se non domabile: evacuare immediatamente. 4) Chiamare 115. 5) Recarsi al punto di raccolta. 6) Il preposto effettua il censimento.", size=8, statico=True)
+
+    # ==================== SEZ. 18: CHECKLIST ALLEGATI ====================
+    num_sez += 1
+    titolo_sezione(str(num_sez), 'Checklist Allegati')
+
+    ha_ponteggio_fisso = any('ponteggio' in (a.get('nome', '') or '').lower() and 'trabattello' not in (a.get('nome', '') or '').lower() for a in attrezzature)
+    ha_trabattello = any('trabattello' in (a.get('nome', '') or '').lower() for a in attrezzature)
+
+    if ha_ponteggio_fisso:
+        pimus_doc = "Pi.M.U.S. (ponteggi fissi Art. 136)"
+        pimus_stato = "Da allegare"
+    elif ha_trabattello:
+        pimus_doc = "Manuale d'uso trabattello"
+        pimus_stato = "Da allegare"
+    else:
+        pimus_doc = "Pi.M.U.S. / Manuale trabattello"
+        pimus_stato = "N.A."
+
+    allegati = [
+        ("Visura Camerale", "Da allegare"),
+        ("DURC in corso di validita", "Da allegare"),
+        ("Attestati formazione lavoratori", "Da allegare"),
+        ("Idoneita sanitarie", "Da allegare"),
+        ("Libretti attrezzature", "Da allegare"),
+        ("Schede SDS sostanze", "Da allegare" if sostanze else "N.A."),
+        (pimus_doc, pimus_stato),
+        ("Verbale consegna DPI", "Da allegare"),
+        ("DVR aziendale (estratto)", "Da allegare"),
+        ("Rapporto valutazione rumore", "Da allegare"),
+        ("Iscrizione CCIAA", "Da allegare"),
+        ("Polizza assicurativa RCT/RCO", "Da allegare"),
+    ]
+
+    cols = [('Documento', 126), ('Stato', 60)]
+    tabella_header(cols)
+
+    for idx, (voce_doc, stato) in enumerate(allegati):
+        def disegna_allegato(pdf, y, idx=idx, voce_doc=voce_doc, stato=stato):
+            if idx % 2 == 0:
+                pdf.set_fill_color(*BIANCO)
+            else:
+                pdf.set_fill_color(*GRIGIO_CHIARO)
+            pdf.set_font('Helvetica', '', 9)
+            pdf.set_x(ML)
+            # Checkbox grafico
+            simbolo = '[ ]' if stato == 'Da allegare' else '[--]'
+            pdf.cell(126, 6, f'  {simbolo}  {voce_doc}', fill=True)
+            # Stato con colore
+            if stato == 'N.A.':
+                pdf.set_text_color(*GRIGIO_MEDIO)
+            else:
+                pdf.set_text_color(*ARANCIONE)
+            pdf.set_font('Helvetica', 'I', 8)
+            pdf.cell(60, 6, f'  {stato}', fill=True, ln=1)
+            pdf.set_text_color(0, 0, 0)
+            pdf.set_draw_color(*GRIGIO_BORDO)
+            pdf.line(ML, pdf.get_y(), ML + W, pdf.get_y())
+            pdf.set_draw_color(0, 0, 0)
+
+        disegno(disegna_allegato, altezza=6, spazio=8)
+
+    # ==================== SEZ. 19: FIRME ====================
+    num_sez += 1
+    titolo_sezione(str(num_sez), 'Dichiarazione e Firme')
+
+    doc.testo("Il sottoscritto, in qualita di Datore di Lavoro dell'impresa esecutrice, DICHIARA che:\n- Il presente POS e redatto conformemente all'Allegato XV, punto 3.2, del D.Lgs 81/2008;\n- I lavoratori sono stati informati e formati sui rischi specifici delle lavorazioni di cantiere;\n- I DPI sono stati forniti e ne viene verificato il corretto utilizzo;\n- Le attrezzature di lavoro sono conformi e regolarmente verificate;\n- La sorveglianza sanitaria e regolarmente effettuata dal Medico Competente;\n- Il presente POS sara aggiornato in caso di modifiche significative al cantiere.")
+
+    doc.ln(8)
+    check_spazio(55)
+
+    rls_tipo = ditta.get('rls_tipo', 'non_eletto')
+    if rls_tipo == 'interno_eletto':
+        titolo_firma_rls = 'PER PRESA VISIONE RLS'
+        firma_rls_nome = ditta.get('rls_nome', '')
+    elif rls_tipo == 'territoriale':
+        titolo_firma_rls = 'PER PRESA VISIONE RLST'
+        firma_rls_nome = ditta.get('rls_territoriale', '')
+    else:
+        titolo_firma_rls = 'PER PRESA VISIONE (RLS)'
+        firma_rls_nome = 'Non eletto - Funzioni RLST'
+
+    def disegna_firme(pdf, y):
+        # Due colonne firme
+        pdf.set_font('Helvetica', 'B', 9)
+        pdf.set_text_color(*BLU_SCURO)
+        pdf.set_x(ML)
+        pdf.cell(90, 5, 'IL DATORE DI LAVORO')
+        pdf.cell(6, 5, '')
+        pdf.cell(90, 5, titolo_firma_rls, ln=1)
+
+        pdf.set_text_color(0, 0, 0)
+        pdf.ln(14)
+
+        # Linee firma
+        pdf.set_draw_color(*GRIGIO_BORDO)
+        pdf.set_x(ML)
+        pdf.line(ML, pdf.get_y(), ML + 85, pdf.get_y())
+        pdf.line(ML + 96, pdf.get_y(), ML + W, pdf.get_y())
+        pdf.set_draw_color(0, 0, 0)
+        pdf.ln(2)
+
+        pdf.set_font('Helvetica', 'I', 8)
+        pdf.set_text_color(*GRIGIO_MEDIO)
+        pdf.set_x(ML)
+        pdf.cell(90, 4, f"({pulisci_testo(ditta.get('datore_lavoro', ''), 35)})")
+        pdf.cell(6, 4, '')
+        pdf.cell(90, 4, f"({pulisci_testo(firma_rls_nome, 40)})", ln=1)
+        pdf.set_text_color(0, 0, 0)
+
+        pdf.ln(10)
+        pdf.set_font('Helvetica', '', 9)
+        pdf.set_x(ML)
+        pdf.cell(W * 0.5, 5, f"Data: {date.today().strftime('%d/%m/%Y')}", align='L')
+        pdf.cell(W * 0.5, 5, f"Luogo: {pulisci_testo(cantiere.get('indirizzo', ''), 50)}", align='R', ln=1)
+
+        pdf.ln(6)
+        pdf.set_draw_color(*GRIGIO_BORDO)
+        pdf.line(ML, pdf.get_y(), ML + W, pdf.get_y())
+        pdf.set_draw_color(0, 0, 0)
+        pdf.ln(3)
+        pdf.set_font('Helvetica', 'B', 8)
+        pdf.set_text_color(*ARANCIONE)
+        pdf.set_x(ML)
+        data_rev = (date.today() + timedelta(days=365)).strftime('%d/%m/%Y')
+        pdf.cell(W, 5, f"PROSSIMA REVISIONE POS: {data_rev} (o in caso di modifiche significative al cantiere)", ln=1)
+        pdf.set_text_color(0, 0, 0)
+
+    disegno(disegna_firme)
+
+    # ==================== SEZ. 20: VERBALE PRESA VISIONE ====================
+    if lavoratori:
+        nuova_pagina()
+        num_sez += 1
+        titolo_sezione(str(num_sez), 'Verbale di Presa Visione e Consegna DPI')
+
+        doc.testo("I sottoscritti lavoratori dichiarano di aver preso visione del presente Piano Operativo di Sicurezza, di essere stati informati sui rischi specifici delle lavorazioni e sulle misure di prevenzione e protezione adottate, e di aver ricevuto i Dispositivi di Protezione Individuale (DPI) necessari per lo svolgimento delle attivita lavorative.")
+
+        doc.ln(2)
+        nota('Riferimento normativo: Art. 36, 37, 77 e 78 D.Lgs 81/08', size=7)
+        doc.ln(4)
+
+        # Tabella firme
+        cols = [('Nome e Cognome', 42), ('Mansione', 28), ('Firma Presa Visione', 40), ('Firma Ricevuta DPI', 40), ('Data', 36)]
+        tabella_header(cols)
+
+        for idx, lav in enumerate(lavoratori):
+            tabella_riga([
+                '  ' + pulisci_testo(lav.get('nome', ''), 20),
+                '  ' + pulisci_testo(lav.get('mansione', ''), 14),
+                '',
+                '',
+                '  ___/___/______'
+            ], cols, idx, h=12, spazio=14, prefisso='', pulisci=False)
+
+        # Righe vuote extra
+        righe_extra = max(0, 5 - len(lavoratori))
+        for i in range(righe_extra):
+            tabella_riga(['', '', '', '', '  ___/___/______'], cols, len(lavoratori) + i,
+                         h=12, spazio=14, prefisso='', pulisci=False)
+
+        doc.ln(5)
+        doc.testo("NOTA: La firma del presente verbale attesta l'avvenuta informazione e formazione sui contenuti del POS e la consegna dei DPI. Il lavoratore si impegna ad utilizzare correttamente i DPI forniti e a segnalare eventuali anomalie al preposto o al Datore di Lavoro.",
+                  h=3.5, size=7, stile='I', colore=GRIGIO_MEDIO)
+
+        doc.ln(5)
+        nota(f"Luogo: {pulisci_testo(cantiere.get('indirizzo', ''), 60)}", size=9, h=5, stile='', colore=(0, 0, 0))
+
+        doc.ln(10)
+
+        def disegna_firma_consegna(pdf, y):
+            pdf.set_font('Helvetica', 'B', 9)
+            pdf.set_text_color(*BLU_SCURO)
+            pdf.set_x(ML)
+            pdf.cell(W * 0.5, 5, 'IL DATORE DI LAVORO (per consegna DPI)', ln=1)
+            pdf.set_text_color(0, 0, 0)
+            pdf.ln(12)
+            pdf.set_draw_color(*GRIGIO_BORDO)
+            pdf.line(ML, pdf.get_y(), ML + 90, pdf.get_y())
+            pdf.set_draw_color(0, 0, 0)
+            pdf.ln(2)
+            pdf.set_font('Helvetica', 'I', 8)
+            pdf.set_text_color(*GRIGIO_MEDIO)
+            pdf.set_x(ML)
+            pdf.cell(90, 4, f"({pulisci_testo(ditta.get('datore_lavoro', ''), 35)})", ln=1)
+            pdf.set_text_color(0, 0, 0)
+
+        disegno(disegna_firma_consegna)
+
+    return doc.genera()
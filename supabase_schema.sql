@@ -166,6 +166,152 @@ CREATE TRIGGER check_monthly_reset
     FOR EACH ROW
     EXECUTE FUNCTION reset_monthly_counter();
 
+-- Limite POS per piano (allineato a get_pos_limits() in database.py)
+CREATE OR REPLACE FUNCTION public.pos_limit_for_plan(p_piano TEXT)
+RETURNS INTEGER AS $$
+    SELECT CASE p_piano
+        WHEN 'free' THEN 1
+        WHEN 'base' THEN 5
+        WHEN 'pro' THEN 20
+        WHEN 'unlimited' THEN 999999
+        ELSE 1
+    END;
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Verifica limite + reset mensile + incremento contatore in un'unica chiamata.
+-- La riga del profilo e bloccata (FOR UPDATE): due schede che generano
+-- insieme non possono superare il limite ne perdere incrementi.
+-- Gira con i permessi del chiamante, quindi valgono le policy RLS.
+-- p_quantita > 1 (generazione in serie): scala tutti i POS o nessuno.
+-- p_quantita = 0: sola lettura (banner e controlli prima della generazione),
+-- nessun blocco e nessuna scrittura; allowed = resta almeno un POS.
+DROP FUNCTION IF EXISTS public.consume_pos_quota(UUID);
+CREATE OR REPLACE FUNCTION public.consume_pos_quota(p_user_id UUID, p_quantita INTEGER DEFAULT 1)
+RETURNS JSON AS $$
+DECLARE
+    v_profile public.profiles%ROWTYPE;
+    v_mese INTEGER := EXTRACT(MONTH FROM NOW());
+    v_anno INTEGER := EXTRACT(YEAR FROM NOW());
+    v_limite INTEGER;
+    v_mese_usati INTEGER;
+    v_remaining INTEGER;
+BEGIN
+    IF p_quantita IS NULL OR p_quantita < 0 THEN
+        RAISE EXCEPTION 'p_quantita non puo essere negativa';
+    END IF;
+
+    IF p_quantita = 0 THEN
+        SELECT * INTO v_profile FROM public.profiles WHERE id = p_user_id;
+    ELSE
+        SELECT * INTO v_profile FROM public.profiles WHERE id = p_user_id FOR UPDATE;
+    END IF;
+    IF NOT FOUND THEN
+        RETURN json_build_object('allowed', FALSE, 'found', FALSE, 'piano', NULL, 'limite', 0, 'remaining', 0);
+    END IF;
+
+    v_limite := public.pos_limit_for_plan(v_profile.piano);
+
+    -- Reset mensile (stessa regola di reset_monthly_counter)
+    v_mese_usati := COALESCE(v_profile.pos_generati_mese, 0);
+    IF v_profile.mese_contatore IS DISTINCT FROM v_mese OR v_profile.anno_contatore IS DISTINCT FROM v_anno THEN
+        v_mese_usati := 0;
+    END IF;
+
+    -- Piano free: limite sul totale; piani a pagamento: limite mensile
+    IF v_profile.piano = 'free' THEN
+        v_remaining := v_limite - COALESCE(v_profile.pos_generati_totale, 0);
+    ELSE
+        v_remaining := v_limite - v_mese_usati;
+    END IF;
+
+    IF p_quantita = 0 THEN
+        RETURN json_build_object('allowed', v_remaining > 0, 'found', TRUE, 'piano', v_profile.piano, 'limite', v_limite, 'remaining', GREATEST(v_remaining, 0));
+    END IF;
+
+    IF v_remaining < p_quantita THEN
+        RETURN json_build_object('allowed', FALSE, 'found', TRUE, 'piano', v_profile.piano, 'limite', v_limite, 'remaining', GREATEST(v_remaining, 0));
+    END IF;
+
+    UPDATE public.profiles SET
+        pos_generati_totale = COALESCE(pos_generati_totale, 0) + p_quantita,
+        pos_generati_mese = v_mese_usati + p_quantita,
+        mese_contatore = v_mese,
+        anno_contatore = v_anno
+    WHERE id = p_user_id;
+
+    RETURN json_build_object('allowed', TRUE, 'found', TRUE, 'piano', v_profile.piano, 'limite', v_limite, 'remaining', v_remaining - p_quantita);
+END;
+$$ LANGUAGE plpgsql;
+
+-- Sostituzione dei template lavoratori/attrezzature in un'unica transazione:
+-- delete + insert multiplo in una sola chiamata RPC.
+-- Le righe nuove vengono confrontate con quelle in tabella (senza ordine):
+-- se sono uguali non si scrive nulla e la funzione restituisce -1.
+-- La riga dell'impresa e bloccata, cosi due salvataggi insieme non si mescolano.
+CREATE OR REPLACE FUNCTION public.replace_lavoratori_template(p_impresa_id UUID, p_rows JSONB)
+RETURNS INTEGER AS $$
+DECLARE
+    v_count INTEGER;
+    v_attuali JSONB;
+    v_nuovi JSONB;
+BEGIN
+    PERFORM 1 FROM public.imprese WHERE id = p_impresa_id FOR UPDATE;
+
+    SELECT COALESCE(jsonb_agg(v ORDER BY v::text), '[]'::jsonb) INTO v_attuali
+    FROM (SELECT jsonb_build_array(COALESCE(nome, ''), COALESCE(mansione, ''),
+                                   COALESCE(formazione, ''), COALESCE(idoneita_sanitaria, '')) AS v
+          FROM public.lavoratori_template WHERE impresa_id = p_impresa_id) t;
+    SELECT COALESCE(jsonb_agg(v ORDER BY v::text), '[]'::jsonb) INTO v_nuovi
+    FROM (SELECT jsonb_build_array(COALESCE(r->>'nome', ''), COALESCE(r->>'mansione', ''),
+                                   COALESCE(r->>'formazione', ''), COALESCE(r->>'idoneita_sanitaria', '')) AS v
+          FROM jsonb_array_elements(COALESCE(p_rows, '[]'::jsonb)) AS r
+          WHERE COALESCE(r->>'nome', '') <> '') t;
+    IF v_attuali = v_nuovi THEN
+        RETURN -1;
+    END IF;
+
+    DELETE FROM public.lavoratori_template WHERE impresa_id = p_impresa_id;
+    INSERT INTO public.lavoratori_template (impresa_id, nome, mansione, formazione, idoneita_sanitaria)
+    SELECT p_impresa_id, r->>'nome', r->>'mansione', r->>'formazione', r->>'idoneita_sanitaria'
+    FROM jsonb_array_elements(COALESCE(p_rows, '[]'::jsonb)) AS r
+    WHERE COALESCE(r->>'nome', '') <> '';
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION public.replace_attrezzature_template(p_impresa_id UUID, p_rows JSONB)
+RETURNS INTEGER AS $$
+DECLARE
+    v_count INTEGER;
+    v_attuali JSONB;
+    v_nuovi JSONB;
+BEGIN
+    PERFORM 1 FROM public.imprese WHERE id = p_impresa_id FOR UPDATE;
+
+    SELECT COALESCE(jsonb_agg(v ORDER BY v::text), '[]'::jsonb) INTO v_attuali
+    FROM (SELECT jsonb_build_array(COALESCE(nome, ''), COALESCE(marca, ''),
+                                   COALESCE(matricola, ''), COALESCE(ultima_verifica, '')) AS v
+          FROM public.attrezzature_template WHERE impresa_id = p_impresa_id) t;
+    SELECT COALESCE(jsonb_agg(v ORDER BY v::text), '[]'::jsonb) INTO v_nuovi
+    FROM (SELECT jsonb_build_array(COALESCE(r->>'nome', ''), COALESCE(r->>'marca', ''),
+                                   COALESCE(r->>'matricola', ''), COALESCE(r->>'ultima_verifica', '')) AS v
+          FROM jsonb_array_elements(COALESCE(p_rows, '[]'::jsonb)) AS r
+          WHERE COALESCE(r->>'nome', '') <> '') t;
+    IF v_attuali = v_nuovi THEN
+        RETURN -1;
+    END IF;
+
+    DELETE FROM public.attrezzature_template WHERE impresa_id = p_impresa_id;
+    INSERT INTO public.attrezzature_template (impresa_id, nome, marca, matricola, ultima_verifica)
+    SELECT p_impresa_id, r->>'nome', r->>'marca', r->>'matricola', r->>'ultima_verifica'
+    FROM jsonb_array_elements(COALESCE(p_rows, '[]'::jsonb)) AS r
+    WHERE COALESCE(r->>'nome', '') <> '';
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
 -- ============================================================================
 -- ROW LEVEL SECURITY (RLS) - IMPORTANTE PER SICUREZZA
 -- ============================================================================
@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""Moduli dell'app importabili dai test (layout piatto, senza pacchetto)."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""Lavorazioni personalizzate sopra il catalogo base: sostituzioni, scarti, versione."""
+
+import pytest
+
+from catalogo import get_catalogo, sovrapponi_lavorazioni
+from classificatore import classifica_descrizione
+
+
+@pytest.fixture
+def base():
+    return get_catalogo()
+
+
+def test_senza_personalizzate(base):
+    assert sovrapponi_lavorazioni() == (base['lavorazioni'], base['versione'])
+    assert sovrapponi_lavorazioni({}) == (base['lavorazioni'], base['versione'])
+
+
+def test_sostituisce_chiave_esistente(base):
+    originale = base['lavorazioni']['scavi']
+    dizionario, versione = sovrapponi_lavorazioni({'scavi': {'nome': 'Scavi a mano'}})
+    assert dizionario['scavi']['nome'] == 'Scavi a mano'
+    assert dizionario['scavi']['rischi'] == []          # campi mancanti: default, non la voce base
+    assert versione != base['versione']
+    # il catalogo base resta quello letto dal file
+    assert base['lavorazioni']['scavi'] is originale
+    assert base['lavorazioni']['scavi']['nome'] == 'Scavi e Movimenti Terra'
+
+
+def test_aggiunge_chiave_nuova(base):
+    dizionario, _ = sovrapponi_lavorazioni({'posa_pannelli': {'nome': 'Posa pannelli fotovoltaici'}})
+    assert set(dizionario) == set(base['lavorazioni']) | {'posa_pannelli'}
+    assert 'posa_pannelli' not in base['lavorazioni']
+
+
+@pytest.mark.parametrize('voce', [
+    {'descrizione_tecnica': 'senza nome'},
+    {'nome': '   '},
+    {'nome': 'Rischi come testo', 'rischi': 'caduta'},
+    'non un dizionario',
+])
+def test_voci_non_valide_scartate(base, voce):
+    dizionario, versione = sovrapponi_lavorazioni({'voce_errata': voce, 'scavi': voce})
+    assert 'voce_errata' not in dizionario
+    assert dizionario['scavi'] is base['lavorazioni']['scavi']
+    assert versione == base['versione']
+
+
+def test_versione_segue_il_contenuto():
+    _, prima = sovrapponi_lavorazioni({'posa_pannelli': {'nome': 'Posa pannelli'}})
+    _, stessa = sovrapponi_lavorazioni({'posa_pannelli': {'nome': 'Posa pannelli'}})
+    _, diversa = sovrapponi_lavorazioni({'posa_pannelli': {'nome': 'Posa pannelli', 'attrezzature': ['Gru']}})
+    assert prima == stessa
+    assert prima != diversa
+
+
+def test_parole_chiave_nel_classificatore():
+    personalizzate = {'posa_pannelli': {'nome': 'Posa pannelli', 'parole_chiave': ['pannell fotovoltaic']}}
+    descrizione = "Montaggio pannelli fotovoltaici in copertura"
+    assert 'posa_pannelli' not in classifica_descrizione(descrizione)['lavorazioni_identificate']
+    esito = classifica_descrizione(descrizione, personalizzate)
+    assert 'posa_pannelli' in esito['lavorazioni_identificate']
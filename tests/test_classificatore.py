@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""Classificatore offline: descrizioni note -> chiavi attese e confidenza."""
+
+import pytest
+
+from classificatore import CONFIDENZA_MINIMA, classifica_descrizione
+
+
+@pytest.mark.parametrize('descrizione, attese', [
+    ("Rifacimento impianto elettrico con nuovi cavi e quadro elettrico", ['impianti_elettrici']),
+    ("Scavo per fondazioni con escavatore", ['scavi']),
+    ("Rimozione pavimento esistente e posa nuovo gres porcellanato", ['rimozione_pavimenti', 'posa_pavimenti']),
+])
+def test_descrizioni_certe(descrizione, attese):
+    esito = classifica_descrizione(descrizione)
+    assert sorted(esito['lavorazioni_identificate']) == sorted(attese)
+    assert esito['confidenza'] == 1.0
+    assert esito['confidenza'] >= CONFIDENZA_MINIMA
+
+
+def test_ordine_per_punteggio_e_confidenza_parziale():
+    # "pareti" da solo (1.0) seleziona le opere murarie ma non le rende certe
+    esito = classifica_descrizione("Tinteggiatura pareti interne con idropittura")
+    assert esito['lavorazioni_identificate'] == ['tinteggiatura', 'opere_murarie']
+    assert esito['punteggi'] == {'tinteggiatura': 5.0, 'opere_murarie': 1.0}
+    assert esito['confidenza'] == 0.5
+    assert esito['confidenza'] < CONFIDENZA_MINIMA
+
+
+def test_radici_composte_e_accenti():
+    esito = classifica_descrizione("Sostituzione QUADRO generale ELETTRICO, più prese")
+    assert esito['lavorazioni_identificate'] == ['impianti_elettrici']
+    assert 'quadro elettric' in esito['parole_chiave']['impianti_elettrici']
+    # radice composta con le parole troppo lontane: non vale
+    lontane = classifica_descrizione("quadro nuovo per la sala riunioni del piano terra elettrico")
+    assert 'quadro elettric' not in lontane['parole_chiave'].get('impianti_elettrici', [])
+
+
+def test_parola_intera():
+    # "cavi " vale solo come parola intera, non come radice di "cavità"
+    assert 'cavi' not in classifica_descrizione("chiusura cavità").get('parole_chiave', {}).get('impianti_elettrici', [])
+
+
+def test_nessuna_regola():
+    generica = classifica_descrizione("Sistemazione generica locale")
+    assert generica['lavorazioni_identificate'] == ['altro_generico']
+    assert generica['confidenza'] == 0.0
+    vuota = classifica_descrizione("")
+    assert vuota['lavorazioni_identificate'] == []
+    assert vuota['confidenza'] == 0.0
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""Controlli a regole della completezza POS: P.IVA, codice fiscale, date."""
+
+from datetime import date
+
+import pytest
+
+from completezza import codice_fiscale_valido, leggi_data, partita_iva_valida, valuta_completezza
+
+OGGI = date(2026, 6, 15)
+
+
+@pytest.mark.parametrize('piva', ['12345678903', '00743110157', 'IT12345678903', '123 456 789 03'])
+def test_partita_iva_valida(piva):
+    assert partita_iva_valida(piva)
+
+
+@pytest.mark.parametrize('piva', ['12345678901', '00743110158', '1234567890', '123456789031', '00000000000',
+                                  '1234567890A', '', None])
+def test_partita_iva_non_valida(piva):
+    assert not partita_iva_valida(piva)
+
+
+@pytest.mark.parametrize('cf', ['RSSMRA80A01H501U', 'rssmra80a01h501u', 'RSS MRA 80A01 H501U'])
+def test_codice_fiscale_valido(cf):
+    assert codice_fiscale_valido(cf)
+
+
+@pytest.mark.parametrize('cf', [
+    'RSSMRA80A01H501V',   # carattere di controllo sbagliato
+    'RSSMRA80Z01H501U',   # mese inesistente
+    'RSSMRA8XA01H501U',   # anno non numerico
+    'RSSMRA80A01H501',    # troppo corto
+    '12345678903',        # P.IVA, non codice fiscale
+    '',
+])
+def test_codice_fiscale_non_valido(cf):
+    assert not codice_fiscale_valido(cf)
+
+
+def test_leggi_data():
+    attesa = date(2026, 12, 31)
+    assert leggi_data('31/12/2026') == attesa
+    assert leggi_data('31-12-2026') == attesa
+    assert leggi_data('2026-12-31') == attesa
+    assert leggi_data(attesa) is attesa
+    assert leggi_data('31/02/2026') is None
+    assert leggi_data('__/__/____') is None
+
+
+def _controllo(esito, campo):
+    return next(c for c in esito['dettaglio'] if c['campo'] == campo)
+
+
+def test_piva_nel_pos():
+    valida = valuta_completezza({'ditta': {'piva_cf': '12345678903'}}, OGGI)
+    assert _controllo(valida, 'P.IVA / C.F.')['ok']
+    cifra = valuta_completezza({'ditta': {'piva_cf': '12345678901'}}, OGGI)
+    assert 'cifra di controllo' in _controllo(cifra, 'P.IVA / C.F.')['messaggio']
+    lunghezza = valuta_completezza({'ditta': {'piva_cf': '123456'}}, OGGI)
+    assert 'servono 11 cifre' in _controllo(lunghezza, 'P.IVA / C.F.')['messaggio']
+
+
+def test_scadenze():
+    dati = {
+        'ditta': {'durc_scadenza': '14/06/2026'},
+        'lavoratori': [{'nome': 'Mario Rossi', 'idoneita': '15/06/2026'}],
+        'attrezzature': [{'nome': 'Trapano', 'verifica': '16/06/2026'}],
+    }
+    esito = valuta_completezza(dati, OGGI)
+    assert not _controllo(esito, 'DURC')['ok']
+    assert _controllo(esito, 'Mario Rossi: idoneita')['ok']
+    assert 'nel futuro' in _controllo(esito, 'Trapano: verifica')['messaggio']
+
+
+def test_score():
+    vuoto = valuta_completezza({}, OGGI)
+    assert 0 <= vuoto['score'] < 20
+    assert len(vuoto['suggerimenti']) == sum(1 for c in vuoto['dettaglio'] if not c['ok'])